@@ -0,0 +1,49 @@
+"""
+Recompute the UserStats counters from the image, post and analytics rows
+"""
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.forms.models import model_to_dict
+from apps.authentication.models import UserStats
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the per-user statistics counters (USER_STATS_ENABLED) and report "
+        "the rows that had drifted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[],
+                            help="Username to rebuild (repeatable), every user by default")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['user']:
+            users = users.filter(username__in=options['user'])
+        
+        current = {stats.user_id: stats for stats in UserStats.objects.filter(user__in=users)}
+        rebuilt = drifted = 0
+        for user_id, username in users.values_list('id', 'username').iterator():
+            before = current.get(user_id)
+            after = UserStats.rebuild(user_id)
+            rebuilt += 1
+            
+            changed = self._changed_fields(before, after)
+            if changed:
+                drifted += 1
+                self.stdout.write(self.style.WARNING(f"{username}: {', '.join(changed)}"))
+        
+        self.stdout.write(self.style.SUCCESS(f"{rebuilt} users rebuilt, {drifted} had drifted"))
+
+    @staticmethod
+    def _changed_fields(before, after):
+        if before is None:
+            return []
+        old = model_to_dict(before, exclude=['user'])
+        new = model_to_dict(after, exclude=['user'])
+        return [
+            f"{field} {old[field]} -> {new[field]}"
+            for field in new
+            if abs(new[field] - old[field]) > 1e-6
+        ]
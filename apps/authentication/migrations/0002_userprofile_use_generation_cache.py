@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-17 03:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='use_generation_cache',
+            field=models.BooleanField(default=True, help_text='Réutiliser une image déjà générée pour une demande identique'),
+        ),
+    ]
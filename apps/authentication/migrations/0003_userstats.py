@@ -0,0 +1,48 @@
+# Generated by Django 4.2.8 on 2026-10-17 05:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('authentication', '0002_userprofile_use_generation_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total_images', models.IntegerField(default=0)),
+                ('pending_images', models.IntegerField(default=0)),
+                ('generating_images', models.IntegerField(default=0)),
+                ('generated_images', models.IntegerField(default=0)),
+                ('validated_images', models.IntegerField(default=0)),
+                ('rejected_images', models.IntegerField(default=0)),
+                ('failed_images', models.IntegerField(default=0)),
+                ('timed_images', models.IntegerField(default=0, help_text='Images ayant un temps de génération')),
+                ('total_generation_time', models.FloatField(default=0)),
+                ('scheduled_posts', models.IntegerField(default=0)),
+                ('processing_posts', models.IntegerField(default=0)),
+                ('posted_posts', models.IntegerField(default=0)),
+                ('failed_posts', models.IntegerField(default=0)),
+                ('cancelled_posts', models.IntegerField(default=0)),
+                ('instagram_posts', models.IntegerField(default=0)),
+                ('facebook_posts', models.IntegerField(default=0)),
+                ('twitter_posts', models.IntegerField(default=0)),
+                ('linkedin_posts', models.IntegerField(default=0)),
+                ('analytics_count', models.IntegerField(default=0)),
+                ('engagement_rate_sum', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'User Stats',
+                'verbose_name_plural': 'User Stats',
+                'db_table': 'user_stats',
+            },
+        ),
+    ]
@@ -1,6 +1,9 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models import Count, F, Q, Sum
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
 from django.dispatch import receiver
 
 
@@ -21,6 +24,10 @@ class UserProfile(models.Model):
     # Preferences
     default_image_style = models.CharField(max_length=100, default='realistic')
     auto_validate_images = models.BooleanField(default=False)
+    use_generation_cache = models.BooleanField(
+        default=True,
+        help_text="Réutiliser une image déjà générée pour une demande identique"
+    )
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -50,3 +57,225 @@ def save_user_profile(sender, instance, **kwargs):
     """
     if hasattr(instance, 'profile'):
         instance.profile.save()
+
+
+class UserStats(models.Model):
+    """
+    Materialized per-user counters behind the statistics endpoints
+    
+    Only maintained when USER_STATS_ENABLED is set. Every write to a
+    counted model (see UserStatsMixin) adds its deltas to the user's row in
+    the same transaction, so the statistics endpoints read one row instead
+    of aggregating all the rows of the user. A missing row is rebuilt from
+    the tables on first read; ``manage.py rebuild_user_stats`` recomputes
+    every row after writes that bypassed the models (raw SQL, queryset
+    updates) or a period with the setting off.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    
+    # Images
+    total_images = models.IntegerField(default=0)
+    pending_images = models.IntegerField(default=0)
+    generating_images = models.IntegerField(default=0)
+    generated_images = models.IntegerField(default=0)
+    validated_images = models.IntegerField(default=0)
+    rejected_images = models.IntegerField(default=0)
+    failed_images = models.IntegerField(default=0)
+    timed_images = models.IntegerField(default=0, help_text="Images ayant un temps de génération")
+    total_generation_time = models.FloatField(default=0)
+    
+    # Scheduled posts
+    scheduled_posts = models.IntegerField(default=0)
+    processing_posts = models.IntegerField(default=0)
+    posted_posts = models.IntegerField(default=0)
+    failed_posts = models.IntegerField(default=0)
+    cancelled_posts = models.IntegerField(default=0)
+    instagram_posts = models.IntegerField(default=0)
+    facebook_posts = models.IntegerField(default=0)
+    twitter_posts = models.IntegerField(default=0)
+    linkedin_posts = models.IntegerField(default=0)
+    analytics_count = models.IntegerField(default=0)
+    engagement_rate_sum = models.FloatField(default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'user_stats'
+        verbose_name = 'User Stats'
+        verbose_name_plural = 'User Stats'
+
+    def __str__(self):
+        return f"{self.user_id}'s stats"
+
+    @staticmethod
+    def count_images(user_id):
+        """
+        Image counters of a user, computed with a single aggregate query
+        
+        Returns:
+            dict: UserStats image field -> value
+        """
+        from apps.images.models import GeneratedImage
+        
+        statuses = [status for status, _ in GeneratedImage.STATUS_CHOICES]
+        counters = GeneratedImage.objects.filter(user_id=user_id).aggregate(
+            total_images=Count('id'),
+            timed_images=Count('generation_time'),
+            total_generation_time=Sum('generation_time'),
+            **{f'{status}_images': Count('id', filter=Q(status=status)) for status in statuses}
+        )
+        counters['total_generation_time'] = counters['total_generation_time'] or 0
+        return counters
+
+    @staticmethod
+    def count_posts(user_id, now=None):
+        """
+        Post counters of a user, computed with a single aggregate query
+        
+        Args:
+            user_id (int): User ID
+            now (datetime): Also count the scheduled posts from this time
+                on as ``upcoming_posts``
+        
+        Returns:
+            dict: UserStats post field -> value (plus upcoming_posts)
+        """
+        from apps.scheduler.models import ScheduledPost
+        
+        statuses = [status for status, _ in ScheduledPost.STATUS_CHOICES]
+        platforms = [platform for platform, _ in ScheduledPost.PLATFORM_CHOICES]
+        aggregates = {
+            'analytics_count': Count('analytics'),
+            'engagement_rate_sum': Sum('analytics__engagement_rate'),
+            **{f'{status}_posts': Count('id', filter=Q(status=status)) for status in statuses},
+            **{f'{platform}_posts': Count('id', filter=Q(platform=platform)) for platform in platforms},
+        }
+        if now is not None:
+            aggregates['upcoming_posts'] = Count(
+                'id', filter=Q(status='scheduled', scheduled_time__gte=now)
+            )
+        counters = ScheduledPost.objects.filter(user_id=user_id).aggregate(**aggregates)
+        counters['engagement_rate_sum'] = counters['engagement_rate_sum'] or 0
+        return counters
+
+    @classmethod
+    def rebuild(cls, user_id):
+        """
+        Recompute the counters of a user from the image, post and analytics rows
+        
+        Returns:
+            UserStats: The saved row
+        """
+        counters = {**cls.count_images(user_id), **cls.count_posts(user_id)}
+        stats, _ = cls.objects.update_or_create(user_id=user_id, defaults=counters)
+        return stats
+
+    @classmethod
+    def for_user(cls, user_id):
+        """
+        Counters of a user, rebuilt when the row does not exist yet
+        """
+        try:
+            return cls.objects.get(user_id=user_id)
+        except cls.DoesNotExist:
+            return cls.rebuild(user_id)
+
+    @classmethod
+    def record(cls, user_id, **deltas):
+        """
+        Add deltas to the counters of a user with a single UPDATE
+        
+        Call it in the transaction of the write the deltas describe. Users
+        without a row are skipped: their row is built from the tables on
+        first read.
+        """
+        updates = {field: F(field) + value for field, value in deltas.items() if value}
+        if not updates or not settings.USER_STATS_ENABLED:
+            return
+        cls.objects.filter(user_id=user_id).update(updated_at=timezone.now(), **updates)
+
+    @classmethod
+    def record_changes(cls, instances, created=False, deleted=False):
+        """
+        Record the counter changes of saved or deleted UserStatsMixin instances
+        
+        The deltas are the difference between what each row contributed
+        when it was loaded (nothing when ``created``) and what it
+        contributes now (nothing when ``deleted``), with one UPDATE per user.
+        """
+        per_user = {}
+        for instance in instances:
+            before = {} if created else getattr(instance, '_stats_counters', None)
+            after = {} if deleted else instance.stats_counters()
+            instance._stats_counters = after
+            # before is None when a counted field was deferred, and so not saved
+            if before is None or not settings.USER_STATS_ENABLED:
+                continue
+            
+            deltas = {field: after.get(field, 0) - before.get(field, 0) for field in {**before, **after}}
+            if not any(deltas.values()):
+                continue
+            user_deltas = per_user.setdefault(instance.stats_user_id, {})
+            for field, value in deltas.items():
+                user_deltas[field] = user_deltas.get(field, 0) + value
+        
+        for user_id, deltas in per_user.items():
+            cls.record(user_id, **deltas)
+
+    @classmethod
+    def track(cls, model):
+        """
+        Keep the counters in step with the saves and deletions of a UserStatsMixin model
+        """
+        post_save.connect(_record_saved_instance, sender=model, weak=False)
+        post_delete.connect(_record_deleted_instance, sender=model, weak=False)
+
+
+class UserStatsMixin:
+    """
+    Model mixin for the rows counted in UserStats
+    
+    Subclasses list the fields their counters depend on in ``stats_fields``
+    and implement ``stats_counters`` (UserStats field -> value contributed
+    by the row) and ``stats_user_id``. Bulk writes, which send no signals,
+    call UserStats.record_changes or UserStats.record themselves.
+    """
+    stats_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_stats_counters()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._remember_stats_counters()
+
+    def save(self, *args, **kwargs):
+        # The post_save receiver updates UserStats in the same transaction
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+
+    def _remember_stats_counters(self):
+        if set(self.stats_fields) & self.get_deferred_fields():
+            self._stats_counters = None
+        else:
+            self._stats_counters = self.stats_counters()
+
+    def stats_counters(self):
+        raise NotImplementedError
+
+    @property
+    def stats_user_id(self):
+        return self.user_id
+
+
+def _record_saved_instance(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not set(update_fields) & set(sender.stats_fields):
+        return
+    UserStats.record_changes([instance], created=created)
+
+
+def _record_deleted_instance(sender, instance, **kwargs):
+    UserStats.record_changes([instance], deleted=True)
@@ -13,7 +13,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = [
             'bio', 'avatar', 'phone_number',
             'instagram_username', 'facebook_page_id', 'twitter_username',
-            'default_image_style', 'auto_validate_images',
+            'default_image_style', 'auto_validate_images', 'use_generation_cache',
             'created_at', 'updated_at'
         ]
         read_only_fields = ['created_at', 'updated_at']
@@ -0,0 +1,75 @@
+"""
+Per-process pooled HTTP sessions shared by the external API clients
+"""
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+
+_sessions = {}
+_owner_pid = None
+_lock = threading.Lock()
+
+
+def get_session(name='default'):
+    """
+    Get the keep-alive session registered under a name for this process
+    
+    Sessions are created lazily and reused by every task running in the
+    worker process. After a fork (Celery prefork pool) the child never
+    reuses the sockets inherited from its parent: the registry notices the
+    new pid and builds fresh sessions.
+    
+    Args:
+        name (str): Logical client name ('blackbox', 'media', 'instagram'...)
+    
+    Returns:
+        requests.Session: Pooled session
+    """
+    global _owner_pid
+    
+    pid = os.getpid()
+    with _lock:
+        if _owner_pid != pid:
+            # Inherited sessions share their sockets with the parent process,
+            # drop them without closing so the parent's connections survive
+            _sessions.clear()
+            _owner_pid = pid
+        
+        session = _sessions.get(name)
+        if session is None:
+            session = _build_session()
+            _sessions[name] = session
+        
+        return session
+
+
+def reset_sessions():
+    """
+    Close every session owned by this process
+    Called when a Celery worker process starts or shuts down
+    """
+    global _owner_pid
+    
+    with _lock:
+        if _owner_pid == os.getpid():
+            for session in _sessions.values():
+                session.close()
+        _sessions.clear()
+        _owner_pid = os.getpid()
+
+
+def _build_session():
+    """
+    Build a session whose adapters keep connections alive between tasks
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=settings.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
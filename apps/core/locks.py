@@ -0,0 +1,104 @@
+"""
+Expiring locks shared by the workers, released by their owner only
+"""
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from .redis import get_redis
+
+
+# Delete the lock only while it still holds the caller's token, so a lock
+# that expired and was taken by another worker is never released by the
+# previous owner.
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LocalLockBackend:
+    """
+    In-process locks, for development and tests
+    """
+    _owners = {}
+    _lock = threading.Lock()
+    
+    def acquire(self, key, token, timeout):
+        with self._lock:
+            owner = self._owners.get(key)
+            if owner and owner[1] > time.monotonic():
+                return False
+            self._owners[key] = (token, time.monotonic() + timeout)
+            return True
+    
+    def release(self, key, token):
+        with self._lock:
+            owner = self._owners.get(key)
+            if owner and owner[0] == token:
+                del self._owners[key]
+    
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._owners.clear()
+
+
+class RedisLockBackend:
+    """
+    Locks shared by every worker through Redis
+    """
+    _script = None
+    
+    def acquire(self, key, token, timeout):
+        return bool(get_redis().set(key, token, nx=True, ex=timeout))
+    
+    def release(self, key, token):
+        client = get_redis()
+        script = RedisLockBackend._script
+        if script is None or script.registered_client is not client:
+            script = RedisLockBackend._script = client.register_script(RELEASE_SCRIPT)
+        script(keys=[key], args=[token])
+
+
+LOCK_BACKENDS = {
+    'local': LocalLockBackend,
+    'redis': RedisLockBackend,
+}
+
+
+class ExpiringLock:
+    """
+    Lock held for at most ``timeout`` seconds
+    
+    Usage:
+        with ExpiringLock('bulk-dispatch', timeout=60).hold() as acquired:
+            if acquired:
+                ...
+    
+    Each holder tags the lock with its own token and the release is a
+    compare-and-delete, so a holder outliving the timeout never releases
+    the lock another worker took since.
+    """
+    prefix = 'lock'
+    
+    def __init__(self, name, timeout=60, backend='redis'):
+        self.key = f"{self.prefix}:{name}"
+        self.timeout = timeout
+        self.backend = LOCK_BACKENDS[backend]()
+    
+    @contextmanager
+    def hold(self):
+        """
+        Yields:
+            bool: True when the lock was acquired, the caller skips its work otherwise
+        """
+        token = uuid.uuid4().hex
+        acquired = self.backend.acquire(self.key, token, self.timeout)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.backend.release(self.key, token)
@@ -0,0 +1,130 @@
+"""
+Lightweight pipeline metrics stored in the Django cache
+"""
+import logging
+from celery import current_app
+from django.core.cache import cache
+from .redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the latency histogram buckets
+LATENCY_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000]
+
+PREFIX = 'metrics'
+
+
+def _incr(key, delta=1):
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # Evicted between add and incr
+        cache.set(key, delta, timeout=None)
+
+
+def _register(kind, name):
+    registry_key = f"{PREFIX}:{kind}"
+    names = cache.get(registry_key) or []
+    if name not in names:
+        cache.set(registry_key, names + [name], timeout=None)
+
+
+def increment(name, delta=1):
+    """
+    Increment a named counter
+    """
+    try:
+        _register('counters', name)
+        _incr(f"{PREFIX}:counter:{name}", delta)
+    except Exception as e:
+        logger.warning(f"Could not record counter {name}: {str(e)}")
+
+
+def record_duration(stage, seconds):
+    """
+    Record one duration of a pipeline stage
+    
+    Durations are kept as a count, a sum and a histogram so percentiles can
+    be estimated without storing samples.
+    
+    Args:
+        stage (str): Stage name ('generation', 'download', 'queue_wait.cpu'...)
+        seconds (float): Measured duration
+    """
+    try:
+        milliseconds = max(0, int(seconds * 1000))
+        bucket = next(
+            (bound for bound in LATENCY_BUCKETS_MS if milliseconds <= bound),
+            'inf'
+        )
+        _register('stages', stage)
+        _incr(f"{PREFIX}:stage:{stage}:count")
+        _incr(f"{PREFIX}:stage:{stage}:sum_ms", milliseconds)
+        _incr(f"{PREFIX}:stage:{stage}:bucket:{bucket}")
+    except Exception as e:
+        logger.warning(f"Could not record duration of {stage}: {str(e)}")
+
+
+def stage_summary(stage):
+    """
+    Returns:
+        dict: count, average and estimated p50/p95/p99 in milliseconds
+    """
+    count = cache.get(f"{PREFIX}:stage:{stage}:count") or 0
+    total = cache.get(f"{PREFIX}:stage:{stage}:sum_ms") or 0
+    bounds = LATENCY_BUCKETS_MS + ['inf']
+    buckets = cache.get_many([f"{PREFIX}:stage:{stage}:bucket:{bound}" for bound in bounds])
+    counts = [buckets.get(f"{PREFIX}:stage:{stage}:bucket:{bound}", 0) for bound in bounds]
+    
+    def percentile(fraction):
+        if not count:
+            return 0
+        threshold = count * fraction
+        seen = 0
+        for bound, bucket_count in zip(bounds, counts):
+            seen += bucket_count
+            if seen >= threshold:
+                return bound
+        return 'inf'
+    
+    return {
+        'count': count,
+        'average_ms': round(total / count, 1) if count else 0,
+        'p50_ms': percentile(0.5),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
+
+
+def snapshot():
+    """
+    Returns:
+        dict: Every counter and stage summary recorded so far
+    """
+    counter_names = cache.get(f"{PREFIX}:counters") or []
+    stage_names = cache.get(f"{PREFIX}:stages") or []
+    return {
+        'counters': {
+            name: cache.get(f"{PREFIX}:counter:{name}") or 0
+            for name in counter_names
+        },
+        'stages': {name: stage_summary(name) for name in stage_names},
+    }
+
+
+def queue_depths(queues=None):
+    """
+    Number of messages waiting in each Celery queue of the Redis broker
+    
+    Returns:
+        dict: Queue name -> depth, None when the broker is unreachable
+    """
+    if queues is None:
+        queues = [queue.name for queue in current_app.conf.task_queues or []]
+    try:
+        client = get_redis()
+        return {queue: client.llen(queue) for queue in queues}
+    except Exception as e:
+        logger.warning(f"Could not read queue depths: {str(e)}")
+        return {queue: None for queue in queues}
@@ -0,0 +1,154 @@
+"""
+Keyset (cursor) pagination for large per-user lists
+"""
+import json
+from collections import OrderedDict
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+def estimate_count(queryset, cap=10000):
+    """
+    Approximate the number of rows of a queryset without counting them all
+    
+    On PostgreSQL the planner estimate is returned and no row is read.
+    Other databases count at most ``cap`` + 1 rows.
+    
+    Args:
+        queryset (QuerySet): Filtered queryset to count
+        cap (int): Maximum number of rows counted when no estimate is available
+    
+    Returns:
+        tuple: (count, exact) where exact is False for an estimate or a capped count
+    """
+    queryset = queryset.order_by()
+    connection = connections[queryset.db]
+    
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows']), False
+    
+    count = queryset[:cap + 1].count()
+    return min(count, cap), count <= cap
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on a composite key: an indexed field plus the ID
+    
+    The cursor holds the values of every ordering field of the last row,
+    so the next page is a range scan of the index (``created_at <= x AND
+    (created_at < x OR id < y)``) instead of an OFFSET, and rows sharing a
+    timestamp (bulk_create) are neither skipped nor repeated.
+    
+    No COUNT(*) is run unless ``?count=approximate`` is passed, see
+    ``estimate_count``.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+    count_query_param = 'count'
+    count_cap = 10000
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'approximate':
+            self.count, self.count_is_exact = estimate_count(queryset, self.count_cap)
+        
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.decode_cursor(request)
+        keyset = self.keyset
+        if keyset is not None:
+            queryset = queryset.filter(self._keyset_filter(keyset))
+        
+        page = super().paginate_queryset(queryset, request, view)
+        
+        # DRF saw a cursor without position, restore the link it points back to
+        if keyset is not None:
+            if keyset.reverse:
+                self.has_next = True
+                self.next_position = keyset.position
+            else:
+                self.has_previous = True
+                self.previous_position = keyset.position
+            if self.template is not None:
+                self.display_page_controls = True
+        return page
+    
+    def get_ordering(self, request, queryset, view):
+        # Always the indexed ordering: OrderingFilter would break the keyset
+        return tuple(self.ordering)
+    
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        self.keyset = None
+        if cursor is None or cursor.position is None:
+            return cursor
+        try:
+            values = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        
+        # DRF filters on the first ordering field only: the composite
+        # filter is applied by paginate_queryset, DRF sees no position
+        self.keyset = cursor
+        return cursor._replace(position=None)
+    
+    def _keyset_filter(self, cursor):
+        values = json.loads(cursor.position)
+        condition = None
+        for field, value in reversed(list(zip(self.ordering, values))):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') != cursor.reverse else 'gt'
+            strict = Q(**{f'{name}__{lookup}': value})
+            condition = strict if condition is None else strict | (Q(**{name: value}) & condition)
+        
+        # Leading bound on the first field so the index range scan is used
+        first = self.ordering[0]
+        lookup = 'lte' if first.startswith('-') != cursor.reverse else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{lookup}': values[0]}) & condition
+    
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for field in ordering:
+            name = field.lstrip('-')
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        return json.dumps(values)
+    
+    def get_paginated_response(self, data):
+        response = [
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]
+        if self.count is not None:
+            response = [('count', self.count), ('count_is_exact', self.count_is_exact)] + response
+        return Response(OrderedDict(response))
+
+
+class OptionalCursorPaginationMixin:
+    """
+    List view mixin switching to keyset pagination with ``?pagination=cursor``
+    
+    Page numbers stay the default. Next and previous links keep the
+    parameter, so clients only opt in on the first request.
+    """
+    cursor_pagination_class = KeysetPagination
+    
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.request.query_params.get('pagination') == 'cursor':
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
@@ -0,0 +1,32 @@
+"""
+Per-process Redis client shared by the caches, limiters and counters
+"""
+import os
+import threading
+import redis
+from django.conf import settings
+
+
+_client = None
+_owner_pid = None
+_lock = threading.Lock()
+
+
+def get_redis():
+    """
+    Get the Redis client of this process
+    
+    Like the HTTP sessions, the client is rebuilt after a fork so prefork
+    children never share a socket with their parent.
+    
+    Returns:
+        redis.Redis: Client connected to settings.REDIS_URL
+    """
+    global _client, _owner_pid
+    
+    pid = os.getpid()
+    with _lock:
+        if _client is None or _owner_pid != pid:
+            _client = redis.Redis.from_url(settings.REDIS_URL)
+            _owner_pid = pid
+        return _client
@@ -0,0 +1,478 @@
+"""
+Rate limiting, circuit breaking and backoff helpers for outgoing API calls
+"""
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from django.core.cache import cache
+from .redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+# Refill then take from a bucket stored as a hash, atomically. Uses the
+# Redis clock so workers with skewed clocks share the same bucket state.
+# Returns the seconds to wait before the tokens are available (0 = taken).
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+# Sliding window log stored as a sorted set of call timestamps, plus a key
+# holding the time until which the API told us to stop. Grants up to the
+# requested calls atomically and returns {granted, seconds to wait for the
+# next free slot (0 = all granted)}.
+SLIDING_WINDOW_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local blocked_until = tonumber(redis.call('GET', KEYS[2]) or '0')
+if blocked_until > now then
+    return {0, tostring(blocked_until - now)}
+end
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local granted = math.max(0, math.min(requested, limit - redis.call('ZCARD', KEYS[1])))
+for i = 1, granted do
+    redis.call('ZADD', KEYS[1], now, ARGV[4] .. ':' .. i)
+end
+redis.call('EXPIRE', KEYS[1], math.ceil(window) + 1)
+
+local wait = 0
+if granted < requested then
+    -- The next slot frees when the oldest call leaves the window
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    wait = tonumber(oldest[2]) + window - now
+end
+return {granted, tostring(wait)}
+"""
+
+
+class LocalTokenBucketBackend:
+    """
+    In-process buckets, for development and tests
+    """
+    _buckets = {}
+    _lock = threading.Lock()
+    
+    def take(self, key, rate, capacity, tokens):
+        with self._lock:
+            now = time.monotonic()
+            available, updated_at = self._buckets.get(key, (capacity, now))
+            available = min(capacity, available + (now - updated_at) * rate)
+            
+            wait = 0.0
+            if available >= tokens:
+                available -= tokens
+            else:
+                wait = (tokens - available) / rate
+            
+            self._buckets[key] = (available, now)
+            return wait
+    
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._buckets.clear()
+
+
+class RedisTokenBucketBackend:
+    """
+    Buckets shared by every worker through Redis
+    """
+    _script = None
+    
+    def take(self, key, rate, capacity, tokens):
+        client = get_redis()
+        script = RedisTokenBucketBackend._script
+        if script is None or script.registered_client is not client:
+            script = RedisTokenBucketBackend._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        return float(script(keys=[key], args=[rate, capacity, tokens]))
+
+
+TOKEN_BUCKET_BACKENDS = {
+    'local': LocalTokenBucketBackend,
+    'redis': RedisTokenBucketBackend,
+}
+
+
+class TokenBucket:
+    """
+    Token bucket allowing ``rate`` calls per second with bursts of ``capacity``
+    
+    Usage:
+        bucket = TokenBucket('blackbox', rate=5, capacity=10)
+        if bucket.acquire(timeout=5):
+            call_the_api()
+    
+    A rate of 0 disables the limit. When the backend is unreachable the
+    bucket lets calls through rather than stopping the pipeline.
+    """
+    prefix = 'token-bucket'
+    
+    def __init__(self, name, rate, capacity=None, backend='redis'):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.backend = TOKEN_BUCKET_BACKENDS[backend]()
+    
+    @property
+    def enabled(self):
+        return self.rate > 0
+    
+    def try_acquire(self, tokens=1):
+        """
+        Take tokens without waiting
+        
+        Returns:
+            float: 0 when the tokens were taken, otherwise the seconds to
+                wait before they are available
+        """
+        if not self.enabled:
+            return 0.0
+        try:
+            return self.backend.take(f"{self.prefix}:{self.name}", self.rate, self.capacity, tokens)
+        except Exception as e:
+            logger.warning(f"Rate limiter {self.name} unavailable: {str(e)}")
+            return 0.0
+    
+    def acquire(self, timeout=0, tokens=1):
+        """
+        Take tokens, sleeping up to ``timeout`` seconds for them
+        
+        Returns:
+            bool: True when the tokens were taken
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class LocalSlidingWindowBackend:
+    """
+    In-process windows, for development and tests
+    """
+    _calls = {}
+    _blocked = {}
+    _lock = threading.Lock()
+    
+    def take(self, key, limit, window, requested):
+        with self._lock:
+            now = time.time()
+            blocked_until = self._blocked.get(key, 0)
+            if blocked_until > now:
+                return 0, blocked_until - now
+            
+            calls = self._calls.setdefault(key, deque())
+            while calls and calls[0] <= now - window:
+                calls.popleft()
+            granted = max(0, min(requested, limit - len(calls)))
+            calls.extend([now] * granted)
+            wait = calls[0] + window - now if granted < requested else 0.0
+            return granted, wait
+    
+    def block(self, key, until):
+        with self._lock:
+            self._blocked[key] = max(until, self._blocked.get(key, 0))
+    
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._calls.clear()
+            cls._blocked.clear()
+
+
+class RedisSlidingWindowBackend:
+    """
+    Windows shared by every worker through Redis
+    """
+    _script = None
+    
+    def take(self, key, limit, window, requested):
+        client = get_redis()
+        script = RedisSlidingWindowBackend._script
+        if script is None or script.registered_client is not client:
+            script = RedisSlidingWindowBackend._script = client.register_script(SLIDING_WINDOW_SCRIPT)
+        granted, wait = script(keys=[key, f"{key}:blocked"], args=[limit, window, requested, uuid.uuid4().hex])
+        return int(granted), float(wait)
+    
+    def block(self, key, until):
+        ttl = math.ceil(until - time.time())
+        if ttl > 0:
+            get_redis().set(f"{key}:blocked", until, ex=ttl + 1)
+
+
+SLIDING_WINDOW_BACKENDS = {
+    'local': LocalSlidingWindowBackend,
+    'redis': RedisSlidingWindowBackend,
+}
+
+
+class SlidingWindowLimiter:
+    """
+    At most ``limit`` calls in any ``window`` seconds, per key
+    
+    Usage:
+        budget = SlidingWindowLimiter('instagram', limit=50, window=86400)
+        granted, wait = budget.take('account', 3)
+    
+    Unlike the token bucket the count is exact over the window, the way
+    platforms count their quotas (50 posts per 24 hours...). Slots are
+    reserved before the calls, and a key can be blocked until a time
+    announced by the API. A limit of 0 disables the limiter; when the
+    backend is unreachable the calls are let through.
+    """
+    prefix = 'sliding-window'
+    
+    def __init__(self, name, limit, window, backend='redis'):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.backend = SLIDING_WINDOW_BACKENDS[backend]()
+    
+    @property
+    def enabled(self):
+        return self.limit > 0
+    
+    def take(self, key, requested=1):
+        """
+        Reserve up to ``requested`` calls for a key
+        
+        Returns:
+            tuple: (calls granted, seconds before the next slot frees, 0
+                when every call was granted)
+        """
+        if not self.enabled:
+            return requested, 0.0
+        try:
+            return self.backend.take(f"{self.prefix}:{self.name}:{key}", self.limit, self.window, requested)
+        except Exception as e:
+            logger.warning(f"Rate budget {self.name} unavailable: {str(e)}")
+            return requested, 0.0
+    
+    def block(self, key, until):
+        """
+        Refuse every call for a key until the ``until`` timestamp
+        """
+        try:
+            self.backend.block(f"{self.prefix}:{self.name}:{key}", until)
+        except Exception as e:
+            logger.warning(f"Rate budget {self.name} unavailable: {str(e)}")
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker shared by every worker through the Django cache
+    (Redis by default, see CACHES)
+    
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls fail fast for ``reset_timeout`` seconds. Then a single probe call
+    is let through (half-open): its success closes the circuit, its failure
+    opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    prefix = 'circuit'
+    
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures_key = f"{self.prefix}:{name}:failures"
+        self._opened_until_key = f"{self.prefix}:{name}:opened_until"
+        self._probe_key = f"{self.prefix}:{name}:probe"
+    
+    @property
+    def state(self):
+        opened_until = cache.get(self._opened_until_key)
+        if not opened_until:
+            return self.CLOSED
+        return self.OPEN if time.time() < opened_until else self.HALF_OPEN
+    
+    def allow(self):
+        """
+        Returns:
+            bool: True when a call may be attempted now
+        """
+        try:
+            opened_until = cache.get(self._opened_until_key)
+            if not opened_until:
+                return True
+            if time.time() < opened_until:
+                return False
+            # Half-open: only one worker gets to probe
+            return cache.add(self._probe_key, 1, timeout=self.reset_timeout)
+        except Exception as e:
+            logger.warning(f"Circuit breaker {self.name} unavailable: {str(e)}")
+            return True
+    
+    def retry_after(self):
+        """
+        Returns:
+            float: Seconds until the circuit lets a probe through
+        """
+        opened_until = cache.get(self._opened_until_key)
+        if not opened_until:
+            return 0.0
+        return max(0.0, opened_until - time.time())
+    
+    def record_success(self):
+        if cache.get(self._opened_until_key) or cache.get(self._failures_key):
+            cache.delete_many([self._failures_key, self._opened_until_key, self._probe_key])
+    
+    def record_failure(self):
+        opened_until = cache.get(self._opened_until_key)
+        if opened_until:
+            if time.time() >= opened_until:
+                # The half-open probe failed
+                self._open()
+            return
+        
+        cache.add(self._failures_key, 0, timeout=None)
+        try:
+            failures = cache.incr(self._failures_key)
+        except ValueError:
+            failures = 1
+            cache.set(self._failures_key, failures, timeout=None)
+        
+        if failures >= self.failure_threshold:
+            self._open()
+    
+    def _open(self):
+        cache.set(self._opened_until_key, time.time() + self.reset_timeout, timeout=None)
+        cache.delete_many([self._failures_key, self._probe_key])
+        logger.warning(f"Circuit {self.name} opened for {self.reset_timeout}s")
+
+
+class AIMDConcurrency:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit
+    
+    The limit grows by one every ``limit`` successful calls and is cut by
+    ``decrease_factor`` on overload (throttling, 5xx, timeouts, latency
+    above ``latency_target``). Decreases closer than ``cooldown`` seconds
+    count once, so a burst of errors from the same window halves the limit
+    a single time. Without an explicit cooldown, the average latency of
+    the successful calls (one round trip) is used.
+    """
+    
+    def __init__(self, initial, minimum=1, maximum=None, latency_target=None,
+                 decrease_factor=0.5, cooldown=None):
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self._limit = float(initial)
+        self._last_decrease = None
+        self._average_latency = None
+    
+    @property
+    def limit(self):
+        return max(self.minimum, int(self._limit))
+    
+    def on_success(self, latency=None):
+        if latency is not None:
+            self._average_latency = latency if self._average_latency is None else (
+                0.8 * self._average_latency + 0.2 * latency
+            )
+        if self.latency_target and latency is not None and latency > self.latency_target:
+            self.on_overload()
+            return
+        self._limit = min(self.maximum, self._limit + 1.0 / self._limit)
+    
+    def on_overload(self):
+        now = time.monotonic()
+        cooldown = self.cooldown
+        if cooldown is None:
+            cooldown = self._average_latency if self._average_latency is not None else 1.0
+        if self._last_decrease is not None and now - self._last_decrease < cooldown:
+            return
+        self._last_decrease = now
+        self._limit = max(self.minimum, self._limit * self.decrease_factor)
+
+
+class AdaptiveSemaphore:
+    """
+    Thread gate letting at most ``controller.limit`` callers in at once,
+    where the limit moves with the AIMD controller
+    """
+    
+    def __init__(self, controller):
+        self.controller = controller
+        self.in_flight = 0
+        self._condition = threading.Condition()
+    
+    def acquire(self, timeout=None):
+        """
+        Returns:
+            bool: False when no slot freed up within ``timeout`` seconds
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.in_flight < self.controller.limit, timeout):
+                return False
+            self.in_flight += 1
+            return True
+    
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+    
+    def on_success(self, latency=None):
+        with self._condition:
+            self.controller.on_success(latency)
+            self._condition.notify_all()
+    
+    def on_overload(self):
+        with self._condition:
+            self.controller.on_overload()
+
+
+def backoff_delay(attempt, base=1.0, cap=300.0):
+    """
+    Exponential backoff with full jitter
+    
+    Args:
+        attempt (int): Number of attempts already made (0 for the first retry)
+        base (float): Delay scale in seconds
+        cap (float): Maximum delay in seconds
+    
+    Returns:
+        float: Random delay in [0, min(cap, base * 2 ** attempt)]
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
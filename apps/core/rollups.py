@@ -0,0 +1,82 @@
+"""
+Time buckets and mergeable latency histograms for the rollup tables
+"""
+import bisect
+from datetime import timedelta
+from django.utils import timezone
+
+GRANULARITIES = ('hour', 'day')
+
+# Upper bounds (seconds) of the latency histogram buckets, plus one
+# unbounded bucket. Fixed bounds make histograms mergeable: hourly
+# buckets add up to daily ones and to any requested range.
+LATENCY_BOUNDS = (0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300)
+
+
+def bucket_start(value, granularity):
+    """
+    Start of the bucket containing a datetime
+    
+    Hours are plain clock hours, days start at midnight in TIME_ZONE.
+    """
+    if granularity == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    return timezone.localtime(value).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_bucket(start, granularity):
+    """
+    Start of the bucket following the one starting at ``start``
+    """
+    if granularity == 'hour':
+        return start + timedelta(hours=1)
+    return bucket_start(timezone.localtime(start) + timedelta(days=1, hours=12), 'day')
+
+
+def latency_histogram(values):
+    """
+    Returns:
+        list: Number of values per LATENCY_BOUNDS bucket
+    """
+    counts = [0] * (len(LATENCY_BOUNDS) + 1)
+    for value in values:
+        counts[bisect.bisect_left(LATENCY_BOUNDS, value)] += 1
+    return counts
+
+
+def merge_histograms(histograms):
+    counts = [0] * (len(LATENCY_BOUNDS) + 1)
+    for histogram in histograms:
+        for index, count in enumerate(histogram):
+            counts[index] += count
+    return counts
+
+
+def histogram_percentile(histogram, fraction):
+    """
+    Estimate a percentile from a latency histogram
+    
+    Values are assumed evenly spread inside their bucket. Percentiles
+    falling in the unbounded bucket are reported as its lower bound.
+    
+    Args:
+        histogram (list): Counts per LATENCY_BOUNDS bucket
+        fraction (float): Percentile between 0 and 1 (0.95 for p95)
+    
+    Returns:
+        float: Estimated value, None for an empty histogram
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+    
+    rank = fraction * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        if count and seen + count >= rank:
+            lower = LATENCY_BOUNDS[index - 1] if index else 0
+            if index == len(LATENCY_BOUNDS):
+                return float(lower)
+            return lower + (LATENCY_BOUNDS[index] - lower) * (rank - seen) / count
+        seen += count
+    return float(LATENCY_BOUNDS[-1])
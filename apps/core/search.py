@@ -0,0 +1,204 @@
+"""
+Full-text search on PostgreSQL (tsvector + GIN) and SQLite (FTS5)
+"""
+import logging
+import re
+from django.db import connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+')
+
+# Same relative weights as PostgreSQL's ts_rank defaults
+WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2, 'D': 0.1}
+
+
+class FullTextIndex:
+    """
+    Weighted full-text index over text columns of a table
+    
+    PostgreSQL: a generated ``search_vector`` tsvector column, kept in sync
+    by the database, with a GIN index. SQLite: an external-content FTS5
+    table ``<table>_fts`` kept in sync by triggers. Other databases have no
+    index and ``search`` returns None.
+    
+    Usage:
+        index = FullTextIndex('generated_images', [('prompt', 'A'), ('validation_notes', 'B')])
+        queryset = index.search(GeneratedImage.objects.all(), 'coucher sol')
+        # -> rows containing words starting with "coucher" and "sol", annotated with search_rank
+    """
+    config = 'french'
+    vector_column = 'search_vector'
+    
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = columns
+        self.fts_table = f"{table}_fts"
+    
+    def supported(self, connection):
+        return connection.vendor in ('postgresql', 'sqlite')
+    
+    def create(self, apps, schema_editor):
+        """
+        RunPython forwards: build the index and index the existing rows
+        """
+        self.ensure(schema_editor.connection)
+    
+    def drop(self, apps, schema_editor):
+        """
+        RunPython backwards
+        """
+        connection = schema_editor.connection
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(f'ALTER TABLE "{self.table}" DROP COLUMN IF EXISTS "{self.vector_column}"')
+            elif connection.vendor == 'sqlite':
+                for suffix in ('ai', 'ad', 'au'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS "{self.fts_table}_{suffix}"')
+                cursor.execute(f'DROP TABLE IF EXISTS "{self.fts_table}"')
+    
+    def ensure(self, connection):
+        """
+        Create whatever part of the index is missing
+        
+        Also run after every migrate: SQLite rebuilds a table (and drops its
+        triggers) on most ALTER TABLE operations.
+        """
+        if self.table not in connection.introspection.table_names():
+            return
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                self._ensure_postgresql(cursor)
+            elif connection.vendor == 'sqlite':
+                self._ensure_sqlite(cursor)
+    
+    def _ensure_postgresql(self, cursor):
+        vector = ' || '.join(
+            f"setweight(to_tsvector('{self.config}', coalesce(\"{column}\", '')), '{weight}')"
+            for column, weight in self.columns
+        )
+        cursor.execute(
+            f'ALTER TABLE "{self.table}" ADD COLUMN IF NOT EXISTS "{self.vector_column}" tsvector '
+            f'GENERATED ALWAYS AS ({vector}) STORED'
+        )
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{self.table}_search_idx" '
+            f'ON "{self.table}" USING GIN ("{self.vector_column}")'
+        )
+    
+    def _ensure_sqlite(self, cursor):
+        names = [column for column, _ in self.columns]
+        columns = ', '.join(f'"{name}"' for name in names)
+        new = ', '.join(f'new."{name}"' for name in names)
+        old = ', '.join(f'old."{name}"' for name in names)
+        triggers = {
+            'ai': f'AFTER INSERT ON "{self.table}" BEGIN '
+                  f'INSERT INTO "{self.fts_table}"(rowid, {columns}) VALUES (new.id, {new}); END',
+            'ad': f'AFTER DELETE ON "{self.table}" BEGIN '
+                  f'INSERT INTO "{self.fts_table}"("{self.fts_table}", rowid, {columns}) '
+                  f"VALUES ('delete', old.id, {old}); END",
+            'au': f'AFTER UPDATE OF {columns} ON "{self.table}" BEGIN '
+                  f'INSERT INTO "{self.fts_table}"("{self.fts_table}", rowid, {columns}) '
+                  f"VALUES ('delete', old.id, {old}); "
+                  f'INSERT INTO "{self.fts_table}"(rowid, {columns}) VALUES (new.id, {new}); END',
+        }
+        
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [self.table]
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        missing = [suffix for suffix in triggers if f"{self.fts_table}_{suffix}" not in existing]
+        if not missing:
+            return
+        
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS "{self.fts_table}" USING fts5({columns}, '
+            f"content='{self.table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        )
+        for suffix in missing:
+            cursor.execute(f'CREATE TRIGGER "{self.fts_table}_{suffix}" {triggers[suffix]}')
+        # Rows written while the triggers were missing are not indexed
+        cursor.execute(f'INSERT INTO "{self.fts_table}"("{self.fts_table}") VALUES (\'rebuild\')')
+        logger.info(f"Full-text index {self.fts_table} rebuilt")
+    
+    def on_post_migrate(self, using, **kwargs):
+        """
+        post_migrate receiver, see ``ensure``
+        """
+        self.ensure(connections[using])
+    
+    def search(self, queryset, text):
+        """
+        Filter rows matching every word of ``text`` (as prefixes)
+        
+        Args:
+            queryset (QuerySet): Queryset over the indexed table
+            text (str): User search terms
+        
+        Returns:
+            QuerySet: Matching rows annotated with ``search_rank`` (higher
+                is better), or None when the database has no full-text index
+        """
+        connection = connections[queryset.db]
+        if not self.supported(connection):
+            return None
+        
+        words = WORD_RE.findall(text.lower())
+        if not words:
+            return queryset.none()
+        
+        if connection.vendor == 'postgresql':
+            tsquery = ' & '.join(f'{word}:*' for word in words)
+            vector = f'"{self.table}"."{self.vector_column}"'
+            query = f"to_tsquery('{self.config}', %s)"
+            return queryset.filter(
+                RawSQL(f'{vector} @@ {query}', [tsquery], output_field=BooleanField())
+            ).annotate(
+                search_rank=RawSQL(f'ts_rank_cd({vector}, {query})', [tsquery], output_field=FloatField())
+            )
+        
+        match = ' '.join(f'"{word}"*' for word in words)
+        weights = ', '.join(str(WEIGHTS[weight]) for _, weight in self.columns)
+        # A join, not a correlated subquery: bm25() is only cheap inside the
+        # MATCH scan itself. The unary + keeps SQLite from probing the FTS
+        # table once per row of the user index, the MATCH scan drives the
+        # join. bm25 is lower for better matches.
+        return queryset.extra(
+            select={'search_rank': f'-bm25("{self.fts_table}", {weights})'},
+            tables=[self.fts_table],
+            where=[
+                f'"{self.table}".id = +"{self.fts_table}".rowid',
+                f'"{self.fts_table}" MATCH %s',
+            ],
+            params=[match],
+        )
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    SearchFilter with a ``search_mode=fulltext`` option
+    
+    The view sets ``search_index`` (a FullTextIndex). In full-text mode the
+    results are ordered by relevance unless ``ordering`` is given, so the
+    filter must come after OrderingFilter. Without an index for the
+    current database, the LIKE search is used.
+    """
+    search_mode_param = 'search_mode'
+    
+    def filter_queryset(self, request, queryset, view):
+        index = getattr(view, 'search_index', None)
+        text = request.query_params.get(self.search_param, '')
+        if index is None or not text.strip() or request.query_params.get(self.search_mode_param) != 'fulltext':
+            return super().filter_queryset(request, queryset, view)
+        
+        results = index.search(queryset, text)
+        if results is None:
+            return super().filter_queryset(request, queryset, view)
+        if api_settings.ORDERING_PARAM in request.query_params:
+            return results
+        return results.order_by('-search_rank', '-id')
+
@@ -0,0 +1,135 @@
+"""
+Local stub HTTP server used by the benchmarks and tests, with optional
+latency and fault injection
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHTTPServer:
+    """
+    Minimal keep-alive HTTP/1.1 server running in a background thread
+    
+    Every request is answered by ``handler(method, path, body)`` which must
+    return a ``(status, headers, body_bytes)`` tuple. The server counts the
+    TCP connections it accepts so callers can measure handshakes.
+    
+    Usage:
+        with StubHTTPServer(handler, latency=0.05) as server:
+            requests.get(server.url + '/image')
+    """
+    
+    def __init__(self, handler=None, latency=0.0):
+        self.handler = handler or json_handler({'url': 'http://localhost/image.png'})
+        self.latency = latency
+        self.connections = 0
+        self.requests = 0
+        self._counter_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+    
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def start(self):
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+            
+            def setup(self):
+                super().setup()
+                with stub._counter_lock:
+                    stub.connections += 1
+            
+            def _respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                with stub._counter_lock:
+                    stub.requests += 1
+                
+                latency = stub.latency() if callable(stub.latency) else stub.latency
+                if latency:
+                    time.sleep(latency)
+                
+                status, headers, payload = stub.handler(self.command, self.path, body)
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                try:
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up (timeout tests)
+                    self.close_connection = True
+            
+            do_GET = _respond
+            do_POST = _respond
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def json_handler(payload, status=200):
+    """
+    Build a handler answering every request with the same JSON document
+    """
+    body = json.dumps(payload).encode()
+    
+    def handler(method, path, request_body):
+        return status, {'Content-Type': 'application/json'}, body
+    
+    return handler
+
+
+def faulty_handler(handler, error_rate=1.0, status=503, retry_after=None, seed=None):
+    """
+    Wrap a handler so a share of the requests fail, to exercise retries,
+    rate limiting and circuit breaking
+    
+    Args:
+        handler: Handler answering the requests that do not fail
+        error_rate (float): Share of requests answered with ``status``
+        status (int): Status code of the injected failures (429, 503...)
+        retry_after (int): Retry-After header sent with the failures
+        seed (int): Seed of the random generator, for reproducible runs
+    """
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    headers = {'Content-Type': 'application/json'}
+    if retry_after is not None:
+        headers['Retry-After'] = str(retry_after)
+    
+    def wrapped(method, path, body):
+        with lock:
+            fail = rng.random() < error_rate
+        if fail:
+            return status, headers, json.dumps({'error': 'injected failure'}).encode()
+        return handler(method, path, body)
+    
+    return wrapped
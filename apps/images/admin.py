@@ -1,5 +1,7 @@
+from collections import Counter
 from django.contrib import admin
-from .models import GeneratedImage, ImageTag, ImageTagRelation, ImageGenerationHistory
+from django.db import transaction
+from .models import GeneratedImage, ImageTag, ImageTagRelation, ImageGenerationHistory, ImageRendition, MediaBlob
 
 
 @admin.register(GeneratedImage)
@@ -35,21 +37,32 @@ class GeneratedImageAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
-    
+
     def prompt_preview(self, obj):
         return obj.prompt[:50] + '...' if len(obj.prompt) > 50 else obj.prompt
     prompt_preview.short_description = 'Prompt'
 
 
+@admin.register(ImageRendition)
+class ImageRenditionAdmin(admin.ModelAdmin):
+    list_display = ['image', 'name', 'width', 'height', 'format', 'file_size', 'created_at']
+    list_filter = ['name', 'format']
+    readonly_fields = ['created_at']
+
+
 @admin.register(ImageTag)
 class ImageTagAdmin(admin.ModelAdmin):
     list_display = ['name', 'description', 'image_count', 'created_at']
     search_fields = ['name', 'description']
-    readonly_fields = ['created_at']
-    
+    readonly_fields = ['usage_count', 'created_at']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_usage()
+
     def image_count(self, obj):
-        return obj.image_relations.count()
+        return obj.usage
     image_count.short_description = 'Images'
+    image_count.admin_order_field = 'usage'
 
 
 @admin.register(ImageTagRelation)
@@ -59,6 +72,25 @@ class ImageTagRelationAdmin(admin.ModelAdmin):
     search_fields = ['image__prompt', 'tag__name']
     readonly_fields = ['created_at']
 
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            if not change:
+                ImageTag.record_usage({obj.tag_id: 1})
+            elif 'tag' in form.changed_data:
+                ImageTag.record_usage({form.initial['tag']: -1, obj.tag_id: 1})
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, ImageTagRelation.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            ImageTag.record_usage({
+                tag_id: -count for tag_id, count in
+                Counter(queryset.values_list('tag_id', flat=True)).items()
+            })
+            queryset.delete()
+
 
 @admin.register(ImageGenerationHistory)
 class ImageGenerationHistoryAdmin(admin.ModelAdmin):
@@ -79,3 +111,10 @@ class ImageGenerationHistoryAdmin(admin.ModelAdmin):
             'fields': ('created_at',)
         }),
     )
+
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ['sha256', 'name', 'size', 'ref_count', 'created_at']
+    search_fields = ['sha256', 'name']
+    readonly_fields = ['sha256', 'name', 'size', 'ref_count', 'created_at']
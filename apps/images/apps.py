@@ -1,7 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ImagesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.images'
     verbose_name = 'Images'
+
+    def ready(self):
+        from .models import PROMPT_SEARCH_INDEX
+        # SQLite drops the full-text triggers when a migration rebuilds the table
+        post_migrate.connect(PROMPT_SEARCH_INDEX.on_post_migrate, sender=self)
@@ -0,0 +1,70 @@
+"""
+Benchmark the async generation engine against sequential generation
+"""
+import json
+import time
+from django.core.management.base import BaseCommand
+from apps.core.http import reset_sessions
+from apps.core.stub_server import StubHTTPServer
+from apps.images.services import ImageGeneratorService
+
+
+class Command(BaseCommand):
+    help = "Measure generation throughput against a local fake Blackbox server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=0.25,
+                            help="Fake Blackbox latency per request in seconds")
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--sequential-sample', type=int, default=20,
+                            help="Images generated sequentially to estimate the baseline")
+
+    def handle(self, *args, **options):
+        images = options['images']
+        
+        with StubHTTPServer(latency=options['latency']) as server:
+            server.handler = self._fake_blackbox(server)
+            generator = ImageGeneratorService()
+            generator.api_key = "benchmark"
+            generator.api_url = f"{server.url}/v1/image"
+            # Measure raw throughput, not the production rate limit
+            generator.rate_limiter.rate = 0
+            requests_by_key = {
+                index: {'prompt': f"benchmark prompt {index}"}
+                for index in range(images)
+            }
+            
+            # Sequential baseline: one request at a time, as generate_image_task does
+            sample = min(options['sequential_sample'], images)
+            reset_sessions()
+            start = time.perf_counter()
+            for index in range(sample):
+                result = generator.generate_image(**requests_by_key[index])
+                generator.download_and_save_image(result['image_url'])
+            sequential_rate = sample / (time.perf_counter() - start)
+            
+            start = time.perf_counter()
+            outcomes = generator.generate_many(requests_by_key, concurrency=options['concurrency'])
+            elapsed = time.perf_counter() - start
+        
+        failures = sum(1 for outcome in outcomes.values() if not outcome['result']['success'])
+        async_rate = images / elapsed
+        
+        self.stdout.write(f"sequential: {sequential_rate:.1f} images/s per process")
+        self.stdout.write(
+            f"     async: {async_rate:.1f} images/s per process "
+            f"({images} images, concurrency {options['concurrency']}, {failures} failures)"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: x{async_rate / sequential_rate:.1f}"))
+
+    def _fake_blackbox(self, server):
+        image_bytes = b'\x89PNG\r\n\x1a\n' + b'\0' * 1024
+        
+        def handler(method, path, body):
+            if method == 'POST':
+                payload = json.dumps({'url': f"{server.url}/files/image.png"}).encode()
+                return 200, {'Content-Type': 'application/json'}, payload
+            return 200, {'Content-Type': 'image/png'}, image_bytes
+        
+        return handler
@@ -0,0 +1,107 @@
+"""
+Benchmark the Blackbox AI client against a fake server that throttles or fails
+"""
+import json
+import threading
+import time
+from django.core.management.base import BaseCommand
+from apps.core.resilience import CircuitBreaker
+from apps.core.stub_server import StubHTTPServer, faulty_handler
+from apps.images.services import ImageGeneratorService
+from apps.images.services.async_generator import AsyncGenerationEngine
+
+
+class Command(BaseCommand):
+    help = "Compare fixed and adaptive concurrency under throttling, and the circuit breaker during an outage"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=200)
+        parser.add_argument('--latency', type=float, default=0.1,
+                            help="Fake Blackbox latency per request in seconds")
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--capacity', type=int, default=8,
+                            help="Requests in flight above which the fake server answers 429")
+        parser.add_argument('--outage-calls', type=int, default=100,
+                            help="Calls made while the fake server answers 503")
+    
+    def handle(self, *args, **options):
+        for adaptive in (False, True):
+            self._throttling_run(adaptive, options)
+        self._outage_run(options)
+    
+    def _generator(self, server, name):
+        generator = ImageGeneratorService()
+        generator.api_key = "benchmark"
+        generator.api_url = f"{server.url}/v1/image"
+        generator.rate_limiter.rate = 0
+        generator.breaker = CircuitBreaker(
+            f"benchmark-{name}-{time.time()}", failure_threshold=5, reset_timeout=60
+        )
+        return generator
+    
+    def _throttling_run(self, adaptive, options):
+        with StubHTTPServer() as server:
+            handler = self._throttling_blackbox(server, options['capacity'], options['latency'])
+            server.handler = handler
+            generator = self._generator(server, 'throttling')
+            # Throttling is measured here, not the breaker
+            generator.breaker.failure_threshold = 10 ** 9
+            
+            engine = AsyncGenerationEngine(generator, concurrency=options['concurrency'], adaptive=adaptive)
+            start = time.perf_counter()
+            outcomes = engine.generate_many({
+                index: {'prompt': f"benchmark prompt {index}"}
+                for index in range(options['images'])
+            })
+            elapsed = time.perf_counter() - start
+        
+        generated = sum(1 for outcome in outcomes.values() if outcome['result']['success'])
+        label = 'adaptive' if adaptive else '   fixed'
+        self.stdout.write(
+            f"{label}: {generated}/{options['images']} generated in {elapsed:.2f}s, "
+            f"{handler.throttled} calls throttled (429), final limit {engine.controller.limit}"
+        )
+    
+    def _outage_run(self, options):
+        with StubHTTPServer(latency=options['latency']) as server:
+            server.handler = faulty_handler(None, status=503)
+            generator = self._generator(server, 'outage')
+            
+            start = time.perf_counter()
+            for index in range(options['outage_calls']):
+                generator.generate_image(f"benchmark prompt {index}")
+            elapsed = time.perf_counter() - start
+            reached = server.requests
+        
+        self.stdout.write(
+            f"  outage: {options['outage_calls']} calls, {reached} reached the API, "
+            f"{options['outage_calls'] - reached} failed fast, {elapsed:.2f}s"
+        )
+        self.stdout.write(self.style.SUCCESS("Done"))
+    
+    def _throttling_blackbox(self, server, capacity, latency):
+        image_bytes = b'\x89PNG\r\n\x1a\n' + b'\0' * 1024
+        lock = threading.Lock()
+        state = {'in_flight': 0}
+        
+        def handler(method, path, body):
+            if method != 'POST':
+                return 200, {'Content-Type': 'image/png'}, image_bytes
+            
+            with lock:
+                state['in_flight'] += 1
+                overloaded = state['in_flight'] > capacity
+                if overloaded:
+                    handler.throttled += 1
+            try:
+                if overloaded:
+                    return 429, {'Content-Type': 'application/json'}, b'{"error": "rate limited"}'
+                time.sleep(latency)
+                payload = json.dumps({'url': f"{server.url}/files/image.png"}).encode()
+                return 200, {'Content-Type': 'application/json'}, payload
+            finally:
+                with lock:
+                    state['in_flight'] -= 1
+        
+        handler.throttled = 0
+        return handler
@@ -0,0 +1,45 @@
+"""
+Benchmark peak memory of buffered vs streaming image downloads
+"""
+import gc
+import tracemalloc
+from django.core.management.base import BaseCommand
+from apps.core.stub_server import StubHTTPServer
+from apps.images.services import ImageGeneratorService
+
+
+class Command(BaseCommand):
+    help = "Measure peak Python memory while downloading images of increasing size"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='4,16,48',
+                            help="Comma separated image sizes in MB")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        generator = ImageGeneratorService()
+        
+        self.stdout.write(f"{'size':>8} {'buffered peak':>15} {'streaming peak':>16}")
+        for size in sizes:
+            # Built before tracing starts so the server's copy is not counted
+            body = b'\x89PNG\r\n\x1a\n' + b'\0' * (size * 1024 * 1024)
+            
+            def handler(method, path, request_body):
+                return 200, {'Content-Type': 'image/png'}, body
+            
+            peaks = {}
+            with StubHTTPServer(handler) as server:
+                for mode, stream in (('buffered', False), ('streaming', True)):
+                    gc.collect()
+                    tracemalloc.start()
+                    result = generator.download_and_save_image(f"{server.url}/image.png", stream=stream)
+                    peaks[mode] = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    if not result['success']:
+                        raise RuntimeError(result['error'])
+                    result['file'].close()
+            
+            self.stdout.write(
+                f"{size:>5} MB {peaks['buffered'] / 1024 / 1024:>12.1f} MB "
+                f"{peaks['streaming'] / 1024 / 1024:>13.1f} MB"
+            )
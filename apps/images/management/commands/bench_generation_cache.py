@@ -0,0 +1,85 @@
+"""
+Benchmark the latency saved by the generation result cache
+"""
+import json
+import random
+import tempfile
+import time
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from apps.core.stub_server import StubHTTPServer
+from apps.images.services import ImageGeneratorService, GenerationResultCache
+from apps.images.services.result_cache import FileSystemResultCacheBackend, RedisResultCacheBackend
+
+
+class Command(BaseCommand):
+    help = "Replay repeated prompts against a fake Blackbox server with and without the cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--distinct', type=int, default=50,
+                            help="Number of distinct prompt/parameter combinations")
+        parser.add_argument('--latency', type=float, default=0.2,
+                            help="Fake Blackbox latency per request in seconds")
+        parser.add_argument('--backend', choices=['filesystem', 'redis'], default='filesystem')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        workload = [
+            {'prompt': f"benchmark prompt {rng.randrange(options['distinct'])}", 'style': 'artistic'}
+            for _ in range(options['requests'])
+        ]
+        
+        with tempfile.TemporaryDirectory() as workdir, \
+                StubHTTPServer(latency=options['latency']) as server:
+            server.handler = self._fake_blackbox(server)
+            storage = FileSystemStorage(location=f"{workdir}/media")
+            generator = ImageGeneratorService()
+            generator.api_url = f"{server.url}/v1/image"
+            # Measure raw throughput, not the production rate limit
+            generator.rate_limiter.rate = 0
+            
+            if options['backend'] == 'redis':
+                backend = RedisResultCacheBackend(ttl=3600)
+            else:
+                backend = FileSystemResultCacheBackend(f"{workdir}/cache", ttl=3600, max_entries=10000)
+            cache = GenerationResultCache(backend)
+            
+            hit_times, miss_times = [], []
+            for params in workload:
+                start = time.perf_counter()
+                key = generator.cache_key(**params)
+                entry = cache.get(key, validate=lambda e: storage.exists(e['image_file']))
+                if entry is None:
+                    result = generator.generate_image(**params)
+                    download = generator.download_and_save_image(result['image_url'])
+                    name = storage.save('generated.png', download['file'])
+                    cache.set(key, {'image_url': result['image_url'], 'image_file': name})
+                    miss_times.append(time.perf_counter() - start)
+                else:
+                    hit_times.append(time.perf_counter() - start)
+            
+            counters = cache.stats()
+        
+        avg_miss = sum(miss_times) / len(miss_times)
+        avg_hit = sum(hit_times) / len(hit_times) if hit_times else 0
+        saved = len(hit_times) * (avg_miss - avg_hit)
+        
+        self.stdout.write(f"  misses: {len(miss_times):>5}, {avg_miss * 1000:.1f} ms average")
+        self.stdout.write(f"    hits: {len(hit_times):>5}, {avg_hit * 1000:.2f} ms average")
+        self.stdout.write(f"counters: {counters}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Latency saved: {saved:.1f}s over {len(workload)} requests "
+            f"({saved / len(workload) * 1000:.0f} ms per request)"
+        ))
+
+    def _fake_blackbox(self, server):
+        image_bytes = b'\x89PNG\r\n\x1a\n' + b'\0' * 64 * 1024
+        
+        def handler(method, path, body):
+            if method == 'POST':
+                payload = json.dumps({'url': f"{server.url}/files/image.png"}).encode()
+                return 200, {'Content-Type': 'application/json'}, payload
+            return 200, {'Content-Type': 'image/png'}, image_bytes
+        
+        return handler
@@ -0,0 +1,59 @@
+"""
+Benchmark pooled keep-alive sessions against one connection per request
+"""
+import time
+import requests
+from django.core.management.base import BaseCommand
+from apps.core.http import get_session, reset_sessions
+from apps.core.stub_server import StubHTTPServer, json_handler
+
+
+class Command(BaseCommand):
+    help = "Compare TCP handshakes and wall time of bare requests vs pooled sessions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generations', type=int, default=1000)
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help="Server latency per request in seconds")
+
+    def handle(self, *args, **options):
+        generations = options['generations']
+        latency = options['latency']
+        
+        results = {}
+        for mode in ('bare', 'pooled'):
+            with StubHTTPServer(latency=latency) as cdn:
+                api_handler = json_handler({'url': f"{cdn.url}/image.png"})
+                with StubHTTPServer(api_handler, latency=latency) as api:
+                    reset_sessions()
+                    start = time.perf_counter()
+                    for _ in range(generations):
+                        self._generation(mode, api.url, cdn.url)
+                    elapsed = time.perf_counter() - start
+                    results[mode] = {
+                        'connections': api.connections + cdn.connections,
+                        'seconds': elapsed,
+                    }
+        reset_sessions()
+        
+        per_thousand = 1000 / generations
+        for mode, data in results.items():
+            self.stdout.write(
+                f"{mode:>7}: {data['connections']:>6} handshakes, "
+                f"{data['seconds']:.2f}s "
+                f"({data['seconds'] / generations * 1000:.2f} ms/generation)"
+            )
+        
+        saved = results['bare']['connections'] - results['pooled']['connections']
+        self.stdout.write(self.style.SUCCESS(
+            f"Handshakes saved per 1,000 generations: {saved * per_thousand:.0f}"
+        ))
+
+    def _generation(self, mode, api_url, cdn_url):
+        """One Blackbox call followed by one CDN download"""
+        if mode == 'bare':
+            response = requests.post(f"{api_url}/v1/image", json={'prompt': 'bench'}, timeout=30)
+            requests.get(response.json()['url'], timeout=30).content
+        else:
+            response = get_session('blackbox').post(f"{api_url}/v1/image", json={'prompt': 'bench'}, timeout=30)
+            get_session('media').get(response.json()['url'], timeout=30).content
@@ -0,0 +1,130 @@
+"""
+Benchmark page-number against keyset pagination on a large seeded history
+"""
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from urllib import parse
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.pagination import Cursor
+from rest_framework.test import APIRequestFactory, force_authenticate
+from apps.core.pagination import estimate_count
+from apps.images.models import GeneratedImage, ImageGenerationHistory
+from apps.images.views import ImageHistoryView, ImageListView
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a power user with --rows images and history entries (kept for the next "
+        "runs), then time pages at increasing depths with page numbers and with cursors"
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--cleanup', action='store_true',
+                            help="Delete the seeded rows at the end")
+    
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='bench-pagination')
+        self._seed(GeneratedImage, user, options['rows'], lambda i: {'prompt': f'benchmark prompt {i}'})
+        self._seed(ImageGenerationHistory, user, options['rows'], lambda i: {'action': 'generated'})
+        
+        for label, model, view_class, url in (
+            ('images', GeneratedImage, ImageListView, '/api/images/'),
+            ('history', ImageGenerationHistory, ImageHistoryView, '/api/images/history/'),
+        ):
+            queryset = model.objects.filter(user=user)
+            total = queryset.count()
+            self.stdout.write(f"{label}: {total} rows, page size {options['page_size']}")
+            
+            for depth in (0, 0.1, 0.5, 0.99):
+                row = int(total * depth)
+                page_number = row // options['page_size'] + 1
+                offset_time, offset_queries = self._time(
+                    view_class, user, url, {'page': page_number, 'page_size': options['page_size']},
+                    options['repeat']
+                )
+                cursor_params = {'pagination': 'cursor', 'page_size': options['page_size']}
+                if row:
+                    cursor_params['cursor'] = self._cursor_at(view_class, queryset, row)
+                cursor_time, cursor_queries = self._time(view_class, user, url, cursor_params, options['repeat'])
+                self.stdout.write(
+                    f"  row {row:>8}: page numbers {offset_time * 1000:8.1f} ms ({offset_queries} queries) | "
+                    f"cursor {cursor_time * 1000:6.1f} ms ({cursor_queries} queries)"
+                )
+            
+            start = time.perf_counter()
+            queryset.count()
+            exact = time.perf_counter() - start
+            start = time.perf_counter()
+            count, is_exact = estimate_count(queryset)
+            estimated = time.perf_counter() - start
+            self.stdout.write(
+                f"  COUNT(*) {exact * 1000:.1f} ms | approximate count {count} "
+                f"({'exact' if is_exact else 'approximate'}) {estimated * 1000:.1f} ms"
+            )
+        
+        if options['cleanup']:
+            GeneratedImage.objects.filter(user=user).delete()
+            ImageGenerationHistory.objects.filter(user=user).delete()
+            user.delete()
+        self.stdout.write(self.style.SUCCESS("Done"))
+    
+    def _seed(self, model, user, rows, fields, batch_size=5000):
+        existing = model.objects.filter(user=user).count()
+        if existing >= rows:
+            return
+        self.stdout.write(f"Seeding {rows - existing} {model._meta.verbose_name_plural}...")
+        start = timezone.now() - timedelta(seconds=rows)
+        with self._explicit_created_at(model), transaction.atomic():
+            for first in range(existing, rows, batch_size):
+                # Some rows share their timestamp, as with bulk_create
+                model.objects.bulk_create([
+                    model(user=user, created_at=start + timedelta(seconds=i - i % 3), **fields(i))
+                    for i in range(first, min(rows, first + batch_size))
+                ])
+    
+    @contextmanager
+    def _explicit_created_at(self, model):
+        field = model._meta.get_field('created_at')
+        field.auto_now_add = False
+        try:
+            yield
+        finally:
+            field.auto_now_add = True
+    
+    def _cursor_at(self, view_class, queryset, row):
+        # Cursor of the row just before the page, as a previous "next" link would hold
+        paginator = view_class.cursor_pagination_class()
+        paginator.base_url = 'http://testserver/'
+        previous = queryset.order_by(*paginator.ordering)[row - 1]
+        link = paginator.encode_cursor(Cursor(
+            offset=0,
+            reverse=False,
+            position=paginator._get_position_from_instance(previous, paginator.ordering)
+        ))
+        return parse.parse_qs(parse.urlsplit(link).query)['cursor'][0]
+    
+    def _time(self, view_class, user, url, params, repeat):
+        factory = APIRequestFactory(HTTP_HOST=settings.ALLOWED_HOSTS[0].lstrip('.*') or 'localhost')
+        view = view_class.as_view()
+        timings = []
+        for _ in range(repeat):
+            request = factory.get(url, params)
+            force_authenticate(request, user=user)
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = view(request)
+                response.render()
+                timings.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.data
+        return statistics.median(timings), len(queries)
@@ -0,0 +1,78 @@
+"""
+Benchmark CPU time of the rendition pipeline against the thumbnail flow
+"""
+import tempfile
+import time
+from io import BytesIO
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from PIL import Image as PILImage
+from apps.images.services import RenditionPipeline
+
+
+class Command(BaseCommand):
+    help = "Compare CPU ms per image: reopen-and-decode thumbnails vs single-decode renditions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=2048, help="Source image side in pixels")
+        parser.add_argument('--iterations', type=int, default=5)
+
+    def handle(self, *args, **options):
+        size = options['size']
+        iterations = options['iterations']
+        pipeline = RenditionPipeline()
+        
+        source = PILImage.merge('RGB', [
+            PILImage.effect_noise((size, size), 40),
+            PILImage.linear_gradient('L').resize((size, size)),
+            PILImage.radial_gradient('L').resize((size, size)),
+        ])
+        
+        self.stdout.write(
+            f"{len(pipeline.specs)} renditions from a {size}x{size} source, "
+            f"CPU ms per image (average of {iterations})"
+        )
+        
+        with tempfile.TemporaryDirectory() as workdir:
+            storage = FileSystemStorage(location=workdir)
+            
+            for source_format in ('JPEG', 'PNG'):
+                buffer = BytesIO()
+                source.save(buffer, format=source_format, quality=95)
+                data = buffer.getvalue()
+                
+                def thumbnail_only():
+                    # Former flow: store, reopen from storage, decode, one thumbnail
+                    name = storage.save('original', ContentFile(data))
+                    with storage.open(name) as stored:
+                        RenditionPipeline(pipeline.specs[:1]).render(stored)
+                    storage.delete(name)
+                
+                def decode_per_rendition():
+                    # Former flow extended to every rendition
+                    name = storage.save('original', ContentFile(data))
+                    for spec in pipeline.specs:
+                        with storage.open(name) as stored:
+                            RenditionPipeline([spec]).render(stored)
+                    storage.delete(name)
+                
+                def single_decode():
+                    pipeline.render(BytesIO(data))
+                
+                results = {
+                    'thumbnail only (former)': self._cpu_ms(thumbnail_only, iterations),
+                    'all renditions, decode each': self._cpu_ms(decode_per_rendition, iterations),
+                    'all renditions, single decode': self._cpu_ms(single_decode, iterations),
+                }
+                
+                self.stdout.write(f"\n{source_format} source ({len(data) / 1024 / 1024:.1f} MB)")
+                for label, cpu_ms in results.items():
+                    self.stdout.write(f"  {label:<32} {cpu_ms:>8.1f} ms")
+
+    @staticmethod
+    def _cpu_ms(function, iterations):
+        start = time.process_time()
+        for _ in range(iterations):
+            function()
+        return (time.process_time() - start) / iterations * 1000
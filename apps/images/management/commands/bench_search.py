@@ -0,0 +1,83 @@
+"""
+Benchmark LIKE search against the full-text index on a large seeded user
+"""
+import random
+import statistics
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.test import APIRequestFactory, force_authenticate
+from apps.images.models import GeneratedImage
+from apps.images.views import ImageListView
+
+WORDS = (
+    "coucher soleil plage tropicale forêt enneigée montagne lac calme ville nuit néon "
+    "portrait femme homme chat chien cheval oiseau fleur jardin printemps été automne hiver "
+    "océan vague bateau phare désert dune ciel étoilé galaxie nébuleuse château médiéval "
+    "rue pavée café terrasse marché fruits légumes cuisine gâteau chocolat vintage moderne "
+    "minimaliste aquarelle huile pastel photographie réaliste cinématique lumière douce "
+    "brume matin pluie orage neige arc-en-ciel rivière cascade pont pierre bois métal verre"
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed --rows images with random prompts (kept for the next runs), then time "
+        "the image list search with LIKE (default) and with search_mode=fulltext"
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--queries', default='soleil,cascade pont,chocolat vint,licorne',
+                            help="Comma-separated searches (the last one matches nothing by default)")
+        parser.add_argument('--cleanup', action='store_true',
+                            help="Delete the seeded rows at the end")
+    
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='bench-search')
+        self._seed(user, options['rows'])
+        self.stdout.write(f"{options['rows']} images, {connection.vendor}")
+        
+        for text in options['queries'].split(','):
+            like_time, count = self._time(user, {'search': text}, options['repeat'])
+            fulltext_time, fulltext_count = self._time(
+                user, {'search': text, 'search_mode': 'fulltext'}, options['repeat']
+            )
+            self.stdout.write(
+                f"  {text!r:>18}: LIKE {like_time * 1000:8.1f} ms ({count} rows) | "
+                f"full-text {fulltext_time * 1000:7.1f} ms ({fulltext_count} rows)"
+            )
+        
+        if options['cleanup']:
+            user.delete()
+        self.stdout.write(self.style.SUCCESS("Done"))
+    
+    def _seed(self, user, rows, batch_size=5000):
+        existing = GeneratedImage.objects.filter(user=user).count()
+        if existing >= rows:
+            return
+        self.stdout.write(f"Seeding {rows - existing} images (the full-text index is filled by triggers)...")
+        rng = random.Random(42)
+        with transaction.atomic():
+            for first in range(existing, rows, batch_size):
+                GeneratedImage.objects.bulk_create([
+                    GeneratedImage(user=user, prompt=' '.join(rng.sample(WORDS, rng.randint(6, 12))))
+                    for _ in range(first, min(rows, first + batch_size))
+                ])
+    
+    def _time(self, user, params, repeat):
+        factory = APIRequestFactory(HTTP_HOST=settings.ALLOWED_HOSTS[0].lstrip('.*') or 'localhost')
+        view = ImageListView.as_view()
+        timings = []
+        for _ in range(repeat):
+            request = factory.get('/api/images/', params)
+            force_authenticate(request, user=user)
+            start = time.perf_counter()
+            response = view(request)
+            response.render()
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.data
+        return statistics.median(timings), response.data['count']
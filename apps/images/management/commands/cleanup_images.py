@@ -0,0 +1,43 @@
+"""
+Purge old rejected and failed images chunk by chunk, or report what would be purged
+"""
+from django.core.management.base import BaseCommand
+from apps.images.services import ImageCleanup
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete rejected and failed images older than CLEANUP_RETENTION_DAYS with their "
+        "files, in chunks; --dry-run only counts them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Count without deleting anything")
+        parser.add_argument('--days', type=int, help="Age of the deleted images (CLEANUP_RETENTION_DAYS)")
+        parser.add_argument('--chunk-size', type=int, help="Images per chunk (CLEANUP_CHUNK_SIZE)")
+        parser.add_argument('--pause', type=float, help="Seconds between chunks (CLEANUP_CHUNK_PAUSE)")
+        parser.add_argument('--max-chunks', type=int, help="Stop after this many chunks")
+
+    def handle(self, *args, **options):
+        cleanup = ImageCleanup(
+            days=options['days'],
+            chunk_size=options['chunk_size'],
+            pause=options['pause'],
+            dry_run=options['dry_run'],
+        )
+        totals = cleanup.run(max_chunks=options['max_chunks'], progress=self._progress)
+        
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(
+                f"Dry run: {totals['images']} images would be deleted, releasing {totals['files']} stored files"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"{totals['images']} images and {totals['files']} files deleted in {totals['chunks']} chunks"
+            ))
+
+    def _progress(self, totals):
+        self.stdout.write(
+            f"chunk {totals['chunks']}: {totals['images']} images, {totals['files']} files "
+            f"(up to id {totals['last_id']})"
+        )
@@ -0,0 +1,159 @@
+"""
+Load test of interactive latency while a large bulk batch is in flight
+"""
+import heapq
+import math
+import random
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from apps.images.services import allocate_batches
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate a 10k-image bulk batch alongside interactive requests and another user's "
+        "batch, with one shared queue (before) and with interactive/bulk queues plus "
+        "fair-share dispatch (after). Durations are simulated, not slept."
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--bulk-images', type=int, default=10000)
+        parser.add_argument('--other-images', type=int, default=200,
+                            help="Images of a second user's batch")
+        parser.add_argument('--other-at', type=float, default=60,
+                            help="Second batch submission time in seconds")
+        parser.add_argument('--latency', type=float, default=8.0,
+                            help="Blackbox latency per image in seconds")
+        parser.add_argument('--concurrency', type=int, default=settings.GENERATION_CONCURRENCY,
+                            help="Blackbox requests in flight per batch task")
+        parser.add_argument('--batch-size', type=int, default=settings.GENERATION_BATCH_SIZE)
+        parser.add_argument('--max-in-flight', type=int, default=settings.BULK_GENERATION_MAX_IN_FLIGHT)
+        parser.add_argument('--bulk-workers', type=int, default=4)
+        parser.add_argument('--interactive-workers', type=int, default=2)
+        parser.add_argument('--interactive-rate', type=float, default=0.1,
+                            help="Interactive requests per second")
+        parser.add_argument('--duration', type=float, default=600,
+                            help="Seconds during which interactive requests arrive")
+        parser.add_argument('--seed', type=int, default=42)
+    
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        arrivals = []
+        now = rng.expovariate(options['interactive_rate'])
+        while now < options['duration']:
+            arrivals.append(now)
+            now += rng.expovariate(options['interactive_rate'])
+        
+        self.stdout.write(
+            f"{options['bulk_images']} bulk images at t=0, {options['other_images']} more from "
+            f"another user at t={options['other_at']:.0f}s, {len(arrivals)} interactive requests, "
+            f"Blackbox latency {options['latency']}s"
+        )
+        for label, simulate in (('before', self._shared_queue), ('after', self._priority_queues)):
+            interactive, other_done, bulk_done = simulate(arrivals, options)
+            self.stdout.write(
+                f"{label:>6}: interactive p50 {self._percentile(interactive, 0.5):7.1f}s "
+                f"p95 {self._percentile(interactive, 0.95):7.1f}s | "
+                f"other user's batch done after {other_done - options['other_at']:7.1f}s | "
+                f"10k batch done after {bulk_done:7.1f}s"
+            )
+    
+    def _batch_duration(self, images, options):
+        return math.ceil(images / options['concurrency']) * options['latency']
+    
+    def _shared_queue(self, arrivals, options):
+        """
+        Every task in one FIFO queue served by all workers: the whole 10k
+        batch is enqueued as chunks at once, the rest waits behind it
+        """
+        batch_size = options['batch_size']
+        jobs = []
+        for start in range(0, options['bulk_images'], batch_size):
+            size = min(batch_size, options['bulk_images'] - start)
+            jobs.append((0.0, len(jobs), 'bulk', self._batch_duration(size, options)))
+        for start in range(0, options['other_images'], batch_size):
+            size = min(batch_size, options['other_images'] - start)
+            jobs.append((options['other_at'], len(jobs), 'other', self._batch_duration(size, options)))
+        for arrival in arrivals:
+            jobs.append((arrival, len(jobs), 'interactive', options['latency']))
+        jobs.sort()
+        
+        workers = [0.0] * (options['bulk_workers'] + options['interactive_workers'])
+        heapq.heapify(workers)
+        interactive, finished = [], {'bulk': 0.0, 'other': 0.0}
+        for enqueued_at, _, kind, duration in jobs:
+            start = max(enqueued_at, heapq.heappop(workers))
+            end = start + duration
+            heapq.heappush(workers, end)
+            if kind == 'interactive':
+                interactive.append(end - enqueued_at)
+            else:
+                finished[kind] = max(finished[kind], end)
+        return interactive, finished['other'], finished['bulk']
+    
+    def _priority_queues(self, arrivals, options):
+        """
+        Interactive requests on their own workers, bulk images dispatched
+        in fair-share batches with at most max_in_flight images generating
+        """
+        # Interactive queue: FIFO on dedicated workers
+        workers = [0.0] * options['interactive_workers']
+        heapq.heapify(workers)
+        interactive = []
+        for arrival in arrivals:
+            start = max(arrival, heapq.heappop(workers))
+            heapq.heappush(workers, start + options['latency'])
+            interactive.append(start + options['latency'] - arrival)
+        
+        # Bulk pool: the dispatcher runs when work arrives and when a batch ends
+        submissions = [
+            (0.0, 'bulk', options['bulk_images']),
+            (options['other_at'], 'other', options['other_images']),
+        ]
+        pending = {}
+        in_flight = {'bulk': 0, 'other': 0}
+        finished = {'bulk': 0.0, 'other': 0.0}
+        queued, running = [], []
+        free_workers = options['bulk_workers']
+        now = 0.0
+        
+        while True:
+            while submissions and submissions[0][0] <= now:
+                submitted_at, user, count = submissions.pop(0)
+                pending[user] = [count, submitted_at]
+            
+            batches = allocate_batches(
+                {user: tuple(state) for user, state in pending.items() if state[0]},
+                in_flight,
+                options['max_in_flight'] - sum(in_flight.values()),
+                options['batch_size']
+            )
+            for user, size in batches:
+                pending[user][0] -= size
+                in_flight[user] += size
+                queued.append((user, size))
+            
+            # Dispatched batches wait in the (short) 'bulk' queue for a worker
+            while free_workers and queued:
+                user, size = queued.pop(0)
+                free_workers -= 1
+                heapq.heappush(running, (now + self._batch_duration(size, options), len(running), user, size))
+            
+            upcoming = [item[0] for item in running[:1]] + [item[0] for item in submissions[:1]]
+            if not upcoming:
+                break
+            now = min(upcoming)
+            
+            while running and running[0][0] <= now:
+                end, _, user, size = heapq.heappop(running)
+                in_flight[user] -= size
+                finished[user] = max(finished[user], end)
+                free_workers += 1
+        
+        return interactive, finished['other'], finished['bulk']
+    
+    def _percentile(self, values, fraction):
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
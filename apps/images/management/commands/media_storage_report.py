@@ -0,0 +1,39 @@
+"""
+Report the disk space saved by content-addressed media storage
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, Sum
+from apps.images.models import MediaBlob
+
+
+class Command(BaseCommand):
+    help = "Show blob count, stored bytes and bytes saved by deduplication"
+
+    def handle(self, *args, **options):
+        totals = MediaBlob.objects.aggregate(
+            blobs=Count('id'),
+            stored=Sum('size'),
+            referenced=Sum(F('size') * F('ref_count')),
+            references=Sum('ref_count'),
+        )
+        stored = totals['stored'] or 0
+        referenced = totals['referenced'] or 0
+        saved = referenced - stored
+        ratio = (saved / referenced * 100) if referenced else 0
+        
+        self.stdout.write(f"Blobs:               {totals['blobs']}")
+        self.stdout.write(f"References:          {totals['references'] or 0}")
+        self.stdout.write(f"Stored on disk:      {self._format(stored)}")
+        self.stdout.write(f"Without dedup:       {self._format(referenced)}")
+        self.stdout.write(self.style.SUCCESS(f"Saved:               {self._format(saved)} ({ratio:.1f}%)"))
+        
+        orphans = MediaBlob.objects.filter(ref_count=0).count()
+        if orphans:
+            self.stdout.write(self.style.WARNING(f"Unreferenced blobs:  {orphans}"))
+
+    @staticmethod
+    def _format(size):
+        for unit in ('B', 'KB', 'MB', 'GB'):
+            if size < 1024 or unit == 'GB':
+                return f"{size:.1f} {unit}" if unit != 'B' else f"{size} B"
+            size /= 1024
@@ -0,0 +1,18 @@
+"""
+Recompute the tag usage counters from the image/tag relations
+"""
+from django.core.management.base import BaseCommand
+from apps.images.models import ImageTag
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild ImageTag.usage_count (TAG_USAGE_COUNTS_ENABLED) and report how many "
+        "tags had drifted"
+    )
+
+    def handle(self, *args, **options):
+        drifted = ImageTag.recount_usage()
+        self.stdout.write(self.style.SUCCESS(
+            f"{ImageTag.objects.count()} tags rebuilt, {drifted} had drifted"
+        ))
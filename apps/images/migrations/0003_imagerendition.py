@@ -0,0 +1,34 @@
+# Generated by Django 4.2.8 on 2026-10-17 04:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0002_mediablob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('file', models.ImageField(upload_to='renditions/%Y/%m/%d/')),
+                ('width', models.IntegerField()),
+                ('height', models.IntegerField()),
+                ('format', models.CharField(max_length=10)),
+                ('file_size', models.IntegerField(help_text='Taille en octets')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='images.generatedimage')),
+            ],
+            options={
+                'verbose_name': 'Image Rendition',
+                'verbose_name_plural': 'Image Renditions',
+                'db_table': 'image_renditions',
+                'unique_together': {('image', 'name')},
+            },
+        ),
+    ]
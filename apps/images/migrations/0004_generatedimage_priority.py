@@ -0,0 +1,22 @@
+# Generated by Django 4.2.8 on 2026-10-17 04:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0003_imagerendition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generatedimage',
+            name='priority',
+            field=models.CharField(choices=[('interactive', 'Interactive'), ('bulk', 'Lot')], default='interactive', help_text='File Celery de génération : interactive ou lot (partage équitable)', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='generatedimage',
+            index=models.Index(fields=['priority', 'status', 'user'], name='generated_i_priorit_56b98c_idx'),
+        ),
+    ]
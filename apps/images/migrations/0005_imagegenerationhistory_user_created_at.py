@@ -0,0 +1,17 @@
+# Generated by Django 4.2.8 on 2026-10-17 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0004_generatedimage_priority'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='imagegenerationhistory',
+            index=models.Index(fields=['user', '-created_at'], name='image_gener_user_id_864f1b_idx'),
+        ),
+    ]
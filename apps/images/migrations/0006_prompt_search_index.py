@@ -0,0 +1,16 @@
+from django.db import migrations
+from apps.core.search import FullTextIndex
+
+
+index = FullTextIndex('generated_images', [('prompt', 'A'), ('validation_notes', 'B')])
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('images', '0005_imagegenerationhistory_user_created_at'),
+    ]
+    
+    operations = [
+        migrations.RunPython(index.create, index.drop),
+    ]
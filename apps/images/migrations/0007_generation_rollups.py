@@ -0,0 +1,55 @@
+# Generated by Django 4.2.8 on 2026-10-17 05:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('images', '0006_prompt_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Heure'), ('day', 'Jour')], max_length=10)),
+                ('bucket', models.DateTimeField(help_text="Début de l'heure ou du jour")),
+                ('action', models.CharField(max_length=50)),
+                ('count', models.IntegerField(default=0)),
+                ('generation_time_count', models.IntegerField(default=0)),
+                ('generation_time_sum', models.FloatField(default=0)),
+                ('generation_time_histogram', models.JSONField(blank=True, default=list, help_text='Nombre de générations par tranche de LATENCY_BOUNDS')),
+            ],
+            options={
+                'verbose_name': 'Generation Rollup',
+                'verbose_name_plural': 'Generation Rollups',
+                'db_table': 'generation_rollups',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='imagegenerationhistory',
+            index=models.Index(fields=['created_at'], name='image_gener_created_afa621_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imagegenerationhistory',
+            index=models.Index(fields=['action', 'created_at'], name='image_gener_action_f6f40e_idx'),
+        ),
+        migrations.AddField(
+            model_name='generationrollup',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_rollups', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='generationrollup',
+            index=models.Index(fields=['granularity', 'bucket'], name='generation__granula_e63b84_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='generationrollup',
+            unique_together={('user', 'granularity', 'bucket', 'action')},
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.8 on 2026-10-17 05:26
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_usage(apps, schema_editor):
+    ImageTag = apps.get_model('images', 'ImageTag')
+    ImageTagRelation = apps.get_model('images', 'ImageTagRelation')
+    counts = ImageTagRelation.objects.filter(tag=OuterRef('pk')).order_by().values('tag').annotate(
+        count=Count('id')
+    ).values('count')
+    ImageTag.objects.update(usage_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('images', '0007_generation_rollups'),
+    ]
+    
+    operations = [
+        migrations.AddField(
+            model_name='imagetag',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, help_text="Nombre d'images portant le tag"),
+        ),
+        migrations.AddIndex(
+            model_name='imagetag',
+            index=models.Index(fields=['-usage_count', 'name'], name='image_tags_usage_c_3f4a71_idx'),
+        ),
+        migrations.RunPython(count_usage, migrations.RunPython.noop),
+    ]
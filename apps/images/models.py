@@ -1,8 +1,15 @@
+from django.conf import settings
 from django.db import models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
+from apps.authentication.models import UserStats, UserStatsMixin
+from apps.core.search import FullTextIndex
 
 
-class GeneratedImage(models.Model):
+class GeneratedImage(UserStatsMixin, models.Model):
     """
     Model for storing generated images
     """
@@ -15,6 +22,11 @@ class GeneratedImage(models.Model):
         ('failed', 'Échec'),
     ]
     
+    PRIORITY_CHOICES = [
+        ('interactive', 'Interactive'),
+        ('bulk', 'Lot'),
+    ]
+    
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='generated_images')
     prompt = models.TextField(help_text="Description de l'image à générer")
     negative_prompt = models.TextField(blank=True, help_text="Éléments à éviter dans l'image")
@@ -26,7 +38,15 @@ class GeneratedImage(models.Model):
     
     # Status and metadata
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    priority = models.CharField(
+        max_length=20,
+        choices=PRIORITY_CHOICES,
+        default='interactive',
+        help_text="File Celery de génération : interactive ou lot (partage équitable)"
+    )
     error_message = models.TextField(blank=True, null=True)
+    claim_token = models.UUIDField(null=True, blank=True, editable=False, db_index=True)
+    claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
     
     # Generation parameters
     style = models.CharField(max_length=100, default='realistic')
@@ -54,11 +74,20 @@ class GeneratedImage(models.Model):
         indexes = [
             models.Index(fields=['user', '-created_at']),
             models.Index(fields=['status']),
+            models.Index(fields=['priority', 'status', 'user']),
         ]
 
+    stats_fields = ('status', 'generation_time')
+
     def __str__(self):
         return f"{self.user.username} - {self.prompt[:50]}... ({self.status})"
 
+    def stats_counters(self):
+        counters = {'total_images': 1, f'{self.status}_images': 1}
+        if self.generation_time is not None:
+            counters.update(timed_images=1, total_generation_time=self.generation_time)
+        return counters
+
     @property
     def is_validated(self):
         return self.status == 'validated'
@@ -67,6 +96,86 @@ class GeneratedImage(models.Model):
     def is_ready_for_scheduling(self):
         return self.status in ['validated', 'generated']
 
+    def delete_files(self):
+        """
+        Release the stored image and thumbnail
+        
+        Content-addressed blobs are only deleted with their last reference.
+        Files stored before content addressing are deleted unless another
+        image links them.
+        """
+        from .services.media_store import MediaStore
+        
+        store = MediaStore()
+        for field_name in ('image_file', 'thumbnail'):
+            field_file = getattr(self, field_name)
+            if not field_file or store.release(field_file.name):
+                continue
+            shared = GeneratedImage.objects.filter(
+                **{field_name: field_file.name}
+            ).exclude(pk=self.pk).exists()
+            if not shared:
+                field_file.delete(save=False)
+        
+        for rendition in self.renditions.all():
+            if rendition.file and not store.release(rendition.file.name):
+                rendition.file.delete(save=False)
+
+
+UserStats.track(GeneratedImage)
+
+# Full-text search on the prompts (search_mode=fulltext)
+PROMPT_SEARCH_INDEX = FullTextIndex(
+    GeneratedImage._meta.db_table, [('prompt', 'A'), ('validation_notes', 'B')]
+)
+
+
+class ImageRendition(models.Model):
+    """
+    Derived version of a generated image (thumbnail, web, platform crops)
+    """
+    image = models.ForeignKey(GeneratedImage, on_delete=models.CASCADE, related_name='renditions')
+    name = models.CharField(max_length=50)
+    file = models.ImageField(upload_to='renditions/%Y/%m/%d/')
+    width = models.IntegerField()
+    height = models.IntegerField()
+    format = models.CharField(max_length=10)
+    file_size = models.IntegerField(help_text="Taille en octets")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'image_renditions'
+        verbose_name = 'Image Rendition'
+        verbose_name_plural = 'Image Renditions'
+        unique_together = ['image', 'name']
+
+    def __str__(self):
+        return f"{self.image_id} - {self.name} ({self.width}x{self.height})"
+
+
+class ImageTagQuerySet(models.QuerySet):
+    def with_usage(self):
+        """
+        Annotate ``usage`` with the number of images carrying each tag
+        
+        Reads the usage_count counter, or counts the relations when
+        TAG_USAGE_COUNTS_ENABLED is off.
+        """
+        if settings.TAG_USAGE_COUNTS_ENABLED:
+            return self.annotate(usage=F('usage_count'))
+        return self.annotate(usage=Count('image_relations'))
+
+    def starting_with(self, prefix):
+        """
+        Tags whose name starts with a prefix
+        
+        Names are stored lower-cased, so the prefix is normalized and matched
+        with a range on the unique name index instead of a LIKE, which SQLite
+        only runs through an index for case-insensitive columns.
+        """
+        prefix = ' '.join(prefix.split()).lower()
+        return self.filter(name__gte=prefix, name__lt=prefix + '\U0010ffff')
+
 
 class ImageTag(models.Model):
     """
@@ -74,17 +183,71 @@ class ImageTag(models.Model):
     """
     name = models.CharField(max_length=50, unique=True)
     description = models.TextField(blank=True)
+    usage_count = models.PositiveIntegerField(default=0, help_text="Nombre d'images portant le tag")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ImageTagQuerySet.as_manager()
+
     class Meta:
         db_table = 'image_tags'
         verbose_name = 'Image Tag'
         verbose_name_plural = 'Image Tags'
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['-usage_count', 'name']),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def record_usage(cls, deltas):
+        """
+        Apply relation count changes to usage_count, one UPDATE per distinct delta
+        
+        Args:
+            deltas (dict): Tag ID -> relations added, negative when removed
+        """
+        if not settings.TAG_USAGE_COUNTS_ENABLED:
+            return
+        
+        tag_ids_by_delta = {}
+        for tag_id, delta in deltas.items():
+            if delta:
+                tag_ids_by_delta.setdefault(delta, []).append(tag_id)
+        for delta, tag_ids in tag_ids_by_delta.items():
+            cls.objects.filter(id__in=tag_ids).update(usage_count=Greatest(F('usage_count') + delta, 0))
+
+    @classmethod
+    def release_images(cls, image_ids):
+        """
+        Remove the relations of images about to be deleted from usage_count, in one UPDATE
+        """
+        if not settings.TAG_USAGE_COUNTS_ENABLED:
+            return
+        
+        released = ImageTagRelation.objects.filter(
+            tag=OuterRef('pk'), image_id__in=image_ids
+        ).order_by().values('tag').annotate(count=Count('id')).values('count')
+        cls.objects.filter(image_relations__image_id__in=image_ids).update(
+            usage_count=Greatest(F('usage_count') - Subquery(released), 0)
+        )
+
+    @classmethod
+    def recount_usage(cls):
+        """
+        Recompute usage_count from the relations
+        
+        Returns:
+            int: Number of tags whose counter had drifted
+        """
+        actual = Coalesce(Subquery(
+            ImageTagRelation.objects.filter(tag=OuterRef('pk'))
+            .order_by().values('tag').annotate(count=Count('id')).values('count')
+        ), 0)
+        drifted = cls.objects.annotate(actual=actual).exclude(usage_count=F('actual'))
+        return cls.objects.filter(id__in=drifted.values('id')).update(usage_count=actual)
+
 
 class ImageTagRelation(models.Model):
     """
@@ -104,6 +267,12 @@ class ImageTagRelation(models.Model):
         return f"{self.image.id} - {self.tag.name}"
 
 
+@receiver(pre_delete, sender=GeneratedImage)
+def _release_image_tags(sender, instance, **kwargs):
+    # The relations are removed by the cascade, after this signal
+    ImageTag.release_images([instance.pk])
+
+
 class ImageGenerationHistory(models.Model):
     """
     Model to track image generation history and statistics
@@ -121,6 +290,68 @@ class ImageGenerationHistory(models.Model):
         verbose_name = 'Image Generation History'
         verbose_name_plural = 'Image Generation Histories'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+            models.Index(fields=['created_at']),
+            models.Index(fields=['action', 'created_at']),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.action} - {self.created_at}"
+
+
+class GenerationRollup(models.Model):
+    """
+    Hourly or daily summary of a user's generation history, per action
+    
+    Filled by the rollup_generation_history task and kept after the raw
+    history is pruned (HISTORY_RETENTION_DAYS).
+    """
+    GRANULARITY_CHOICES = [
+        ('hour', 'Heure'),
+        ('day', 'Jour'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='generation_rollups')
+    granularity = models.CharField(max_length=10, choices=GRANULARITY_CHOICES)
+    bucket = models.DateTimeField(help_text="Début de l'heure ou du jour")
+    action = models.CharField(max_length=50)
+    count = models.IntegerField(default=0)
+    
+    # Generation times of the 'generated' entries (cache hits have none)
+    generation_time_count = models.IntegerField(default=0)
+    generation_time_sum = models.FloatField(default=0)
+    generation_time_histogram = models.JSONField(
+        default=list, blank=True, help_text="Nombre de générations par tranche de LATENCY_BOUNDS"
+    )
+
+    class Meta:
+        db_table = 'generation_rollups'
+        verbose_name = 'Generation Rollup'
+        verbose_name_plural = 'Generation Rollups'
+        unique_together = ['user', 'granularity', 'bucket', 'action']
+        indexes = [
+            models.Index(fields=['granularity', 'bucket']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.granularity} {self.bucket} - {self.action}: {self.count}"
+
+
+class MediaBlob(models.Model):
+    """
+    Content-addressed file shared by every image field storing the same bytes
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True, help_text="Chemin dans le stockage")
+    size = models.BigIntegerField(help_text="Taille en octets")
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'media_blobs'
+        verbose_name = 'Media Blob'
+        verbose_name_plural = 'Media Blobs'
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} refs)"
@@ -1,15 +1,51 @@
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
-from .models import GeneratedImage, ImageTag, ImageTagRelation, ImageGenerationHistory
+from apps.core.rollups import GRANULARITIES, bucket_start, histogram_percentile
+from .models import (
+    GeneratedImage, GenerationRollup, ImageTag, ImageGenerationHistory, ImageRendition
+)
+from .services import set_image_tags
 
 
 class ImageTagSerializer(serializers.ModelSerializer):
     """
     Serializer for image tags
+    
+    ``usage_count`` is the ``usage`` annotation when the queryset has one
+    (ImageTag.objects.with_usage(), or a per-user count), the counter otherwise.
     """
+    usage_count = serializers.SerializerMethodField()
+    
     class Meta:
         model = ImageTag
-        fields = ['id', 'name', 'description', 'created_at']
+        fields = ['id', 'name', 'description', 'usage_count', 'created_at']
         read_only_fields = ['id', 'created_at']
+    
+    def get_usage_count(self, obj):
+        return getattr(obj, 'usage', obj.usage_count)
+
+
+class TagQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the top tags and autocomplete endpoints
+    """
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+
+class TagAutocompleteQuerySerializer(TagQuerySerializer):
+    q = serializers.CharField(max_length=50)
+
+
+class ImageRenditionSerializer(serializers.ModelSerializer):
+    """
+    Serializer for image renditions
+    """
+    class Meta:
+        model = ImageRendition
+        fields = ['name', 'file', 'width', 'height', 'format', 'file_size']
+        read_only_fields = fields
 
 
 class GeneratedImageSerializer(serializers.ModelSerializer):
@@ -18,6 +54,7 @@ class GeneratedImageSerializer(serializers.ModelSerializer):
     """
     user = serializers.StringRelatedField(read_only=True)
     tags = serializers.SerializerMethodField()
+    renditions = ImageRenditionSerializer(many=True, read_only=True)
     image_url_display = serializers.SerializerMethodField()
     
     class Meta:
@@ -25,22 +62,25 @@ class GeneratedImageSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'user', 'prompt', 'negative_prompt',
             'image_url', 'image_file', 'thumbnail', 'image_url_display',
-            'status', 'error_message',
+            'status', 'priority', 'error_message',
             'style', 'width', 'height', 'quality',
             'metadata', 'generation_time',
             'validated_at', 'validation_notes',
-            'tags', 'is_validated', 'is_ready_for_scheduling',
+            'tags', 'renditions', 'is_validated', 'is_ready_for_scheduling',
             'created_at', 'updated_at'
         ]
         read_only_fields = [
             'id', 'user', 'image_url', 'image_file', 'thumbnail',
-            'status', 'error_message', 'generation_time',
+            'status', 'priority', 'error_message', 'generation_time',
             'validated_at', 'created_at', 'updated_at'
         ]
 
     def get_tags(self, obj):
-        tag_relations = obj.tag_relations.select_related('tag').all()
-        return [relation.tag.name for relation in tag_relations]
+        # .all() keeps using the prefetched tag relations, others are joined to their tag
+        relations = obj.tag_relations.all()
+        if 'tag_relations' not in getattr(obj, '_prefetched_objects_cache', {}):
+            relations = relations.select_related('tag')
+        return [relation.tag.name for relation in relations]
 
     def get_image_url_display(self, obj):
         if obj.image_file:
@@ -50,6 +90,18 @@ class GeneratedImageSerializer(serializers.ModelSerializer):
         return obj.image_url
 
 
+class GeneratedImageListSerializer(GeneratedImageSerializer):
+    """
+    Serializer for image lists, without the metadata blob
+    
+    Querysets must prefetch ``tag_relations`` (with their tag) and ``renditions`` and
+    select ``user`` so a page costs the same number of queries whatever
+    its size.
+    """
+    class Meta(GeneratedImageSerializer.Meta):
+        fields = [field for field in GeneratedImageSerializer.Meta.fields if field != 'metadata']
+
+
 class ImageGenerationRequestSerializer(serializers.Serializer):
     """
     Serializer for image generation requests
@@ -94,6 +146,17 @@ class ImageGenerationRequestSerializer(serializers.Serializer):
     )
 
 
+class BulkImageGenerationRequestSerializer(serializers.Serializer):
+    """
+    Serializer for bulk image generation requests
+    """
+    images = ImageGenerationRequestSerializer(
+        many=True,
+        allow_empty=False,
+        max_length=100
+    )
+
+
 class ImageValidationSerializer(serializers.Serializer):
     """
     Serializer for image validation
@@ -126,20 +189,15 @@ class ImageUpdateSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         tags_data = validated_data.pop('tags', None)
         
-        # Update basic fields
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
+        with transaction.atomic():
+            # Update basic fields
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            instance.save()
         
-        # Update tags if provided
-        if tags_data is not None:
-            # Remove existing tags
-            instance.tag_relations.all().delete()
-            
-            # Add new tags
-            for tag_name in tags_data:
-                tag, _ = ImageTag.objects.get_or_create(name=tag_name.lower())
-                ImageTagRelation.objects.create(image=instance, tag=tag)
+            # Update tags if provided, only the added and removed ones are written
+            if tags_data is not None:
+                set_image_tags(instance, tags_data)
         
         return instance
 
@@ -149,7 +207,7 @@ class ImageGenerationHistorySerializer(serializers.ModelSerializer):
     Serializer for image generation history
     """
     user = serializers.StringRelatedField(read_only=True)
-    image_id = serializers.IntegerField(source='image.id', read_only=True)
+    image_id = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = ImageGenerationHistory
@@ -169,3 +227,56 @@ class ImageStatisticsSerializer(serializers.Serializer):
     failed_images = serializers.IntegerField()
     average_generation_time = serializers.FloatField()
     total_generation_time = serializers.FloatField()
+
+
+class RollupQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the rollup endpoints
+    
+    The range defaults to the last 48 hours or 30 days and is widened to
+    whole buckets.
+    """
+    max_buckets = 1000
+    default_buckets = {'hour': 48, 'day': 30}
+    
+    granularity = serializers.ChoiceField(choices=GRANULARITIES, default='day')
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    
+    def validate(self, attrs):
+        granularity = attrs['granularity']
+        step = timedelta(hours=1) if granularity == 'hour' else timedelta(days=1)
+        end = attrs.get('end') or timezone.now()
+        start = bucket_start(attrs.get('start') or end - step * self.default_buckets[granularity], granularity)
+        
+        if start >= end:
+            raise serializers.ValidationError("La date de début doit précéder la date de fin.")
+        if end - start > step * self.max_buckets:
+            raise serializers.ValidationError(
+                f"Intervalle trop long : {self.max_buckets} intervalles au maximum."
+            )
+        attrs.update(start=start, end=end)
+        return attrs
+
+
+class GenerationRollupSerializer(serializers.ModelSerializer):
+    """
+    Serializer for a generation history rollup bucket
+    """
+    generation_time = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = GenerationRollup
+        fields = ['bucket', 'action', 'count', 'generation_time']
+    
+    def get_generation_time(self, obj):
+        if not obj.generation_time_count:
+            return None
+        histogram = obj.generation_time_histogram
+        return {
+            'count': obj.generation_time_count,
+            'average': round(obj.generation_time_sum / obj.generation_time_count, 2),
+            'p50': round(histogram_percentile(histogram, 0.50), 2),
+            'p95': round(histogram_percentile(histogram, 0.95), 2),
+            'p99': round(histogram_percentile(histogram, 0.99), 2),
+        }
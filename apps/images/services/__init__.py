@@ -1,3 +1,24 @@
+from .cleanup import ImageCleanup
+from .dispatch import BulkGenerationDispatcher, allocate_batches
 from .image_generator import ImageGeneratorService
+from .media_store import MediaStore
+from .renditions import RenditionPipeline
+from .result_cache import GenerationResultCache, generation_cache_key
+from .rollups import GenerationRollupBuilder
+from .tags import add_image_tags, normalize_tag_names, resolve_tags, set_image_tags
 
-__all__ = ['ImageGeneratorService']
+__all__ = [
+    'BulkGenerationDispatcher',
+    'allocate_batches',
+    'ImageGeneratorService',
+    'MediaStore',
+    'RenditionPipeline',
+    'GenerationResultCache',
+    'generation_cache_key',
+    'GenerationRollupBuilder',
+    'add_image_tags',
+    'normalize_tag_names',
+    'resolve_tags',
+    'set_image_tags',
+    'ImageCleanup'
+]
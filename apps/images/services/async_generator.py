@@ -0,0 +1,204 @@
+"""
+Asyncio generation engine running many Blackbox AI requests in one process
+"""
+import asyncio
+import time
+import httpx
+from django.conf import settings
+from apps.core.resilience import AIMDConcurrency
+from .downloads import DownloadSink
+
+
+class AdaptiveSlots:
+    """
+    Async gate letting at most ``controller.limit`` coroutines in at once,
+    where the limit moves with the AIMD controller
+    """
+    
+    def __init__(self, controller):
+        self.controller = controller
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+    
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.controller.limit)
+            self.in_flight += 1
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+
+class AsyncGenerationEngine:
+    """
+    Keep up to ``concurrency`` generations in flight on a single event loop
+    
+    Each generation is the Blackbox AI call followed by the download of the
+    produced file. Every request has its own timeout so one stuck call only
+    costs its own slot.
+    
+    The number of calls in flight adapts (AIMD) to what Blackbox sustains:
+    it is halved on throttling, 5xx, timeouts and slow answers, and grows
+    back by one per round of successes. Calls also go through the service
+    rate limiter and circuit breaker.
+    """
+    
+    def __init__(self, service, concurrency=None, timeout=None, adaptive=True):
+        self.service = service
+        self.concurrency = concurrency or settings.GENERATION_CONCURRENCY
+        self.timeout = timeout or settings.GENERATION_REQUEST_TIMEOUT
+        self.controller = AIMDConcurrency(
+            initial=self.concurrency,
+            minimum=min(settings.GENERATION_MIN_CONCURRENCY, self.concurrency),
+            maximum=self.concurrency,
+            latency_target=settings.GENERATION_LATENCY_TARGET if adaptive else None,
+            decrease_factor=0.5 if adaptive else 1.0
+        )
+    
+    def generate_many(self, requests_by_key):
+        """
+        Generate and download every requested image
+        
+        Args:
+            requests_by_key (dict): Key -> keyword arguments of generate_image
+        
+        Returns:
+            dict: Key -> {'result': generate_image result,
+                'download': download_and_save_image result or None}
+        """
+        if not requests_by_key:
+            return {}
+        return asyncio.run(self._generate_many(requests_by_key))
+    
+    async def _generate_many(self, requests_by_key):
+        slots = AdaptiveSlots(self.controller)
+        limits = httpx.Limits(
+            max_connections=self.concurrency,
+            max_keepalive_connections=self.concurrency
+        )
+        
+        async with httpx.AsyncClient(limits=limits, timeout=self.timeout) as client:
+            keys = list(requests_by_key)
+            outcomes = await asyncio.gather(*(
+                self._generate_one(client, slots, requests_by_key[key])
+                for key in keys
+            ))
+        
+        return dict(zip(keys, outcomes))
+    
+    async def _acquire_token(self):
+        """
+        Wait for a rate limiter token without blocking the event loop
+        """
+        limiter = self.service.rate_limiter
+        deadline = time.monotonic() + settings.BLACKBOX_RATE_LIMIT_WAIT
+        while True:
+            wait = limiter.try_acquire()
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+    
+    async def _generate_one(self, client, slots, params):
+        prompt = params.get('prompt', '')
+        
+        async with slots:
+            unavailable = self.service._check_availability(prompt)
+            if unavailable:
+                return {'result': unavailable, 'download': None}
+            
+            if not await self._acquire_token():
+                return {'result': self.service._rate_limited_result(prompt), 'download': None}
+            
+            try:
+                start_time = time.time()
+                payload = self.service._build_payload(**params)
+                
+                response = await asyncio.wait_for(
+                    client.post(self.service.api_url, json=payload, headers=self.service._headers()),
+                    self.timeout
+                )
+                
+                if self.service.is_overloaded(response.status_code):
+                    self.controller.on_overload()
+                    return {
+                        'result': self.service._overloaded_result(
+                            prompt, response.status_code, response.headers
+                        ),
+                        'download': None
+                    }
+                
+                response.raise_for_status()
+                
+                latency = time.time() - start_time
+                self.service.breaker.record_success()
+                self.controller.on_success(latency)
+                
+                result = self.service._build_result(
+                    response.json(), payload, latency, **params
+                )
+                
+                try:
+                    download = await asyncio.wait_for(
+                        self._download(client, result['image_url']),
+                        settings.DOWNLOAD_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    # The media host is not Blackbox, keep its failures out of the breaker
+                    download = {
+                        'success': False,
+                        'error': f"Download timeout after {settings.DOWNLOAD_TIMEOUT}s"
+                    }
+                
+                return {'result': result, 'download': download}
+                
+            except asyncio.TimeoutError:
+                self.service.breaker.record_failure()
+                self.controller.on_overload()
+                return {
+                    'result': self.service._error_result(
+                        prompt, f"Timeout after {self.timeout}s", 'TimeoutError', retryable=True
+                    ),
+                    'download': None
+                }
+            except (httpx.TimeoutException, httpx.NetworkError) as e:
+                self.service.breaker.record_failure()
+                self.controller.on_overload()
+                return {
+                    'result': self.service._error_result(
+                        prompt, f"API Request Error: {str(e)}", 'RequestException', retryable=True
+                    ),
+                    'download': None
+                }
+            except httpx.HTTPError as e:
+                return {
+                    'result': self.service._error_result(
+                        prompt, f"API Request Error: {str(e)}", 'RequestException'
+                    ),
+                    'download': None
+                }
+            except Exception as e:
+                return {
+                    'result': self.service._error_result(prompt, str(e), type(e).__name__),
+                    'download': None
+                }
+    
+    async def _download(self, client, image_url):
+        """
+        Stream the generated file into a DownloadSink
+        """
+        sink = DownloadSink()
+        try:
+            async with client.stream('GET', image_url) as response:
+                response.raise_for_status()
+                sink.check_declared_length(response.headers.get('Content-Length'))
+                async for chunk in response.aiter_bytes(settings.DOWNLOAD_CHUNK_SIZE):
+                    sink.write(chunk)
+            return sink.finish()
+        except Exception as e:
+            sink.close()
+            return {'success': False, 'error': str(e)}
@@ -0,0 +1,158 @@
+"""
+Fair-share dispatch of bulk image generation
+"""
+import uuid
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from apps.authentication.models import UserStats
+from apps.core.locks import ExpiringLock
+from ..models import GeneratedImage
+
+
+def allocate_batches(pending_by_user, in_flight_by_user, capacity, batch_size):
+    """
+    Share the free bulk generation capacity between users
+    
+    Max-min fair: capacity is handed out one batch at a time to the user
+    with the fewest images in flight, ties going to the user waiting the
+    longest. A user with a huge backlog therefore only keeps its share of
+    the workers once other users submit work.
+    
+    Args:
+        pending_by_user (dict): User ID -> (pending image count, oldest pending time)
+        in_flight_by_user (dict): User ID -> number of images being generated
+        capacity (int): Number of images that may be dispatched now
+        batch_size (int): Maximum number of images per batch
+    
+    Returns:
+        list: (user_id, image count) tuples, in dispatch order
+    """
+    in_flight = dict(in_flight_by_user)
+    pending = {user_id: count for user_id, (count, _) in pending_by_user.items() if count}
+    oldest = {user_id: oldest for user_id, (_, oldest) in pending_by_user.items()}
+    
+    batches = []
+    while capacity > 0 and pending:
+        user_id = min(pending, key=lambda candidate: (in_flight.get(candidate, 0), oldest[candidate]))
+        size = min(batch_size, pending[user_id], capacity)
+        
+        batches.append((user_id, size))
+        in_flight[user_id] = in_flight.get(user_id, 0) + size
+        capacity -= size
+        pending[user_id] -= size
+        if not pending[user_id]:
+            del pending[user_id]
+    
+    return batches
+
+
+class BulkGenerationDispatcher:
+    """
+    Pick the next bulk batches to generate
+    
+    Bulk images wait in the database ('pending', priority 'bulk') instead
+    of the broker. At most ``max_in_flight`` of them are generating at
+    once, so the 'bulk' queue stays short and a new user's batch starts as
+    soon as a slot frees up instead of behind every queued chunk.
+    
+    A claim is a lease: images still 'generating' ``lease_timeout``
+    seconds after their batch last started (worker killed, message lost)
+    go back to 'pending' instead of holding a slot for good.
+    """
+    lock_name = 'bulk-dispatch'
+    
+    def __init__(self, max_in_flight=None, batch_size=None, lease_timeout=None):
+        self.max_in_flight = max_in_flight or settings.BULK_GENERATION_MAX_IN_FLIGHT
+        self.batch_size = batch_size or settings.GENERATION_BATCH_SIZE
+        self.lease_timeout = timedelta(seconds=lease_timeout or settings.BULK_GENERATION_LEASE_TIMEOUT)
+    
+    def lock(self, timeout=60):
+        """
+        Serialize dispatchers so they do not share out the same free slots
+        
+        The lock is shared by every worker (see BULK_DISPATCH_LOCK_BACKEND)
+        and only released by its holder. Should it expire under a slow
+        dispatcher, the claim tokens still keep concurrent batches disjoint.
+        
+        Returns:
+            Context manager yielding True when the lock was acquired
+        """
+        return ExpiringLock(self.lock_name, timeout, backend=settings.BULK_DISPATCH_LOCK_BACKEND).hold()
+    
+    def recover_expired(self, now=None):
+        """
+        Hand back the bulk images whose lease expired, to be dispatched again
+        
+        Returns:
+            int: Number of images released
+        """
+        now = now or timezone.now()
+        return self.release(
+            GeneratedImage.objects.filter(priority='bulk', claimed_at__lt=now - self.lease_timeout)
+        )
+    
+    @staticmethod
+    def release(images, status='pending', **fields):
+        """
+        Hand claimed images back, to be generated again or as failed
+        
+        Args:
+            images (QuerySet): GeneratedImage rows, only those still 'generating' are released
+            status (str): 'pending' to generate them again, 'failed' to give up
+        
+        Returns:
+            int: Number of images released
+        """
+        # A fresh token tells the rows released here from those released concurrently
+        token = uuid.uuid4()
+        with transaction.atomic():
+            if not images.filter(status='generating').update(
+                status=status, claim_token=token, claimed_at=None, updated_at=timezone.now(), **fields
+            ):
+                return 0
+            released = list(GeneratedImage.objects.filter(claim_token=token).values_list('id', 'user_id'))
+            # The UPDATE sends no signal: move the counters of the images' owners
+            for user_id, count in Counter(user_id for _, user_id in released).items():
+                UserStats.record(user_id, generating_images=-count, **{f'{status}_images': count})
+        return len(released)
+    
+    def plan(self):
+        """
+        Returns:
+            list: Image ID lists, one per batch to dispatch (not claimed yet)
+        """
+        bulk = GeneratedImage.objects.filter(priority='bulk').order_by()
+        in_flight = dict(
+            bulk.filter(status='generating')
+            .values_list('user_id')
+            .annotate(count=Count('id'))
+        )
+        capacity = self.max_in_flight - sum(in_flight.values())
+        if capacity <= 0:
+            return []
+        
+        pending = {
+            row['user_id']: (row['count'], row['oldest'])
+            for row in bulk.filter(status='pending')
+            .values('user_id')
+            .annotate(count=Count('id'), oldest=Min('created_at'))
+        }
+        
+        batches = []
+        taken = {}
+        for user_id, size in allocate_batches(pending, in_flight, capacity, self.batch_size):
+            # Nothing is claimed yet, skip the images of this user's earlier batches
+            offset = taken.get(user_id, 0)
+            taken[user_id] = offset + size
+            image_ids = list(
+                bulk.filter(status='pending', user_id=user_id)
+                .order_by('created_at', 'id')
+                .values_list('id', flat=True)[offset:offset + size]
+            )
+            if image_ids:
+                batches.append(image_ids)
+        return batches
@@ -0,0 +1,113 @@
+"""
+Streaming download sink with size cap, type sniffing and hashing
+"""
+import hashlib
+from tempfile import SpooledTemporaryFile
+from django.conf import settings
+from django.core.files.base import File
+
+
+# Magic numbers of the image formats we accept: (prefix, content type, extension)
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png', 'png'),
+    (b'\xff\xd8\xff', 'image/jpeg', 'jpg'),
+    (b'GIF87a', 'image/gif', 'gif'),
+    (b'GIF89a', 'image/gif', 'gif'),
+]
+
+SNIFF_BYTES = 12
+
+
+class DownloadError(Exception):
+    """Raised when a download is rejected"""
+
+
+def sniff_image_type(header):
+    """
+    Detect the image format from the first bytes of a file
+    
+    Args:
+        header (bytes): At least the first SNIFF_BYTES bytes
+    
+    Returns:
+        tuple: (content_type, extension) or None if not a supported image
+    """
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp', 'webp'
+    for signature, content_type, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return content_type, extension
+    return None
+
+
+class DownloadSink:
+    """
+    Receive a download chunk by chunk without holding it in memory
+    
+    Chunks are spooled to a temporary file (in memory up to
+    DOWNLOAD_SPOOL_MAX_MEMORY bytes, on disk beyond), hashed as they
+    arrive and capped at DOWNLOAD_MAX_BYTES.
+    """
+    
+    def __init__(self, max_bytes=None, spool_size=None):
+        self.max_bytes = max_bytes or settings.DOWNLOAD_MAX_BYTES
+        self.file = SpooledTemporaryFile(max_size=spool_size or settings.DOWNLOAD_SPOOL_MAX_MEMORY)
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.header = b''
+        self.image_type = None
+    
+    def check_declared_length(self, content_length):
+        """
+        Reject early when the server announces a file over the cap
+        """
+        if content_length and int(content_length) > self.max_bytes:
+            raise DownloadError(
+                f"Image too large: {content_length} bytes (max {self.max_bytes})"
+            )
+    
+    def write(self, chunk):
+        if not chunk:
+            return
+        
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise DownloadError(f"Image too large: over {self.max_bytes} bytes")
+        
+        if self.image_type is None:
+            self.header += chunk[:SNIFF_BYTES]
+            if len(self.header) >= SNIFF_BYTES:
+                self._sniff()
+        
+        self.digest.update(chunk)
+        self.file.write(chunk)
+    
+    def finish(self):
+        """
+        Returns:
+            dict: success, file (Django File), sha256, content_type,
+                extension and size
+        """
+        if self.image_type is None:
+            self._sniff()
+        
+        self.file.seek(0)
+        django_file = File(self.file, name=f"download.{self.image_type[1]}")
+        django_file.size = self.size
+        
+        return {
+            'success': True,
+            'file': django_file,
+            'sha256': self.digest.hexdigest(),
+            'content_type': self.image_type[0],
+            'extension': self.image_type[1],
+            'size': self.size
+        }
+    
+    def close(self):
+        self.file.close()
+    
+    def _sniff(self):
+        self.image_type = sniff_image_type(self.header)
+        if self.image_type is None:
+            raise DownloadError("Downloaded file is not a supported image")
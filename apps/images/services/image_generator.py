@@ -1,22 +1,86 @@
 """
 Service for generating images using Blackbox AI API
 """
+import threading
 import time
 import requests
-from io import BytesIO
-from django.core.files.base import ContentFile
 from django.conf import settings
-from PIL import Image as PILImage
+from apps.core import metrics
+from apps.core.http import get_session
+from apps.core.resilience import AdaptiveSemaphore, AIMDConcurrency, CircuitBreaker, TokenBucket
+from .downloads import DownloadSink
+from .result_cache import generation_cache_key
+
+
+_call_slots = None
+_slots_lock = threading.Lock()
+
+
+def get_call_slots():
+    """
+    Process-wide AIMD gate of the synchronous Blackbox calls
+    
+    Under a thread or gevent pool many generate_image calls share a worker
+    process; the gate keeps at most GENERATION_CONCURRENCY of them in
+    flight and narrows on throttling, 5xx, timeouts and slow answers, like
+    the asyncio engine does for batches.
+    
+    Returns:
+        AdaptiveSemaphore: Gate shared by the threads of this process
+    """
+    global _call_slots
+    
+    with _slots_lock:
+        if _call_slots is None:
+            _call_slots = AdaptiveSemaphore(AIMDConcurrency(
+                initial=settings.GENERATION_CONCURRENCY,
+                minimum=min(settings.GENERATION_MIN_CONCURRENCY, settings.GENERATION_CONCURRENCY),
+                latency_target=settings.GENERATION_LATENCY_TARGET
+            ))
+        return _call_slots
+
+
+def reset_call_slots():
+    """
+    Forget the gate of this process, the next call builds it from settings
+    """
+    global _call_slots
+    
+    with _slots_lock:
+        _call_slots = None
 
 
 class ImageGeneratorService:
     """
     Service class for generating images using Blackbox AI
     """
+    # Seconds before retrying a call refused without a better estimate
+    retry_backoff = 1.0
     
     def __init__(self):
         self.api_key = settings.BLACKBOX_API_KEY
-        self.api_url = "https://api.blackbox.ai/v1/image"
+        self.api_url = settings.BLACKBOX_API_URL
+        self.rate_limiter = TokenBucket(
+            'blackbox',
+            rate=settings.BLACKBOX_RATE_LIMIT,
+            capacity=settings.BLACKBOX_RATE_BURST,
+            backend=settings.BLACKBOX_RATE_LIMIT_BACKEND
+        )
+        self.breaker = CircuitBreaker(
+            'blackbox',
+            failure_threshold=settings.BLACKBOX_BREAKER_THRESHOLD,
+            reset_timeout=settings.BLACKBOX_BREAKER_RESET_TIMEOUT
+        )
+    
+    @property
+    def session(self):
+        """Pooled keep-alive session for the Blackbox API"""
+        return get_session('blackbox')
+    
+    @property
+    def media_session(self):
+        """Pooled keep-alive session for downloading generated files"""
+        return get_session('media')
     
     def generate_image(self, prompt, negative_prompt="", style="realistic", 
                       width=1024, height=1024, quality="standard"):
@@ -32,84 +96,232 @@ class ImageGeneratorService:
             quality (str): Quality of the image ('standard' or 'hd')
         
         Returns:
-            dict: Dictionary containing image_url and metadata
+            dict: Dictionary containing image_url and metadata. Failures
+                caused by Blackbox being unavailable are flagged
+                ``retryable`` with a ``retry_after`` delay in seconds.
         """
+        unavailable = self._check_availability(prompt)
+        if unavailable:
+            return unavailable
+        
+        slots = get_call_slots()
+        if not slots.acquire(timeout=settings.BLACKBOX_RATE_LIMIT_WAIT):
+            return self._saturated_result(prompt)
+        
+        try:
+            return self._post_generation(slots, prompt, negative_prompt, style, width, height, quality)
+        finally:
+            slots.release()
+    
+    def _post_generation(self, slots, prompt, negative_prompt, style, width, height, quality):
+        """
+        Call Blackbox once a slot is held, feeding its outcome to the gate
+        """
+        if not self.rate_limiter.acquire(timeout=settings.BLACKBOX_RATE_LIMIT_WAIT):
+            return self._rate_limited_result(prompt)
+        
         try:
             start_time = time.time()
             
-            # Prepare the prompt with style
-            full_prompt = self._prepare_prompt(prompt, negative_prompt, style)
-            
             # Prepare request payload for Blackbox AI
-            payload = {
-                "prompt": full_prompt,
-                "width": width,
-                "height": height,
-                "steps": 50 if quality == "hd" else 30,
-                "guidance_scale": 7.5,
-                "negative_prompt": negative_prompt if negative_prompt else None
-            }
-            
-            # Make request to Blackbox AI
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+            payload = self._build_payload(prompt, negative_prompt, style, width, height, quality)
             
-            response = requests.post(
+            response = self.session.post(
                 self.api_url,
                 json=payload,
-                headers=headers,
-                timeout=120
+                headers=self._headers(),
+                timeout=settings.GENERATION_REQUEST_TIMEOUT
             )
             
-            response.raise_for_status()
-            result = response.json()
-            
-            generation_time = time.time() - start_time
+            if self.is_overloaded(response.status_code):
+                slots.on_overload()
+                return self._overloaded_result(prompt, response.status_code, response.headers)
             
-            # Extract image URL from response
-            # Adjust based on actual Blackbox AI response structure
-            image_url = result.get('image_url') or result.get('url') or result.get('data', {}).get('url')
-            
-            if not image_url:
-                raise ValueError("No image URL in response")
+            response.raise_for_status()
+            latency = time.time() - start_time
+            self.breaker.record_success()
+            slots.on_success(latency)
             
-            return {
-                'success': True,
-                'image_url': image_url,
-                'generation_time': generation_time,
-                'metadata': {
-                    'original_prompt': prompt,
-                    'negative_prompt': negative_prompt,
-                    'style': style,
-                    'width': width,
-                    'height': height,
-                    'quality': quality,
-                    'steps': payload['steps'],
-                    'guidance_scale': payload['guidance_scale'],
-                    'model': 'blackbox-ai'
-                }
-            }
+            return self._build_result(
+                response.json(),
+                payload,
+                latency,
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                style=style,
+                width=width,
+                height=height,
+                quality=quality
+            )
             
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            self.breaker.record_failure()
+            slots.on_overload()
+            return self._error_result(
+                prompt, f"API Request Error: {str(e)}", 'RequestException', retryable=True
+            )
         except requests.exceptions.RequestException as e:
-            return {
-                'success': False,
-                'error': f"API Request Error: {str(e)}",
-                'metadata': {
-                    'original_prompt': prompt,
-                    'error_type': 'RequestException'
-                }
-            }
+            return self._error_result(prompt, f"API Request Error: {str(e)}", 'RequestException')
         except Exception as e:
-            return {
-                'success': False,
-                'error': str(e),
-                'metadata': {
-                    'original_prompt': prompt,
-                    'error_type': type(e).__name__
-                }
+            return self._error_result(prompt, str(e), type(e).__name__)
+    
+    def generate_many(self, requests_by_key, concurrency=None):
+        """
+        Generate and download many images concurrently
+        
+        Args:
+            requests_by_key (dict): Key -> keyword arguments of generate_image
+            concurrency (int): Maximum number of requests in flight
+        
+        Returns:
+            dict: Key -> {'result': generate_image result,
+                'download': download_and_save_image result or None}
+        """
+        from .async_generator import AsyncGenerationEngine
+        
+        engine = AsyncGenerationEngine(self, concurrency=concurrency)
+        return engine.generate_many(requests_by_key)
+    
+    def cache_key(self, prompt, negative_prompt="", style="realistic",
+                  width=1024, height=1024, quality="standard"):
+        """
+        Content address of a generation request, see GenerationResultCache
+        """
+        payload = self._build_payload(prompt, negative_prompt, style, width, height, quality)
+        return generation_cache_key(payload['prompt'], payload)
+    
+    def _build_payload(self, prompt, negative_prompt="", style="realistic",
+                       width=1024, height=1024, quality="standard"):
+        """
+        Build the Blackbox AI request payload
+        """
+        # Prepare the prompt with style
+        full_prompt = self._prepare_prompt(prompt, negative_prompt, style)
+        
+        return {
+            "prompt": full_prompt,
+            "width": width,
+            "height": height,
+            "steps": 50 if quality == "hd" else 30,
+            "guidance_scale": 7.5,
+            "negative_prompt": negative_prompt if negative_prompt else None
+        }
+    
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+    
+    def _build_result(self, result, payload, generation_time, prompt, negative_prompt="",
+                      style="realistic", width=1024, height=1024, quality="standard"):
+        """
+        Turn a Blackbox AI response into the service result dictionary
+        """
+        # Extract image URL from response
+        # Adjust based on actual Blackbox AI response structure
+        image_url = result.get('image_url') or result.get('url') or result.get('data', {}).get('url')
+        
+        if not image_url:
+            raise ValueError("No image URL in response")
+        
+        return {
+            'success': True,
+            'image_url': image_url,
+            'generation_time': generation_time,
+            'metadata': {
+                'original_prompt': prompt,
+                'negative_prompt': negative_prompt,
+                'style': style,
+                'width': width,
+                'height': height,
+                'quality': quality,
+                'steps': payload['steps'],
+                'guidance_scale': payload['guidance_scale'],
+                'model': 'blackbox-ai'
             }
+        }
+    
+    def _error_result(self, prompt, error, error_type, retryable=False, retry_after=None):
+        return {
+            'success': False,
+            'error': error,
+            'retryable': retryable,
+            'retry_after': retry_after,
+            'metadata': {
+                'original_prompt': prompt,
+                'error_type': error_type
+            }
+        }
+    
+    @staticmethod
+    def is_overloaded(status_code):
+        """
+        Whether a Blackbox status code means "slow down" rather than a bad request
+        """
+        return status_code == 429 or status_code >= 500
+    
+    def _check_availability(self, prompt):
+        """
+        Fail fast while the Blackbox circuit is open
+        
+        Returns:
+            dict: Retryable error result, None when a call may be attempted
+        """
+        if self.breaker.allow():
+            return None
+        metrics.increment('blackbox.circuit_open')
+        return self._error_result(
+            prompt,
+            "Blackbox AI temporairement indisponible",
+            'CircuitOpen',
+            retryable=True,
+            retry_after=self.breaker.retry_after()
+        )
+    
+    def _rate_limited_result(self, prompt):
+        metrics.increment('blackbox.rate_limited')
+        rate = self.rate_limiter.rate
+        return self._error_result(
+            prompt,
+            "Limite de requêtes Blackbox AI atteinte",
+            'RateLimited',
+            retryable=True,
+            retry_after=1.0 / rate if rate else self.retry_backoff
+        )
+    
+    def _saturated_result(self, prompt):
+        """
+        Result of a call that found every concurrency slot taken
+        """
+        metrics.increment('blackbox.saturated')
+        return self._error_result(
+            prompt,
+            "Trop de requêtes Blackbox AI en cours",
+            'Saturated',
+            retryable=True,
+            retry_after=self.retry_backoff
+        )
+    
+    def _overloaded_result(self, prompt, status_code, headers):
+        """
+        Record a throttled (429) or failed (5xx) call and build its result
+        """
+        self.breaker.record_failure()
+        metrics.increment('blackbox.throttled' if status_code == 429 else 'blackbox.server_error')
+        
+        try:
+            retry_after = float(headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            retry_after = None
+        
+        return self._error_result(
+            prompt,
+            f"API Request Error: HTTP {status_code}",
+            'Throttled' if status_code == 429 else 'ServerError',
+            retryable=True,
+            retry_after=retry_after
+        )
     
     def _prepare_prompt(self, prompt, negative_prompt, style):
         """
@@ -135,63 +347,42 @@ class ImageGeneratorService:
         
         return full_prompt
     
-    def download_and_save_image(self, image_url):
+    def download_and_save_image(self, image_url, stream=True):
         """
         Download image from URL and return as Django file
         
+        In streaming mode the body is read chunk by chunk into a spooled
+        temporary file, so memory use does not grow with the image size.
+        
         Args:
             image_url (str): URL of the image to download
+            stream (bool): Stream the body instead of reading it at once
         
         Returns:
-            ContentFile: Django ContentFile object
+            dict: success, file (Django File), sha256, content_type,
+                extension and size
         """
+        sink = DownloadSink()
         try:
-            response = requests.get(image_url, timeout=30)
-            response.raise_for_status()
-            
-            # Create ContentFile from image data
-            image_content = ContentFile(response.content)
+            with self.media_session.get(
+                image_url,
+                timeout=settings.DOWNLOAD_TIMEOUT,
+                stream=stream
+            ) as response:
+                response.raise_for_status()
+                sink.check_declared_length(response.headers.get('Content-Length'))
+                
+                if stream:
+                    for chunk in response.iter_content(chunk_size=settings.DOWNLOAD_CHUNK_SIZE):
+                        sink.write(chunk)
+                else:
+                    sink.write(response.content)
             
-            return {
-                'success': True,
-                'file': image_content
-            }
+            return sink.finish()
             
         except Exception as e:
+            sink.close()
             return {
                 'success': False,
                 'error': str(e)
             }
-    
-    def create_thumbnail(self, image_file, size=(300, 300)):
-        """
-        Create a thumbnail from an image file
-        
-        Args:
-            image_file: Django ImageField file
-            size (tuple): Thumbnail size (width, height)
-        
-        Returns:
-            ContentFile: Thumbnail as ContentFile
-        """
-        try:
-            # Open image
-            img = PILImage.open(image_file)
-            
-            # Convert to RGB if necessary
-            if img.mode in ('RGBA', 'LA', 'P'):
-                img = img.convert('RGB')
-            
-            # Create thumbnail
-            img.thumbnail(size, PILImage.Resampling.LANCZOS)
-            
-            # Save to BytesIO
-            thumb_io = BytesIO()
-            img.save(thumb_io, format='JPEG', quality=85)
-            thumb_io.seek(0)
-            
-            return ContentFile(thumb_io.read())
-            
-        except Exception as e:
-            print(f"Error creating thumbnail: {e}")
-            return None
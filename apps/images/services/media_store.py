@@ -0,0 +1,154 @@
+"""
+Content-addressed, reference-counted storage for generated media
+"""
+import hashlib
+import logging
+from collections import Counter
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from ..models import MediaBlob
+
+logger = logging.getLogger(__name__)
+
+
+class MediaStore:
+    """
+    Store files under their SHA-256 so identical bytes are kept once
+    
+    Every image field pointing at a blob holds one reference; the file is
+    deleted from the storage when the last reference is released.
+    """
+    
+    def __init__(self, storage=None):
+        self.storage = storage or default_storage
+    
+    @staticmethod
+    def blob_name(digest, extension):
+        return f"blobs/{digest[:2]}/{digest[2:4]}/{digest}.{extension}"
+    
+    def save(self, content, extension, digest=None):
+        """
+        Store content and take one reference on its blob
+        
+        Call it in the transaction saving the row that links the blob, so
+        the reference is rolled back with that row.
+        
+        Args:
+            content: Django File (ContentFile, UploadedFile...)
+            extension (str): File extension used for the blob name
+            digest (str): SHA-256 of the content when already known
+        
+        Returns:
+            str: Storage name of the blob
+        """
+        if digest is None:
+            digest = self._hash(content)
+        
+        with transaction.atomic():
+            blob, created = MediaBlob.objects.select_for_update().get_or_create(
+                sha256=digest,
+                defaults={'name': self.blob_name(digest, extension), 'size': content.size}
+            )
+            
+            # A file left by a rolled back save holds the same bytes
+            if not self.storage.exists(blob.name):
+                content.seek(0)
+                stored_name = self.storage.save(blob.name, content)
+                if stored_name != blob.name:
+                    blob.name = stored_name
+                    blob.save(update_fields=['name'])
+            
+            MediaBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        
+        return blob.name
+    
+    def acquire(self, name):
+        """
+        Take one more reference on an existing blob
+        
+        Returns:
+            bool: False when the name is not a content-addressed blob
+        """
+        return MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1) > 0
+    
+    def acquire_many(self, names):
+        """
+        Take one more reference per name, in a constant number of queries
+        
+        A name listed several times takes several references. Runs in the
+        caller's transaction, with the rows that now link the blobs.
+        
+        Args:
+            names (list): Storage names, names that are not blobs are skipped
+        """
+        names_by_count = {}
+        for name, count in Counter(names).items():
+            names_by_count.setdefault(count, []).append(name)
+        for count, batch in names_by_count.items():
+            MediaBlob.objects.filter(name__in=batch).update(ref_count=F('ref_count') + count)
+    
+    def release(self, name):
+        """
+        Drop one reference, deleting the blob with its last reference
+        
+        Returns:
+            bool: False when the name is not a content-addressed blob
+        """
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                return False
+            
+            if blob.ref_count > 1:
+                MediaBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+                return True
+            
+            blob.delete()
+            transaction.on_commit(lambda: self._delete_file(name))
+        
+        return True
+    
+    def release_many(self, names):
+        """
+        Drop one reference per name, in a constant number of queries
+        
+        A name listed several times drops several references. Runs in the
+        caller's transaction: the caller deletes the returned files once it
+        has committed.
+        
+        Args:
+            names (list): Storage names, content-addressed or not
+        
+        Returns:
+            tuple: (names that are content-addressed blobs, blob files left without reference)
+        """
+        counts = Counter(names)
+        blobs = list(MediaBlob.objects.select_for_update().filter(name__in=counts))
+        orphaned = [blob.name for blob in blobs if blob.ref_count <= counts[blob.name]]
+        
+        ids_by_count = {}
+        for blob in blobs:
+            if blob.ref_count > counts[blob.name]:
+                ids_by_count.setdefault(counts[blob.name], []).append(blob.pk)
+        for count, ids in ids_by_count.items():
+            MediaBlob.objects.filter(pk__in=ids).update(ref_count=F('ref_count') - count)
+        if orphaned:
+            MediaBlob.objects.filter(name__in=orphaned).delete()
+        
+        return {blob.name for blob in blobs}, orphaned
+    
+    def _delete_file(self, name):
+        try:
+            self.storage.delete(name)
+        except Exception as e:
+            logger.error(f"Error deleting blob {name}: {str(e)}")
+    
+    @staticmethod
+    def _hash(content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        return digest.hexdigest()
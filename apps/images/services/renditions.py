@@ -0,0 +1,110 @@
+"""
+Image derivative pipeline: every rendition from a single decode
+"""
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image as PILImage
+
+
+FORMAT_EXTENSIONS = {
+    'JPEG': 'jpg',
+    'WEBP': 'webp',
+    'PNG': 'png',
+}
+
+
+class RenditionPipeline:
+    """
+    Produce the configured renditions of an image in one pass
+    
+    The source is decoded once. For JPEG sources ``draft()`` lets the
+    decoder skip resolution the largest rendition does not need, and every
+    resize uses ``reducing_gap`` so Pillow first shrinks with ``reduce()``
+    before the final LANCZOS pass.
+    
+    Each spec of settings.IMAGE_RENDITIONS is a dict with:
+        name: Rendition name ('thumbnail', 'web', ...)
+        size: (width, height) bounding box
+        mode: 'fit' to keep the aspect ratio inside the box, 'crop' to
+            center-crop to the box aspect ratio
+        format: Pillow output format ('JPEG', 'WEBP', 'PNG')
+        quality: Encoder quality
+    """
+    reducing_gap = 2.0
+    
+    def __init__(self, specs=None):
+        self.specs = specs if specs is not None else settings.IMAGE_RENDITIONS
+    
+    def render(self, source):
+        """
+        Render every rendition of an image
+        
+        Args:
+            source: File-like object with the original image bytes
+        
+        Returns:
+            list: Dicts with name, file (ContentFile), width, height,
+                format, extension and file_size
+        """
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        img = PILImage.open(source)
+        
+        # Let the JPEG decoder scale down while decoding
+        largest = (
+            max(spec['size'][0] for spec in self.specs),
+            max(spec['size'][1] for spec in self.specs),
+        )
+        img.draft('RGB', largest)
+        
+        # Decode once, convert to RGB if necessary
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        else:
+            img.load()
+        
+        return [self._render_one(img, spec) for spec in self.specs]
+    
+    def _render_one(self, img, spec):
+        if spec.get('mode', 'fit') == 'crop':
+            rendition = self._crop(img, spec['size'])
+        else:
+            rendition = self._fit(img, spec['size'])
+        
+        output = BytesIO()
+        image_format = spec.get('format', 'JPEG')
+        rendition.save(output, format=image_format, quality=spec.get('quality', 85))
+        
+        return {
+            'name': spec['name'],
+            'file': ContentFile(output.getvalue()),
+            'width': rendition.width,
+            'height': rendition.height,
+            'format': image_format,
+            'extension': FORMAT_EXTENSIONS.get(image_format, image_format.lower()),
+            'file_size': output.tell()
+        }
+    
+    def _fit(self, img, size):
+        """Scale down to fit inside the box, never upscale"""
+        ratio = min(size[0] / img.width, size[1] / img.height, 1)
+        target = (max(1, round(img.width * ratio)), max(1, round(img.height * ratio)))
+        if target == img.size:
+            return img
+        return img.resize(target, PILImage.Resampling.LANCZOS, reducing_gap=self.reducing_gap)
+    
+    def _crop(self, img, size):
+        """Center-crop to the box aspect ratio, then scale down to the box"""
+        target_ratio = size[0] / size[1]
+        if img.width / img.height > target_ratio:
+            crop_width, crop_height = round(img.height * target_ratio), img.height
+        else:
+            crop_width, crop_height = img.width, round(img.width / target_ratio)
+        left = (img.width - crop_width) // 2
+        top = (img.height - crop_height) // 2
+        box = (left, top, left + crop_width, top + crop_height)
+        
+        ratio = min(size[0] / crop_width, 1)
+        target = (max(1, round(crop_width * ratio)), max(1, round(crop_height * ratio)))
+        return img.resize(target, PILImage.Resampling.LANCZOS, box=box, reducing_gap=self.reducing_gap)
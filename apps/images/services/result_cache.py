@@ -0,0 +1,257 @@
+"""
+Content-addressed cache of Blackbox AI generation results
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from django.conf import settings
+from apps.core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+def generation_cache_key(full_prompt, payload):
+    """
+    Canonical hash of a generation request
+    
+    Args:
+        full_prompt (str): Output of ImageGeneratorService._prepare_prompt
+        payload (dict): Payload sent to the Blackbox AI API
+    
+    Returns:
+        str: Hex SHA-256 digest
+    """
+    canonical = json.dumps(
+        {'prompt': full_prompt, 'payload': payload},
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class FileSystemResultCacheBackend:
+    """
+    Local filesystem backend with TTL and LRU eviction
+    
+    One JSON document per key; the file modification time is bumped on
+    every hit and used as the last access time for eviction. The number of
+    entries is kept next to the hit counters, so writes only scan the
+    directory when it crosses ``max_entries``; eviction then goes down to
+    ``low_water`` of the limit and the next scan is that many writes away.
+    """
+    low_water = 0.9
+    
+    def __init__(self, directory, ttl, max_entries):
+        self.directory = Path(directory)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.directory.mkdir(parents=True, exist_ok=True)
+    
+    def _path(self, key):
+        return self.directory / key[:2] / f"{key}.json"
+    
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                self._remove(path)
+                return None
+            entry = json.loads(path.read_text())
+            os.utime(path)
+            return entry
+        except (FileNotFoundError, ValueError):
+            return None
+    
+    def set(self, key, entry):
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        created = not path.exists()
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(entry))
+        os.replace(tmp_path, path)
+        if not created:
+            return
+        
+        with self._locked_stats() as stats:
+            stats['entries'] = stats.get('entries', 0) + 1
+            if stats['entries'] > self.max_entries:
+                stats['entries'] = self._evict()
+    
+    def delete(self, key):
+        self._remove(self._path(key))
+    
+    def incr(self, counter):
+        with self._locked_stats() as stats:
+            stats[counter] = stats.get(counter, 0) + 1
+    
+    def stats(self):
+        with self._locked_stats() as stats:
+            return dict(stats)
+    
+    def _remove(self, path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            return
+        with self._locked_stats() as stats:
+            stats['entries'] = max(0, stats.get('entries', 0) - 1)
+    
+    def _evict(self):
+        """
+        Drop the least recently used entries down to the low water mark
+        
+        Returns:
+            int: Number of entries left, which also resyncs the counter
+        """
+        entries = list(self.directory.glob('*/*.json'))
+        keep = int(self.max_entries * self.low_water)
+        if len(entries) <= keep:
+            return len(entries)
+        
+        def last_access(path):
+            try:
+                return path.stat().st_mtime
+            except FileNotFoundError:
+                return 0
+        
+        entries.sort(key=last_access)
+        for path in entries[:len(entries) - keep]:
+            path.unlink(missing_ok=True)
+        return keep
+    
+    def _locked_stats(self):
+        return _LockedJSONFile(self.directory / 'stats.json')
+
+
+class _LockedJSONFile:
+    """
+    Read-modify-write a small JSON document under an exclusive file lock
+    """
+    
+    def __init__(self, path):
+        self.path = path
+    
+    def __enter__(self):
+        self.file = open(self.path, 'a+')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        self.file.seek(0)
+        try:
+            self.data = json.loads(self.file.read() or '{}')
+        except ValueError:
+            self.data = {}
+        return self.data
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.file.seek(0)
+            self.file.truncate()
+            self.file.write(json.dumps(self.data))
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+class RedisResultCacheBackend:
+    """
+    Redis backend, entries expire after the TTL and Redis' maxmemory
+    policy (allkeys-lru) takes care of LRU eviction
+    """
+    prefix = 'generation-cache'
+    
+    def __init__(self, ttl):
+        self.ttl = ttl
+    
+    def get(self, key):
+        value = get_redis().get(f"{self.prefix}:{key}")
+        return json.loads(value) if value else None
+    
+    def set(self, key, entry):
+        get_redis().set(f"{self.prefix}:{key}", json.dumps(entry), ex=self.ttl)
+    
+    def delete(self, key):
+        get_redis().delete(f"{self.prefix}:{key}")
+    
+    def incr(self, counter):
+        get_redis().hincrby(f"{self.prefix}:stats", counter, 1)
+    
+    def stats(self):
+        raw = get_redis().hgetall(f"{self.prefix}:stats")
+        return {name.decode(): int(value) for name, value in raw.items()}
+
+
+class GenerationResultCache:
+    """
+    Cache of generation results keyed by the canonical request hash
+    
+    Entries hold the storage names of the files produced by the first
+    generation so later identical requests can link them.
+    """
+    
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else self._default_backend()
+    
+    @staticmethod
+    def _default_backend():
+        backend = settings.GENERATION_CACHE_BACKEND
+        if backend == 'redis':
+            return RedisResultCacheBackend(settings.GENERATION_CACHE_TTL)
+        if backend == 'filesystem':
+            return FileSystemResultCacheBackend(
+                settings.GENERATION_CACHE_DIR,
+                settings.GENERATION_CACHE_TTL,
+                settings.GENERATION_CACHE_MAX_ENTRIES
+            )
+        return None
+    
+    @property
+    def enabled(self):
+        return self.backend is not None
+    
+    def get(self, key, validate=None):
+        """
+        Look up a cached result and count the hit or miss
+        
+        Args:
+            key (str): Canonical request hash
+            validate (callable): Optional check of the entry, entries failing
+                it (e.g. files deleted since) are dropped and count as misses
+        
+        Returns:
+            dict: Cached entry or None
+        """
+        if not self.enabled:
+            return None
+        try:
+            entry = self.backend.get(key)
+            if entry and validate and not validate(entry):
+                self.backend.delete(key)
+                self.backend.incr('stale')
+                entry = None
+            self.backend.incr('hits' if entry else 'misses')
+            return entry
+        except Exception as e:
+            logger.warning(f"Generation cache lookup failed: {str(e)}")
+            return None
+    
+    def set(self, key, entry):
+        if not self.enabled:
+            return
+        try:
+            self.backend.set(key, entry)
+        except Exception as e:
+            logger.warning(f"Generation cache store failed: {str(e)}")
+    
+    def stats(self):
+        """
+        Returns:
+            dict: hits, misses, stale counters and hit ratio
+        """
+        stats = self.backend.stats() if self.enabled else {}
+        hits = stats.get('hits', 0)
+        misses = stats.get('misses', 0)
+        stats['hit_ratio'] = round(hits / (hits + misses), 4) if hits + misses else 0
+        return stats
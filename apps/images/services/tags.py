@@ -0,0 +1,97 @@
+"""
+Batched tag resolution for image creation and updates
+"""
+from collections import Counter
+from django.db import transaction
+from ..models import ImageTag, ImageTagRelation
+
+
+def normalize_tag_names(names):
+    """
+    Lower-case tag names and collapse their whitespace
+    
+    Returns:
+        list: Distinct non-empty names, in their first order
+    """
+    normalized = (' '.join(name.split()).lower() for name in names)
+    return list(dict.fromkeys(name for name in normalized if name))
+
+
+def resolve_tags(names):
+    """
+    Get or create tags with two queries, whatever their number
+    
+    Missing tags are inserted with one INSERT that skips existing names,
+    so concurrent requests creating the same tag do not fail, then every
+    tag is read back with one SELECT.
+    
+    Args:
+        names (list): Tag names, normalized here
+    
+    Returns:
+        dict: Normalized name -> ImageTag
+    """
+    names = normalize_tag_names(names)
+    if not names:
+        return {}
+    ImageTag.objects.bulk_create([ImageTag(name=name) for name in names], ignore_conflicts=True)
+    return {tag.name: tag for tag in ImageTag.objects.filter(name__in=names).order_by()}
+
+
+def add_image_tags(image_tags):
+    """
+    Tag freshly created images
+    
+    Args:
+        image_tags (list): (image, tag names) pairs
+    
+    Returns:
+        list: Created ImageTagRelation instances
+    """
+    image_tags = [(image, normalize_tag_names(names)) for image, names in image_tags]
+    all_names = [name for _, names in image_tags for name in names]
+    if not all_names:
+        return []
+    
+    with transaction.atomic():
+        tags = resolve_tags(all_names)
+        ImageTag.record_usage(Counter(tags[name].id for name in all_names))
+        return ImageTagRelation.objects.bulk_create([
+            ImageTagRelation(image=image, tag=tags[name])
+            for image, names in image_tags
+            for name in names
+        ])
+
+
+def set_image_tags(image, names):
+    """
+    Replace the tags of an image, writing only the relations that change
+    
+    Args:
+        image (GeneratedImage): Image to tag
+        names (list): Complete list of tag names, an empty list removes every tag
+    
+    Returns:
+        tuple: (added, removed) tag names
+    """
+    names = normalize_tag_names(names)
+    
+    with transaction.atomic():
+        current = {name: (relation_id, tag_id) for name, relation_id, tag_id in
+                   image.tag_relations.values_list('tag__name', 'id', 'tag_id')}
+        added = [name for name in names if name not in current]
+        removed = [name for name in current if name not in names]
+        
+        deltas = {}
+        if removed:
+            ImageTagRelation.objects.filter(id__in=[current[name][0] for name in removed]).delete()
+            deltas.update((current[name][1], -1) for name in removed)
+        if added:
+            tags = resolve_tags(added)
+            ImageTagRelation.objects.bulk_create([
+                ImageTagRelation(image=image, tag=tags[name]) for name in added
+            ])
+            deltas.update((tags[name].id, 1) for name in added)
+        ImageTag.record_usage(deltas)
+    
+    return added, removed
@@ -1,15 +1,34 @@
 """
 Celery tasks for image generation and processing
 """
-from celery import shared_task
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+from celery import group, shared_task
+from celery.exceptions import Retry
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
-from django.core.files.base import ContentFile
-from .models import GeneratedImage, ImageGenerationHistory
-from .services import ImageGeneratorService
+from django.core.files.storage import default_storage
+from .models import GeneratedImage, ImageGenerationHistory, ImageRendition
+from .services import (
+    BulkGenerationDispatcher, ImageGeneratorService, GenerationResultCache, GenerationRollupBuilder,
+    ImageCleanup, MediaStore, RenditionPipeline
+)
+from apps.authentication.models import UserStats
+from apps.core import metrics
+from apps.core.resilience import backoff_delay
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Fields written back when a generation finishes
+GENERATION_RESULT_FIELDS = [
+    'status', 'error_message', 'image_url', 'image_file', 'thumbnail',
+    'metadata', 'generation_time', 'updated_at'
+]
+
 
 @shared_task(bind=True, max_retries=3)
 def generate_image_task(self, image_id):
@@ -30,75 +49,73 @@ def generate_image_task(self, image_id):
         # Initialize the image generator service
         generator = ImageGeneratorService()
         
+        # Reuse the files of an identical earlier request when possible
+        cache = GenerationResultCache()
+        cache_key = _generation_cache_key(image, generator) if cache.enabled else None
+        cached = cache.get(cache_key, validate=_cached_files_exist) if cache_key else None
+        
+        if cached:
+            history = _apply_cached_result(image, cached)
+            renditions = _cached_renditions(image, cached)
+            with transaction.atomic():
+                image.save()
+                history.save()
+                ImageRendition.objects.bulk_create(renditions)
+                # The image now references the cached blobs
+                MediaStore().acquire_many(_linked_files(image, renditions))
+            
+            if not cached.get('renditions'):
+                _enqueue_renditions({image.id: None})
+            
+            _record_latency(image)
+            logger.info(f"Image {image_id} served from the generation cache")
+            return {'status': 'success', 'image_id': image_id, 'cache_hit': True}
+        
         # Generate the image
-        result = generator.generate_image(
-            prompt=image.prompt,
-            negative_prompt=image.negative_prompt,
-            style=image.style,
-            width=image.width,
-            height=image.height,
-            quality=image.quality
-        )
+        result = generator.generate_image(**_generation_params(image))
+        
+        if result.get('retryable') and self.request.retries < self.max_retries:
+            # Blackbox is throttling or down: try again later instead of failing
+            countdown = max(backoff_delay(self.request.retries, base=10), result.get('retry_after') or 0)
+            metrics.increment('generation.requeued')
+            logger.warning(f"Image {image_id} re-queued in {countdown:.1f}s: {result.get('error')}")
+            raise self.retry(countdown=countdown)
         
+        download_result = None
         if result['success']:
-            # Download and save the image
-            image.image_url = result['image_url']
-            image.metadata = result['metadata']
-            image.generation_time = result['generation_time']
+            metrics.record_duration('generation', result['generation_time'])
             
             # Download the image file
+            download_start = time.time()
             download_result = generator.download_and_save_image(result['image_url'])
-            
-            if download_result['success']:
-                # Save the image file
-                filename = f"generated_{image.id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.png"
-                image.image_file.save(filename, download_result['file'], save=False)
-                
-                # Create thumbnail
-                thumbnail = generator.create_thumbnail(image.image_file)
-                if thumbnail:
-                    thumb_filename = f"thumb_{image.id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-                    image.thumbnail.save(thumb_filename, thumbnail, save=False)
-            
-            # Update status to generated
-            image.status = 'generated'
+            metrics.record_duration('download', time.time() - download_start)
+        
+        history = _apply_generation_result(image, result, download_result)
+        
+        with transaction.atomic():
+            _store_download(image, download_result)
             image.save()
-            
-            # Log the generation
-            ImageGenerationHistory.objects.create(
-                user=image.user,
-                image=image,
-                action='generated',
-                details={
-                    'generation_time': result['generation_time'],
-                    'model': result['metadata'].get('model', 'unknown')
-                }
-            )
-            
+            history.save()
+        
+        # Thumbnail and renditions are rendered by the CPU workers
+        if image.image_file:
+            _enqueue_renditions({image.id: cache_key})
+        
+        if result['success']:
+            _record_latency(image)
             logger.info(f"Image {image_id} generated successfully")
             return {'status': 'success', 'image_id': image_id}
-            
-        else:
-            # Generation failed
-            image.status = 'failed'
-            image.error_message = result.get('error', 'Unknown error')
-            image.save()
-            
-            # Log the failure
-            ImageGenerationHistory.objects.create(
-                user=image.user,
-                image=image,
-                action='failed',
-                details={'error': result.get('error', 'Unknown error')}
-            )
-            
-            logger.error(f"Image {image_id} generation failed: {result.get('error')}")
-            return {'status': 'failed', 'image_id': image_id, 'error': result.get('error')}
+        
+        logger.error(f"Image {image_id} generation failed: {result.get('error')}")
+        return {'status': 'failed', 'image_id': image_id, 'error': result.get('error')}
             
     except GeneratedImage.DoesNotExist:
         logger.error(f"Image {image_id} not found")
         return {'status': 'error', 'message': 'Image not found'}
         
+    except Retry:
+        raise
+    
     except Exception as e:
         logger.error(f"Error generating image {image_id}: {str(e)}")
         
@@ -112,66 +129,613 @@ def generate_image_task(self, image_id):
             pass
         
         # Retry the task
-        raise self.retry(exc=e, countdown=60)
+        raise self.retry(exc=e, countdown=backoff_delay(self.request.retries, base=30))
 
 
 @shared_task
-def cleanup_old_images():
+def process_image_renditions(image_id, cache_key=None):
     """
-    Celery task to clean up old rejected or failed images
-    Runs daily to free up storage space
+    Celery task rendering the thumbnail and renditions of a generated image
+    Routed to the 'cpu' queue (see config/celery.py)
+    
+    Args:
+        image_id (int): ID of the GeneratedImage instance
+        cache_key (str): Generation cache key to store once renditions exist
     """
-    from datetime import timedelta
+    start_time = time.time()
     
     try:
-        # Delete images older than 30 days that are rejected or failed
-        cutoff_date = timezone.now() - timedelta(days=30)
-        
-        old_images = GeneratedImage.objects.filter(
-            status__in=['rejected', 'failed'],
-            created_at__lt=cutoff_date
-        )
+        image = GeneratedImage.objects.get(id=image_id)
+    except GeneratedImage.DoesNotExist:
+        logger.error(f"Image {image_id} not found")
+        return {'status': 'error', 'message': 'Image not found'}
+    
+    # A redelivered task finds the renditions of its first run
+    if not image.image_file or image.renditions.exists():
+        return {'status': 'skipped', 'image_id': image_id}
+    
+    with image.image_file.open('rb') as source:
+        renditions = _create_renditions(image, source)
+    
+    image.updated_at = timezone.now()
+    try:
+        with transaction.atomic():
+            # Serialize deliveries of the same image on its row
+            GeneratedImage.objects.select_for_update().filter(id=image_id).first()
+            if image.renditions.exists():
+                # A concurrent delivery stored its renditions first: keep them
+                # and drop the references taken on the files rendered here
+                _release_renditions(image, renditions)
+                return {'status': 'skipped', 'image_id': image_id}
         
-        count = old_images.count()
+            image.save(update_fields=['thumbnail', 'updated_at'])
+            ImageRendition.objects.bulk_create(renditions)
+    except Exception:
+        # Nothing links the rendered files
+        _release_renditions(image, renditions)
+        raise
+    
+    if cache_key:
+        GenerationResultCache().set(cache_key, _cache_entry(image, renditions))
+    
+    metrics.record_duration('renditions', time.time() - start_time)
+    return {'status': 'success', 'image_id': image_id, 'renditions': len(renditions)}
+
+
+def _generation_params(image):
+    """
+    Keyword arguments of ImageGeneratorService.generate_image for an image
+    """
+    return {
+        'prompt': image.prompt,
+        'negative_prompt': image.negative_prompt,
+        'style': image.style,
+        'width': image.width,
+        'height': image.height,
+        'quality': image.quality,
+    }
+
+
+def _generation_cache_key(image, generator):
+    """
+    Cache key of an image request, None when its owner opted out
+    """
+    profile = getattr(image.user, 'profile', None)
+    if profile is not None and not profile.use_generation_cache:
+        return None
+    return generator.cache_key(**_generation_params(image))
+
+
+def _cached_files_exist(entry):
+    return bool(entry.get('image_file')) and default_storage.exists(entry['image_file'])
+
+
+def _cache_entry(image, renditions):
+    """
+    Generation cache entry pointing at the files stored for an image
+    """
+    return {
+        'image_url': image.image_url,
+        'image_file': image.image_file.name,
+        'thumbnail': image.thumbnail.name if image.thumbnail else '',
+        'metadata': image.metadata,
+        'generation_time': image.generation_time,
+        'renditions': [
+            {
+                'name': rendition.name,
+                'file': rendition.file.name,
+                'width': rendition.width,
+                'height': rendition.height,
+                'format': rendition.format,
+                'file_size': rendition.file_size,
+            }
+            for rendition in renditions
+        ],
+    }
+
+
+def _cached_renditions(image, entry):
+    """
+    Rendition rows linking the cached rendition files to an image
+    
+    Returns:
+        list: Unsaved ImageRendition instances
+    """
+    return [ImageRendition(image=image, **item) for item in entry.get('renditions', [])]
+
+
+def _linked_files(image, renditions):
+    """
+    Storage names an image served from the cache links, one per reference
+    to take in the transaction saving it
+    """
+    names = [image.image_file.name] + [rendition.file.name for rendition in renditions]
+    if image.thumbnail:
+        names.append(image.thumbnail.name)
+    return names
+
+
+def _create_renditions(image, source):
+    """
+    Render and store every rendition of an image
+    
+    The original bytes are decoded once; the 'thumbnail' rendition also
+    fills GeneratedImage.thumbnail.
+    
+    Args:
+        image (GeneratedImage): Image the renditions belong to
+        source: File-like object with the original image bytes
+    
+    Returns:
+        list: Unsaved ImageRendition instances
+    """
+    try:
+        rendered = RenditionPipeline().render(source)
+    except Exception as e:
+        logger.error(f"Error creating renditions for image {image.id}: {str(e)}")
+        return []
+    
+    store = MediaStore()
+    renditions = []
+    for item in rendered:
+        name = store.save(item['file'], item['extension'])
+        renditions.append(ImageRendition(
+            image=image,
+            name=item['name'],
+            file=name,
+            width=item['width'],
+            height=item['height'],
+            format=item['format'],
+            file_size=item['file_size']
+        ))
         
-        # Delete the images
-        for image in old_images:
-            # Delete the actual files
-            if image.image_file:
-                image.image_file.delete(save=False)
-            if image.thumbnail:
-                image.thumbnail.delete(save=False)
-            
-            # Delete the database record
-            image.delete()
+        if item['name'] == 'thumbnail':
+            store.acquire(name)
+            image.thumbnail = name
+    
+    return renditions
+
+
+def _release_renditions(image, renditions):
+    """
+    Drop the references _create_renditions took on files that are not kept
+    """
+    store = MediaStore()
+    names = [rendition.file.name for rendition in renditions]
+    if any(rendition.name == 'thumbnail' for rendition in renditions):
+        names.append(image.thumbnail.name)
+    for name in names:
+        store.release(name)
+
+
+def _apply_cached_result(image, entry):
+    """
+    Link the files of a cached generation to an image
+    
+    The references on the files are taken by the caller, see _linked_files.
+    
+    Returns:
+        ImageGenerationHistory: Unsaved history entry
+    """
+    image.image_url = entry['image_url']
+    image.image_file = entry['image_file']
+    image.thumbnail = entry.get('thumbnail') or None
+    image.metadata = dict(entry.get('metadata') or {}, cache_hit=True)
+    # Nothing was generated, keep the Blackbox timing statistics untouched
+    image.generation_time = None
+    image.status = 'generated'
+    
+    return ImageGenerationHistory(
+        user_id=image.user_id,
+        image=image,
+        action='generated',
+        details={
+            'cache_hit': True,
+            'model': image.metadata.get('model', 'unknown')
+        }
+    )
+
+
+def _record_latency(image):
+    """
+    Record the time between the request and the generated image, per priority class
+    """
+    metrics.record_duration(
+        f"latency.{image.priority}",
+        (timezone.now() - image.created_at).total_seconds()
+    )
+
+
+def _enqueue_renditions(cache_keys):
+    """
+    Send the rendition work of freshly generated images to the 'cpu' queue
+    
+    Args:
+        cache_keys (dict): Image ID -> generation cache key (or None), the
+            cache entry is stored once the renditions exist
+    """
+    if not cache_keys:
+        return
+    
+    signatures = group(
+        process_image_renditions.s(image_id, cache_key=cache_key)
+        for image_id, cache_key in cache_keys.items()
+    )
+    transaction.on_commit(signatures.apply_async)
+
+
+def _apply_generation_result(image, result, download_result=None):
+    """
+    Copy a generation result onto an image and build its history entry
+    
+    The image and the history entry are not saved so callers can persist
+    them one by one or in bulk. The downloaded file is stored by
+    _store_download, in the transaction saving the image.
+    
+    Args:
+        image (GeneratedImage): Image being generated
+        result (dict): Result of ImageGeneratorService.generate_image
+        download_result (dict): Result of download_and_save_image, if any
+    
+    Returns:
+        ImageGenerationHistory: Unsaved history entry
+    """
+    if not result['success']:
+        # Generation failed
+        image.status = 'failed'
+        image.error_message = result.get('error', 'Unknown error')
         
-        logger.info(f"Cleaned up {count} old images")
-        return {'status': 'success', 'deleted_count': count}
+        return ImageGenerationHistory(
+            user_id=image.user_id,
+            image=image,
+            action='failed',
+            details={'error': result.get('error', 'Unknown error')}
+        )
+    
+    image.image_url = result['image_url']
+    image.metadata = result['metadata']
+    image.generation_time = result['generation_time']
+    
+    # Update status to generated
+    image.status = 'generated'
+    
+    return ImageGenerationHistory(
+        user_id=image.user_id,
+        image=image,
+        action='generated',
+        details={
+            'generation_time': result['generation_time'],
+            'model': result['metadata'].get('model', 'unknown')
+        }
+    )
+
+
+def _store_download(image, download_result):
+    """
+    Store the downloaded file of a generated image and link it to the image
+    
+    Called in the transaction saving the image: the reference taken on the
+    blob is rolled back with the row should the save fail.
+    """
+    if image.status != 'generated' or not download_result or not download_result['success']:
+        return
+    # Identical bytes are stored once
+    image.image_file = MediaStore().save(
+        download_result['file'],
+        download_result['extension'],
+        digest=download_result['sha256']
+    )
+    download_result['file'].close()
+
+
+def _claim_images(image_ids):
+    """
+    Flip pending images to generating with a single UPDATE
+    Images already picked up elsewhere are left untouched; the claim is
+    tagged with a token so the caller reads back exactly the images it won
+    
+    Returns:
+        tuple: (claim token, IDs of the images claimed by this call)
+    """
+    token = uuid.uuid4()
+    with transaction.atomic():
+        now = timezone.now()
+        GeneratedImage.objects.filter(id__in=image_ids, status='pending').update(
+            status='generating', claim_token=token, claimed_at=now, updated_at=now
+        )
+        claimed = list(GeneratedImage.objects.filter(claim_token=token).values_list('id', 'user_id'))
+        # The UPDATE sends no signal: move the counters of the images' owners
+        for user_id, count in Counter(user_id for _, user_id in claimed).items():
+            UserStats.record(user_id, pending_images=-count, generating_images=count)
+    return str(token), [image_id for image_id, _ in claimed]
+
+
+@shared_task
+def generate_image_batch(image_ids, claim_token, concurrency=None, attempt=0):
+    """
+    Celery task to generate a batch of claimed images concurrently
+    
+    The whole batch is fetched with one query, generated on one event loop
+    with bounded concurrency, then written back with bulk queries. Only the
+    images still holding ``claim_token`` are taken, so a batch delivered
+    twice or overlapping another claim never generates an image twice.
+    Images whose generation failed because Blackbox was unavailable keep
+    their claim and are re-queued with exponential backoff.
+    
+    Every run renews the lease of the claim (see BULK_GENERATION_LEASE_TIMEOUT).
+    Should the batch raise, the images it still holds are failed instead of
+    taking a bulk slot until their lease expires.
+    
+    Args:
+        image_ids (list): IDs of GeneratedImage instances claimed by _claim_images
+        claim_token (str): Token of that claim
+        concurrency (int): Maximum number of Blackbox requests in flight
+        attempt (int): Number of times these images were already re-queued
+    """
+    claimed = GeneratedImage.objects.filter(id__in=image_ids, status='generating', claim_token=claim_token)
+    claimed.update(claimed_at=timezone.now())
+    images = claimed.select_related('user__profile').in_bulk()
+    
+    if not images:
+        return {'status': 'success', 'generated': 0, 'failed': 0}
+    
+    try:
+        return _generate_claimed_images(images, claim_token, concurrency, attempt)
+    except Exception as e:
+        logger.error(f"Batch generation failed, releasing {len(images)} images: {str(e)}")
+        failed = BulkGenerationDispatcher.release(
+            claimed, 'failed', error_message="Génération interrompue par une erreur inattendue"
+        )
+        transaction.on_commit(dispatch_bulk_generation.delay)
+        return {'status': 'error', 'message': str(e), 'failed': failed}
+
+
+def _generate_claimed_images(images, claim_token, concurrency, attempt):
+    """
+    Generate the images of a batch and write them back, see generate_image_batch
+    """
+    generator = ImageGeneratorService()
+    cache = GenerationResultCache()
+    
+    # Serve identical earlier requests from the generation cache
+    history = []
+    renditions = []
+    linked_files = []
+    cache_keys = {}
+    rendition_keys = {}
+    for image in images.values():
+        cache_key = _generation_cache_key(image, generator) if cache.enabled else None
+        cached = cache.get(cache_key, validate=_cached_files_exist) if cache_key else None
+        if cached:
+            history.append(_apply_cached_result(image, cached))
+            image_renditions = _cached_renditions(image, cached)
+            renditions.extend(image_renditions)
+            linked_files.extend(_linked_files(image, image_renditions))
+            if not cached.get('renditions'):
+                rendition_keys[image.id] = None
+        else:
+            cache_keys[image.id] = cache_key
+    
+    outcomes = generator.generate_many(
+        {image_id: _generation_params(images[image_id]) for image_id in cache_keys},
+        concurrency=concurrency
+    )
+    
+    retry_ids = []
+    for image_id, outcome in outcomes.items():
+        image = images[image_id]
+        if outcome['result'].get('retryable') and attempt < settings.GENERATION_MAX_RETRIES:
+            retry_ids.append(image_id)
+            continue
+        if outcome['result']['success']:
+            metrics.record_duration('generation', outcome['result']['generation_time'])
+        history.append(_apply_generation_result(image, outcome['result'], outcome['download']))
+    
+    now = timezone.now()
+    for image in images.values():
+        image.updated_at = now
+    
+    with transaction.atomic():
+        for image_id, outcome in outcomes.items():
+            if image_id not in retry_ids:
+                _store_download(images[image_id], outcome['download'])
+        GeneratedImage.objects.bulk_update(images.values(), GENERATION_RESULT_FIELDS)
+        UserStats.record_changes(images.values())
+        ImageGenerationHistory.objects.bulk_create(history)
+        ImageRendition.objects.bulk_create(renditions)
+        MediaStore().acquire_many(linked_files)
+    
+    for entry in history:
+        if entry.action == 'generated':
+            _record_latency(entry.image)
+    
+    # Thumbnails and renditions are rendered by the CPU workers
+    rendition_keys.update({
+        image_id: cache_key
+        for image_id, cache_key in cache_keys.items()
+        if images[image_id].image_file
+    })
+    _enqueue_renditions(rendition_keys)
+    
+    if retry_ids:
+        countdown = max(
+            [backoff_delay(attempt, base=10)] +
+            [outcomes[image_id]['result'].get('retry_after') or 0 for image_id in retry_ids]
+        )
+        metrics.increment('generation.requeued', len(retry_ids))
+        generate_image_batch.apply_async(
+            (retry_ids, claim_token),
+            {'concurrency': concurrency, 'attempt': attempt + 1},
+            countdown=countdown
+        )
+        logger.warning(f"{len(retry_ids)} images re-queued in {countdown:.1f}s (attempt {attempt + 1})")
+    
+    # Hand the freed bulk slots to the next fair-share batches
+    transaction.on_commit(dispatch_bulk_generation.delay)
+    
+    generated = sum(1 for entry in history if entry.action == 'generated')
+    logger.info(f"Batch generation finished: {generated}/{len(history)} images generated")
+    return {
+        'status': 'success',
+        'generated': generated,
+        'failed': len(history) - generated,
+        'requeued': len(retry_ids)
+    }
+
+
+@shared_task
+def generate_pending_images(image_ids=None, limit=None, concurrency=None):
+    """
+    Celery task to drain a batch of pending images concurrently
+    
+    Args:
+        image_ids (list): IDs of GeneratedImage instances, or None to take
+            the oldest pending bulk images (interactive ones belong to
+            generate_image_task)
+        limit (int): Maximum number of images taken when image_ids is None
+        concurrency (int): Maximum number of Blackbox requests in flight
+    """
+    if image_ids is None:
+        image_ids = list(
+            GeneratedImage.objects.filter(status='pending', priority='bulk')
+            .order_by('created_at')
+            .values_list('id', flat=True)[:limit or settings.GENERATION_BATCH_SIZE]
+        )
+    
+    claim_token, claimed = _claim_images(image_ids)
+    return generate_image_batch(claimed, claim_token, concurrency=concurrency)
+
+
+@shared_task
+def cleanup_old_images(dry_run=False, max_chunks=None):
+    """
+    Celery task to clean up old rejected or failed images
+    Runs daily to free up storage space, in chunks of CLEANUP_CHUNK_SIZE images
+    
+    Args:
+        dry_run (bool): Only count what would be deleted
+        max_chunks (int): Stop after this many chunks, the next run resumes
+    """
+    try:
+        totals = ImageCleanup(dry_run=dry_run).run(max_chunks=max_chunks)
+        logger.info(f"Cleaned up {totals['images']} old images and {totals['files']} files")
+        return {
+            'status': 'success',
+            'deleted_count': totals['images'],
+            'files_count': totals['files'],
+            'chunks': totals['chunks'],
+            'dry_run': dry_run
+        }
         
     except Exception as e:
         logger.error(f"Error cleaning up old images: {str(e)}")
         return {'status': 'error', 'message': str(e)}
 
 
+@shared_task
+def rollup_generation_history(max_hours=None):
+    """
+    Celery task aggregating the generation history into hourly and daily rollups
+    Runs every hour; after a backlog each run catches up ROLLUP_MAX_HOURS_PER_RUN hours
+    
+    Args:
+        max_hours (int): Maximum number of hours of history read by this run
+    """
+    result = GenerationRollupBuilder(max_hours=max_hours).run()
+    if result['start']:
+        logger.info(
+            f"Generation history rolled up from {result['start']} to {result['end']}: "
+            f"{result['hours']} hourly and {result['days']} daily rows"
+        )
+    return {'status': 'success', **result}
+
+
+@shared_task
+def prune_generation_history(chunk_size=5000):
+    """
+    Celery task deleting the raw history older than HISTORY_RETENTION_DAYS
+    Only rows already in the rollups are deleted; runs daily
+    
+    Args:
+        chunk_size (int): Number of rows deleted per statement
+    """
+    if not settings.HISTORY_RETENTION_DAYS:
+        return {'status': 'skipped', 'message': 'History retention is disabled'}
+    
+    rolled_up_until = GenerationRollupBuilder().rolled_up_until()
+    if rolled_up_until is None:
+        return {'status': 'skipped', 'message': 'History is not rolled up yet'}
+    cutoff = min(timezone.now() - timedelta(days=settings.HISTORY_RETENTION_DAYS), rolled_up_until)
+    
+    expired = ImageGenerationHistory.objects.filter(created_at__lt=cutoff)
+    deleted = 0
+    while True:
+        ids = list(expired.values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            break
+        ImageGenerationHistory.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+    
+    logger.info(f"Pruned {deleted} history entries older than {cutoff}")
+    return {'status': 'success', 'deleted_count': deleted}
+
+
+@shared_task
+def dispatch_bulk_generation():
+    """
+    Celery task feeding the 'bulk' queue with fair-share batches
+    
+    Runs every minute and whenever a batch finishes. Free bulk slots
+    (BULK_GENERATION_MAX_IN_FLIGHT images) go one batch at a time to the
+    users with the fewest images in flight, after the images whose lease
+    expired were handed back.
+    """
+    dispatcher = BulkGenerationDispatcher()
+    
+    with dispatcher.lock() as acquired:
+        if not acquired:
+            return {'status': 'skipped', 'message': 'Another dispatcher is running'}
+        
+        recovered = dispatcher.recover_expired()
+        if recovered:
+            logger.warning(f"Released {recovered} bulk images whose lease expired")
+        
+        batches = []
+        for image_ids in dispatcher.plan():
+            claim_token, claimed = _claim_images(image_ids)
+            if claimed:
+                generate_image_batch.delay(claimed, claim_token)
+                batches.append(claimed)
+    
+    if batches:
+        logger.info(f"Dispatched {len(batches)} bulk batches ({sum(map(len, batches))} images)")
+    return {
+        'status': 'success',
+        'batches': len(batches),
+        'images': sum(map(len, batches)),
+        'recovered': recovered
+    }
+
+
 @shared_task
 def batch_generate_images(image_ids):
     """
     Celery task to generate multiple images in batch
     
+    The images join the bulk pool, which dispatch_bulk_generation shares
+    fairly between users in batches of GENERATION_BATCH_SIZE images.
+    
     Args:
         image_ids (list): List of GeneratedImage IDs
     """
-    results = []
+    queued = GeneratedImage.objects.filter(
+        id__in=image_ids, status='pending'
+    ).update(priority='bulk', updated_at=timezone.now())
     
-    for image_id in image_ids:
-        result = generate_image_task.delay(image_id)
-        results.append({
-            'image_id': image_id,
-            'task_id': result.id
-        })
+    dispatched = dispatch_bulk_generation()
     
     return {
         'status': 'success',
-        'message': f'Started generation for {len(image_ids)} images',
-        'results': results
+        'message': f'Queued {queued} images for bulk generation',
+        'batches': dispatched.get('batches', 0)
     }
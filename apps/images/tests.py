@@ -1,3 +1,1829 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count
+from django.db.models.signals import post_delete, pre_delete
+from django.forms.models import model_to_dict
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from apps.authentication.models import UserStats
+from apps.core import metrics
+from apps.core.http import get_session, reset_sessions
+from apps.core.locks import ExpiringLock, LocalLockBackend
+from apps.core.rollups import bucket_start
+from apps.core.resilience import (
+    AdaptiveSemaphore, AIMDConcurrency, CircuitBreaker, LocalTokenBucketBackend, TokenBucket, backoff_delay
+)
+from apps.core.stub_server import StubHTTPServer, faulty_handler
+from apps.scheduler.models import ScheduledPost
+from .models import (
+    GeneratedImage, GenerationRollup, ImageGenerationHistory, ImageRendition, ImageTag, ImageTagRelation, MediaBlob,
+    PROMPT_SEARCH_INDEX
+)
+from .services import (
+    BulkGenerationDispatcher, GenerationResultCache, ImageCleanup, ImageGeneratorService, MediaStore, RenditionPipeline,
+    add_image_tags, allocate_batches
+)
+from .services.async_generator import AsyncGenerationEngine
+from .services.downloads import DownloadError, DownloadSink, sniff_image_type
+from .services.image_generator import get_call_slots, reset_call_slots
+from .services.result_cache import FileSystemResultCacheBackend
+from .tasks import (
+    _claim_images, _create_renditions, _enqueue_renditions, dispatch_bulk_generation, generate_image_batch, generate_image_task,
+    generate_pending_images, process_image_renditions, prune_generation_history, rollup_generation_history
+)
 
-# Create your tests here.
+
+def png_bytes(size=(64, 64)):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'blue').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def blackbox_handler(server_url):
+    """
+    Fake Blackbox API: POST returns the URL of a PNG served by the same server
+    """
+    image = png_bytes()
+    
+    def handler(method, path, body):
+        if method == 'POST':
+            payload = json.dumps({'url': server_url() + '/image.png'}).encode()
+            return 200, {'Content-Type': 'application/json'}, payload
+        return 200, {'Content-Type': 'image/png'}, image
+    
+    return handler
+
+
+RESILIENCE_SETTINGS = dict(
+    BLACKBOX_API_KEY='test',
+    BLACKBOX_RATE_LIMIT=1000,
+    BLACKBOX_RATE_BURST=1000,
+    BLACKBOX_RATE_LIMIT_BACKEND='local',
+    BLACKBOX_RATE_LIMIT_WAIT=1,
+    BLACKBOX_BREAKER_THRESHOLD=3,
+    BLACKBOX_BREAKER_RESET_TIMEOUT=30,
+    GENERATION_CACHE_BACKEND='',
+)
+
+
+class HttpSessionPoolTests(SimpleTestCase):
+    """
+    Keep-alive sessions are pooled per process and name
+    """
+    
+    def setUp(self):
+        reset_sessions()
+        self.addCleanup(reset_sessions)
+    
+    def test_session_is_reused_per_name(self):
+        session = get_session('blackbox')
+        self.assertIs(get_session('blackbox'), session)
+        self.assertIsNot(get_session('media'), session)
+    
+    def test_requests_share_one_connection(self):
+        with StubHTTPServer() as server:
+            for _ in range(5):
+                self.assertEqual(get_session('blackbox').get(server.url + '/image').status_code, 200)
+            self.assertEqual((server.requests, server.connections), (5, 1))
+    
+    @override_settings(HTTP_POOL_CONNECTIONS=3, HTTP_POOL_MAXSIZE=7)
+    def test_pool_size_follows_settings(self):
+        adapter = get_session('blackbox').get_adapter('https://api.blackbox.ai')
+        self.assertEqual((adapter._pool_connections, adapter._pool_maxsize), (3, 7))
+    
+    def test_forked_process_builds_its_own_sessions(self):
+        session = get_session('blackbox')
+        with mock.patch('apps.core.http.os.getpid', return_value=-1):
+            child_session = get_session('blackbox')
+        self.assertIsNot(child_session, session)
+    
+    def test_reset_closes_the_sessions(self):
+        session = get_session('blackbox')
+        with mock.patch.object(session, 'close') as close:
+            reset_sessions()
+        close.assert_called_once_with()
+        self.assertIsNot(get_session('blackbox'), session)
+
+
+class ResilienceTestMixin:
+    
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        LocalTokenBucketBackend.reset()
+        reset_call_slots()
+    
+    def start_server(self, handler=None, latency=0.0):
+        server = StubHTTPServer(latency=latency).start()
+        self.addCleanup(server.stop)
+        server.handler = handler or blackbox_handler(lambda: server.url)
+        return server
+
+
+class TemporaryMediaMixin:
+    """
+    Files saved through the default storage and the filesystem generation
+    cache land in a temporary directory
+    """
+    
+    def setUp(self):
+        super().setUp()
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.workdir = Path(workdir.name)
+        media = override_settings(MEDIA_ROOT=self.workdir / 'media', GENERATION_CACHE_DIR=self.workdir / 'cache')
+        media.enable()
+        self.addCleanup(media.disable)
+
+
+class TokenBucketTests(ResilienceTestMixin, SimpleTestCase):
+    
+    def test_burst_then_wait(self):
+        bucket = TokenBucket('test', rate=10, capacity=3, backend='local')
+        self.assertEqual([bucket.try_acquire() for _ in range(3)], [0, 0, 0])
+        wait = bucket.try_acquire()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.1)
+    
+    def test_acquire_waits_for_refill(self):
+        bucket = TokenBucket('test', rate=20, capacity=1, backend='local')
+        self.assertTrue(bucket.acquire())
+        self.assertFalse(bucket.acquire(timeout=0))
+        self.assertTrue(bucket.acquire(timeout=0.2))
+    
+    def test_zero_rate_disables_the_limit(self):
+        bucket = TokenBucket('test', rate=0, backend='local')
+        self.assertTrue(all(bucket.try_acquire() == 0 for _ in range(100)))
+
+
+class CircuitBreakerTests(ResilienceTestMixin, SimpleTestCase):
+    
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=30)
+        for _ in range(2):
+            breaker.record_failure()
+        breaker.record_success()
+        for _ in range(2):
+            breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        self.assertGreater(breaker.retry_after(), 0)
+    
+    def test_half_open_probe(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        # Only one probe at a time
+        self.assertFalse(breaker.allow())
+        
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+    
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+
+class AIMDConcurrencyTests(SimpleTestCase):
+    
+    def test_additive_increase(self):
+        controller = AIMDConcurrency(initial=4, maximum=8)
+        for _ in range(5):
+            controller.on_success()
+        self.assertEqual(controller.limit, 5)
+    
+    def test_multiplicative_decrease_once_per_cooldown(self):
+        controller = AIMDConcurrency(initial=16, cooldown=60)
+        controller.on_overload()
+        controller.on_overload()
+        self.assertEqual(controller.limit, 8)
+    
+    def test_slow_answers_count_as_overload(self):
+        controller = AIMDConcurrency(initial=8, latency_target=1.0)
+        controller.on_success(latency=5.0)
+        self.assertEqual(controller.limit, 4)
+    
+    def test_bounds(self):
+        controller = AIMDConcurrency(initial=2, minimum=1, maximum=2, cooldown=0)
+        for _ in range(10):
+            controller.on_overload()
+        self.assertEqual(controller.limit, 1)
+        for _ in range(100):
+            controller.on_success()
+        self.assertEqual(controller.limit, 2)
+    
+    def test_semaphore_follows_the_limit(self):
+        slots = AdaptiveSemaphore(AIMDConcurrency(initial=2, cooldown=0))
+        self.assertTrue(slots.acquire(timeout=0))
+        self.assertTrue(slots.acquire(timeout=0))
+        self.assertFalse(slots.acquire(timeout=0))
+        
+        slots.on_overload()
+        slots.release()
+        # One call still in flight fills the narrowed limit
+        self.assertFalse(slots.acquire(timeout=0))
+        slots.release()
+        self.assertTrue(slots.acquire(timeout=0))
+    
+    def test_backoff_delay_is_capped(self):
+        for attempt in range(20):
+            delay = backoff_delay(attempt, base=1, cap=60)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(60, 2 ** attempt))
+
+
+@override_settings(**RESILIENCE_SETTINGS)
+class ImageGeneratorResilienceTests(ResilienceTestMixin, SimpleTestCase):
+    
+    def generator(self, server):
+        generator = ImageGeneratorService()
+        generator.api_url = server.url + '/v1/image'
+        return generator
+    
+    def test_success(self):
+        server = self.start_server()
+        result = self.generator(server).generate_image('a cat')
+        self.assertTrue(result['success'])
+    
+    def test_throttling_is_retryable(self):
+        server = self.start_server(faulty_handler(None, status=429, retry_after=7))
+        result = self.generator(server).generate_image('a cat')
+        
+        self.assertFalse(result['success'])
+        self.assertTrue(result['retryable'])
+        self.assertEqual(result['retry_after'], 7.0)
+        self.assertEqual(result['metadata']['error_type'], 'Throttled')
+    
+    def test_bad_request_is_not_retryable(self):
+        server = self.start_server(faulty_handler(None, status=400))
+        generator = self.generator(server)
+        for _ in range(5):
+            result = generator.generate_image('a cat')
+        
+        self.assertFalse(result['retryable'])
+        self.assertEqual(generator.breaker.state, CircuitBreaker.CLOSED)
+    
+    def test_open_circuit_fails_fast(self):
+        server = self.start_server(faulty_handler(None, status=503))
+        generator = self.generator(server)
+        for _ in range(3):
+            generator.generate_image('a cat')
+        
+        result = generator.generate_image('a cat')
+        self.assertEqual(result['metadata']['error_type'], 'CircuitOpen')
+        self.assertTrue(result['retryable'])
+        self.assertEqual(server.requests, 3)
+    
+    @override_settings(GENERATION_REQUEST_TIMEOUT=0.1)
+    def test_timeouts_open_the_circuit(self):
+        server = self.start_server(latency=0.3)
+        generator = self.generator(server)
+        for _ in range(3):
+            result = generator.generate_image('a cat')
+            self.assertTrue(result['retryable'])
+        
+        self.assertEqual(generator.breaker.state, CircuitBreaker.OPEN)
+    
+    @override_settings(GENERATION_CONCURRENCY=8, BLACKBOX_BREAKER_THRESHOLD=10)
+    def test_sync_calls_adapt_concurrency(self):
+        server = self.start_server(faulty_handler(None, status=503))
+        generator = self.generator(server)
+        generator.generate_image('a cat')
+        self.assertEqual(get_call_slots().controller.limit, 4)
+        
+        server.handler = blackbox_handler(lambda: server.url)
+        for _ in range(8):
+            self.assertTrue(generator.generate_image('a cat')['success'])
+        self.assertEqual(get_call_slots().controller.limit, 5)
+        self.assertEqual(get_call_slots().in_flight, 0)
+    
+    @override_settings(GENERATION_CONCURRENCY=1, BLACKBOX_RATE_LIMIT_WAIT=0)
+    def test_full_gate_defers_the_call(self):
+        server = self.start_server()
+        slots = get_call_slots()
+        slots.acquire()
+        self.addCleanup(slots.release)
+        
+        result = self.generator(server).generate_image('a cat')
+        self.assertEqual(result['metadata']['error_type'], 'Saturated')
+        self.assertTrue(result['retryable'])
+        self.assertEqual(server.requests, 0)
+    
+    @override_settings(GENERATION_CONCURRENCY=1, BLACKBOX_RATE_LIMIT=0, BLACKBOX_RATE_LIMIT_WAIT=0)
+    def test_full_gate_without_rate_limit(self):
+        server = self.start_server()
+        slots = get_call_slots()
+        slots.acquire()
+        self.addCleanup(slots.release)
+        
+        result = self.generator(server).generate_image('a cat')
+        self.assertEqual(result['metadata']['error_type'], 'Saturated')
+        self.assertEqual(result['retry_after'], ImageGeneratorService.retry_backoff)
+    
+    @override_settings(BLACKBOX_RATE_LIMIT=1, BLACKBOX_RATE_BURST=2, BLACKBOX_RATE_LIMIT_WAIT=0)
+    def test_rate_limit(self):
+        server = self.start_server()
+        generator = self.generator(server)
+        results = [generator.generate_image('a cat') for _ in range(3)]
+        
+        self.assertEqual([result['success'] for result in results], [True, True, False])
+        self.assertEqual(results[2]['metadata']['error_type'], 'RateLimited')
+        self.assertEqual(server.requests, 2)
+
+
+@override_settings(**RESILIENCE_SETTINGS)
+class AsyncEngineResilienceTests(ResilienceTestMixin, SimpleTestCase):
+    
+    def test_adaptive_concurrency_under_throttling(self):
+        """
+        The fake server throttles above 4 requests in flight; the engine
+        must back off below its configured concurrency and still finish
+        """
+        in_flight = [0]
+        lock = threading.Lock()
+        server = self.start_server(latency=0.02)
+        serve = blackbox_handler(lambda: server.url)
+        
+        def throttling_handler(method, path, body):
+            if method != 'POST':
+                return serve(method, path, body)
+            with lock:
+                in_flight[0] += 1
+                overloaded = in_flight[0] > 4
+            try:
+                if overloaded:
+                    return 429, {}, b'{}'
+                time.sleep(0.02)
+                return serve(method, path, body)
+            finally:
+                with lock:
+                    in_flight[0] -= 1
+        
+        server.handler = throttling_handler
+        generator = ImageGeneratorService()
+        generator.api_url = server.url + '/v1/image'
+        # Throttling is expected here, keep the breaker out of the way
+        generator.breaker.failure_threshold = 1000
+        
+        engine = AsyncGenerationEngine(generator, concurrency=16)
+        outcomes = engine.generate_many({i: {'prompt': f'cat {i}'} for i in range(40)})
+        
+        self.assertLess(engine.controller.limit, 16)
+        succeeded = [o for o in outcomes.values() if o['result']['success']]
+        self.assertTrue(succeeded)
+        self.assertTrue(all(o['download']['success'] for o in succeeded))
+        throttled = [o for o in outcomes.values() if not o['result']['success']]
+        self.assertTrue(all(o['result']['retryable'] for o in throttled))
+    
+    def test_open_circuit_skips_the_api(self):
+        server = self.start_server(faulty_handler(None, status=503))
+        generator = ImageGeneratorService()
+        generator.api_url = server.url + '/v1/image'
+        
+        engine = AsyncGenerationEngine(generator, concurrency=1)
+        outcomes = engine.generate_many({i: {'prompt': 'a cat'} for i in range(10)})
+        
+        self.assertEqual(server.requests, 3)
+        error_types = [o['result']['metadata']['error_type'] for o in outcomes.values()]
+        self.assertEqual(error_types.count('CircuitOpen'), 7)
+
+
+@override_settings(**RESILIENCE_SETTINGS)
+class AsyncGenerationEngineTests(ResilienceTestMixin, SimpleTestCase):
+    
+    def generator(self, server):
+        generator = ImageGeneratorService()
+        generator.api_url = server.url + '/v1/image'
+        return generator
+    
+    def test_requests_overlap_up_to_the_concurrency(self):
+        in_flight, peak = [0], [0]
+        lock = threading.Lock()
+        server = self.start_server()
+        serve = blackbox_handler(lambda: server.url)
+        
+        def counting_handler(method, path, body):
+            if method != 'POST':
+                return serve(method, path, body)
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            return serve(method, path, body)
+        
+        server.handler = counting_handler
+        outcomes = AsyncGenerationEngine(self.generator(server), concurrency=4).generate_many(
+            {i: {'prompt': f'cat {i}'} for i in range(12)}
+        )
+        
+        self.assertEqual(peak[0], 4)
+        self.assertTrue(all(o['result']['success'] and o['download']['success'] for o in outcomes.values()))
+        self.assertEqual(outcomes[0]['download']['content_type'], 'image/png')
+    
+    def test_stuck_request_only_costs_its_slot(self):
+        server = self.start_server()
+        # The stuck call may still be answered after the server stopped
+        url = server.url
+        serve = blackbox_handler(lambda: url)
+        
+        def stuck_handler(method, path, body):
+            if method == 'POST' and b'stuck' in body:
+                time.sleep(1)
+            return serve(method, path, body)
+        
+        server.handler = stuck_handler
+        engine = AsyncGenerationEngine(self.generator(server), concurrency=2, timeout=0.2)
+        start = time.monotonic()
+        outcomes = engine.generate_many({'stuck': {'prompt': 'stuck'}, **{i: {'prompt': 'cat'} for i in range(6)}})
+        
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(outcomes['stuck']['result']['metadata']['error_type'], 'TimeoutError')
+        self.assertTrue(outcomes['stuck']['result']['retryable'])
+        self.assertTrue(all(outcomes[i]['result']['success'] for i in range(6)))
+    
+    def test_no_request(self):
+        self.assertEqual(AsyncGenerationEngine(ImageGeneratorService()).generate_many({}), {})
+
+
+@override_settings(**RESILIENCE_SETTINGS)
+class PendingImagesDrainTests(TemporaryMediaMixin, ResilienceTestMixin, TestCase):
+    
+    def test_pending_images_are_generated_and_written_in_bulk(self):
+        server = self.start_server()
+        user = User.objects.create_user(username='drainer', password='secret')
+        GeneratedImage.objects.bulk_create([
+            GeneratedImage(user=user, prompt=f'cat {i}', priority='bulk') for i in range(3)
+        ])
+        interactive = GeneratedImage.objects.create(user=user, prompt='interactive')
+        
+        with override_settings(BLACKBOX_API_URL=server.url + '/v1/image'):
+            result = generate_pending_images(concurrency=2)
+        
+        self.assertEqual((result['generated'], result['failed']), (3, 0))
+        generated = GeneratedImage.objects.filter(status='generated')
+        self.assertEqual(generated.count(), 3)
+        self.assertTrue(all(image.image_file and image.generation_time for image in generated))
+        self.assertEqual(ImageGenerationHistory.objects.filter(action='generated').count(), 3)
+        self.assertEqual(GeneratedImage.objects.get(id=interactive.id).status, 'pending')
+
+
+@override_settings(**RESILIENCE_SETTINGS)
+class GenerationRetryTests(ResilienceTestMixin, TestCase):
+    
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='creator', password='secret')
+    
+    def test_task_retries_throttled_generation(self):
+        server = self.start_server(faulty_handler(None, status=429))
+        image = GeneratedImage.objects.create(user=self.user, prompt='a cat')
+        
+        with override_settings(BLACKBOX_API_URL=server.url + '/v1/image'):
+            generate_image_task.apply(args=(image.id,))
+        
+        image.refresh_from_db()
+        # Three throttled calls open the circuit, the last retry fails fast
+        self.assertEqual(server.requests, 3)
+        self.assertEqual(image.status, 'failed')
+        self.assertEqual(image.error_message, 'Blackbox AI temporairement indisponible')
+    
+    def test_batch_requeues_retryable_images(self):
+        server = self.start_server(faulty_handler(None, status=503, retry_after=12))
+        claim_token, image_ids = _claim_images([
+            GeneratedImage.objects.create(user=self.user, prompt=f'cat {i}').id for i in range(2)
+        ])
+        
+        with override_settings(BLACKBOX_API_URL=server.url + '/v1/image'), \
+                mock.patch.object(generate_image_batch, 'apply_async') as apply_async:
+            result = generate_image_batch(image_ids, claim_token, concurrency=2)
+        
+        self.assertEqual(result['requeued'], 2)
+        args, kwargs = apply_async.call_args
+        # The re-queued images keep their claim
+        self.assertEqual((sorted(args[0][0]), args[0][1]), (sorted(image_ids), claim_token))
+        self.assertEqual(args[1]['attempt'], 1)
+        self.assertGreaterEqual(kwargs['countdown'], 12)
+        self.assertEqual(
+            set(GeneratedImage.objects.values_list('status', flat=True)), {'generating'}
+        )
+    
+    def test_batch_fails_images_after_last_attempt(self):
+        server = self.start_server(faulty_handler(None, status=503))
+        image = GeneratedImage.objects.create(user=self.user, prompt='a cat')
+        claim_token, image_ids = _claim_images([image.id])
+        
+        with override_settings(BLACKBOX_API_URL=server.url + '/v1/image'), \
+                mock.patch.object(generate_image_batch, 'apply_async') as apply_async:
+            generate_image_batch(image_ids, claim_token, attempt=3)
+        
+        apply_async.assert_not_called()
+        image.refresh_from_db()
+        self.assertEqual(image.status, 'failed')
+
+
+@override_settings(GENERATION_CACHE_BACKEND='')
+class ImageBatchClaimTests(TestCase):
+    """
+    Batches are claimed with one UPDATE and written back in bulk
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='batcher', password='secret')
+        generate_many = mock.patch.object(ImageGeneratorService, 'generate_many', side_effect=self.generated)
+        self.generate_many = generate_many.start()
+        self.addCleanup(generate_many.stop)
+    
+    @staticmethod
+    def generated(requests_by_key, concurrency=None):
+        return {
+            image_id: {
+                'result': {
+                    'success': True, 'image_url': f'https://cdn.example.com/{image_id}.png',
+                    'generation_time': 2.0, 'metadata': {'model': 'blackbox-ai'}
+                },
+                'download': None
+            }
+            for image_id in requests_by_key
+        }
+    
+    def pending(self, count):
+        return [GeneratedImage.objects.create(user=self.user, prompt=f'cat {i}').id for i in range(count)]
+    
+    def test_overlapping_claims_split_the_images(self):
+        image_ids = self.pending(4)
+        first_token, first = _claim_images(image_ids[:3])
+        second_token, second = _claim_images(image_ids[1:])
+        
+        self.assertEqual((sorted(first), second), (image_ids[:3], [image_ids[3]]))
+        self.assertNotEqual(first_token, second_token)
+        
+        # The loser of an overlap passes only what it won: nothing is generated twice
+        self.assertEqual(generate_image_batch(image_ids[1:], second_token)['generated'], 1)
+        self.assertEqual(generate_image_batch(image_ids[:3], first_token)['generated'], 3)
+        generated = [image_id for call in self.generate_many.call_args_list for image_id in call.args[0]]
+        self.assertEqual(sorted(generated), image_ids)
+        self.assertEqual(ImageGenerationHistory.objects.count(), 4)
+    
+    def test_redelivered_batch_generates_nothing(self):
+        claim_token, image_ids = _claim_images(self.pending(2))
+        
+        self.assertEqual(generate_image_batch(image_ids, claim_token)['generated'], 2)
+        self.assertEqual(generate_image_batch(image_ids, claim_token)['generated'], 0)
+        self.assertEqual(self.generate_many.call_count, 1)
+        self.assertEqual(ImageGenerationHistory.objects.count(), 2)
+    
+    def test_batch_queries_do_not_grow_with_its_size(self):
+        counts = []
+        for size in (2, 20):
+            claim_token, image_ids = _claim_images(self.pending(size))
+            with CaptureQueriesContext(connection) as queries:
+                result = generate_image_batch(image_ids, claim_token)
+            self.assertEqual(result['generated'], size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(
+            set(GeneratedImage.objects.values_list('status', 'generation_time')), {('generated', 2.0)}
+        )
+
+
+class GenerationResultCacheTests(TemporaryMediaMixin, SimpleTestCase):
+    """
+    Filesystem backend of the generation result cache
+    """
+    
+    def cache(self, ttl=60, max_entries=10):
+        return GenerationResultCache(FileSystemResultCacheBackend(self.workdir / 'cache', ttl, max_entries))
+    
+    def test_hits_misses_and_stale_entries(self):
+        cache = self.cache()
+        self.assertIsNone(cache.get('a' * 64))
+        cache.set('a' * 64, {'image_file': 'blobs/a.png'})
+        self.assertEqual(cache.get('a' * 64), {'image_file': 'blobs/a.png'})
+        # Entries whose files are gone are dropped
+        self.assertIsNone(cache.get('a' * 64, validate=lambda entry: False))
+        self.assertIsNone(cache.get('a' * 64))
+        
+        self.assertEqual(cache.stats(), {'entries': 0, 'hits': 1, 'misses': 3, 'stale': 1, 'hit_ratio': 0.25})
+    
+    def test_expired_entries_are_misses(self):
+        cache = self.cache(ttl=60)
+        cache.set('b' * 64, {'image_file': 'blobs/b.png'})
+        expired = time.time() - 120
+        os.utime(cache.backend._path('b' * 64), (expired, expired))
+        
+        self.assertIsNone(cache.get('b' * 64))
+        self.assertEqual(cache.stats()['entries'], 0)
+    
+    def test_eviction_scans_only_past_the_limit(self):
+        cache = self.cache(max_entries=10)
+        keys = [f'{i:02d}' * 32 for i in range(12)]
+        for i, key in enumerate(keys[:10]):
+            cache.set(key, {'image_file': key})
+            accessed = time.time() - 30 + i
+            os.utime(cache.backend._path(key), (accessed, accessed))
+        # The oldest entry was just used
+        self.assertIsNotNone(cache.get(keys[0]))
+        
+        with mock.patch.object(cache.backend, '_evict', wraps=cache.backend._evict) as evict:
+            cache.set(keys[0], {'image_file': 'overwritten'})
+            evict.assert_not_called()
+            cache.set(keys[10], {'image_file': keys[10]})
+            self.assertEqual(evict.call_count, 1)
+            cache.set(keys[11], {'image_file': keys[11]})
+            self.assertEqual(evict.call_count, 1)
+        
+        # Down to 9 entries, least recently used first, then one more
+        kept = [key for key in keys if cache.backend._path(key).exists()]
+        self.assertEqual(kept, [keys[0]] + keys[3:])
+        self.assertEqual(cache.stats()['entries'], 10)
+
+
+@override_settings(**dict(RESILIENCE_SETTINGS, GENERATION_CACHE_BACKEND='filesystem'))
+class GenerationCacheTaskTests(TemporaryMediaMixin, ResilienceTestMixin, TestCase):
+    """
+    Identical requests link the files of the cached generation
+    """
+    
+    def setUp(self):
+        super().setUp()
+        self.server = self.start_server()
+        self.user = User.objects.create_user(username='cached', password='secret')
+        self.blob = MediaStore().save(ContentFile(png_bytes()), 'png')
+        GenerationResultCache().set(ImageGeneratorService().cache_key('a cat'), {
+            'image_url': 'https://cdn.example.com/cat.png', 'image_file': self.blob, 'thumbnail': '',
+            'metadata': {'model': 'blackbox-ai'}, 'generation_time': 3.0, 'renditions': []
+        })
+    
+    def generate(self):
+        image = GeneratedImage.objects.create(user=self.user, prompt='a cat')
+        with override_settings(BLACKBOX_API_URL=self.server.url + '/v1/image'):
+            result = generate_image_task.apply(args=(image.id,)).get()
+        image.refresh_from_db()
+        return result, image
+    
+    def test_hit_links_the_cached_files(self):
+        result, image = self.generate()
+        
+        self.assertTrue(result['cache_hit'])
+        self.assertEqual(self.server.requests, 0)
+        self.assertEqual((image.status, image.image_file.name, image.generation_time), ('generated', self.blob, None))
+        self.assertTrue(image.metadata['cache_hit'])
+        self.assertEqual(MediaBlob.objects.get(name=self.blob).ref_count, 2)
+        self.assertEqual(GenerationResultCache().stats()['hits'], 1)
+    
+    def test_failed_save_takes_no_reference(self):
+        claim_token, image_ids = _claim_images([GeneratedImage.objects.create(user=self.user, prompt='a cat').id])
+        
+        with mock.patch.object(ImageGenerationHistory.objects, 'bulk_create', side_effect=DatabaseError('disk full')):
+            self.assertEqual(generate_image_batch(image_ids, claim_token)['status'], 'error')
+        
+        self.assertEqual(MediaBlob.objects.get(name=self.blob).ref_count, 1)
+        # The batch hands its claim back instead of holding a bulk slot
+        self.assertEqual(GeneratedImage.objects.get(id=image_ids[0]).status, 'failed')
+        
+    def test_failed_save_keeps_no_reference_on_the_download(self):
+        self.user.profile.use_generation_cache = False
+        self.user.profile.save()
+        claim_token, image_ids = _claim_images([GeneratedImage.objects.create(user=self.user, prompt='a cat').id])
+        
+        with override_settings(BLACKBOX_API_URL=self.server.url + '/v1/image'), \
+                mock.patch.object(ImageGenerationHistory.objects, 'bulk_create', side_effect=DatabaseError('disk full')):
+            self.assertEqual(generate_image_batch(image_ids, claim_token)['status'], 'error')
+        
+        # The downloaded bytes are those of the cached blob
+        self.assertEqual(self.server.requests, 2)
+        self.assertEqual(MediaBlob.objects.get(name=self.blob).ref_count, 1)
+    
+    def test_users_can_opt_out(self):
+        self.user.profile.use_generation_cache = False
+        self.user.profile.save()
+        
+        result, image = self.generate()
+        
+        self.assertNotIn('cache_hit', result)
+        self.assertEqual(self.server.requests, 2)
+        # Same bytes as the cached file: stored once anyway
+        self.assertEqual((image.image_file.name, image.generation_time is not None), (self.blob, True))
+        self.assertEqual(MediaBlob.objects.get(name=self.blob).ref_count, 2)
+        self.assertEqual(GenerationResultCache().stats().get('hits', 0), 0)
+
+
+class MediaStoreTests(TemporaryMediaMixin, TestCase):
+    """
+    Content-addressed media with reference counts
+    """
+    
+    def setUp(self):
+        super().setUp()
+        self.store = MediaStore()
+        self.user = User.objects.create_user(username='stored', password='secret')
+    
+    def test_identical_bytes_are_stored_once(self):
+        first = self.store.save(ContentFile(b'same bytes'), 'png')
+        second = self.store.save(ContentFile(b'same bytes'), 'png')
+        other = self.store.save(ContentFile(b'other bytes'), 'png')
+        
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        blob = MediaBlob.objects.get(name=first)
+        self.assertEqual((blob.ref_count, blob.size), (2, 10))
+        self.assertEqual(first, MediaStore.blob_name(blob.sha256, 'png'))
+        self.assertEqual(len(list((self.workdir / 'media').rglob('*.png'))), 2)
+    
+    def test_file_is_deleted_with_its_last_reference(self):
+        name = self.store.save(ContentFile(b'bytes'), 'png')
+        self.assertTrue(self.store.acquire(name))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self.store.release(name))
+        self.assertEqual(MediaBlob.objects.get(name=name).ref_count, 1)
+        self.assertTrue(self.store.storage.exists(name))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self.store.release(name))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+        self.assertFalse(self.store.storage.exists(name))
+        # Files stored before content addressing are not blobs
+        self.assertFalse(self.store.release('generated_images/legacy.png'))
+        self.assertFalse(self.store.acquire('generated_images/legacy.png'))
+    
+    def test_rolled_back_save_leaves_no_reference(self):
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            name = self.store.save(ContentFile(b'rolled back'), 'png')
+            raise DatabaseError('row save failed')
+        
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+        # The file left behind is reused by the next save of the same bytes
+        self.assertEqual(self.store.save(ContentFile(b'rolled back'), 'png'), name)
+        self.assertEqual(MediaBlob.objects.get(name=name).ref_count, 1)
+        self.assertEqual(len(list((self.workdir / 'media').rglob('*.png'))), 1)
+    
+    def test_many_references_at_once(self):
+        shared = self.store.save(ContentFile(b'shared'), 'png')
+        single = self.store.save(ContentFile(b'single'), 'png')
+        
+        with CaptureQueriesContext(connection) as queries:
+            self.store.acquire_many([shared, shared, single, 'legacy.png'])
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(
+            dict(MediaBlob.objects.values_list('name', 'ref_count')), {shared: 3, single: 2}
+        )
+        
+        blobs, orphaned = self.store.release_many([shared, single, single, 'legacy.png'])
+        self.assertEqual((blobs, orphaned), ({shared, single}, [single]))
+        self.assertEqual(dict(MediaBlob.objects.values_list('name', 'ref_count')), {shared: 2})
+    
+    def test_delete_files_releases_every_field(self):
+        shared = self.store.save(ContentFile(b'shared'), 'png')
+        self.store.acquire(shared)
+        thumbnail = self.store.save(ContentFile(b'thumbnail'), 'jpg')
+        rendition = self.store.save(ContentFile(b'web'), 'webp')
+        legacy = self.store.storage.save('generated_images/legacy.png', ContentFile(b'legacy'))
+        image = GeneratedImage.objects.create(user=self.user, prompt='a', image_file=shared, thumbnail=thumbnail)
+        other = GeneratedImage.objects.create(user=self.user, prompt='b', image_file=shared, thumbnail=legacy)
+        linked = GeneratedImage.objects.create(user=self.user, prompt='c', thumbnail=legacy)
+        ImageRendition.objects.create(image=image, name='web', file=rendition, width=1, height=1,
+                                      format='WEBP', file_size=3)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete_files()
+        self.assertEqual(MediaBlob.objects.get(name=shared).ref_count, 1)
+        for name in (thumbnail, rendition):
+            self.assertFalse(self.store.storage.exists(name), name)
+        
+        # A legacy file is kept while another image links it
+        other.delete_files()
+        other.delete()
+        self.assertTrue(self.store.storage.exists(legacy))
+        linked.delete_files()
+        self.assertFalse(self.store.storage.exists(legacy))
+
+
+class PostProcessingQueueTests(TestCase):
+    """
+    Rendition work runs on the 'cpu' queue, after the generation commits
+    """
+    
+    def test_routes(self):
+        from config.celery import app
+        
+        def queue(task_name):
+            return app.amqp.router.route({}, task_name)['queue'].name
+        
+        self.assertEqual(queue('apps.images.tasks.process_image_renditions'), 'cpu')
+        self.assertEqual(queue('apps.images.tasks.generate_image_task'), 'interactive')
+        self.assertEqual(queue('apps.images.tasks.generate_image_batch'), 'bulk')
+        self.assertEqual(queue('apps.images.tasks.cleanup_old_images'), 'default')
+    
+    def test_renditions_are_sent_on_commit(self):
+        with mock.patch('apps.images.tasks.group') as group:
+            with self.captureOnCommitCallbacks() as callbacks:
+                _enqueue_renditions({1: 'key', 2: None})
+                _enqueue_renditions({})
+            
+            signatures = list(group.call_args.args[0])
+            group.return_value.apply_async.assert_not_called()
+            for callback in callbacks:
+                callback()
+        
+        group.return_value.apply_async.assert_called_once_with()
+        self.assertEqual(
+            [(signature.args, signature.kwargs) for signature in signatures],
+            [((1,), {'cache_key': 'key'}), ((2,), {'cache_key': None})]
+        )
+
+
+class PipelineMetricsTests(ResilienceTestMixin, TestCase):
+    """
+    Stage durations are kept as histograms in the shared cache
+    """
+    
+    def test_stage_summary(self):
+        for milliseconds in [5] * 90 + [400] * 9 + [200000]:
+            metrics.record_duration('renditions', milliseconds / 1000)
+        metrics.increment('generation.requeued', 3)
+        
+        self.assertEqual(metrics.snapshot(), {
+            'counters': {'generation.requeued': 3},
+            'stages': {'renditions': {
+                'count': 100, 'average_ms': 2040.5, 'p50_ms': 10, 'p95_ms': 500, 'p99_ms': 500
+            }},
+        })
+        self.assertEqual(metrics.stage_summary('unknown')['p95_ms'], 0)
+    
+    def test_view_is_admin_only(self):
+        metrics.record_duration('queue_wait.cpu', 0.02)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='member', password='secret'))
+        self.assertEqual(client.get(reverse('images:metrics')).status_code, 403)
+        
+        client.force_authenticate(User.objects.create_user(username='admin', password='secret', is_staff=True))
+        with mock.patch('apps.core.metrics.queue_depths', return_value={'cpu': 2}):
+            response = client.get(reverse('images:metrics'))
+        self.assertEqual(response.data['queues'], {'cpu': 2})
+        self.assertEqual(response.data['stages']['queue_wait.cpu']['p50_ms'], 25)
+
+
+class RenditionPipelineTests(SimpleTestCase):
+    """
+    Every rendition comes from a single decode of the original
+    """
+    
+    def test_source_is_decoded_once(self):
+        buffer = BytesIO()
+        Image.new('RGB', (2000, 1000), 'red').save(buffer, format='JPEG')
+        
+        with mock.patch('apps.images.services.renditions.PILImage.open', wraps=Image.open) as image_open:
+            rendered = RenditionPipeline().render(buffer)
+        
+        image_open.assert_called_once()
+        self.assertEqual(
+            {item['name']: (item['width'], item['height'], item['extension']) for item in rendered},
+            {
+                'thumbnail': (300, 150, 'jpg'),
+                'web': (1080, 540, 'webp'),
+                'instagram_portrait': (800, 1000, 'jpg'),
+                'twitter': (1600, 900, 'jpg'),
+            }
+        )
+        self.assertEqual(rendered[0]['file_size'], rendered[0]['file'].size)
+    
+    def test_small_sources_are_not_upscaled(self):
+        rendered = RenditionPipeline([{'name': 'web', 'size': (1080, 1080)}]).render(BytesIO(png_bytes()))
+        self.assertEqual((rendered[0]['width'], rendered[0]['height']), (64, 64))
+
+
+class ImageRenditionTaskTests(TemporaryMediaMixin, TestCase):
+    """
+    Redelivered rendition tasks keep the renditions of the first run
+    """
+    
+    def setUp(self):
+        super().setUp()
+        self.store = MediaStore()
+        user = User.objects.create_user(username='rendered', password='secret')
+        self.image = GeneratedImage.objects.create(
+            user=user, prompt='a cat', status='completed', image_file=self.store.save(ContentFile(png_bytes()), 'png')
+        )
+    
+    def ref_counts(self):
+        return dict(MediaBlob.objects.values_list('name', 'ref_count'))
+    
+    def test_redelivered_task_is_skipped(self):
+        result = process_image_renditions(self.image.id)
+        self.assertEqual(result['renditions'], 4)
+        ref_counts = self.ref_counts()
+        
+        self.assertEqual(process_image_renditions(self.image.id), {'status': 'skipped', 'image_id': self.image.id})
+        self.assertEqual(self.image.renditions.count(), 4)
+        self.assertEqual(self.ref_counts(), ref_counts)
+    
+    def test_concurrent_delivery_releases_its_files(self):
+        def concurrent_delivery(image, source):
+            # Another worker stores its renditions while this one renders
+            other = GeneratedImage.objects.get(id=image.id)
+            ImageRendition.objects.bulk_create(_create_renditions(other, source))
+            other.save(update_fields=['thumbnail'])
+            return _create_renditions(image, source)
+        
+        with mock.patch('apps.images.tasks._create_renditions', side_effect=concurrent_delivery):
+            with self.captureOnCommitCallbacks(execute=True):
+                result = process_image_renditions(self.image.id)
+        
+        self.assertEqual(result['status'], 'skipped')
+        self.assertEqual(self.image.renditions.count(), 4)
+        # Identical bytes share blobs: one reference per row linking them
+        thumbnail = GeneratedImage.objects.get(id=self.image.id).thumbnail.name
+        expected = {name: 1 for name in self.image.renditions.values_list('file', flat=True)}
+        expected[thumbnail] += 1
+        expected[self.image.image_file.name] = 1
+        self.assertEqual(self.ref_counts(), expected)
+
+
+class DownloadSinkTests(SimpleTestCase):
+    """
+    Streamed downloads are capped, sniffed and hashed chunk by chunk
+    """
+    
+    def test_chunks_are_hashed_and_spooled(self):
+        content = png_bytes((256, 256))
+        sink = DownloadSink(max_bytes=len(content), spool_size=64)
+        for start in range(0, len(content), 5):
+            sink.write(content[start:start + 5])
+        result = sink.finish()
+        
+        self.assertEqual(
+            (result['sha256'], result['content_type'], result['extension'], result['size']),
+            (hashlib.sha256(content).hexdigest(), 'image/png', 'png', len(content))
+        )
+        # Past spool_size the chunks went to disk
+        self.assertTrue(sink.file._rolled)
+        self.assertEqual(result['file'].read(), content)
+        sink.close()
+    
+    def test_image_types_are_sniffed_from_magic_bytes(self):
+        self.assertEqual(sniff_image_type(b'\xff\xd8\xff\xe0' + b'\0' * 8), ('image/jpeg', 'jpg'))
+        self.assertEqual(sniff_image_type(b'GIF89a' + b'\0' * 6), ('image/gif', 'gif'))
+        self.assertEqual(sniff_image_type(b'RIFF\0\0\0\0WEBP'), ('image/webp', 'webp'))
+        self.assertIsNone(sniff_image_type(b'<!DOCTYPE html>'))
+        
+        sink = DownloadSink()
+        with self.assertRaises(DownloadError):
+            sink.write(b'<html><body>Not found</body></html>')
+        sink.close()
+    
+    def test_size_cap(self):
+        sink = DownloadSink(max_bytes=100)
+        with self.assertRaises(DownloadError):
+            sink.check_declared_length('101')
+        sink.check_declared_length('100')
+        # Servers may announce nothing, or lie
+        sink.write(png_bytes()[:60])
+        with self.assertRaises(DownloadError):
+            sink.write(b'\0' * 41)
+        sink.close()
+    
+    def test_download_rejects_oversized_and_non_image_files(self):
+        with StubHTTPServer() as server:
+            generator = ImageGeneratorService()
+            server.handler = lambda method, path, body: (200, {'Content-Type': 'image/png'}, png_bytes())
+            result = generator.download_and_save_image(server.url + '/image.png')
+            self.assertTrue(result['success'])
+            self.assertEqual(result['sha256'], hashlib.sha256(png_bytes()).hexdigest())
+            result['file'].close()
+            
+            with override_settings(DOWNLOAD_MAX_BYTES=10):
+                result = generator.download_and_save_image(server.url + '/image.png')
+            self.assertFalse(result['success'])
+            self.assertIn('too large', result['error'])
+            
+            server.handler = lambda method, path, body: (200, {'Content-Type': 'image/png'}, b'<html></html>')
+            result = generator.download_and_save_image(server.url + '/image.png')
+            self.assertEqual(result, {'success': False, 'error': 'Downloaded file is not a supported image'})
+
+
+class FairShareAllocationTests(SimpleTestCase):
+    
+    def test_new_user_is_served_before_the_backlog(self):
+        now = timezone.now()
+        pending = {
+            1: (10000, now - timedelta(hours=1)),
+            2: (120, now),
+        }
+        batches = allocate_batches(pending, {1: 150}, capacity=100, batch_size=50)
+        self.assertEqual(batches, [(2, 50), (2, 50)])
+    
+    def test_capacity_is_shared_between_users(self):
+        now = timezone.now()
+        pending = {
+            1: (10000, now - timedelta(hours=1)),
+            2: (10000, now - timedelta(minutes=5)),
+            3: (30, now),
+        }
+        batches = allocate_batches(pending, {}, capacity=200, batch_size=50)
+        
+        self.assertEqual(batches, [(1, 50), (2, 50), (3, 30), (1, 50), (2, 20)])
+    
+    def test_no_capacity(self):
+        pending = {1: (10, timezone.now())}
+        self.assertEqual(allocate_batches(pending, {1: 200}, capacity=0, batch_size=50), [])
+
+
+@override_settings(BULK_DISPATCH_LOCK_BACKEND='local')
+class BulkDispatchTests(TestCase):
+    
+    def setUp(self):
+        LocalLockBackend.reset()
+        self.heavy = User.objects.create_user(username='heavy', password='secret')
+        self.light = User.objects.create_user(username='light', password='secret')
+        GeneratedImage.objects.bulk_create([
+            GeneratedImage(user=self.heavy, prompt=f'heavy {i}', priority='bulk')
+            for i in range(300)
+        ])
+        GeneratedImage.objects.bulk_create([
+            GeneratedImage(user=self.light, prompt=f'light {i}', priority='bulk')
+            for i in range(20)
+        ])
+        # Interactive images are never taken by the dispatcher
+        GeneratedImage.objects.create(user=self.light, prompt='interactive')
+    
+    def test_plan_respects_in_flight_limit_and_fairness(self):
+        dispatcher = BulkGenerationDispatcher(max_in_flight=100, batch_size=40)
+        batches = dispatcher.plan()
+        
+        owners = [
+            set(GeneratedImage.objects.filter(id__in=ids).values_list('user__username', flat=True))
+            for ids in batches
+        ]
+        self.assertEqual(owners, [{'heavy'}, {'light'}, {'heavy'}])
+        self.assertEqual([len(ids) for ids in batches], [40, 20, 40])
+        all_ids = [image_id for ids in batches for image_id in ids]
+        self.assertEqual(len(all_ids), len(set(all_ids)))
+    
+    def test_dispatch_claims_and_sends_batches(self):
+        with override_settings(BULK_GENERATION_MAX_IN_FLIGHT=100, GENERATION_BATCH_SIZE=50), \
+                mock.patch.object(generate_image_batch, 'delay') as delay:
+            result = dispatch_bulk_generation()
+            self.assertEqual(result['images'], 100)
+            self.assertEqual(delay.call_count, 3)
+            
+            # Slots are full until a batch finishes
+            self.assertEqual(dispatch_bulk_generation()['batches'], 0)
+        
+        generating = GeneratedImage.objects.filter(status='generating')
+        self.assertEqual(generating.count(), 100)
+        self.assertEqual(generating.filter(user=self.light).count(), 20)
+        self.assertEqual(GeneratedImage.objects.get(prompt='interactive').status, 'pending')
+
+    def test_two_dispatchers_over_one_pending_set(self):
+        first = BulkGenerationDispatcher(max_in_flight=100, batch_size=50)
+        second = BulkGenerationDispatcher(max_in_flight=100, batch_size=50)
+        with first.lock() as first_acquired, second.lock() as second_acquired:
+            self.assertEqual((first_acquired, second_acquired), (True, False))
+            with mock.patch.object(generate_image_batch, 'delay') as delay:
+                self.assertEqual(dispatch_bulk_generation()['status'], 'skipped')
+            delay.assert_not_called()
+        
+        # Without the lock both plan the same images, the claims keep them apart
+        plans = [first.plan(), second.plan()]
+        self.assertEqual(plans[0], plans[1])
+        claimed = [_claim_images(image_ids)[1] for plan in plans for image_ids in plan]
+        
+        self.assertEqual([len(image_ids) for image_ids in claimed], [50, 20, 30, 0, 0, 0])
+        all_ids = [image_id for image_ids in claimed for image_id in image_ids]
+        self.assertEqual(len(set(all_ids)), 100)
+        self.assertEqual(GeneratedImage.objects.filter(status='generating').count(), 100)
+    
+    def test_lock_is_released_by_its_owner_only(self):
+        dispatcher = BulkGenerationDispatcher()
+        with dispatcher.lock() as acquired:
+            self.assertTrue(acquired)
+        with dispatcher.lock(timeout=0) as acquired:
+            self.assertTrue(acquired)
+            # Expired, then taken by another dispatcher
+            other = ExpiringLock(dispatcher.lock_name, backend='local')
+            self.assertTrue(other.backend.acquire(other.key, 'other', 60))
+        
+        self.assertEqual(LocalLockBackend._owners[other.key][0], 'other')
+        with dispatcher.lock() as acquired:
+            self.assertFalse(acquired)
+    
+    def test_expired_leases_free_their_slots(self):
+        with override_settings(
+            BULK_GENERATION_MAX_IN_FLIGHT=100, GENERATION_BATCH_SIZE=50, BULK_GENERATION_LEASE_TIMEOUT=1800
+        ), mock.patch.object(generate_image_batch, 'delay'):
+            dispatch_bulk_generation()
+            # The workers died with their batches
+            GeneratedImage.objects.filter(status='generating').update(
+                claimed_at=timezone.now() - timedelta(hours=1)
+            )
+            result = dispatch_bulk_generation()
+        
+        self.assertEqual((result['recovered'], result['images']), (100, 100))
+        self.assertEqual(GeneratedImage.objects.filter(status='generating').count(), 100)
+    
+    @override_settings(USER_STATS_ENABLED=True, GENERATION_CACHE_BACKEND='')
+    def test_worker_failing_mid_batch_releases_its_slots(self):
+        UserStats.rebuild(self.heavy.id)
+        claim_token, image_ids = _claim_images(
+            GeneratedImage.objects.filter(user=self.heavy).values_list('id', flat=True)[:50]
+        )
+        
+        with mock.patch.object(ImageGeneratorService, 'generate_many', side_effect=RuntimeError('worker lost')), \
+                self.captureOnCommitCallbacks(execute=True), \
+                mock.patch.object(dispatch_bulk_generation, 'delay') as dispatch:
+            result = generate_image_batch(image_ids, claim_token)
+        
+        self.assertEqual((result['status'], result['failed']), ('error', 50))
+        self.assertEqual(GeneratedImage.objects.filter(status='generating').count(), 0)
+        self.assertEqual(GeneratedImage.objects.filter(status='failed').count(), 50)
+        # The freed slots are handed out again
+        dispatch.assert_called_once_with()
+        self.assertEqual(
+            model_to_dict(UserStats.objects.get(user=self.heavy)),
+            model_to_dict(UserStats.rebuild(self.heavy.id))
+        )
+
+
+class ListQueryCountTests(TestCase):
+    """
+    List endpoints cost a fixed number of queries, whatever the page size
+    """
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='lister', password='secret')
+        tags = [ImageTag.objects.create(name=f'tag{i}') for i in range(3)]
+        images = GeneratedImage.objects.bulk_create([
+            GeneratedImage(user=cls.user, prompt=f'prompt {i}', status='generated', metadata={'seed': i})
+            for i in range(60)
+        ])
+        ImageTagRelation.objects.bulk_create([
+            ImageTagRelation(image=image, tag=tag) for image in images for tag in tags
+        ])
+        ImageRendition.objects.bulk_create([
+            ImageRendition(image=image, name=name, file=f'renditions/{image.id}-{name}.jpg',
+                           width=320, height=320, format='JPEG', file_size=1024)
+            for image in images for name in ('thumbnail', 'web')
+        ])
+        ImageGenerationHistory.objects.bulk_create([
+            ImageGenerationHistory(user=cls.user, image=image, action='generated') for image in images
+        ])
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def assertPageQueries(self, url, expected, **params):
+        for page_size in (1, 10, 50):
+            with self.subTest(page_size=page_size), self.assertNumQueries(expected):
+                response = self.client.get(url, {'page_size': page_size, **params})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), page_size)
+    
+    def test_image_list(self):
+        # count, page (with user), tags, renditions
+        self.assertPageQueries(reverse('images:list'), 4)
+    
+    def test_image_list_filtered_by_tag(self):
+        self.assertPageQueries(reverse('images:list'), 4, tags='tag0')
+    
+    def test_image_list_serializes_prefetched_tags_without_metadata(self):
+        response = self.client.get(reverse('images:list'), {'page_size': 1})
+        result = response.data['results'][0]
+        
+        self.assertEqual(sorted(result['tags']), ['tag0', 'tag1', 'tag2'])
+        self.assertEqual(len(result['renditions']), 2)
+        self.assertNotIn('metadata', result)
+    
+    def test_image_detail_keeps_metadata(self):
+        image = GeneratedImage.objects.filter(user=self.user).first()
+        response = self.client.get(reverse('images:detail', args=[image.pk]))
+        
+        self.assertEqual(response.data['metadata'], image.metadata)
+    
+    def test_history_list(self):
+        # count, page (with user)
+        self.assertPageQueries(reverse('images:history'), 2)
+    
+    def test_tag_list(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('images:tags'))
+        self.assertEqual(len(response.data['results']), 3)
+
+
+class CursorPaginationTests(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='cursor', password='secret')
+        # bulk_create gives every row the same created_at: the ID breaks ties
+        GeneratedImage.objects.bulk_create([
+            GeneratedImage(user=cls.user, prompt=f'prompt {i}') for i in range(45)
+        ])
+        GeneratedImage.objects.create(user=cls.user, prompt='latest')
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def _walk(self, url, params):
+        pages = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            if not response.data['next']:
+                return pages
+            response = self.client.get(response.data['next'])
+    
+    def test_walk_covers_every_row_once(self):
+        pages = self._walk(reverse('images:list'), {'pagination': 'cursor', 'page_size': 10})
+        
+        ids = [row['id'] for page in pages for row in page['results']]
+        expected = list(
+            GeneratedImage.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+        self.assertEqual([len(page['results']) for page in pages], [10, 10, 10, 10, 6])
+        self.assertNotIn('count', pages[0])
+    
+    def test_previous_link_returns_previous_page(self):
+        pages = self._walk(reverse('images:list'), {'pagination': 'cursor', 'page_size': 10})
+        
+        response = self.client.get(pages[2]['previous'])
+        self.assertEqual(
+            [row['id'] for row in response.data['results']],
+            [row['id'] for row in pages[1]['results']]
+        )
+        self.assertIsNone(pages[0]['previous'])
+    
+    def test_no_count_query_unless_requested(self):
+        # page, tags, renditions
+        with self.assertNumQueries(3):
+            self.client.get(reverse('images:list'), {'pagination': 'cursor'})
+        
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('images:list'), {'pagination': 'cursor', 'count': 'approximate'})
+        self.assertEqual(response.data['count'], 46)
+        self.assertTrue(response.data['count_is_exact'])
+    
+    def test_approximate_count_is_capped(self):
+        with mock.patch('apps.core.pagination.KeysetPagination.count_cap', 20):
+            response = self.client.get(reverse('images:list'), {'pagination': 'cursor', 'count': 'approximate'})
+        
+        self.assertEqual(response.data['count'], 20)
+        self.assertFalse(response.data['count_is_exact'])
+    
+    def test_history_cursor(self):
+        ImageGenerationHistory.objects.bulk_create([
+            ImageGenerationHistory(user=self.user, action='generated') for _ in range(25)
+        ])
+        pages = self._walk(reverse('images:history'), {'pagination': 'cursor', 'page_size': 10})
+        
+        ids = [row['id'] for page in pages for row in page['results']]
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(len(set(ids)), 25)
+    
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('images:list'), {'pagination': 'cursor', 'cursor': 'garbage'})
+        
+        self.assertEqual(response.status_code, 404)
+    
+    def test_page_numbers_stay_the_default(self):
+        response = self.client.get(reverse('images:list'))
+        
+        self.assertEqual(response.data['count'], 46)
+        self.assertEqual(len(response.data['results']), 20)
+
+
+class FullTextSearchTests(TestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='searcher', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.sunset = self._image('Un coucher de soleil sur la plage')
+        self.tropical = self._image('Plage tropicale au soleil levant')
+        self.forest = self._image('Forêt enneigée', validation_notes='Parfait pour la plage de Noël')
+    
+    def _image(self, prompt, **fields):
+        return GeneratedImage.objects.create(user=self.user, prompt=prompt, **fields)
+    
+    def _search(self, text, **params):
+        response = self.client.get(reverse('images:list'), {'search': text, 'search_mode': 'fulltext', **params})
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+    
+    def test_prefix_match_on_every_word(self):
+        self.assertEqual(set(self._search('sol pla')), {self.sunset.id, self.tropical.id})
+        self.assertEqual(self._search('foret'), [self.forest.id])
+        self.assertEqual(self._search('lune'), [])
+    
+    def test_prompt_ranks_above_validation_notes(self):
+        ids = self._search('plage')
+        
+        self.assertEqual(set(ids[:2]), {self.sunset.id, self.tropical.id})
+        self.assertEqual(ids[2], self.forest.id)
+    
+    def test_explicit_ordering_wins_over_rank(self):
+        ids = self._search('plage', ordering='created_at')
+        
+        self.assertEqual(ids, [self.sunset.id, self.tropical.id, self.forest.id])
+    
+    def test_index_follows_updates_and_deletes(self):
+        self.sunset.prompt = 'Un lever de lune'
+        self.sunset.save()
+        self.tropical.delete()
+        
+        self.assertEqual(self._search('lune'), [self.sunset.id])
+        self.assertEqual(self._search('soleil'), [])
+        # Status updates do not touch the indexed columns
+        GeneratedImage.objects.filter(id=self.forest.id).update(status='validated')
+        self.assertEqual(self._search('foret'), [self.forest.id])
+    
+    def test_like_search_stays_the_default(self):
+        response = self.client.get(reverse('images:list'), {'search': 'oleil'})
+        
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(self._search('oleil'), [])
+    
+    def test_post_migrate_restores_dropped_triggers(self):
+        with connection.cursor() as cursor:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER "{PROMPT_SEARCH_INDEX.fts_table}_{suffix}"')
+        missed = self._image('Cascade en montagne')
+        
+        PROMPT_SEARCH_INDEX.on_post_migrate(using='default')
+        
+        self.assertEqual(self._search('montagne'), [missed.id])
+        self.assertEqual(self._search('cascade', status='pending'), [missed.id])
+
+
+class ImageStatisticsTests(TemporaryMediaMixin, TestCase):
+    """
+    Statistics come from one aggregate query, or one UserStats row
+    """
+    
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='counter', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for status, generation_time in (('pending', None), ('generated', 2.0), ('generated', None),
+                                        ('validated', 4.5), ('failed', None)):
+            GeneratedImage.objects.create(
+                user=self.user, prompt=status, status=status, generation_time=generation_time
+            )
+    
+    def _statistics(self, queries=None):
+        if queries is None:
+            response = self.client.get(reverse('images:statistics'))
+        else:
+            with self.assertNumQueries(queries):
+                response = self.client.get(reverse('images:statistics'))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+    
+    def _expected(self, **counts):
+        return dict({
+            'total_images': 5, 'pending_images': 1, 'generated_images': 2, 'validated_images': 1,
+            'rejected_images': 0, 'failed_images': 1, 'average_generation_time': 3.25,
+            'total_generation_time': 6.5,
+        }, **counts)
+    
+    def test_single_aggregate_query(self):
+        self.assertEqual(self._statistics(1), self._expected())
+    
+    @override_settings(USER_STATS_ENABLED=True)
+    def test_counters_follow_transitions(self):
+        # The row is built from the tables on first read, then read alone
+        self.assertEqual(self._statistics(), self._expected())
+        self.assertEqual(self._statistics(1), self._expected())
+        
+        pending = GeneratedImage.objects.get(status='pending')
+        with mock.patch('apps.images.tasks.ImageGeneratorService.generate_image',
+                        return_value={'success': False, 'error': 'boom'}):
+            generate_image_task.apply(args=(pending.id,))
+        generated = GeneratedImage.objects.get(generation_time=2.0)
+        self.client.patch(reverse('images:validate', args=[generated.id]), {'action': 'reject'})
+        self.client.delete(reverse('images:detail', args=[GeneratedImage.objects.get(status='validated').id]))
+        
+        self.assertEqual(self._statistics(1), self._expected(
+            total_images=4, pending_images=0, generated_images=1, validated_images=0, rejected_images=1,
+            failed_images=2, average_generation_time=2.0, total_generation_time=2.0,
+        ))
+        self.assertEqual(
+            model_to_dict(UserStats.objects.get(user=self.user)),
+            model_to_dict(UserStats.rebuild(self.user.id))
+        )
+    
+    @override_settings(USER_STATS_ENABLED=True, BULK_DISPATCH_LOCK_BACKEND='local')
+    def test_counters_follow_bulk_writes(self):
+        UserStats.rebuild(self.user.id)
+        response = self.client.post(reverse('images:generate_bulk'), {
+            'images': [{'prompt': 'a cat'}, {'prompt': 'a dog'}]
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        image_ids = [image['id'] for image in response.data['images']]
+        
+        with mock.patch.object(generate_image_batch, 'delay') as delay:
+            dispatch_bulk_generation()
+        stats = UserStats.objects.get(user=self.user)
+        self.assertEqual((stats.pending_images, stats.generating_images), (1, 2))
+        
+        with mock.patch.object(ImageGeneratorService, 'generate_many', return_value={
+            image_id: {'result': {'success': False, 'error': 'boom'}, 'download': None}
+            for image_id in image_ids
+        }):
+            generate_image_batch(*delay.call_args.args)
+        stats.refresh_from_db()
+        self.assertEqual((stats.total_images, stats.generating_images, stats.failed_images), (7, 0, 3))
+    
+    @override_settings(USER_STATS_ENABLED=True)
+    def test_untimed_counters_have_no_average(self):
+        # Drifted counters: a generation time but no timed image
+        UserStats.rebuild(self.user.id)
+        UserStats.objects.filter(user=self.user).update(timed_images=0)
+        self.assertEqual(self._statistics(1), self._expected(average_generation_time=0))
+        
+        UserStats.objects.filter(user=self.user).update(total_generation_time=0)
+        self.assertEqual(self._statistics(1), self._expected(average_generation_time=0, total_generation_time=0))
+    
+    @override_settings(USER_STATS_ENABLED=True)
+    def test_rebuild_command_repairs_drift(self):
+        UserStats.rebuild(self.user.id)
+        # Queryset updates bypass the counters
+        GeneratedImage.objects.filter(status='generated').update(status='validated')
+        
+        out = StringIO()
+        call_command('rebuild_user_stats', stdout=out)
+        
+        self.assertIn('counter: generated_images 2 -> 0, validated_images 1 -> 3', out.getvalue())
+        self.assertEqual(self._statistics(1), self._expected(generated_images=0, validated_images=3))
+
+
+class HistoryRollupTests(TestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='historian', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.day = bucket_start(timezone.now() - timedelta(days=3), 'day')
+        self.first_hour = self.day + timedelta(hours=10)
+        for minutes, action, details in ((5, 'requested', {}),
+                                         (10, 'generated', {'generation_time': 2.0}),
+                                         (20, 'generated', {'generation_time': 4.0}),
+                                         (30, 'generated', {'cache_hit': True}),
+                                         (70, 'generated', {'generation_time': 40.0})):
+            self._history(self.first_hour + timedelta(minutes=minutes), action, details)
+    
+    def _history(self, created_at, action, details):
+        entry = ImageGenerationHistory.objects.create(user=self.user, action=action, details=details)
+        ImageGenerationHistory.objects.filter(id=entry.id).update(created_at=created_at)
+    
+    def _rollups(self, **params):
+        response = self.client.get(reverse('images:history_rollups'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+    
+    def test_hourly_and_daily_buckets(self):
+        rollup_generation_history()
+        
+        params = {'start': self.day.isoformat(), 'end': (self.day + timedelta(days=1)).isoformat()}
+        hourly = self._rollups(granularity='hour', action='generated', **params)
+        self.assertEqual([(row['bucket'], row['count']) for row in hourly], [
+            (self.first_hour.isoformat(), 3), ((self.first_hour + timedelta(hours=1)).isoformat(), 1)
+        ])
+        self.assertEqual(hourly[0]['generation_time']['count'], 2)
+        self.assertEqual(hourly[0]['generation_time']['average'], 3.0)
+        
+        daily = self._rollups(**params)
+        self.assertEqual([(row['action'], row['count']) for row in daily], [('generated', 4), ('requested', 1)])
+        self.assertIsNone(daily[1]['generation_time'])
+        generation_time = daily[0]['generation_time']
+        self.assertEqual((generation_time['count'], generation_time['average']), (3, 15.33))
+        self.assertTrue(1 <= generation_time['p50'] <= 5)
+        self.assertTrue(30 <= generation_time['p99'] <= 45)
+    
+    def test_incremental_runs(self):
+        rollup_generation_history()
+        # Reruns resume near the last bucket and give the same rows
+        late = self.first_hour + timedelta(minutes=75)
+        self._history(late, 'validated', {})
+        rollup_generation_history()
+        rollup_generation_history()
+        
+        self.assertEqual(GenerationRollup.objects.filter(granularity='hour').count(), 4)
+        day = GenerationRollup.objects.get(granularity='day', action='generated')
+        self.assertEqual(day.count, 4)
+        self.assertEqual(sum(day.generation_time_histogram), 3)
+        self.assertEqual(GenerationRollup.objects.get(granularity='day', action='validated').count, 1)
+    
+    def test_backlog_is_read_in_windows(self):
+        self._history(self.first_hour + timedelta(days=2), 'requested', {})
+        
+        result = rollup_generation_history(max_hours=24)
+        self.assertEqual(result['end'], self.first_hour + timedelta(hours=24))
+        self.assertEqual(GenerationRollup.objects.filter(action='requested', granularity='hour').count(), 1)
+        
+        # The empty hours are skipped
+        rollup_generation_history(max_hours=24)
+        self.assertEqual(GenerationRollup.objects.filter(action='requested', granularity='hour').count(), 2)
+    
+    def test_prune_keeps_recent_and_unrolled_rows(self):
+        self._history(timezone.now() - timedelta(hours=1), 'requested', {})
+        with override_settings(HISTORY_RETENTION_DAYS=1):
+            # Nothing is deleted before it is rolled up
+            self.assertEqual(prune_generation_history()['status'], 'skipped')
+            rollup_generation_history()
+            
+            result = prune_generation_history(chunk_size=2)
+        
+        self.assertEqual(result['deleted_count'], 5)
+        self.assertEqual(ImageGenerationHistory.objects.count(), 1)
+        self.assertEqual(self._rollups(start=self.day.isoformat())[0]['count'], 4)
+    
+    def test_range_is_validated(self):
+        response = self.client.get(reverse('images:history_rollups'), {
+            'granularity': 'hour', 'start': '2020-01-01T00:00:00Z', 'end': '2021-01-01T00:00:00Z'
+        })
+        self.assertEqual(response.status_code, 400)
+
+
+class TagUpsertTests(TestCase):
+    """
+    Tags are resolved and diffed in a constant number of queries
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='tagger', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        ImageTag.objects.create(name='existing')
+    
+    def _tags(self, image):
+        return sorted(image.tag_relations.values_list('tag__name', flat=True))
+    
+    @mock.patch('apps.images.views.generate_image_task.delay')
+    def test_generate_queries_do_not_grow_with_tags(self, delay):
+        for count in (1, 20):
+            tags = ['Existing'] + [f' New  Tag {count}-{i} ' for i in range(count - 1)]
+            with self.subTest(tags=count), self.assertNumQueries(10):
+                response = self.client.post(
+                    reverse('images:generate'), {'prompt': 'tagged', 'tags': tags}, format='json'
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.data['image']['tags']), count)
+        
+        image = GeneratedImage.objects.latest('id')
+        self.assertIn('existing', self._tags(image))
+        self.assertIn('new tag 20-0', self._tags(image))
+        self.assertEqual(ImageTag.objects.filter(name='existing').count(), 1)
+    
+    def test_update_writes_only_changed_relations(self):
+        image = GeneratedImage.objects.create(user=self.user, prompt='tagged', status='generated')
+        url = reverse('images:detail', args=[image.id])
+        self.client.patch(url, {'tags': ['keep', 'drop']}, format='json')
+        kept = image.tag_relations.get(tag__name='keep')
+        
+        for count in (2, 20):
+            tags = ['keep', 'KEEP'] + [f'added {count}-{i}' for i in range(count)]
+            with self.subTest(tags=count), self.assertNumQueries(13):
+                response = self.client.patch(url, {'tags': tags}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(self._tags(image)), count + 1)
+        
+        self.assertNotIn('drop', self._tags(image))
+        self.assertEqual(image.tag_relations.get(tag__name='keep').id, kept.id)
+        
+        with self.assertNumQueries(9):
+            self.client.patch(url, {'tags': ['keep']}, format='json')
+        self.assertEqual(self._tags(image), ['keep'])
+
+
+class TagUsageTests(TestCase):
+    """
+    Tag usage counters, top tags and prefix autocomplete
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='popular', password='secret')
+        self.other = User.objects.create_user(username='other', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def _image(self, user, tags):
+        image = GeneratedImage.objects.create(user=user, prompt='tagged', status='generated')
+        add_image_tags([(image, tags)])
+        return image
+    
+    def _usage(self):
+        return dict(ImageTag.objects.values_list('name', 'usage_count'))
+    
+    def _counted(self):
+        return {tag.name: tag.usage for tag in ImageTag.objects.annotate(usage=Count('image_relations'))}
+    
+    def test_counters_follow_tag_writes(self):
+        first = self._image(self.user, ['sea', 'sky'])
+        self._image(self.user, ['sea'])
+        self.client.post(reverse('images:generate_bulk'), {
+            'images': [{'prompt': 'bulk', 'tags': ['sea', 'sun']}, {'prompt': 'bulk', 'tags': ['sun']}]
+        }, format='json')
+        self.assertEqual(self._usage(), {'sea': 3, 'sky': 1, 'sun': 2})
+        
+        self.client.patch(reverse('images:detail', args=[first.id]), {'tags': ['sky', 'sun']}, format='json')
+        self.assertEqual(self._usage(), {'sea': 2, 'sky': 1, 'sun': 3})
+        
+        self.client.delete(reverse('images:detail', args=[first.id]))
+        GeneratedImage.objects.filter(prompt='bulk').delete()
+        self.assertEqual(self._usage(), {'sea': 1, 'sky': 0, 'sun': 0})
+        self.assertEqual(self._usage(), self._counted())
+    
+    def test_counted_fallback_and_rebuild(self):
+        self._image(self.user, ['sea'])
+        with override_settings(TAG_USAGE_COUNTS_ENABLED=False):
+            self._image(self.user, ['sea'])
+            response = self.client.get(reverse('images:tags'))
+            self.assertEqual(response.data['results'][0]['usage_count'], 2)
+        
+        self.assertEqual(self._usage(), {'sea': 1})
+        out = StringIO()
+        call_command('rebuild_tag_usage', stdout=out)
+        self.assertIn('1 had drifted', out.getvalue())
+        self.assertEqual(self._usage(), {'sea': 2})
+    
+    def test_top_tags_counts_only_the_user_images(self):
+        for tags in (['sea', 'sky'], ['sea'], ['sun']):
+            self._image(self.user, tags)
+        for _ in range(3):
+            self._image(self.other, ['sun'])
+        
+        response = self.client.get(reverse('images:tags_top'), {'limit': 2})
+        self.assertEqual(
+            [(tag['name'], tag['usage_count']) for tag in response.data['results']],
+            [('sea', 2), ('sky', 1)]
+        )
+        response = self.client.get(reverse('images:tags_top'), {'limit': 0})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_autocomplete_matches_prefix_by_popularity(self):
+        self._image(self.user, ['sea', 'seaside'])
+        self._image(self.other, ['seaside'])
+        self._image(self.user, ['sky', 'season'])
+        
+        response = self.client.get(reverse('images:tags_autocomplete'), {'q': ' SEA '})
+        self.assertEqual([tag['name'] for tag in response.data['results']], ['seaside', 'sea', 'season'])
+        response = self.client.get(reverse('images:tags_autocomplete'), {'q': 'seas', 'limit': 1})
+        self.assertEqual([tag['name'] for tag in response.data['results']], ['seaside'])
+        self.assertEqual(self.client.get(reverse('images:tags_autocomplete')).status_code, 400)
+    
+    def test_autocomplete_uses_name_index(self):
+        sql, params = ImageTag.objects.starting_with('sea').order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+        self.assertIn('USING INDEX', plan)
+        self.assertNotIn('SCAN', plan)
+
+
+@override_settings(USER_STATS_ENABLED=True)
+class ImageCleanupTests(TestCase):
+    """
+    Chunked purge of old rejected and failed images
+    """
+    
+    def setUp(self):
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.storage = FileSystemStorage(location=workdir.name)
+        store = MediaStore(storage=self.storage)
+        self.user = User.objects.create_user(username='cleaner', password='secret')
+        
+        self.shared = store.save(ContentFile(b'shared'), 'png')
+        store.acquire(self.shared)
+        self.unique = store.save(ContentFile(b'unique'), 'png')
+        self.legacy = self.storage.save('legacy/thumb.png', ContentFile(b'legacy'))
+        self.rendition = self.storage.save('renditions/web.jpg', ContentFile(b'web'))
+        
+        self.rejected = self._image('rejected', image_file=self.shared)
+        self.failed = self._image('failed', image_file=self.unique, thumbnail=self.legacy)
+        self.validated = self._image('validated', image_file=self.shared)
+        self.recent = self._image('rejected', old=False)
+        ImageRendition.objects.create(image=self.failed, name='web', file=self.rendition,
+                                      width=10, height=10, format='JPEG', file_size=3)
+        add_image_tags([(self.rejected, ['sea']), (self.failed, ['sea']), (self.validated, ['sea'])])
+        ImageGenerationHistory.objects.create(user=self.user, image=self.rejected, action='rejected')
+        UserStats.rebuild(self.user.id)
+    
+    def _image(self, status, old=True, **files):
+        image = GeneratedImage.objects.create(user=self.user, prompt=status, status=status, **files)
+        if old:
+            GeneratedImage.objects.filter(pk=image.pk).update(created_at=timezone.now() - timedelta(days=40))
+        return image
+    
+    def test_purge_deletes_rows_counters_and_files(self):
+        totals = ImageCleanup(chunk_size=1, pause=0, storage=self.storage).run()
+        
+        self.assertEqual((totals['chunks'], totals['images'], totals['files']), (2, 2, 3))
+        self.assertEqual(
+            set(GeneratedImage.objects.values_list('id', flat=True)), {self.validated.id, self.recent.id}
+        )
+        self.assertFalse(ImageGenerationHistory.objects.filter(image__isnull=False).exists())
+        self.assertFalse(ImageRendition.objects.exists())
+        self.assertEqual(ImageTag.objects.get(name='sea').usage_count, 1)
+        stats = model_to_dict(UserStats.objects.get(user=self.user))
+        self.assertEqual(stats, model_to_dict(UserStats.rebuild(self.user.id)))
+        
+        self.assertTrue(self.storage.exists(self.shared))
+        self.assertEqual(MediaBlob.objects.get(name=self.shared).ref_count, 1)
+        self.assertFalse(MediaBlob.objects.filter(name=self.unique).exists())
+        for name in (self.unique, self.legacy, self.rendition):
+            self.assertFalse(self.storage.exists(name), name)
+    
+    def test_plain_delete_skips_only_what_the_purge_does(self):
+        # _delete_rows handles each of these for the whole chunk before its raw DELETE
+        self.assertEqual(
+            {relation.related_model for relation in GeneratedImage._meta.related_objects},
+            {ImageRendition, ImageTagRelation, ImageGenerationHistory, ScheduledPost}
+        )
+        self.assertEqual(
+            [
+                receiver.__name__
+                for signal in (pre_delete, post_delete) for receiver in signal._live_receivers(GeneratedImage)
+            ],
+            ['_release_image_tags', '_record_deleted_instance']
+        )
+        
+        with self.settings(USER_STATS_ENABLED=True):
+            UserStats.rebuild(self.user.id)
+            post = ScheduledPost.objects.create(
+                user=self.user, image=self.failed, platform='instagram', caption='jamais',
+                scheduled_time=timezone.now()
+            )
+            ImageCleanup(pause=0, storage=self.storage).run()
+            
+            self.assertFalse(ScheduledPost.objects.filter(id=post.id).exists())
+            self.assertEqual(
+                model_to_dict(UserStats.objects.get(user=self.user)), model_to_dict(UserStats.rebuild(self.user.id))
+            )
+        self.assertEqual(ImageTag.objects.get(name='sea').usage_count, ImageTagRelation.objects.count())
+    
+    def test_chunk_queries_do_not_grow_with_chunk_size(self):
+        for i in range(10):
+            image = self._image('failed')
+            add_image_tags([(image, [f'tag{i}', 'sea'])])
+        cleanup = ImageCleanup(chunk_size=5, pause=0, storage=self.storage)
+        images = list(cleanup.candidates().order_by('id').only(
+            'id', 'user_id', 'image_file', 'thumbnail', *GeneratedImage.stats_fields
+        ))
+        # The first two are the setup images, with files
+        with CaptureQueriesContext(connection) as small:
+            cleanup._purge_chunk(images[2:4])
+        with CaptureQueriesContext(connection) as large:
+            cleanup._purge_chunk(images[4:])
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertEqual(cleanup.candidates().count(), 2)
+    
+    def test_dry_run_deletes_nothing(self):
+        out = StringIO()
+        call_command('cleanup_images', '--dry-run', '--chunk-size', '1', '--pause', '0', stdout=out)
+        
+        self.assertIn('2 images would be deleted, releasing 4 stored files', out.getvalue())
+        self.assertIn('chunk 2: 2 images', out.getvalue())
+        self.assertEqual(GeneratedImage.objects.count(), 4)
+        self.assertEqual(ImageTag.objects.get(name='sea').usage_count, 3)
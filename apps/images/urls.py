@@ -1,12 +1,17 @@
 from django.urls import path
 from .views import (
     GenerateImageView,
+    BulkGenerateImageView,
     ImageListView,
     ImageDetailView,
     ValidateImageView,
     ImageStatisticsView,
     ImageTagListView,
-    ImageHistoryView
+    TopTagsView,
+    TagAutocompleteView,
+    ImageHistoryView,
+    GenerationRollupView,
+    PipelineMetricsView
 )
 
 app_name = 'images'
@@ -14,6 +19,7 @@ app_name = 'images'
 urlpatterns = [
     # Image generation
     path('generate/', GenerateImageView.as_view(), name='generate'),
+    path('generate/bulk/', BulkGenerateImageView.as_view(), name='generate_bulk'),
     
     # Image management
     path('', ImageListView.as_view(), name='list'),
@@ -23,7 +29,11 @@ urlpatterns = [
     # Statistics and history
     path('statistics/', ImageStatisticsView.as_view(), name='statistics'),
     path('history/', ImageHistoryView.as_view(), name='history'),
+    path('history/rollups/', GenerationRollupView.as_view(), name='history_rollups'),
+    path('metrics/', PipelineMetricsView.as_view(), name='metrics'),
     
     # Tags
     path('tags/', ImageTagListView.as_view(), name='tags'),
+    path('tags/top/', TopTagsView.as_view(), name='tags_top'),
+    path('tags/autocomplete/', TagAutocompleteView.as_view(), name='tags_autocomplete'),
 ]
@@ -2,19 +2,35 @@ from rest_framework import status, generics, permissions, filters
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
+from django.forms.models import model_to_dict
 from django.utils import timezone
-from django.db.models import Avg, Sum, Count, Q
-from .models import GeneratedImage, ImageTag, ImageGenerationHistory
+from django.db import transaction
+from django.db.models import Count, Prefetch
+from .models import (
+    GeneratedImage, GenerationRollup, ImageTag, ImageTagRelation, ImageGenerationHistory, PROMPT_SEARCH_INDEX
+)
 from .serializers import (
     GeneratedImageSerializer,
+    GeneratedImageListSerializer,
     ImageGenerationRequestSerializer,
+    BulkImageGenerationRequestSerializer,
     ImageValidationSerializer,
     ImageUpdateSerializer,
     ImageTagSerializer,
+    TagQuerySerializer,
+    TagAutocompleteQuerySerializer,
     ImageGenerationHistorySerializer,
-    ImageStatisticsSerializer
+    ImageStatisticsSerializer,
+    GenerationRollupSerializer,
+    RollupQuerySerializer
 )
-from .tasks import generate_image_task
+from .services import add_image_tags
+from .tasks import generate_image_task, dispatch_bulk_generation
+from apps.authentication.models import UserStats
+from apps.core import metrics
+from apps.core.pagination import OptionalCursorPaginationMixin
+from apps.core.search import FullTextSearchFilter
 
 
 class ImagePagination(PageNumberPagination):
@@ -45,11 +61,8 @@ class GenerateImageView(APIView):
                 status='pending'
             )
             
-            # Add tags if provided
-            tags_data = serializer.validated_data.get('tags', [])
-            for tag_name in tags_data:
-                tag, _ = ImageTag.objects.get_or_create(name=tag_name.lower())
-                image.tag_relations.create(tag=tag)
+            # Add tags if provided, resolved in a constant number of queries
+            add_image_tags([(image, serializer.validated_data.get('tags', []))])
             
             # Trigger async image generation
             generate_image_task.delay(image.id)
@@ -70,15 +83,71 @@ class GenerateImageView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ImageListView(generics.ListAPIView):
+class BulkGenerateImageView(APIView):
+    """
+    API endpoint to generate several images in one request
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = BulkImageGenerationRequestSerializer(data=request.data)
+        
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        items = serializer.validated_data['images']
+        
+        with transaction.atomic():
+            # Create all image instances at once
+            images = GeneratedImage.objects.bulk_create([
+                GeneratedImage(
+                    user=request.user,
+                    prompt=item['prompt'],
+                    negative_prompt=item.get('negative_prompt', ''),
+                    style=item.get('style', 'realistic'),
+                    width=item.get('width', 1024),
+                    height=item.get('height', 1024),
+                    quality=item.get('quality', 'standard'),
+                    status='pending',
+                    priority='bulk'
+                )
+                for item in items
+            ])
+            UserStats.record_changes(images, created=True)
+            
+            # Add tags, resolved once for the whole batch
+            add_image_tags([(image, item.get('tags', [])) for image, item in zip(images, items)])
+            
+            # Log the requests
+            ImageGenerationHistory.objects.bulk_create([
+                ImageGenerationHistory(
+                    user=request.user,
+                    image=image,
+                    action='requested',
+                    details=item
+                )
+                for image, item in zip(images, items)
+            ])
+            
+            # The images join the fair-share bulk pool once the rows are committed
+            transaction.on_commit(dispatch_bulk_generation.delay)
+        
+        return Response({
+            'message': f'Génération de {len(images)} images lancée avec succès.',
+            'images': GeneratedImageSerializer(images, many=True, context={'request': request}).data
+        }, status=status.HTTP_201_CREATED)
+
+
+class ImageListView(OptionalCursorPaginationMixin, generics.ListAPIView):
     """
     API endpoint to list user's generated images
     """
     permission_classes = [permissions.IsAuthenticated]
-    serializer_class = GeneratedImageSerializer
+    serializer_class = GeneratedImageListSerializer
     pagination_class = ImagePagination
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [filters.OrderingFilter, FullTextSearchFilter]
     search_fields = ['prompt', 'validation_notes']
+    search_index = PROMPT_SEARCH_INDEX
     ordering_fields = ['created_at', 'updated_at', 'status']
     ordering = ['-created_at']
 
@@ -96,7 +165,10 @@ class ImageListView(generics.ListAPIView):
             tag_list = tags.split(',')
             queryset = queryset.filter(tag_relations__tag__name__in=tag_list).distinct()
         
-        return queryset.select_related('user').prefetch_related('tag_relations__tag')
+        return queryset.select_related('user').prefetch_related(
+            Prefetch('tag_relations', queryset=ImageTagRelation.objects.select_related('tag')),
+            'renditions'
+        )
 
 
 class ImageDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -116,10 +188,7 @@ class ImageDetailView(generics.RetrieveUpdateDestroyAPIView):
 
     def perform_destroy(self, instance):
         # Delete the actual files
-        if instance.image_file:
-            instance.image_file.delete(save=False)
-        if instance.thumbnail:
-            instance.thumbnail.delete(save=False)
+        instance.delete_files()
         
         # Log the deletion
         ImageGenerationHistory.objects.create(
@@ -161,15 +230,17 @@ class ValidateImageView(APIView):
                 message = 'Image rejetée.'
             
             image.validation_notes = validation_notes
-            image.save()
             
-            # Log the validation
-            ImageGenerationHistory.objects.create(
-                user=request.user,
-                image=image,
-                action=action,
-                details={'notes': validation_notes}
-            )
+            with transaction.atomic():
+                image.save()
+                
+                # Log the validation
+                ImageGenerationHistory.objects.create(
+                    user=request.user,
+                    image=image,
+                    action=action,
+                    details={'notes': validation_notes}
+                )
             
             return Response({
                 'message': message,
@@ -186,30 +257,23 @@ class ImageStatisticsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        user_images = GeneratedImage.objects.filter(user=request.user)
+        # One row with USER_STATS_ENABLED, one aggregate query otherwise
+        if settings.USER_STATS_ENABLED:
+            counters = model_to_dict(UserStats.for_user(request.user.id))
+        else:
+            counters = UserStats.count_images(request.user.id)
         
         stats = {
-            'total_images': user_images.count(),
-            'pending_images': user_images.filter(status='pending').count(),
-            'generated_images': user_images.filter(status='generated').count(),
-            'validated_images': user_images.filter(status='validated').count(),
-            'rejected_images': user_images.filter(status='rejected').count(),
-            'failed_images': user_images.filter(status='failed').count(),
+            field: counters[field]
+            for field in ('total_images', 'pending_images', 'generated_images',
+                          'validated_images', 'rejected_images', 'failed_images')
         }
         
-        # Calculate average generation time
-        avg_time = user_images.filter(
-            generation_time__isnull=False
-        ).aggregate(Avg('generation_time'))['generation_time__avg']
-        
-        stats['average_generation_time'] = round(avg_time, 2) if avg_time else 0
-        
-        # Calculate total generation time
-        total_time = user_images.filter(
-            generation_time__isnull=False
-        ).aggregate(Sum('generation_time'))['generation_time__sum']
-        
-        stats['total_generation_time'] = round(total_time, 2) if total_time else 0
+        # Average and total over the images that have a generation time
+        total_time = counters['total_generation_time'] or 0
+        timed_images = counters['timed_images']
+        stats['average_generation_time'] = round(total_time / timed_images, 2) if timed_images else 0
+        stats['total_generation_time'] = round(total_time, 2)
         
         serializer = ImageStatisticsSerializer(stats)
         return Response(serializer.data)
@@ -221,12 +285,56 @@ class ImageTagListView(generics.ListCreateAPIView):
     """
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = ImageTagSerializer
-    queryset = ImageTag.objects.all()
-    filter_backends = [filters.SearchFilter]
+    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description']
+    ordering_fields = ['name', 'usage', 'created_at']
+    ordering = ['name']
 
+    def get_queryset(self):
+        return ImageTag.objects.with_usage()
 
-class ImageHistoryView(generics.ListAPIView):
+
+class TopTagsView(APIView):
+    """
+    API endpoint listing the tags the user puts on the most images
+    
+    Counted from the user's images (user index) and their relations (the
+    image/tag unique index covers them), without reading the tag table
+    beyond the returned rows.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        query = TagQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        
+        tags = ImageTag.objects.filter(
+            image_relations__image__user=request.user
+        ).annotate(usage=Count('image_relations')).order_by('-usage', 'name')[:query.validated_data['limit']]
+        return Response({'results': ImageTagSerializer(tags, many=True).data})
+
+
+class TagAutocompleteView(APIView):
+    """
+    API endpoint completing a tag name prefix, most used tags first
+    
+    The prefix is matched with a range on the unique name index, so the
+    cost depends on the number of matching tags, not on the size of the table.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        query = TagAutocompleteQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        
+        tags = ImageTag.objects.starting_with(params['q']).with_usage().order_by(
+            '-usage', 'name'
+        )[:params['limit']]
+        return Response({'results': ImageTagSerializer(tags, many=True).data})
+
+
+class ImageHistoryView(OptionalCursorPaginationMixin, generics.ListAPIView):
     """
     API endpoint to view image generation history
     """
@@ -235,6 +343,49 @@ class ImageHistoryView(generics.ListAPIView):
     pagination_class = ImagePagination
 
     def get_queryset(self):
+        # Only the image ID is serialized, no need to join the images
         return ImageGenerationHistory.objects.filter(
             user=self.request.user
-        ).select_related('user', 'image').order_by('-created_at')
+        ).select_related('user').order_by('-created_at')
+
+
+class GenerationRollupView(APIView):
+    """
+    API endpoint serving the generation history as a time series
+    
+    Reads the hourly or daily rollups, never the raw history.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        query = RollupQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        
+        rollups = GenerationRollup.objects.filter(
+            user=request.user,
+            granularity=params['granularity'],
+            bucket__gte=params['start'],
+            bucket__lt=params['end']
+        ).order_by('bucket', 'action')
+        if request.query_params.get('action'):
+            rollups = rollups.filter(action=request.query_params['action'])
+        
+        return Response({
+            'granularity': params['granularity'],
+            'start': params['start'],
+            'end': params['end'],
+            'results': GenerationRollupSerializer(rollups, many=True).data
+        })
+
+
+class PipelineMetricsView(APIView):
+    """
+    API endpoint exposing Celery queue depths and per-stage latencies
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        data = metrics.snapshot()
+        data['queues'] = metrics.queue_depths()
+        return Response(data)
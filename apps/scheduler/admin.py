@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import ScheduledPost, PostingSchedule, PostAnalytics
+from django.db import transaction
+from .models import ScheduledPost, PostingSchedule, PostAnalytics, PostAnalyticsPayload
 
 
 @admin.register(ScheduledPost)
@@ -7,7 +8,7 @@ class ScheduledPostAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'platform', 'scheduled_time', 'status', 'created_at']
     list_filter = ['status', 'platform', 'scheduled_time', 'created_at']
     search_fields = ['user__username', 'caption', 'hashtags']
-    readonly_fields = ['created_at', 'updated_at', 'posted_at']
+    readonly_fields = ['created_at', 'updated_at', 'posted_at', 'claimed_at', 'claim_count', 'deferred_until']
     date_hierarchy = 'scheduled_time'
     
     fieldsets = (
@@ -21,7 +22,7 @@ class ScheduledPostAdmin(admin.ModelAdmin):
             'fields': ('caption', 'hashtags')
         }),
         ('Publishing Details', {
-            'fields': ('posted_at', 'platform_post_id', 'platform_post_url', 'error_message')
+            'fields': ('posted_at', 'platform_post_id', 'platform_post_url', 'error_message', 'claimed_at', 'claim_count', 'deferred_until')
         }),
         ('Metadata', {
             'fields': ('metadata',),
@@ -44,7 +45,13 @@ class ScheduledPostAdmin(admin.ModelAdmin):
     cancel_posts.short_description = 'Annuler les posts sélectionnés'
     
     def mark_as_failed(self, request, queryset):
-        count = queryset.update(status='failed')
+        # Saved one by one so the UserStats counters follow
+        count = 0
+        with transaction.atomic():
+            for post in queryset:
+                post.status = 'failed'
+                post.save(update_fields=['status', 'updated_at'])
+                count += 1
         self.message_user(request, f'{count} posts marqués comme échoués.')
     mark_as_failed.short_description = 'Marquer comme échoués'
 
@@ -73,8 +80,16 @@ class PostingScheduleAdmin(admin.ModelAdmin):
     )
 
 
+class PostAnalyticsPayloadInline(admin.StackedInline):
+    model = PostAnalyticsPayload
+    readonly_fields = ['data', 'updated_at']
+    can_delete = False
+    extra = 0
+
+
 @admin.register(PostAnalytics)
 class PostAnalyticsAdmin(admin.ModelAdmin):
+    inlines = [PostAnalyticsPayloadInline]
     list_display = ['scheduled_post', 'likes', 'comments', 'shares', 'engagement_rate', 'last_synced_at']
     list_filter = ['last_synced_at', 'created_at']
     search_fields = ['scheduled_post__caption']
@@ -90,10 +105,6 @@ class PostAnalyticsAdmin(admin.ModelAdmin):
         ('Reach Metrics', {
             'fields': ('reach', 'impressions', 'engagement_rate')
         }),
-        ('Raw Data', {
-            'fields': ('raw_data',),
-            'classes': ('collapse',)
-        }),
         ('Timestamps', {
             'fields': ('created_at', 'last_synced_at'),
             'classes': ('collapse',)
@@ -1,7 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class SchedulerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.scheduler'
     verbose_name = 'Scheduler'
+
+    def ready(self):
+        from .models import CAPTION_SEARCH_INDEX
+        # SQLite drops the full-text triggers when a migration rebuilds the table
+        post_migrate.connect(CAPTION_SEARCH_INDEX.on_post_migrate, sender=self)
@@ -0,0 +1,107 @@
+"""
+Benchmark of the analytics sync, one task per post against the batched syncer
+"""
+import time
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from apps.images.models import GeneratedImage
+from apps.scheduler.models import PostAnalytics, ScheduledPost
+from apps.scheduler.services import AnalyticsSyncer, PlatformPublisherFactory
+from apps.scheduler.services.platform_integrations import SocialMediaPublisher
+
+
+class StubPublisher(SocialMediaPublisher):
+    """
+    Publisher answering analytics after a fixed API latency per call
+    """
+    session_name = 'instagram'
+    
+    def __init__(self, latency, batch_size):
+        self.latency = latency
+        self.analytics_batch_size = batch_size
+        self.calls = 0
+    
+    def get_analytics(self, post_id):
+        return self.get_analytics_batch([post_id])[0]
+    
+    def get_analytics_batch(self, post_ids):
+        self.calls += 1
+        time.sleep(self.latency)
+        return [
+            {'success': True, 'likes': 10, 'comments': 2, 'shares': 1, 'views': 50, 'reach': 40, 'impressions': 100}
+            for _ in post_ids
+        ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Sync the analytics of --posts posts published over the last 30 days: every post "
+        "with its own get_or_create and two saves as sync_all_analytics did, then the posts "
+        "due in their age tier with batched API calls and one bulk_update per batch"
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--latency', type=float, default=0.005, help="Seconds per platform API call")
+        parser.add_argument('--api-batch', type=int, default=50, help="Posts per analytics API call")
+    
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='bench-analytics-sync')
+        image = GeneratedImage.objects.create(user=user, prompt='benchmark prompt', status='validated')
+        now = timezone.now()
+        posts = ScheduledPost.objects.bulk_create([
+            ScheduledPost(
+                user=user, image=image, platform='instagram', caption='benchmark', status='posted',
+                scheduled_time=now - timedelta(days=30) * i / options['posts'],
+                posted_at=now - timedelta(days=30) * i / options['posts'], platform_post_id=str(i)
+            )
+            for i in range(options['posts'])
+        ])
+        PostAnalytics.objects.bulk_create([PostAnalytics(scheduled_post=post) for post in posts])
+        # Last synced a day ago
+        PostAnalytics.objects.filter(scheduled_post__user=user).update(last_synced_at=now - timedelta(days=1))
+        
+        publisher = StubPublisher(options['latency'], options['api_batch'])
+        saved_publishers = dict(PlatformPublisherFactory._instances)
+        PlatformPublisherFactory._instances['instagram'] = publisher
+        try:
+            self.stdout.write(
+                f"{options['posts']} posts over 30 days, API latency {options['latency']}s, "
+                f"{options['api_batch']} posts per batched API call"
+            )
+            for label, sync in (('per post', self._sync_one_by_one), ('tiered', AnalyticsSyncer().run)):
+                publisher.calls = 0
+                queries = []
+                with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+                    start = time.perf_counter()
+                    result = sync()
+                    elapsed = time.perf_counter() - start
+                synced = result if isinstance(result, int) else sum(result[tier] for tier in ('hot', 'warm', 'cold'))
+                self.stdout.write(
+                    f"{label:>8}: {elapsed:6.2f}s, {publisher.calls:>5} API calls, "
+                    f"{len(queries):>5} queries, {synced} posts synced"
+                )
+                PostAnalytics.objects.filter(scheduled_post__user=user).update(last_synced_at=now - timedelta(days=1))
+        finally:
+            PlatformPublisherFactory._instances.clear()
+            PlatformPublisherFactory._instances.update(saved_publishers)
+            user.delete()
+    
+    def _sync_one_by_one(self):
+        # What one sync_post_analytics task per post did
+        posts = ScheduledPost.objects.filter(
+            status='posted', posted_at__gte=timezone.now() - timedelta(days=30), user__username='bench-analytics-sync'
+        )
+        count = 0
+        for post in posts:
+            result = PlatformPublisherFactory.get_publisher(post.platform).get_analytics(post.platform_post_id)
+            analytics, _ = PostAnalytics.objects.get_or_create(scheduled_post=post)
+            for field in ('likes', 'comments', 'shares', 'views', 'reach', 'impressions'):
+                setattr(analytics, field, result.get(field, 0))
+            analytics.save()
+            analytics.calculate_engagement_rate()
+            count += 1
+        return count
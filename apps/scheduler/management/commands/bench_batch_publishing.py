@@ -0,0 +1,110 @@
+"""
+Benchmark one-post-at-a-time publishing against the concurrent batch publisher
+"""
+import json
+import time
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.core.stub_server import StubHTTPServer
+from apps.images.models import GeneratedImage
+from apps.scheduler.models import ScheduledPost
+from apps.scheduler.services import BatchPublisher, PlatformPublisherFactory, PublishDispatcher
+from apps.scheduler.services.platform_integrations import SocialMediaPublisher
+from apps.scheduler.tasks import _publish_post
+
+PLATFORMS = ('instagram', 'facebook', 'twitter')
+
+
+class StubPublisher(SocialMediaPublisher):
+    """
+    Publisher posting to a local stub server instead of the platform API
+    """
+    
+    def __init__(self, platform, url, max_concurrency):
+        self.session_name = platform
+        self.url = url
+        self.max_concurrency = max_concurrency
+    
+    def publish(self, post):
+        # Same related objects as the real publishers
+        post.user.profile
+        response = self.session.post(f"{self.url}/publish", json={
+            'caption': post.caption,
+            'image_url': post.image.image_url,
+        }, timeout=30)
+        data = response.json()
+        return {'success': True, 'platform_post_id': data['id'], 'platform_post_url': data['url']}
+
+
+def publish_handler(method, path, body):
+    return 200, {'Content-Type': 'application/json'}, json.dumps({
+        'id': 'stub', 'url': 'https://example.com/p/stub'
+    }).encode()
+
+
+class Command(BaseCommand):
+    help = (
+        "Publish --posts claimed posts spread over Instagram, Facebook and Twitter stub "
+        "servers answering in --latency seconds, one post per task as before, then with "
+        "the concurrent batch publisher and its per-platform caps"
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=300)
+        parser.add_argument('--latency', type=float, default=0.1,
+                            help="Platform API latency per post in seconds")
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help="Posts published at the same time per platform")
+    
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='bench-batch-publishing')
+        image = GeneratedImage.objects.create(
+            user=user, prompt='benchmark prompt', status='validated', image_url='https://example.com/image.png'
+        )
+        servers = [StubHTTPServer(publish_handler, latency=options['latency']).start() for _ in PLATFORMS]
+        saved_publishers = dict(PlatformPublisherFactory._instances)
+        PlatformPublisherFactory._instances.update({
+            platform: StubPublisher(platform, server.url, options['concurrency'])
+            for platform, server in zip(PLATFORMS, servers)
+        })
+        
+        try:
+            self.stdout.write(
+                f"{options['posts']} posts on {len(PLATFORMS)} platforms, API latency {options['latency']}s, "
+                f"{options['concurrency']} posts at a time per platform in batches"
+            )
+            for label, publish in (('per post', self._publish_one_by_one), ('batch', BatchPublisher().publish)):
+                claim_token, post_ids = self._claim(user, image, options['posts'])
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    publish(post_ids, claim_token)
+                    elapsed = time.perf_counter() - start
+                published = ScheduledPost.objects.filter(id__in=post_ids, status='posted').count()
+                self.stdout.write(
+                    f"{label:>9}: {elapsed:6.2f}s ({published / elapsed:7.1f} posts/s), "
+                    f"{len(queries):>5} queries, {published} published"
+                )
+        finally:
+            PlatformPublisherFactory._instances.clear()
+            PlatformPublisherFactory._instances.update(saved_publishers)
+            for server in servers:
+                server.stop()
+            user.delete()
+    
+    def _claim(self, user, image, count):
+        scheduled_time = timezone.now() - timedelta(minutes=1)
+        for i in range(count):
+            ScheduledPost.objects.create(
+                user=user, image=image, platform=PLATFORMS[i % len(PLATFORMS)],
+                caption=f'benchmark post {i}', scheduled_time=scheduled_time
+            )
+        return PublishDispatcher(batch_size=count).claim(ScheduledPost.objects.filter(user=user))
+    
+    def _publish_one_by_one(self, post_ids, claim_token):
+        # What thousands of publish_scheduled_post tasks did, one post each
+        for post_id in post_ids:
+            _publish_post(ScheduledPost.objects.get(id=post_id))
@@ -0,0 +1,115 @@
+"""
+Benchmark of the publish time with the media containers created inline or staged ahead
+"""
+import json
+import time
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from apps.core.stub_server import StubHTTPServer
+from apps.images.models import GeneratedImage
+from apps.scheduler.models import ScheduledPost
+from apps.scheduler.services import BatchPublisher, MediaStager, PlatformPublisherFactory, PublishDispatcher
+from apps.scheduler.services.platform_integrations import SocialMediaPublisher
+
+
+class StubPublisher(SocialMediaPublisher):
+    """
+    Container-based publisher talking to a local stub server
+    """
+    session_name = 'instagram'
+    staging_ttl = 86400
+    
+    def __init__(self, url, media, max_concurrency):
+        self.url = url
+        self.media = media
+        self.max_concurrency = max_concurrency
+    
+    def create_container(self, post):
+        response = self.session.post(f"{self.url}/media", data=self.media, timeout=60)
+        return response.json()['id']
+    
+    def publish(self, post):
+        container_id = self.staged_container(post) or self.create_container(post)
+        response = self.session.post(f"{self.url}/media_publish", json={'creation_id': container_id}, timeout=30)
+        return {'success': True, 'platform_post_id': response.json()['id']}
+
+
+def platform_handler(upload_latency, publish_latency):
+    def handler(method, path, body):
+        # Transfer and processing of the media dominate the container creation
+        time.sleep(upload_latency if path == '/media' else publish_latency)
+        return 200, {'Content-Type': 'application/json'}, json.dumps({'id': 'stub'}).encode()
+    
+    return handler
+
+
+class Command(BaseCommand):
+    help = (
+        "Publish a burst of --posts posts due at the same time, with the media uploaded "
+        "and the containers created at publish time as before, then staged beforehand by "
+        "stage_upcoming_posts; reports the publish time of the burst"
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100)
+        parser.add_argument('--media-size', type=int, default=2 * 1024 * 1024, help="Bytes uploaded per post")
+        parser.add_argument('--upload-latency', type=float, default=0.5,
+                            help="Seconds the platform takes to process an uploaded media")
+        parser.add_argument('--publish-latency', type=float, default=0.05,
+                            help="Seconds of the publish container call")
+        parser.add_argument('--concurrency', type=int, default=8)
+    
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='bench-publish-staging')
+        image = GeneratedImage.objects.create(
+            user=user, prompt='benchmark prompt', status='validated', image_url='https://example.com/image.png'
+        )
+        server = StubHTTPServer(platform_handler(options['upload_latency'], options['publish_latency'])).start()
+        saved_publishers = dict(PlatformPublisherFactory._instances)
+        PlatformPublisherFactory._instances['instagram'] = StubPublisher(
+            server.url, b'\0' * options['media_size'], options['concurrency']
+        )
+        
+        try:
+            self.stdout.write(
+                f"{options['posts']} posts, {options['media_size'] / 1024 / 1024:.1f} MB media processed in "
+                f"{options['upload_latency']}s, publish call {options['publish_latency']}s, "
+                f"{options['concurrency']} posts at a time"
+            )
+            for label, staged in (('inline', False), ('staged', True)):
+                posts = self._schedule(user, image, options['posts'])
+                staging_time = 0.0
+                if staged:
+                    start = time.perf_counter()
+                    MediaStager(batch_size=options['posts']).stage()
+                    staging_time = time.perf_counter() - start
+                
+                # The burst falls due
+                ScheduledPost.objects.filter(id__in=posts).update(scheduled_time=timezone.now())
+                claim_token, post_ids = PublishDispatcher(batch_size=options['posts']).claim(
+                    ScheduledPost.objects.filter(id__in=posts)
+                )
+                start = time.perf_counter()
+                result = BatchPublisher().publish(post_ids, claim_token)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"{label:>7}: burst published in {elapsed:6.2f}s ({result['published']} posts)"
+                    + (f", staged beforehand in {staging_time:.2f}s" if staged else "")
+                )
+        finally:
+            PlatformPublisherFactory._instances.clear()
+            PlatformPublisherFactory._instances.update(saved_publishers)
+            server.stop()
+            user.delete()
+    
+    def _schedule(self, user, image, count):
+        scheduled_time = timezone.now() + timedelta(minutes=5)
+        return [
+            ScheduledPost.objects.create(
+                user=user, image=image, platform='instagram',
+                caption=f'benchmark post {i}', scheduled_time=scheduled_time
+            ).id
+            for i in range(count)
+        ]
@@ -0,0 +1,121 @@
+"""
+Benchmark of the publish lateness, beat polling against the publish scheduler
+"""
+import math
+import random
+import threading
+import time
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from apps.authentication.models import UserStats
+from apps.images.models import GeneratedImage
+from apps.scheduler.models import ScheduledPost
+from apps.scheduler.services import PublishScheduler, notify_schedule_change
+from apps.scheduler.services.timer import LocalScheduleChanges
+
+
+class Command(BaseCommand):
+    help = (
+        "Schedule --posts posts over the next --window seconds, reschedule and add some "
+        "while the publish scheduler runs, and report how late each post is enqueued. "
+        "The beat polling (every --beat-interval seconds) is simulated for as many posts "
+        "scheduled at random times of the day."
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=500)
+        parser.add_argument('--window', type=float, default=30,
+                            help="Seconds over which the posts are spread")
+        parser.add_argument('--changes', type=float, default=0.2,
+                            help="Fraction of the posts rescheduled, and of posts added, while the scheduler runs")
+        parser.add_argument('--beat-interval', type=int, default=300,
+                            help="Seconds between two process_scheduled_posts runs (crontab */5)")
+        parser.add_argument('--seed', type=int, default=42)
+    
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        user, _ = User.objects.get_or_create(username='bench-publish-timing')
+        image = GeneratedImage.objects.create(user=user, prompt='benchmark prompt', status='validated')
+        start = timezone.now() + timedelta(seconds=2)
+        
+        def random_time():
+            return start + timedelta(seconds=rng.uniform(0, options['window']))
+        
+        posts = self._create(user, image, [random_time() for _ in range(options['posts'])])
+        
+        fired = {}
+        
+        def enqueue(post_ids, claim_token):
+            enqueued_at = timezone.now()
+            fired.update((post_id, enqueued_at) for post_id in post_ids)
+        
+        scheduler = PublishScheduler(changes=LocalScheduleChanges(), enqueue=enqueue)
+        stop = threading.Event()
+        
+        def run():
+            try:
+                scheduler.run(stop)
+            finally:
+                connection.close()
+        
+        thread = threading.Thread(target=run)
+        thread.start()
+        try:
+            # Edits and new posts coming from the API once the timer is loaded
+            time.sleep(1)
+            moved = rng.sample(posts, int(len(posts) * options['changes']))
+            for post in moved:
+                post.scheduled_time = random_time()
+            ScheduledPost.objects.bulk_update(moved, ['scheduled_time'])
+            added = self._create(user, image, [random_time() for _ in range(int(len(posts) * options['changes']))])
+            notify_schedule_change([post.id for post in moved + added], backend='local')
+            
+            expected = {post.id: post.scheduled_time for post in posts + added}
+            give_up = start + timedelta(seconds=options['window'] + 10)
+            while len(fired) < len(expected) and timezone.now() < give_up:
+                time.sleep(0.1)
+        finally:
+            stop.set()
+            thread.join()
+            user.delete()
+        
+        scheduler_lateness = [(fired[post_id] - when).total_seconds() for post_id, when in expected.items()
+                              if post_id in fired]
+        beat_lateness = [
+            self._beat_lateness(rng.uniform(0, 86400), options['beat_interval']) for _ in expected
+        ]
+        
+        self.stdout.write(
+            f"{len(expected)} posts over {options['window']:.0f}s, {len(moved)} rescheduled and "
+            f"{len(added)} added while running; lateness in seconds"
+        )
+        for label, lateness in (('beat', beat_lateness), ('scheduler', scheduler_lateness)):
+            self.stdout.write(
+                f"{label:>9}: p50 {self._percentile(lateness, 0.5):7.3f} | "
+                f"p99 {self._percentile(lateness, 0.99):7.3f} | max {max(lateness, default=0):7.3f}"
+            )
+        missed = len(expected) - len(scheduler_lateness)
+        if missed:
+            self.stdout.write(self.style.WARNING(f"{missed} posts were not enqueued by the scheduler"))
+    
+    def _create(self, user, image, times):
+        with transaction.atomic():
+            posts = ScheduledPost.objects.bulk_create([
+                ScheduledPost(user=user, image=image, platform='instagram', caption='benchmark', scheduled_time=when)
+                for when in times
+            ])
+            UserStats.record_changes(posts, created=True)
+        return posts
+    
+    def _beat_lateness(self, seconds, interval):
+        # Crontab runs fall on multiples of the interval
+        return math.ceil(seconds / interval) * interval - seconds
+    
+    def _percentile(self, values, fraction):
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
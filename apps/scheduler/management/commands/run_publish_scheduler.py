@@ -0,0 +1,33 @@
+"""
+Run the publish scheduler, firing each post at its scheduled time
+"""
+import signal
+import threading
+from django.core.management.base import BaseCommand
+from apps.scheduler.services import PublishScheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Keep the posts due within PUBLISH_TIMER_LOOKAHEAD seconds in memory and enqueue "
+        "each one at its scheduled time; stop with Ctrl+C or SIGTERM"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lookahead', type=int, help="Seconds of upcoming posts kept (PUBLISH_TIMER_LOOKAHEAD)")
+        parser.add_argument('--refresh', type=int, help="Seconds between two reloads (PUBLISH_TIMER_REFRESH)")
+
+    def handle(self, *args, **options):
+        scheduler = PublishScheduler(lookahead=options['lookahead'], refresh=options['refresh'])
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+
+        self.stdout.write(
+            f"Publish scheduler started (lookahead {scheduler.lookahead.total_seconds():.0f}s, "
+            f"refresh {scheduler.refresh_interval.total_seconds():.0f}s)"
+        )
+        try:
+            scheduler.run(stop)
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS("Publish scheduler stopped"))
@@ -0,0 +1,16 @@
+from django.db import migrations
+from apps.core.search import FullTextIndex
+
+
+index = FullTextIndex('scheduled_posts', [('caption', 'A'), ('hashtags', 'B')])
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('scheduler', '0001_initial'),
+    ]
+    
+    operations = [
+        migrations.RunPython(index.create, index.drop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.8 on 2026-10-17 05:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('scheduler', '0002_caption_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EngagementRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(help_text='Début du jour de publication')),
+                ('platform', models.CharField(choices=[('instagram', 'Instagram'), ('facebook', 'Facebook'), ('twitter', 'Twitter'), ('linkedin', 'LinkedIn')], max_length=20)),
+                ('posts', models.IntegerField(default=0)),
+                ('likes', models.IntegerField(default=0)),
+                ('comments', models.IntegerField(default=0)),
+                ('shares', models.IntegerField(default=0)),
+                ('views', models.IntegerField(default=0)),
+                ('reach', models.IntegerField(default=0)),
+                ('impressions', models.IntegerField(default=0)),
+                ('engagement_rate_sum', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Engagement Rollup',
+                'verbose_name_plural': 'Engagement Rollups',
+                'db_table': 'engagement_rollups',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='postanalytics',
+            index=models.Index(fields=['last_synced_at'], name='post_analyt_last_sy_b11f53_idx'),
+        ),
+        migrations.AddField(
+            model_name='engagementrollup',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='engagement_rollups', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='engagementrollup',
+            index=models.Index(fields=['updated_at'], name='engagement__updated_339676_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='engagementrollup',
+            unique_together={('user', 'bucket', 'platform')},
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.8 on 2026-10-17 05:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('scheduler', '0003_engagement_rollups'),
+    ]
+    
+    operations = [
+        migrations.AddField(
+            model_name='scheduledpost',
+            name='claim_count',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Nombre de prises en charge pour publication'),
+        ),
+        migrations.AddField(
+            model_name='scheduledpost',
+            name='claim_token',
+            field=models.UUIDField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='scheduledpost',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='scheduledpost',
+            index=models.Index(fields=['status', 'claimed_at'], name='scheduled_p_status_ae7a92_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-17 05:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('scheduler', '0004_publish_claims'),
+    ]
+    
+    operations = [
+        migrations.AddField(
+            model_name='scheduledpost',
+            name='deferred_until',
+            field=models.DateTimeField(blank=True, help_text="Publication reportée jusqu'à cette date (quota de la plateforme)", null=True),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.8 on 2026-10-17 05:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_raw_data(apps, schema_editor):
+    PostAnalytics = apps.get_model('scheduler', 'PostAnalytics')
+    PostAnalyticsPayload = apps.get_model('scheduler', 'PostAnalyticsPayload')
+    rows = PostAnalytics.objects.exclude(raw_data={}).values_list('id', 'raw_data')
+    batch = []
+    for analytics_id, data in rows.iterator(chunk_size=2000):
+        batch.append(PostAnalyticsPayload(analytics_id=analytics_id, data=data))
+        if len(batch) == 2000:
+            PostAnalyticsPayload.objects.bulk_create(batch)
+            batch = []
+    PostAnalyticsPayload.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+    
+    dependencies = [
+        ('scheduler', '0005_publish_deferral'),
+    ]
+    
+    operations = [
+        migrations.CreateModel(
+            name='PostAnalyticsPayload',
+            fields=[
+                ('analytics', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='payload', serialize=False, to='scheduler.postanalytics')),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Post Analytics Payload',
+                'verbose_name_plural': 'Post Analytics Payloads',
+                'db_table': 'post_analytics_payloads',
+            },
+        ),
+        migrations.RunPython(move_raw_data, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='postanalytics',
+            name='raw_data',
+        ),
+        migrations.CreateModel(
+            name='AnalyticsSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('taken_at', models.DateTimeField()),
+                ('likes', models.IntegerField(default=0)),
+                ('comments', models.IntegerField(default=0)),
+                ('shares', models.IntegerField(default=0)),
+                ('views', models.IntegerField(default=0)),
+                ('reach', models.IntegerField(default=0)),
+                ('impressions', models.IntegerField(default=0)),
+                ('scheduled_post', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='analytics_snapshots', to='scheduler.scheduledpost')),
+            ],
+            options={
+                'verbose_name': 'Analytics Snapshot',
+                'verbose_name_plural': 'Analytics Snapshots',
+                'db_table': 'analytics_snapshots',
+                'indexes': [models.Index(fields=['scheduled_post', 'taken_at'], name='analytics_s_schedul_a055b5_idx'), models.Index(fields=['day'], name='analytics_s_day_ab254f_idx')],
+            },
+        ),
+    ]
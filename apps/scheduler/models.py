@@ -1,10 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
+from apps.authentication.models import UserStats, UserStatsMixin
+from apps.core.search import FullTextIndex
 from apps.images.models import GeneratedImage
 
 
-class ScheduledPost(models.Model):
+class ScheduledPost(UserStatsMixin, models.Model):
     """
     Model for scheduled social media posts
     """
@@ -46,6 +48,14 @@ class ScheduledPost(models.Model):
     # Metadata
     metadata = models.JSONField(default=dict, blank=True)
     
+    # Dispatch lease, taken when a dispatcher moves the post to processing
+    claim_token = models.UUIDField(null=True, blank=True, editable=False, db_index=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    claim_count = models.PositiveSmallIntegerField(default=0, help_text="Nombre de prises en charge pour publication")
+    deferred_until = models.DateTimeField(
+        null=True, blank=True, help_text="Publication reportée jusqu'à cette date (quota de la plateforme)"
+    )
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -59,11 +69,17 @@ class ScheduledPost(models.Model):
             models.Index(fields=['user', 'scheduled_time']),
             models.Index(fields=['status', 'scheduled_time']),
             models.Index(fields=['platform']),
+            models.Index(fields=['status', 'claimed_at']),
         ]
 
+    stats_fields = ('status', 'platform')
+
     def __str__(self):
         return f"{self.user.username} - {self.platform} - {self.scheduled_time}"
 
+    def stats_counters(self):
+        return {f'{self.status}_posts': 1, f'{self.platform}_posts': 1}
+
     @property
     def is_due(self):
         """Check if the post is due for publishing"""
@@ -88,6 +104,14 @@ class ScheduledPost(models.Model):
         return False
 
 
+UserStats.track(ScheduledPost)
+
+# Full-text search on the captions (search_mode=fulltext)
+CAPTION_SEARCH_INDEX = FullTextIndex(
+    ScheduledPost._meta.db_table, [('caption', 'A'), ('hashtags', 'B')]
+)
+
+
 class PostingSchedule(models.Model):
     """
     Model for recurring posting schedules
@@ -149,7 +173,7 @@ class PostingSchedule(models.Model):
         return f"{self.user.username} - {self.name}"
 
 
-class PostAnalytics(models.Model):
+class PostAnalytics(UserStatsMixin, models.Model):
     """
     Model for tracking post analytics and performance
     """
@@ -175,23 +199,169 @@ class PostAnalytics(models.Model):
     # Last updated
     last_synced_at = models.DateTimeField(auto_now=True)
     
-    # Raw data from platform
-    raw_data = models.JSONField(default=dict, blank=True)
-    
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         db_table = 'post_analytics'
         verbose_name = 'Post Analytics'
         verbose_name_plural = 'Post Analytics'
+        indexes = [
+            models.Index(fields=['last_synced_at']),
+        ]
+
+    stats_fields = ('engagement_rate',)
 
     def __str__(self):
         return f"Analytics for {self.scheduled_post}"
 
+    def stats_counters(self):
+        return {'analytics_count': 1, 'engagement_rate_sum': self.engagement_rate}
+
+    @property
+    def stats_user_id(self):
+        return self.scheduled_post.user_id
+
     def calculate_engagement_rate(self):
         """Calculate engagement rate"""
         if self.impressions > 0:
-            total_engagement = self.likes + self.comments + self.shares
-            self.engagement_rate = (total_engagement / self.impressions) * 100
+            self.engagement_rate = self._engagement_rate()
             self.save()
         return self.engagement_rate
+
+    def apply_metrics(self, result, synced_at=None):
+        """
+        Copy the metrics of a platform analytics result, without saving
+
+        The engagement rate is computed in the same pass, so a sync writes
+        the row once (or once per batch with bulk_update). The raw result
+        is not kept on the row (see PostAnalyticsPayload).
+        """
+        self.likes = result.get('likes', 0)
+        self.comments = result.get('comments', 0)
+        self.shares = result.get('shares', 0)
+        self.views = result.get('views', 0)
+        self.reach = result.get('reach', 0)
+        self.impressions = result.get('impressions', 0)
+        if self.impressions > 0:
+            self.engagement_rate = self._engagement_rate()
+        self.last_synced_at = synced_at or timezone.now()
+
+    def _engagement_rate(self):
+        total_engagement = self.likes + self.comments + self.shares
+        return (total_engagement / self.impressions) * 100
+
+
+UserStats.track(PostAnalytics)
+
+
+class PostAnalyticsPayload(models.Model):
+    """
+    Raw platform result of the last analytics sync of a post
+
+    Kept apart from PostAnalytics so syncs and reads of the counters never
+    carry the JSON, and only written with ANALYTICS_KEEP_RAW_DATA.
+    """
+    analytics = models.OneToOneField(
+        PostAnalytics,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='payload'
+    )
+    data = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'post_analytics_payloads'
+        verbose_name = 'Post Analytics Payload'
+        verbose_name_plural = 'Post Analytics Payloads'
+
+    def __str__(self):
+        return f"Payload of {self.analytics_id}"
+
+
+class AnalyticsSnapshot(models.Model):
+    """
+    Counters of a published post at one analytics sync, append-only
+
+    One row of integers per sync, bucketed by the local ``day`` of the
+    sync. Recent days keep every sync; the compaction downsamples older
+    days to the last snapshot of each hour, then of each day, so a curve
+    keeps its shape at a fraction of the rows.
+    """
+    scheduled_post = models.ForeignKey(
+        ScheduledPost,
+        on_delete=models.CASCADE,
+        related_name='analytics_snapshots',
+        db_index=False
+    )
+    day = models.DateField()
+    taken_at = models.DateTimeField()
+    
+    likes = models.IntegerField(default=0)
+    comments = models.IntegerField(default=0)
+    shares = models.IntegerField(default=0)
+    views = models.IntegerField(default=0)
+    reach = models.IntegerField(default=0)
+    impressions = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'analytics_snapshots'
+        verbose_name = 'Analytics Snapshot'
+        verbose_name_plural = 'Analytics Snapshots'
+        indexes = [
+            models.Index(fields=['scheduled_post', 'taken_at']),
+            models.Index(fields=['day']),
+        ]
+
+    counters = ('likes', 'comments', 'shares', 'views', 'reach', 'impressions')
+
+    def __str__(self):
+        return f"{self.scheduled_post_id} at {self.taken_at}"
+
+    @classmethod
+    def of(cls, analytics):
+        """
+        Snapshot of PostAnalytics as last synced
+        """
+        return cls(
+            scheduled_post_id=analytics.scheduled_post_id,
+            day=timezone.localtime(analytics.last_synced_at).date(),
+            taken_at=analytics.last_synced_at,
+            **{field: getattr(analytics, field) for field in cls.counters}
+        )
+
+
+class EngagementRollup(models.Model):
+    """
+    Daily engagement of a user's published posts, per platform
+    
+    Posts count in the day they were published. Filled by the
+    rollup_post_analytics task, which recomputes the days whose analytics
+    were synced since its last run.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='engagement_rollups')
+    bucket = models.DateTimeField(help_text="Début du jour de publication")
+    platform = models.CharField(max_length=20, choices=ScheduledPost.PLATFORM_CHOICES)
+    
+    posts = models.IntegerField(default=0)
+    likes = models.IntegerField(default=0)
+    comments = models.IntegerField(default=0)
+    shares = models.IntegerField(default=0)
+    views = models.IntegerField(default=0)
+    reach = models.IntegerField(default=0)
+    impressions = models.IntegerField(default=0)
+    engagement_rate_sum = models.FloatField(default=0)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'engagement_rollups'
+        verbose_name = 'Engagement Rollup'
+        verbose_name_plural = 'Engagement Rollups'
+        unique_together = ['user', 'bucket', 'platform']
+        indexes = [
+            models.Index(fields=['updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.bucket} - {self.platform}: {self.posts} posts"
@@ -1,7 +1,8 @@
 from rest_framework import serializers
 from django.utils import timezone
-from .models import ScheduledPost, PostingSchedule, PostAnalytics
-from apps.images.serializers import GeneratedImageSerializer
+from .models import EngagementRollup, ScheduledPost, PostingSchedule, PostAnalytics
+from .services import notify_schedule_change
+from apps.images.serializers import GeneratedImageSerializer, GeneratedImageListSerializer, RollupQuerySerializer
 
 
 class ScheduledPostSerializer(serializers.ModelSerializer):
@@ -19,13 +20,13 @@ class ScheduledPostSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'user', 'image', 'image_details',
             'scheduled_time', 'platform', 'caption', 'hashtags',
-            'status', 'posted_at', 'error_message',
+            'status', 'posted_at', 'error_message', 'deferred_until',
             'platform_post_id', 'platform_post_url',
             'metadata', 'is_due', 'can_be_cancelled', 'is_published',
             'created_at', 'updated_at'
         ]
         read_only_fields = [
-            'id', 'user', 'status', 'posted_at', 'error_message',
+            'id', 'user', 'status', 'posted_at', 'error_message', 'deferred_until',
             'platform_post_id', 'platform_post_url',
             'created_at', 'updated_at'
         ]
@@ -47,6 +48,19 @@ class ScheduledPostSerializer(serializers.ModelSerializer):
         return value
 
 
+class ScheduledPostListSerializer(ScheduledPostSerializer):
+    """
+    Serializer for scheduled post lists, without the metadata blobs
+    
+    Querysets must select ``user``, ``image`` and ``image__user`` and
+    prefetch the image tags and renditions.
+    """
+    image_details = GeneratedImageListSerializer(source='image', read_only=True)
+    
+    class Meta(ScheduledPostSerializer.Meta):
+        fields = [field for field in ScheduledPostSerializer.Meta.fields if field != 'metadata']
+
+
 class CreateScheduledPostSerializer(serializers.ModelSerializer):
     """
     Serializer for creating scheduled posts
@@ -103,6 +117,12 @@ class UpdateScheduledPostSerializer(serializers.ModelSerializer):
             )
         return attrs
 
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        if 'scheduled_time' in validated_data:
+            notify_schedule_change([instance.id])
+        return instance
+
 
 class PostingScheduleSerializer(serializers.ModelSerializer):
     """
@@ -186,3 +206,45 @@ class SchedulerStatisticsSerializer(serializers.Serializer):
     upcoming_posts = serializers.IntegerField()
     posts_by_platform = serializers.DictField()
     average_engagement_rate = serializers.FloatField()
+
+
+class EngagementRollupQuerySerializer(RollupQuerySerializer):
+    """
+    Query parameters of the engagement rollups, kept per day only
+    """
+    granularity = serializers.ChoiceField(choices=['day'], default='day')
+    platform = serializers.ChoiceField(choices=ScheduledPost.PLATFORM_CHOICES, required=False)
+
+
+class AnalyticsCurveQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of the engagement curve of a post
+    
+    ``sync`` returns every stored snapshot, ``hour`` and ``day`` the last
+    snapshot of each bucket.
+    """
+    granularity = serializers.ChoiceField(choices=['sync', 'hour', 'day'], default='sync')
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        if attrs.get('start') and attrs.get('end') and attrs['start'] >= attrs['end']:
+            raise serializers.ValidationError("La date de début doit précéder la date de fin.")
+        return attrs
+
+
+class EngagementRollupSerializer(serializers.ModelSerializer):
+    """
+    Serializer for a daily engagement rollup
+    """
+    average_engagement_rate = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = EngagementRollup
+        fields = [
+            'bucket', 'platform', 'posts', 'likes', 'comments', 'shares',
+            'views', 'reach', 'impressions', 'average_engagement_rate'
+        ]
+    
+    def get_average_engagement_rate(self, obj):
+        return round(obj.engagement_rate_sum / obj.posts, 2) if obj.posts else 0
@@ -4,10 +4,25 @@ from .platform_integrations import (
     FacebookPublisher,
     TwitterPublisher
 )
+from .analytics import AnalyticsSyncer, SnapshotCompactor
+from .dispatch import PublishDispatcher
+from .publishing import BatchPublisher
+from .rollups import EngagementRollupBuilder
+from .staging import MediaStager
+from .timer import PublishScheduler, PublishTimer, notify_schedule_change
 
 __all__ = [
     'PlatformPublisherFactory',
     'InstagramPublisher',
     'FacebookPublisher',
-    'TwitterPublisher'
+    'TwitterPublisher',
+    'AnalyticsSyncer',
+    'BatchPublisher',
+    'EngagementRollupBuilder',
+    'MediaStager',
+    'PublishDispatcher',
+    'PublishScheduler',
+    'PublishTimer',
+    'SnapshotCompactor',
+    'notify_schedule_change'
 ]
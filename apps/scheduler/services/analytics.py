@@ -0,0 +1,228 @@
+"""
+Tiered, batched sync of the analytics of the published posts
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Q
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+from apps.authentication.models import UserStats
+from apps.core import metrics
+from ..models import AnalyticsSnapshot, PostAnalytics, PostAnalyticsPayload, ScheduledPost
+from .platform_integrations import PlatformPublisherFactory
+
+logger = logging.getLogger(__name__)
+
+
+class AnalyticsSyncer:
+    """
+    Refresh the analytics of the published posts, the most recent most often
+    
+    Posts are split in tiers by age: 'hot' posts (published within a day)
+    are synced every ANALYTICS_SYNC_HOT_INTERVAL seconds, 'warm' ones
+    (within a week) every ANALYTICS_SYNC_WARM_INTERVAL and 'cold' ones
+    (within 30 days) every ANALYTICS_SYNC_COLD_INTERVAL; older posts are
+    not synced any more. Each run takes the analytics due in each tier,
+    stalest first, fetches them ``analytics_batch_size`` posts per platform
+    API call and writes every batch with one bulk_update, plus one
+    bulk_create appending an AnalyticsSnapshot per synced post. The delay
+    past the interval of the tier is recorded as the
+    'analytics_sync.lag.<tier>' metric.
+    """
+    max_age = timedelta(days=30)
+    update_fields = (
+        'likes', 'comments', 'shares', 'views', 'reach', 'impressions',
+        'engagement_rate', 'last_synced_at'
+    )
+    
+    def __init__(self, batch_size=None, max_posts=None):
+        self.batch_size = batch_size or settings.ANALYTICS_SYNC_BATCH_SIZE
+        self.max_posts = max_posts or settings.ANALYTICS_SYNC_MAX_PER_RUN
+        self.tiers = [
+            ('hot', timedelta(days=1), timedelta(seconds=settings.ANALYTICS_SYNC_HOT_INTERVAL)),
+            ('warm', timedelta(days=7), timedelta(seconds=settings.ANALYTICS_SYNC_WARM_INTERVAL)),
+            ('cold', self.max_age, timedelta(seconds=settings.ANALYTICS_SYNC_COLD_INTERVAL)),
+        ]
+    
+    def due(self, now=None, full=False):
+        """
+        Analytics to sync in each tier
+        
+        Args:
+            now (datetime): Time of the run, now by default
+            full (bool): Every post of the tier, whatever its last sync
+        
+        Returns:
+            list: (tier name, interval, queryset) tuples, the most recent tier first
+        """
+        now = now or timezone.now()
+        tiers, newer = [], now
+        for name, age, interval in self.tiers:
+            analytics = PostAnalytics.objects.filter(
+                scheduled_post__status='posted',
+                scheduled_post__posted_at__gt=now - age,
+                scheduled_post__posted_at__lte=newer,
+                last_synced_at__lt=now if full else now - interval,
+            )
+            tiers.append((name, interval, analytics))
+            newer = now - age
+        return tiers
+    
+    def run(self, now=None, full=False):
+        """
+        Sync the analytics due, at most ``max_posts`` per run unless ``full``
+        
+        Args:
+            now (datetime): Time of the run, now by default
+            full (bool): Sync every post younger than 30 days
+        
+        Returns:
+            dict: Number of analytics synced per tier and failed
+        """
+        now = now or timezone.now()
+        self._create_missing(now)
+        
+        result = {'failed': 0}
+        budget = float('inf') if full else self.max_posts
+        for name, interval, analytics in self.due(now, full):
+            result[name] = 0
+            # Keyset walk, the failed rows keep their last_synced_at
+            last = None
+            while budget > 0:
+                page = analytics.select_related('scheduled_post').order_by('last_synced_at', 'id')
+                if last is not None:
+                    page = page.filter(Q(last_synced_at__gt=last[0]) | Q(last_synced_at=last[0], id__gt=last[1]))
+                batch = list(page[:min(self.batch_size, budget)])
+                if not batch:
+                    break
+                # Before the sync moves last_synced_at
+                last = (batch[-1].last_synced_at, batch[-1].id)
+                budget -= len(batch)
+                
+                for row in batch:
+                    lag = now - row.last_synced_at - (timedelta(0) if full else interval)
+                    metrics.record_duration(f'analytics_sync.lag.{name}', lag.total_seconds())
+                synced, failed = self.sync(batch)
+                result[name] += synced
+                result['failed'] += failed
+        
+        logger.info(f"Analytics synced: {result}")
+        return result
+    
+    def sync(self, analytics):
+        """
+        Fetch and write the metrics of PostAnalytics loaded with their post
+        
+        Returns:
+            tuple: Number of analytics synced and failed
+        """
+        by_platform = defaultdict(list)
+        for row in analytics:
+            by_platform[row.scheduled_post.platform].append(row)
+        
+        synced, results = [], []
+        failed = 0
+        for platform, rows in by_platform.items():
+            try:
+                publisher = PlatformPublisherFactory.get_publisher(platform)
+            except ValueError:
+                failed += len(rows)
+                continue
+            size = max(1, publisher.analytics_batch_size)
+            for start in range(0, len(rows), size):
+                chunk = rows[start:start + size]
+                fetched = publisher.get_analytics_batch([row.scheduled_post.platform_post_id for row in chunk])
+                synced_at = timezone.now()
+                for row, result in zip(chunk, fetched):
+                    if result.get('success'):
+                        row.apply_metrics(result, synced_at)
+                        synced.append(row)
+                        results.append(result)
+                    else:
+                        logger.error(f"Failed to sync analytics for post {row.scheduled_post_id}: {result.get('error')}")
+                        failed += 1
+        
+        with transaction.atomic():
+            PostAnalytics.objects.bulk_update(synced, self.update_fields, batch_size=500)
+            # Bulk writes send no signal
+            UserStats.record_changes(synced)
+            self.store(synced, results)
+        return len(synced), failed
+    
+    def store(self, analytics, results):
+        """
+        Append the snapshots of just synced PostAnalytics, and keep their
+        raw results with ANALYTICS_KEEP_RAW_DATA
+        
+        Args:
+            analytics (list): PostAnalytics with their new counters
+            results (list): Platform analytics result of each
+        """
+        AnalyticsSnapshot.objects.bulk_create([AnalyticsSnapshot.of(row) for row in analytics], batch_size=500)
+        if settings.ANALYTICS_KEEP_RAW_DATA:
+            PostAnalyticsPayload.objects.bulk_create(
+                [PostAnalyticsPayload(analytics=row, data=result) for row, result in zip(analytics, results)],
+                batch_size=500, update_conflicts=True, unique_fields=['analytics'], update_fields=['data', 'updated_at']
+            )
+    
+    def _create_missing(self, now):
+        # Posts published before the analytics rows were created with them
+        posts = ScheduledPost.objects.filter(
+            status='posted', posted_at__gt=now - self.max_age, analytics__isnull=True
+        ).only('id', 'user_id')
+        with transaction.atomic():
+            created = PostAnalytics.objects.bulk_create(
+                [PostAnalytics(scheduled_post=post) for post in posts], batch_size=500
+            )
+            UserStats.record_changes(created, created=True)
+            # Never synced: due at once (auto_now stamped them)
+            PostAnalytics.objects.filter(id__in=[analytics.id for analytics in created]).update(
+                last_synced_at=now - self.max_age
+            )
+        return len(created)
+
+
+class SnapshotCompactor:
+    """
+    Downsample the analytics snapshots as they age
+    
+    Days older than ANALYTICS_SNAPSHOT_FULL_DAYS keep the last snapshot of
+    each post and hour, days older than ANALYTICS_SNAPSHOT_HOURLY_DAYS the
+    last of each post and day. Snapshots are append-only, so the last one
+    of a bucket is the one with the highest id. Each run compacts the days
+    that crossed a threshold in the last ``lookback``, one day at a time
+    through the day index; compacting a day again deletes nothing.
+    """
+    lookback = timedelta(days=7)
+    
+    def __init__(self, full_days=None, hourly_days=None):
+        self.full_days = full_days or settings.ANALYTICS_SNAPSHOT_FULL_DAYS
+        self.hourly_days = hourly_days or settings.ANALYTICS_SNAPSHOT_HOURLY_DAYS
+    
+    def run(self, now=None):
+        """
+        Returns:
+            dict: Number of snapshots deleted per resolution
+        """
+        today = timezone.localtime(now or timezone.now()).date()
+        result = {}
+        for resolution, days, trunc in (('hour', self.full_days, TruncHour), ('day', self.hourly_days, TruncDay)):
+            cutoff = today - timedelta(days=days)
+            result[resolution] = 0
+            day = cutoff - self.lookback
+            while day < cutoff:
+                result[resolution] += self._compact(day, trunc)
+                day += timedelta(days=1)
+        logger.info(f"Analytics snapshots compacted: {result}")
+        return result
+    
+    def _compact(self, day, trunc):
+        snapshots = AnalyticsSnapshot.objects.filter(day=day)
+        kept = snapshots.annotate(bucket=trunc('taken_at')).values('scheduled_post_id', 'bucket').annotate(
+            last=Max('id')
+        ).values('last')
+        deleted, _ = snapshots.exclude(id__in=kept).delete()
+        return deleted
@@ -0,0 +1,179 @@
+"""
+Claim-based dispatch of the due posts
+"""
+import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from apps.authentication.models import UserStats
+from ..models import ScheduledPost
+from .platform_integrations import PlatformPublisherFactory
+
+
+class PublishDispatcher:
+    """
+    Move due posts to 'processing' in batches before enqueuing them
+    
+    Only the dispatcher that claimed a post enqueues it, so overlapping
+    beat ticks or several dispatchers never publish a post twice. Where
+    the database supports it, batches are claimed with SELECT ... FOR
+    UPDATE SKIP LOCKED and concurrent dispatchers skip each other's rows
+    instead of waiting. SQLite has no row locks but runs one write at a
+    time, so it claims with a single UPDATE ... WHERE id IN (SELECT ...
+    LIMIT n). Every claim is tagged with a token so a dispatcher reads
+    back exactly the rows it won.
+    
+    A claim is a lease: posts still 'processing' ``lease_timeout`` seconds
+    after their claim (worker killed, message lost) are scheduled again,
+    or failed once claimed ``max_claims`` times.
+    
+    Claimed posts also take a slot in the rate budget of their platform
+    account. Those over budget go back to 'scheduled' with
+    ``deferred_until`` set to when the budget frees a slot, and are not due
+    before then.
+    """
+    
+    def __init__(self, batch_size=None, lease_timeout=None, max_claims=None):
+        self.batch_size = batch_size or settings.PUBLISH_BATCH_SIZE
+        self.lease_timeout = timedelta(seconds=lease_timeout or settings.PUBLISH_LEASE_TIMEOUT)
+        self.max_claims = max_claims or settings.PUBLISH_MAX_CLAIMS
+    
+    def due(self, now=None):
+        now = now or timezone.now()
+        return ScheduledPost.objects.filter(
+            Q(deferred_until__isnull=True) | Q(deferred_until__lte=now),
+            status='scheduled', scheduled_time__lte=now
+        )
+    
+    def claim(self, posts, now=None):
+        """
+        Claim up to batch_size scheduled posts, the earliest first
+        
+        Args:
+            posts (QuerySet): ScheduledPost candidates, usually ``due()``
+        
+        Returns:
+            tuple: (claim token, IDs of the posts claimed by this call)
+        """
+        now = now or timezone.now()
+        token = uuid.uuid4()
+        candidates = posts.filter(status='scheduled').order_by('scheduled_time', 'id')
+        
+        with transaction.atomic():
+            if connection.features.has_select_for_update_skip_locked:
+                post_ids = list(
+                    candidates.select_for_update(skip_locked=True).values_list('id', flat=True)[:self.batch_size]
+                )
+                claimable = ScheduledPost.objects.filter(id__in=post_ids)
+            else:
+                claimable = ScheduledPost.objects.filter(id__in=candidates.values('id')[:self.batch_size])
+            
+            claimable.filter(status='scheduled').update(
+                status='processing',
+                claim_token=token,
+                claimed_at=now,
+                claim_count=F('claim_count') + 1,
+                updated_at=now
+            )
+            claimed = self._within_budget(
+                ScheduledPost.objects.filter(claim_token=token)
+                .select_related('user__profile').order_by('scheduled_time', 'id'),
+                now
+            )
+            self._record([(post.id, post.user_id) for post in claimed], 'scheduled', 'processing')
+        
+        return str(token), [post.id for post in claimed]
+    
+    def _within_budget(self, posts, now):
+        """
+        Take a budget slot for each claimed post, defer the posts over budget
+        
+        Returns:
+            list: The claimed posts that keep their claim
+        """
+        platforms = defaultdict(list)
+        for post in posts:
+            platforms[post.platform].append(post)
+        
+        kept, deferred = [], defaultdict(list)
+        for platform, platform_posts in platforms.items():
+            try:
+                publisher = PlatformPublisherFactory.get_publisher(platform)
+            except ValueError:
+                # Unsupported platform, publishing fails the posts
+                kept += platform_posts
+                continue
+            accounts = defaultdict(list)
+            for post in platform_posts:
+                accounts[publisher.account_key(post)].append(post)
+            for account, account_posts in accounts.items():
+                granted, wait = publisher.rate_budget.take(account, len(account_posts))
+                kept += account_posts[:granted]
+                if granted < len(account_posts):
+                    deferred[now + timedelta(seconds=wait)] += [post.id for post in account_posts[granted:]]
+        
+        for deferred_until, post_ids in deferred.items():
+            # Not a claim attempt: the post goes back as it was, later
+            ScheduledPost.objects.filter(id__in=post_ids).update(
+                status='scheduled',
+                claim_token=None,
+                claimed_at=None,
+                claim_count=F('claim_count') - 1,
+                deferred_until=deferred_until,
+                updated_at=now
+            )
+        if deferred:
+            from .timer import notify_schedule_change
+            notify_schedule_change([post_id for post_ids in deferred.values() for post_id in post_ids])
+        
+        return sorted(kept, key=lambda post: (post.scheduled_time, post.id))
+    
+    def recover_expired(self, now=None):
+        """
+        Release the posts whose claim is older than the lease timeout
+        
+        Returns:
+            dict: Number of posts scheduled again and failed
+        """
+        now = now or timezone.now()
+        expired = ScheduledPost.objects.filter(status='processing', claimed_at__lt=now - self.lease_timeout)
+        
+        with transaction.atomic():
+            rescheduled = self._release(expired.filter(claim_count__lt=self.max_claims), 'scheduled')
+            failed = self._release(
+                expired.filter(claim_count__gte=self.max_claims), 'failed',
+                error_message=f"Publication interrompue {self.max_claims} fois, abandonnée."
+            )
+        return {'rescheduled': rescheduled, 'failed': failed}
+    
+    def release(self, posts, status='scheduled', **fields):
+        """
+        Hand claimed posts back, to be published again or as failed
+        
+        Args:
+            posts (QuerySet): ScheduledPost rows, only those still 'processing' are released
+            status (str): 'scheduled' to publish them again, 'failed' to give up
+        
+        Returns:
+            int: Number of posts released
+        """
+        with transaction.atomic():
+            return self._release(posts.filter(status='processing'), status, **fields)
+    
+    def _release(self, posts, status, **fields):
+        # A fresh token tells the rows released here from those released concurrently
+        token = uuid.uuid4()
+        if not posts.update(status=status, claim_token=token, updated_at=timezone.now(), **fields):
+            return 0
+        released = list(ScheduledPost.objects.filter(claim_token=token).values_list('id', 'user_id'))
+        self._record(released, 'processing', status)
+        return len(released)
+    
+    @staticmethod
+    def _record(posts, before, after):
+        # The UPDATEs send no signal: move the counters of the posts' owners
+        for user_id, count in Counter(user_id for _, user_id in posts).items():
+            UserStats.record(user_id, **{f'{before}_posts': -count, f'{after}_posts': count})
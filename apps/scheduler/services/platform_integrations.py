@@ -1,8 +1,16 @@
 """
 Service for integrating with social media platforms
 """
+import hashlib
+import json
+import time
+from datetime import datetime, timedelta
+from functools import cached_property
 import requests
 from django.conf import settings
+from django.utils import timezone
+from apps.core.http import get_session
+from apps.core.resilience import SlidingWindowLimiter
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,7 +19,177 @@ logger = logging.getLogger(__name__)
 class SocialMediaPublisher:
     """
     Base class for social media publishing
+    
+    ``max_concurrency`` caps the posts published at the same time on the
+    platform by one batch (see BatchPublisher). Each platform account (the
+    ``account_field`` of the user profile) may publish ``rate_limit`` posts
+    per ``rate_window`` seconds, 0 disables the budget. The API calls go
+    through ``api_request``, which blocks the budget of the account when
+    the platform says its quota is spent.
+    
+    Publishers whose platform publishes from a media container (uploaded
+    media, then a cheap publish call) set ``staging_ttl`` to the lifetime
+    of a container: MediaStager creates it before the scheduled time and
+    ``publish`` reuses it (see ``staged_container``).
     """
+    session_name = 'default'
+    max_concurrency = 1
+    account_field = None
+    rate_limit = 0
+    rate_window = 3600
+    staging_ttl = 0
+    # Seconds given to a platform API call
+    request_timeout = 30
+    # A container this close to its expiry is not used any more
+    staging_margin = 300
+    # Posts whose analytics one API call returns
+    analytics_batch_size = 1
+    
+    @property
+    def session(self):
+        """Pooled keep-alive session for the platform API"""
+        return get_session(self.session_name)
+    
+    @cached_property
+    def rate_budget(self):
+        """Sliding-window budget of the posts of each account"""
+        return SlidingWindowLimiter(
+            f'publish-{self.session_name}', self.rate_limit, self.rate_window,
+            backend=settings.PUBLISH_RATE_BUDGET_BACKEND
+        )
+    
+    def account_key(self, post):
+        """
+        Platform account a post is published with, its user when not configured
+        """
+        profile = getattr(post.user, 'profile', None)
+        account = getattr(profile, self.account_field, '') if self.account_field else ''
+        return account or f'user-{post.user_id}'
+    
+    def quota_from_headers(self, headers):
+        """
+        Read the quota announced in the headers of an API response
+        
+        Returns:
+            float: Timestamp until which the account has no call left, None
+                when calls remain or the platform does not tell
+        """
+        return None
+    
+    def api_request(self, post, method, url, **kwargs):
+        """
+        Call the platform API for a post, tracking the quota of its account
+        
+        When the response says the quota is spent, the budget of the account
+        is blocked until the platform resets it: the dispatcher then defers
+        the next posts of the account instead of letting them fail.
+        
+        Returns:
+            requests.Response: API response
+        """
+        kwargs.setdefault('timeout', self.request_timeout)
+        response = self.session.request(method, url, **kwargs)
+        blocked_until = self._blocked_until(response)
+        if blocked_until is not None:
+            self.rate_budget.block(self.account_key(post), blocked_until)
+        return response
+    
+    def quota_refused(self, response):
+        """
+        Whether the platform refused a call because the quota is spent
+        """
+        return not response.ok and self._blocked_until(response) is not None
+    
+    def rate_limited(self, response):
+        """
+        Result of a publication refused by the platform quota
+        
+        The post is scheduled again ``retry_after`` seconds later instead of
+        failing.
+        """
+        blocked_until = self._blocked_until(response) or time.time() + 60
+        return {
+            'success': False,
+            'error': f'{self.session_name} rate limit reached',
+            'retry_after': max(0.0, blocked_until - time.time())
+        }
+    
+    def _blocked_until(self, response):
+        blocked_until = self.quota_from_headers(response.headers)
+        if blocked_until is None and response.status_code == 429:
+            try:
+                blocked_until = time.time() + float(response.headers.get('Retry-After') or 60)
+            except ValueError:
+                blocked_until = time.time() + 60
+        return blocked_until
+    
+    def media_url(self, post):
+        """URL of the image published with a post"""
+        return post.image.image_url or post.image.image_file.url
+    
+    def staging_fingerprint(self, post):
+        """
+        Digest of what a container holds, a container staged before an edit is not used
+        """
+        content = '\n'.join([self.media_url(post), post.caption, post.hashtags])
+        return hashlib.sha256(content.encode()).hexdigest()
+    
+    def create_container(self, post):
+        """
+        Upload the media of a post and create its container on the platform
+        Must be implemented by the subclasses setting ``staging_ttl``
+        
+        Returns:
+            str: Container ID
+        """
+        raise NotImplementedError("Subclasses must implement create_container method")
+    
+    def stage(self, post, now=None):
+        """
+        Create the container of a post ahead of its scheduled time
+        
+        Args:
+            post: ScheduledPost instance
+            now (datetime): Creation time, now by default
+        
+        Returns:
+            dict: Staging stored as ``metadata['staging']`` of the post
+        """
+        now = now or timezone.now()
+        return {
+            'container_id': self.create_container(post),
+            'fingerprint': self.staging_fingerprint(post),
+            'staged_at': now.isoformat(),
+            'expires_at': (now + timedelta(seconds=self.staging_ttl)).isoformat()
+        }
+    
+    def staged_container(self, post, at=None):
+        """
+        Container staged for a post, usable at a given time
+        
+        Args:
+            post: ScheduledPost instance
+            at (datetime): Time of the publication, now by default
+        
+        Returns:
+            str: Container ID, None when the post has no container, it
+                expires before ``at`` or the post changed since
+        """
+        staging = (post.metadata or {}).get('staging')
+        if not self.staging_ttl or not staging:
+            return None
+        expires_at = datetime.fromisoformat(staging['expires_at'])
+        if expires_at - (at or timezone.now()) < timedelta(seconds=self.staging_margin):
+            return None
+        if staging['fingerprint'] != self.staging_fingerprint(post):
+            return None
+        return staging['container_id']
+    
+    def discard(self, staging):
+        """
+        Delete a staged container no post will publish
+        Platforms without a delete call let their containers expire
+        """
     
     def publish(self, post):
         """
@@ -26,16 +204,101 @@ class SocialMediaPublisher:
         Must be implemented by subclasses
         """
         raise NotImplementedError("Subclasses must implement get_analytics method")
+    
+    def get_analytics_batch(self, post_ids):
+        """
+        Get analytics for up to ``analytics_batch_size`` published posts
+        
+        Args:
+            post_ids (list): Platform post IDs
+        
+        Returns:
+            list: One get_analytics result per post, in the same order
+        """
+        return [self.get_analytics(post_id) for post_id in post_ids]
+
+
+class GraphAPIPublisher(SocialMediaPublisher):
+    """
+    Base class of the publishers using the Meta Graph API
+    """
+    
+    def quota_from_headers(self, headers):
+        """
+        Meta reports the usage of a rolling hour in percent of the quota, in
+        X-Business-Use-Case-Usage (with the minutes before access is
+        regained) and X-App-Usage
+        """
+        usages = []
+        for name in ('X-Business-Use-Case-Usage', 'X-App-Usage'):
+            try:
+                data = json.loads(headers.get(name) or '{}')
+            except ValueError:
+                continue
+            if name == 'X-App-Usage':
+                usages.append(data)
+            else:
+                usages += [usage for entries in data.values() for usage in entries]
+        
+        blocked_until = None
+        for usage in usages:
+            if max(usage.get(key) or 0 for key in ('call_count', 'total_cputime', 'total_time')) >= 100:
+                minutes = usage.get('estimated_time_to_regain_access') or 60
+                blocked_until = max(blocked_until or 0, time.time() + minutes * 60)
+        return blocked_until
+    
+    def get_analytics_batch(self, post_ids):
+        """
+        Get analytics for several posts with one call of the Graph API
+        """
+        try:
+            # In production: GET {api_url}/?ids=id1,id2...&fields=insights.metric(...)
+            logger.info(f"Would fetch {self.session_name} analytics of {len(post_ids)} posts")
+            return [self.get_analytics(post_id) for post_id in post_ids]
+        except Exception as e:
+            logger.error(f"Error getting {self.session_name} analytics: {str(e)}")
+            return [{'success': False, 'error': str(e)} for _ in post_ids]
 
 
-class InstagramPublisher(SocialMediaPublisher):
+class InstagramPublisher(GraphAPIPublisher):
     """
     Publisher for Instagram
     """
     
+    session_name = 'instagram'
+    account_field = 'instagram_username'
+    # Media containers expire 24 hours after their creation
+    staging_ttl = 86400
+    analytics_batch_size = 50
+    
     def __init__(self):
         self.access_token = settings.INSTAGRAM_ACCESS_TOKEN
         self.api_url = "https://graph.instagram.com/v18.0"
+        self.max_concurrency = settings.PUBLISH_CONCURRENCY_INSTAGRAM
+        self.rate_limit = settings.PUBLISH_RATE_LIMIT_INSTAGRAM
+        self.rate_window = settings.PUBLISH_RATE_WINDOW_INSTAGRAM
+    
+    def create_container(self, post):
+        """
+        Create the Instagram media container of a post, Instagram fetches the image itself
+        """
+        if not self.access_token:
+            raise ValueError('Instagram access token not configured')
+        if not post.user.profile.instagram_username:
+            raise ValueError('Instagram username not configured in user profile')
+        
+        caption = f"{post.caption}\n\n{post.hashtags}" if post.hashtags else post.caption
+        container_data = {
+            'image_url': self.media_url(post),
+            'caption': caption,
+            'access_token': self.access_token
+        }
+        
+        # Note: This is a simplified example
+        # In production, you would POST container_data to
+        # {api_url}/{ig-user-id}/media and wait for the container to be FINISHED
+        logger.info(f"Would create Instagram container: {caption[:50]}...")
+        return 'instagram_container_mock_id'
     
     def publish(self, post):
         """
@@ -62,29 +325,25 @@ class InstagramPublisher(SocialMediaPublisher):
                     'error': 'Instagram username not configured in user profile'
                 }
             
-            # Step 1: Create media container
-            image_url = post.image.image_url or post.image.image_file.url
-            caption = f"{post.caption}\n\n{post.hashtags}" if post.hashtags else post.caption
-            
-            container_data = {
-                'image_url': image_url,
-                'caption': caption,
-                'access_token': self.access_token
-            }
-            
-            # Note: This is a simplified example
-            # In production, you would need to:
-            # 1. Get the Instagram Business Account ID
-            # 2. Create a media container
-            # 3. Publish the container
+            # Step 1: Media container, staged ahead of time when possible
+            container_id = self.staged_container(post) or self.create_container(post)
             
-            logger.info(f"Would publish to Instagram: {caption[:50]}...")
+            # Step 2: Publish the container
+            response = self.api_request(
+                post, 'POST', f"{self.api_url}/me/media_publish",
+                data={'creation_id': container_id, 'access_token': self.access_token}
+            )
+            if self.quota_refused(response):
+                return self.rate_limited(response)
+            response.raise_for_status()
+            media_id = response.json()['id']
             
             return {
                 'success': True,
-                'platform_post_id': 'instagram_mock_id',
-                'platform_post_url': f'https://instagram.com/p/mock_id/',
-                'message': 'Post published to Instagram (mock)'
+                'platform_post_id': media_id,
+                # The permalink needs another call, {api_url}/{media-id}?fields=permalink
+                'platform_post_url': '',
+                'message': 'Post published to Instagram'
             }
             
         except Exception as e:
@@ -117,14 +376,43 @@ class InstagramPublisher(SocialMediaPublisher):
             }
 
 
-class FacebookPublisher(SocialMediaPublisher):
+class FacebookPublisher(GraphAPIPublisher):
     """
     Publisher for Facebook
     """
     
+    session_name = 'facebook'
+    account_field = 'facebook_page_id'
+    # Unpublished photos can be attached to a post for 24 hours
+    staging_ttl = 86400
+    analytics_batch_size = 50
+    
     def __init__(self):
         self.access_token = settings.FACEBOOK_ACCESS_TOKEN
         self.api_url = "https://graph.facebook.com/v18.0"
+        self.max_concurrency = settings.PUBLISH_CONCURRENCY_FACEBOOK
+        self.rate_limit = settings.PUBLISH_RATE_LIMIT_FACEBOOK
+        self.rate_window = settings.PUBLISH_RATE_WINDOW_FACEBOOK
+    
+    def create_container(self, post):
+        """
+        Upload the image of a post to its page as an unpublished photo
+        """
+        if not self.access_token:
+            raise ValueError('Facebook access token not configured')
+        if not post.user.profile.facebook_page_id:
+            raise ValueError('Facebook page ID not configured in user profile')
+        
+        # In production: POST {api_url}/{page-id}/photos with url and published=false
+        logger.info(f"Would upload to Facebook page: {self.media_url(post)}")
+        return 'facebook_photo_mock_id'
+    
+    def discard(self, staging):
+        """
+        Delete the unpublished photo of a cancelled post
+        """
+        # In production: DELETE {api_url}/{photo-id}
+        logger.info(f"Would delete Facebook photo {staging['container_id']}")
     
     def publish(self, post):
         """
@@ -144,16 +432,27 @@ class FacebookPublisher(SocialMediaPublisher):
                     'error': 'Facebook page ID not configured in user profile'
                 }
             
-            image_url = post.image.image_url or post.image.image_file.url
+            photo_id = self.staged_container(post) or self.create_container(post)
             caption = f"{post.caption}\n\n{post.hashtags}" if post.hashtags else post.caption
             
-            logger.info(f"Would publish to Facebook: {caption[:50]}...")
+            response = self.api_request(
+                post, 'POST', f"{self.api_url}/{user_profile.facebook_page_id}/feed",
+                data={
+                    'message': caption,
+                    'attached_media': json.dumps([{'media_fbid': photo_id}]),
+                    'access_token': self.access_token
+                }
+            )
+            if self.quota_refused(response):
+                return self.rate_limited(response)
+            response.raise_for_status()
+            facebook_post_id = response.json()['id']
             
             return {
                 'success': True,
-                'platform_post_id': 'facebook_mock_id',
-                'platform_post_url': f'https://facebook.com/mock_page/posts/mock_id',
-                'message': 'Post published to Facebook (mock)'
+                'platform_post_id': facebook_post_id,
+                'platform_post_url': f'https://facebook.com/{facebook_post_id}',
+                'message': 'Post published to Facebook'
             }
             
         except Exception as e:
@@ -190,10 +489,41 @@ class TwitterPublisher(SocialMediaPublisher):
     Publisher for Twitter/X
     """
     
+    session_name = 'twitter'
+    account_field = 'twitter_username'
+    # Uploaded media must be attached to a tweet within 24 hours
+    staging_ttl = 86400
+    analytics_batch_size = 100
+    
     def __init__(self):
         self.api_key = settings.TWITTER_API_KEY
         self.api_secret = settings.TWITTER_API_SECRET
         self.api_url = "https://api.twitter.com/2"
+        self.max_concurrency = settings.PUBLISH_CONCURRENCY_TWITTER
+        self.rate_limit = settings.PUBLISH_RATE_LIMIT_TWITTER
+        self.rate_window = settings.PUBLISH_RATE_WINDOW_TWITTER
+    
+    def quota_from_headers(self, headers):
+        """
+        Twitter announces the calls left in the current window and its reset time
+        """
+        try:
+            if int(headers.get('x-rate-limit-remaining', 1)) > 0:
+                return None
+            return float(headers['x-rate-limit-reset'])
+        except (KeyError, ValueError):
+            return None
+    
+    def create_container(self, post):
+        """
+        Upload the image of a post to the Twitter media endpoint
+        """
+        if not self.api_key or not self.api_secret:
+            raise ValueError('Twitter API credentials not configured')
+        
+        # In production: chunked upload to upload.twitter.com/1.1/media/upload.json
+        logger.info(f"Would upload to Twitter: {self.media_url(post)}")
+        return 'twitter_media_mock_id'
     
     def publish(self, post):
         """
@@ -206,15 +536,24 @@ class TwitterPublisher(SocialMediaPublisher):
                     'error': 'Twitter API credentials not configured'
                 }
             
+            media_id = self.staged_container(post) or self.create_container(post)
             caption = f"{post.caption}\n\n{post.hashtags}" if post.hashtags else post.caption
             
-            logger.info(f"Would publish to Twitter: {caption[:50]}...")
+            # Note: in production the request is signed with the user's OAuth credentials
+            response = self.api_request(
+                post, 'POST', f"{self.api_url}/tweets",
+                json={'text': caption, 'media': {'media_ids': [media_id]}}
+            )
+            if self.quota_refused(response):
+                return self.rate_limited(response)
+            response.raise_for_status()
+            tweet_id = response.json()['data']['id']
             
             return {
                 'success': True,
-                'platform_post_id': 'twitter_mock_id',
-                'platform_post_url': f'https://twitter.com/user/status/mock_id',
-                'message': 'Post published to Twitter (mock)'
+                'platform_post_id': tweet_id,
+                'platform_post_url': f'https://twitter.com/i/web/status/{tweet_id}',
+                'message': 'Post published to Twitter'
             }
             
         except Exception as e:
@@ -224,6 +563,18 @@ class TwitterPublisher(SocialMediaPublisher):
                 'error': str(e)
             }
     
+    def get_analytics_batch(self, post_ids):
+        """
+        Get the public metrics of up to 100 tweets with one call
+        """
+        try:
+            # In production: GET {api_url}/tweets?ids=id1,id2...&tweet.fields=public_metrics
+            logger.info(f"Would fetch Twitter analytics of {len(post_ids)} tweets")
+            return [self.get_analytics(post_id) for post_id in post_ids]
+        except Exception as e:
+            logger.error(f"Error getting Twitter analytics: {str(e)}")
+            return [{'success': False, 'error': str(e)} for _ in post_ids]
+    
     def get_analytics(self, post_id):
         """
         Get analytics for a Twitter post
@@ -249,10 +600,14 @@ class TwitterPublisher(SocialMediaPublisher):
 class PlatformPublisherFactory:
     """
     Factory class to get the appropriate publisher for a platform
+    
+    Publishers are cached per process so their pooled sessions are
+    reused by every task handled by the worker.
     """
+    _instances = {}
     
-    @staticmethod
-    def get_publisher(platform):
+    @classmethod
+    def get_publisher(cls, platform):
         """
         Get the publisher for the specified platform
         
@@ -272,4 +627,9 @@ class PlatformPublisherFactory:
         if not publisher_class:
             raise ValueError(f"Unsupported platform: {platform}")
         
-        return publisher_class()
+        publisher = cls._instances.get(platform)
+        if publisher is None:
+            publisher = publisher_class()
+            cls._instances[platform] = publisher
+        
+        return publisher
@@ -0,0 +1,134 @@
+"""
+Concurrent publishing of the batches of claimed posts
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from django.db import transaction
+from django.utils import timezone
+from apps.authentication.models import UserStats
+from ..models import PostAnalytics, ScheduledPost
+from .platform_integrations import PlatformPublisherFactory
+from .timer import notify_schedule_change
+
+logger = logging.getLogger(__name__)
+
+
+class BatchPublisher:
+    """
+    Publish claimed posts concurrently and write their outcomes in bulk
+    
+    The posts are loaded with their user, profile and image in one query,
+    then grouped by platform. Every platform gets its own thread pool of
+    ``max_concurrency`` threads (set per publisher) and all the platforms
+    publish at the same time. The threads only call the platform APIs:
+    the outcomes are written afterwards with one bulk_update, plus one
+    bulk_create for the analytics rows of the published posts. Posts
+    refused by the platform quota are scheduled again after the delay it
+    announced instead of failing.
+    
+    Only the posts still holding the claim token are published, and an
+    outcome is written only if its post kept the claim meanwhile: a batch
+    delivered twice, or posts whose lease expired and were claimed again,
+    are never written over.
+    """
+    update_fields = (
+        'status', 'posted_at', 'platform_post_id', 'platform_post_url', 'error_message',
+        'deferred_until', 'claim_count', 'updated_at'
+    )
+    
+    def publish(self, post_ids, claim_token):
+        """
+        Publish a batch of claimed posts
+        
+        Args:
+            post_ids (list): IDs of ScheduledPost instances claimed by PublishDispatcher.claim
+            claim_token (str): Token of that claim
+        
+        Returns:
+            dict: Number of posts published, failed and deferred
+        """
+        posts = list(
+            self._claimed(claim_token).filter(id__in=post_ids)
+            .select_related('user__profile', 'image')
+        )
+        by_platform = defaultdict(list)
+        for post in posts:
+            by_platform[post.platform].append(post)
+        
+        outcomes, calls = [], []
+        with ExitStack() as pools:
+            for platform, platform_posts in by_platform.items():
+                try:
+                    publisher = PlatformPublisherFactory.get_publisher(platform)
+                except ValueError as e:
+                    outcomes += [(post, {'success': False, 'error': str(e)}, timezone.now()) for post in platform_posts]
+                    continue
+                pool = pools.enter_context(ThreadPoolExecutor(
+                    max_workers=publisher.max_concurrency, thread_name_prefix=f'publish-{platform}'
+                ))
+                calls += [(post, pool.submit(self._call, publisher, post)) for post in platform_posts]
+        # Leaving the pools waited for every call
+        outcomes += [(post, *call.result()) for post, call in calls]
+        
+        return self._save(outcomes, claim_token)
+    
+    @staticmethod
+    def _claimed(claim_token):
+        return ScheduledPost.objects.filter(status='processing', claim_token=claim_token)
+    
+    def _call(self, publisher, post):
+        try:
+            result = publisher.publish(post)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        return result, timezone.now()
+    
+    def _save(self, outcomes, claim_token):
+        now = timezone.now()
+        published, deferred, posts = [], [], []
+        with transaction.atomic():
+            # Lease recovery may have taken posts back while they were published
+            held = set(
+                self._claimed(claim_token).select_for_update()
+                .filter(id__in=[post.id for post, _, _ in outcomes]).values_list('id', flat=True)
+            )
+            for post, result, finished_at in outcomes:
+                if post.id not in held:
+                    logger.warning(f"Post {post.id} lost its claim while being published, outcome not written")
+                    continue
+                
+                post.updated_at = now
+                if result['success']:
+                    post.status = 'posted'
+                    post.posted_at = finished_at
+                    post.platform_post_id = result.get('platform_post_id', '')
+                    post.platform_post_url = result.get('platform_post_url', '')
+                    published.append(post)
+                elif result.get('retry_after') is not None:
+                    post.status = 'scheduled'
+                    post.deferred_until = finished_at + timedelta(seconds=result['retry_after'])
+                    post.claim_count -= 1
+                    deferred.append(post.id)
+                    logger.warning(f"Post {post.id} deferred until {post.deferred_until}: {result.get('error')}")
+                else:
+                    post.status = 'failed'
+                    post.error_message = result.get('error', 'Unknown error')
+                    logger.error(f"Failed to publish post {post.id}: {post.error_message}")
+                posts.append(post)
+            
+            self._claimed(claim_token).bulk_update(posts, self.update_fields, batch_size=500)
+            analytics = PostAnalytics.objects.bulk_create(
+                [PostAnalytics(scheduled_post=post) for post in published], batch_size=500
+            )
+            # Bulk writes send no signal
+            UserStats.record_changes(posts)
+            UserStats.record_changes(analytics, created=True)
+            if deferred:
+                notify_schedule_change(deferred)
+        
+        failed = len(posts) - len(published) - len(deferred)
+        logger.info(f"Published {len(published)} posts, {failed} failed, {len(deferred)} deferred")
+        return {'published': len(published), 'failed': failed, 'deferred': len(deferred)}
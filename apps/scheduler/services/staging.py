@@ -0,0 +1,121 @@
+"""
+Media pre-staging of the upcoming posts
+"""
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from ..models import ScheduledPost
+from .platform_integrations import PlatformPublisherFactory
+
+logger = logging.getLogger(__name__)
+
+
+class MediaStager:
+    """
+    Upload the media of the upcoming posts and create their platform containers
+    
+    The posts scheduled within ``lead`` seconds get their container created
+    ahead of time and cached in ``metadata['staging']``, so publishing only
+    makes the cheap "publish container" call at the scheduled time. A post
+    is staged again when its container would expire before its scheduled
+    time or its image or caption changed since; the publishers fall back to
+    creating the container inline when none is usable. Containers of the
+    posts cancelled or failed in the meantime are discarded.
+    """
+    update_fields = ('metadata', 'updated_at')
+    
+    def __init__(self, lead=None, batch_size=None):
+        self.lead = timedelta(seconds=lead or settings.PUBLISH_STAGING_LEAD)
+        self.batch_size = batch_size or settings.PUBLISH_STAGING_BATCH_SIZE
+    
+    def upcoming(self, now=None):
+        now = now or timezone.now()
+        return ScheduledPost.objects.filter(
+            status='scheduled', scheduled_time__gt=now, scheduled_time__lte=now + self.lead
+        )
+    
+    def stage(self, now=None):
+        """
+        Create the missing containers of the upcoming posts
+        
+        Returns:
+            dict: Number of posts staged and failed
+        """
+        now = now or timezone.now()
+        by_platform = defaultdict(list)
+        pending = 0
+        posts = self.upcoming(now).select_related('user__profile', 'image').order_by('scheduled_time', 'id')
+        for post in posts.iterator(chunk_size=500):
+            try:
+                publisher = PlatformPublisherFactory.get_publisher(post.platform)
+            except ValueError:
+                continue
+            if not publisher.staging_ttl or publisher.staged_container(post, at=post.scheduled_time):
+                continue
+            by_platform[post.platform].append((publisher, post))
+            pending += 1
+            if pending == self.batch_size:
+                break
+        
+        calls = []
+        with ExitStack() as pools:
+            for platform, platform_posts in by_platform.items():
+                pool = pools.enter_context(ThreadPoolExecutor(
+                    max_workers=platform_posts[0][0].max_concurrency, thread_name_prefix=f'stage-{platform}'
+                ))
+                calls += [(publisher, post, pool.submit(publisher.stage, post)) for publisher, post in platform_posts]
+        
+        staged, failed = [], 0
+        for publisher, post, call in calls:
+            try:
+                staging = call.result()
+            except Exception as e:
+                # Publishing creates the container inline
+                logger.warning(f"Could not stage post {post.id}: {str(e)}")
+                failed += 1
+                continue
+            previous = post.metadata.get('staging')
+            if previous:
+                self._discard(publisher, previous)
+            post.metadata = {**post.metadata, 'staging': staging}
+            post.updated_at = now
+            staged.append(post)
+        
+        ScheduledPost.objects.bulk_update(staged, self.update_fields, batch_size=500)
+        if staged or failed:
+            logger.info(f"Staged media of {len(staged)} posts, {failed} failed")
+        return {'staged': len(staged), 'failed': failed}
+    
+    def release(self, now=None):
+        """
+        Discard the containers of the posts cancelled or failed since their staging
+        
+        Returns:
+            int: Number of containers discarded
+        """
+        now = now or timezone.now()
+        posts = list(
+            ScheduledPost.objects.filter(status__in=['cancelled', 'failed'], metadata__has_key='staging')
+            .only('id', 'platform', 'metadata')[:self.batch_size]
+        )
+        for post in posts:
+            staging = post.metadata.pop('staging')
+            try:
+                self._discard(PlatformPublisherFactory.get_publisher(post.platform), staging)
+            except ValueError:
+                pass
+            post.updated_at = now
+        
+        ScheduledPost.objects.bulk_update(posts, self.update_fields, batch_size=500)
+        return len(posts)
+    
+    def _discard(self, publisher, staging):
+        try:
+            publisher.discard(staging)
+        except Exception as e:
+            # The platform lets it expire
+            logger.warning(f"Could not discard container {staging.get('container_id')}: {str(e)}")
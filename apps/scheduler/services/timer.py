@@ -0,0 +1,302 @@
+"""
+In-process timer publishing the scheduled posts at their scheduled time
+"""
+import heapq
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from apps.core import metrics
+from apps.core.redis import get_redis
+from ..models import ScheduledPost
+from .dispatch import PublishDispatcher
+
+logger = logging.getLogger(__name__)
+
+CHANGES_CHANNEL = 'scheduler:post-changes'
+
+
+class PublishTimer:
+    """
+    Min-heap of post deadlines
+    
+    Scheduling, moving or removing a post costs O(log n): only its entry in
+    ``_deadlines`` is replaced, the heap items left behind are dropped when
+    they reach the top.
+    """
+    
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+    
+    def __len__(self):
+        return len(self._deadlines)
+    
+    def __contains__(self, post_id):
+        return post_id in self._deadlines
+    
+    def schedule(self, post_id, when):
+        if self._deadlines.get(post_id) == when:
+            return
+        self._deadlines[post_id] = when
+        heapq.heappush(self._heap, (when, post_id))
+    
+    def remove(self, post_id):
+        self._deadlines.pop(post_id, None)
+    
+    def clear(self):
+        self._heap.clear()
+        self._deadlines.clear()
+    
+    def next_deadline(self):
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+    
+    def pop_due(self, now):
+        """
+        Take the posts whose deadline has passed
+        
+        Returns:
+            list: (post_id, deadline) pairs, the earliest first
+        """
+        due = []
+        while self.next_deadline() is not None and self._heap[0][0] <= now:
+            deadline, post_id = heapq.heappop(self._heap)
+            del self._deadlines[post_id]
+            due.append((post_id, deadline))
+        return due
+
+
+class LocalScheduleChanges:
+    """
+    In-process change feed, for development, tests and benchmarks
+    """
+    _queue = queue.Queue()
+    
+    def publish(self, post_ids):
+        self._queue.put(list(post_ids))
+    
+    def subscribe(self):
+        pass
+    
+    def wait(self, timeout):
+        try:
+            post_ids = list(self._queue.get(timeout=timeout))
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                post_ids += self._queue.get_nowait()
+            except queue.Empty:
+                return post_ids
+
+
+class RedisScheduleChanges:
+    """
+    Change feed from the web processes to the scheduler, through Redis pub/sub
+    """
+    
+    def __init__(self):
+        self._pubsub = None
+    
+    def publish(self, post_ids):
+        get_redis().publish(CHANGES_CHANNEL, json.dumps(list(post_ids)))
+    
+    def subscribe(self):
+        self._pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(CHANGES_CHANNEL)
+    
+    def wait(self, timeout):
+        post_ids = []
+        message = self._pubsub.get_message(timeout=timeout)
+        while message is not None:
+            post_ids += json.loads(message['data'])
+            message = self._pubsub.get_message()
+        return post_ids
+
+
+SCHEDULE_CHANGE_BACKENDS = {
+    'local': LocalScheduleChanges,
+    'redis': RedisScheduleChanges,
+}
+
+
+def notify_schedule_change(post_ids, backend=None):
+    """
+    Tell the publish scheduler that posts were created, rescheduled or cancelled
+    
+    The message is sent once the current transaction commits, so the
+    scheduler reads the new rows. When no scheduler listens or the feed
+    is unreachable the message is lost: the next refresh of the scheduler
+    or the next beat run picks the posts up.
+    
+    Args:
+        post_ids (list): IDs of the changed ScheduledPost instances
+        backend (str): 'redis' or 'local', PUBLISH_TIMER_BACKEND by default
+    """
+    post_ids = list(post_ids)
+    feed = SCHEDULE_CHANGE_BACKENDS[backend or settings.PUBLISH_TIMER_BACKEND]()
+    
+    def publish():
+        try:
+            feed.publish(post_ids)
+        except Exception as e:
+            logger.warning(f"Could not notify the publish scheduler: {str(e)}")
+    
+    transaction.on_commit(publish)
+
+
+class PublishScheduler:
+    """
+    Long-running process publishing each post at its scheduled time
+    
+    The scheduled posts due within ``lookahead`` seconds are loaded into a
+    PublishTimer, reloaded every ``refresh`` seconds. In between, the
+    process sleeps until the next deadline or the next change notification,
+    whichever comes first; the posts named by a notification are read again
+    and added to, moved in or removed from the timer. Due posts are claimed
+    with the PublishDispatcher, like the beat task that keeps running as a
+    safety net, so a post is never published twice, then enqueued in
+    batches.
+    """
+    max_wait = 1.0
+    
+    def __init__(self, lookahead=None, refresh=None, dispatcher=None, changes=None, enqueue=None):
+        self.lookahead = timedelta(seconds=lookahead or settings.PUBLISH_TIMER_LOOKAHEAD)
+        self.refresh_interval = timedelta(seconds=refresh or settings.PUBLISH_TIMER_REFRESH)
+        self.dispatcher = dispatcher or PublishDispatcher()
+        self.changes = changes or SCHEDULE_CHANGE_BACKENDS[settings.PUBLISH_TIMER_BACKEND]()
+        self.enqueue = enqueue or self._enqueue
+        self.timer = PublishTimer()
+        self.horizon = None
+        self.next_refresh = None
+        self._subscribed = False
+    
+    def refresh(self, now=None):
+        """
+        Reload the timer with the posts due before now + lookahead
+        
+        Returns:
+            int: Number of posts in the timer
+        """
+        now = now or timezone.now()
+        self.timer.clear()
+        self.horizon = now + self.lookahead
+        for post_id, when in self._deadlines(self.dispatcher.due(self.horizon)):
+            self.timer.schedule(post_id, when)
+        self.next_refresh = now + self.refresh_interval
+        return len(self.timer)
+    
+    def apply_changes(self, post_ids):
+        """
+        Add, move or remove changed posts according to their current row
+        """
+        upcoming = dict(self._deadlines(self.dispatcher.due(self.horizon).filter(id__in=post_ids)))
+        for post_id in set(post_ids):
+            if post_id in upcoming:
+                self.timer.schedule(post_id, upcoming[post_id])
+            else:
+                self.timer.remove(post_id)
+    
+    def fire_due(self, now=None):
+        """
+        Claim and enqueue the posts whose scheduled time has passed
+        
+        A timer entry may be stale (post moved or deferred by a change not
+        received yet): only the posts still due are claimed, the others are
+        put back at their current deadline.
+        
+        Returns:
+            list: IDs of the posts enqueued, those published in the meantime
+            (publish now, beat run) are skipped
+        """
+        now = now or timezone.now()
+        deadlines = dict(self.timer.pop_due(now))
+        if not deadlines:
+            return []
+        
+        fired = []
+        posts = self.dispatcher.due(now).filter(id__in=deadlines)
+        while True:
+            claim_token, post_ids = self.dispatcher.claim(posts)
+            if not post_ids:
+                break
+            self.enqueue(post_ids, claim_token)
+            fired += post_ids
+        
+        stale = set(deadlines) - set(fired)
+        if stale:
+            self.apply_changes(list(stale))
+        
+        enqueued_at = timezone.now()
+        for post_id in fired:
+            metrics.record_duration('publish.lateness', (enqueued_at - deadlines[post_id]).total_seconds())
+        return fired
+    
+    def run(self, stop=None):
+        """
+        Fire the posts until ``stop`` (threading.Event) is set
+        """
+        stop = stop or threading.Event()
+        # Listen before the first load so no change falls between the two
+        self._subscribe()
+        while not stop.is_set():
+            try:
+                now = timezone.now()
+                if self.next_refresh is None or now >= self.next_refresh:
+                    close_old_connections()
+                    if not self._subscribed:
+                        self._subscribe()
+                    self.refresh(now)
+                self.fire_due(now)
+                
+                post_ids = self._wait(self._timeout(timezone.now()))
+                if post_ids:
+                    self.apply_changes(post_ids)
+            except Exception as e:
+                logger.error(f"Publish scheduler error: {str(e)}")
+                self.next_refresh = None
+                stop.wait(self.max_wait)
+    
+    def _deadlines(self, posts):
+        # Posts deferred by their rate budget wait for the end of the deferral
+        for post_id, scheduled_time, deferred_until in posts.values_list('id', 'scheduled_time', 'deferred_until'):
+            yield post_id, max(scheduled_time, deferred_until or scheduled_time)
+    
+    def _timeout(self, now):
+        wake_at = self.next_refresh
+        next_deadline = self.timer.next_deadline()
+        if next_deadline is not None:
+            wake_at = min(wake_at, next_deadline)
+        return max(0.0, min(self.max_wait, (wake_at - now).total_seconds()))
+    
+    def _subscribe(self):
+        try:
+            self.changes.subscribe()
+            self._subscribed = True
+        except Exception as e:
+            logger.warning(f"Schedule changes unavailable, posts are reloaded every refresh: {str(e)}")
+            self._subscribed = False
+    
+    def _wait(self, timeout):
+        # Without the feed, changes wait for the next refresh
+        if not self._subscribed:
+            time.sleep(timeout)
+            return []
+        try:
+            return self.changes.wait(timeout)
+        except Exception as e:
+            logger.warning(f"Lost the schedule changes feed: {str(e)}")
+            self._subscribed = False
+            return []
+    
+    @staticmethod
+    def _enqueue(post_ids, claim_token):
+        from ..tasks import publish_claimed_posts
+        publish_claimed_posts.delay(post_ids, claim_token)
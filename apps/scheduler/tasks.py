@@ -1,23 +1,118 @@
 """
 Celery tasks for scheduling and publishing posts
 """
+from datetime import timedelta
 from celery import shared_task
+from django.db import DatabaseError, transaction
+from django.db.models import F
 from django.utils import timezone
 from .models import ScheduledPost, PostAnalytics
-from .services import PlatformPublisherFactory
+from .services import (
+    AnalyticsSyncer, BatchPublisher, EngagementRollupBuilder, MediaStager, PlatformPublisherFactory,
+    PublishDispatcher, SnapshotCompactor, notify_schedule_change
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def _publish_post(post):
+    """
+    Publish a claimed post and write its outcome
+    
+    Args:
+        post (ScheduledPost): Post in 'processing' status
+    
+    Returns:
+        dict: Task result
+    """
+    # Get the appropriate publisher for the platform
+    publisher = PlatformPublisherFactory.get_publisher(post.platform)
+    
+    # Publish the post
+    result = publisher.publish(post)
+    
+    if result['success']:
+        # Update post status
+        post.status = 'posted'
+        post.posted_at = timezone.now()
+        post.platform_post_id = result.get('platform_post_id', '')
+        post.platform_post_url = result.get('platform_post_url', '')
+        
+        with transaction.atomic():
+            post.save()
+            
+            # Create analytics record
+            PostAnalytics.objects.create(scheduled_post=post)
+        
+        logger.info(f"Post {post.id} published successfully to {post.platform}")
+        return {
+            'status': 'success',
+            'post_id': post.id,
+            'platform': post.platform,
+            'platform_post_url': post.platform_post_url
+        }
+    
+    if result.get('retry_after') is not None:
+        # Platform quota reached, the post waits for the announced delay
+        deferred_until = timezone.now() + timedelta(seconds=result['retry_after'])
+        with transaction.atomic():
+            PublishDispatcher().release(
+                ScheduledPost.objects.filter(id=post.id, claim_token=post.claim_token),
+                deferred_until=deferred_until, claim_count=F('claim_count') - 1
+            )
+            notify_schedule_change([post.id])
+        
+        logger.warning(f"Post {post.id} deferred until {deferred_until}: {result.get('error')}")
+        return {
+            'status': 'deferred',
+            'post_id': post.id,
+            'deferred_until': deferred_until.isoformat()
+        }
+    
+    # Publishing failed
+    post.status = 'failed'
+    post.error_message = result.get('error', 'Unknown error')
+    post.save()
+    
+    logger.error(f"Failed to publish post {post.id}: {result.get('error')}")
+    return {
+        'status': 'failed',
+        'post_id': post.id,
+        'error': result.get('error')
+    }
+
+
+def _release_claim(post_id, claim_token, status, **fields):
+    """
+    Hand back the claim held by a failed publish_scheduled_post attempt
+    
+    Nothing is released when the attempt failed before claiming the post,
+    or when its claim was taken over since. Should the release itself fail,
+    the lease recovery of process_scheduled_posts takes over.
+    """
+    if claim_token is None:
+        return
+    try:
+        PublishDispatcher().release(
+            ScheduledPost.objects.filter(id=post_id, claim_token=claim_token), status, **fields
+        )
+    except DatabaseError as e:
+        logger.error(f"Could not release the claim on post {post_id}: {str(e)}")
+
+
 @shared_task(bind=True, max_retries=3)
 def publish_scheduled_post(self, post_id):
     """
     Celery task to publish a scheduled post
     
+    An unexpected error hands the post back to the schedule and retries
+    the task in 5 minutes; the last attempt fails the post instead.
+    
     Args:
         post_id (int): ID of the ScheduledPost instance
     """
+    claim_token = None
     try:
         # Get the scheduled post
         post = ScheduledPost.objects.get(id=post_id)
@@ -27,50 +122,19 @@ def publish_scheduled_post(self, post_id):
             logger.warning(f"Post {post_id} is not due yet")
             return {'status': 'not_due', 'post_id': post_id}
         
-        if post.status != 'scheduled':
-            logger.warning(f"Post {post_id} status is {post.status}, not scheduled")
+        # Claim the post, a dispatcher may have taken it since it was read
+        token, claimed = PublishDispatcher().claim(ScheduledPost.objects.filter(id=post_id))
+        if not claimed:
+            post.refresh_from_db()
+            if post.status == 'scheduled' and post.deferred_until and post.deferred_until > timezone.now():
+                logger.warning(f"Post {post_id} deferred until {post.deferred_until}, rate budget spent")
+                return {'status': 'deferred', 'post_id': post_id, 'deferred_until': post.deferred_until.isoformat()}
+            logger.warning(f"Post {post_id} was claimed elsewhere")
             return {'status': 'invalid_status', 'post_id': post_id}
+        claim_token = token
+        post.refresh_from_db()
         
-        # Update status to processing
-        post.status = 'processing'
-        post.save()
-        
-        # Get the appropriate publisher for the platform
-        publisher = PlatformPublisherFactory.get_publisher(post.platform)
-        
-        # Publish the post
-        result = publisher.publish(post)
-        
-        if result['success']:
-            # Update post status
-            post.status = 'posted'
-            post.posted_at = timezone.now()
-            post.platform_post_id = result.get('platform_post_id', '')
-            post.platform_post_url = result.get('platform_post_url', '')
-            post.save()
-            
-            # Create analytics record
-            PostAnalytics.objects.create(scheduled_post=post)
-            
-            logger.info(f"Post {post_id} published successfully to {post.platform}")
-            return {
-                'status': 'success',
-                'post_id': post_id,
-                'platform': post.platform,
-                'platform_post_url': post.platform_post_url
-            }
-        else:
-            # Publishing failed
-            post.status = 'failed'
-            post.error_message = result.get('error', 'Unknown error')
-            post.save()
-            
-            logger.error(f"Failed to publish post {post_id}: {result.get('error')}")
-            return {
-                'status': 'failed',
-                'post_id': post_id,
-                'error': result.get('error')
-            }
+        return _publish_post(post)
             
     except ScheduledPost.DoesNotExist:
         logger.error(f"Post {post_id} not found")
@@ -79,52 +143,67 @@ def publish_scheduled_post(self, post_id):
     except Exception as e:
         logger.error(f"Error publishing post {post_id}: {str(e)}")
         
-        # Update post status
-        try:
-            post = ScheduledPost.objects.get(id=post_id)
-            post.status = 'failed'
-            post.error_message = str(e)
-            post.save()
-        except:
-            pass
+        if self.request.retries < self.max_retries:
+            # The retry, or a dispatcher, claims the post again
+            _release_claim(post_id, claim_token, 'scheduled')
+            raise self.retry(exc=e, countdown=300)  # Retry after 5 minutes
         
-        # Retry the task
-        raise self.retry(exc=e, countdown=300)  # Retry after 5 minutes
+        _release_claim(post_id, claim_token, 'failed', error_message=str(e))
+        return {'status': 'failed', 'post_id': post_id, 'error': str(e)}
+
+
+@shared_task
+def publish_claimed_posts(post_ids, claim_token):
+    """
+    Celery task publishing a batch of posts claimed by the dispatcher
+    
+    The posts are published concurrently, within the concurrency cap of
+    each platform, and their outcomes written in bulk (see BatchPublisher)
+    
+    Args:
+        post_ids (list): IDs of ScheduledPost instances claimed by PublishDispatcher.claim
+        claim_token (str): Token of that claim
+    """
+    return {'status': 'success', **BatchPublisher().publish(post_ids, claim_token)}
 
 
 @shared_task
 def process_scheduled_posts():
     """
-    Celery task to process all due scheduled posts
-    Runs every 5 minutes via Celery Beat
+    Celery task to claim the due scheduled posts and enqueue them in batches
+    Runs every 5 minutes via Celery Beat; overlapping runs never claim the same post
     """
     try:
-        # Get all posts that are due
-        due_posts = ScheduledPost.objects.filter(
-            status='scheduled',
-            scheduled_time__lte=timezone.now()
-        )
-        
-        count = due_posts.count()
-        
-        if count == 0:
-            logger.info("No posts due for publishing")
-            return {'status': 'success', 'processed': 0}
+        dispatcher = PublishDispatcher()
+        recovered = dispatcher.recover_expired()
+        if recovered['rescheduled'] or recovered['failed']:
+            logger.warning(
+                f"Released expired claims: {recovered['rescheduled']} posts rescheduled, "
+                f"{recovered['failed']} failed"
+            )
         
-        # Trigger publishing for each post
+        # One message per claimed batch
         results = []
-        for post in due_posts:
-            result = publish_scheduled_post.delay(post.id)
+        while True:
+            claim_token, post_ids = dispatcher.claim(dispatcher.due())
+            if not post_ids:
+                break
+            result = publish_claimed_posts.delay(post_ids, claim_token)
             results.append({
-                'post_id': post.id,
+                'post_ids': post_ids,
                 'task_id': result.id
             })
         
-        logger.info(f"Started publishing {count} posts")
+        count = sum(len(result['post_ids']) for result in results)
+        if count == 0:
+            logger.info("No posts due for publishing")
+        else:
+            logger.info(f"Started publishing {count} posts in {len(results)} batches")
         return {
             'status': 'success',
             'processed': count,
-            'results': results
+            'results': results,
+            **recovered
         }
         
     except Exception as e:
@@ -132,6 +211,24 @@ def process_scheduled_posts():
         return {'status': 'error', 'message': str(e)}
 
 
+@shared_task
+def stage_upcoming_posts():
+    """
+    Celery task creating ahead of time the platform containers of the posts
+    due within PUBLISH_STAGING_LEAD seconds, so publishing only has to
+    publish them. Runs every minute via Celery Beat
+    """
+    try:
+        stager = MediaStager()
+        released = stager.release()
+        result = stager.stage()
+        return {'status': 'success', 'released': released, **result}
+    
+    except Exception as e:
+        logger.error(f"Error staging upcoming posts: {str(e)}")
+        return {'status': 'error', 'message': str(e)}
+
+
 @shared_task
 def sync_post_analytics(post_id):
     """
@@ -159,17 +256,11 @@ def sync_post_analytics(post_id):
                 scheduled_post=post
             )
             
-            analytics.likes = result.get('likes', 0)
-            analytics.comments = result.get('comments', 0)
-            analytics.shares = result.get('shares', 0)
-            analytics.views = result.get('views', 0)
-            analytics.reach = result.get('reach', 0)
-            analytics.impressions = result.get('impressions', 0)
-            analytics.raw_data = result
-            analytics.save()
-            
-            # Calculate engagement rate
-            analytics.calculate_engagement_rate()
+            # Metrics and engagement rate written in one save
+            analytics.apply_metrics(result)
+            with transaction.atomic():
+                analytics.save()
+                AnalyticsSyncer().store([analytics], [result])
             
             logger.info(f"Analytics synced for post {post_id}")
             return {
@@ -198,44 +289,57 @@ def sync_post_analytics(post_id):
         return {'status': 'error', 'message': str(e)}
 
 
+@shared_task
+def sync_due_analytics():
+    """
+    Celery task syncing the analytics due in each age tier, in batches
+    Runs every 5 minutes via Celery Beat (see AnalyticsSyncer)
+    """
+    try:
+        return {'status': 'success', **AnalyticsSyncer().run()}
+    
+    except Exception as e:
+        logger.error(f"Error syncing due analytics: {str(e)}")
+        return {'status': 'error', 'message': str(e)}
+
+
 @shared_task
 def sync_all_analytics():
     """
-    Celery task to sync analytics for all published posts
-    Runs daily via Celery Beat
+    Celery task to sync analytics for all the posts published in the last 30 days
+    Fetched and written in batches; the periodic sync is sync_due_analytics
     """
     try:
-        # Get all published posts from the last 30 days
-        from datetime import timedelta
-        cutoff_date = timezone.now() - timedelta(days=30)
-        
-        published_posts = ScheduledPost.objects.filter(
-            status='posted',
-            posted_at__gte=cutoff_date
-        )
-        
-        count = published_posts.count()
+        result = AnalyticsSyncer().run(full=True)
+        synced = sum(count for tier, count in result.items() if tier != 'failed')
         
-        if count == 0:
+        if synced == 0 and result['failed'] == 0:
             logger.info("No posts to sync analytics for")
-            return {'status': 'success', 'synced': 0}
-        
-        # Trigger analytics sync for each post
-        results = []
-        for post in published_posts:
-            result = sync_post_analytics.delay(post.id)
-            results.append({
-                'post_id': post.id,
-                'task_id': result.id
-            })
-        
-        logger.info(f"Started syncing analytics for {count} posts")
-        return {
-            'status': 'success',
-            'synced': count,
-            'results': results
-        }
+        else:
+            logger.info(f"Synced analytics for {synced} posts, {result['failed']} failed")
+        return {'status': 'success', 'synced': synced, **result}
         
     except Exception as e:
         logger.error(f"Error syncing all analytics: {str(e)}")
         return {'status': 'error', 'message': str(e)}
+
+
+@shared_task
+def compact_analytics_snapshots():
+    """
+    Celery task downsampling the analytics snapshots of the older days
+    Runs daily via Celery Beat (see SnapshotCompactor)
+    """
+    result = SnapshotCompactor().run()
+    return {'status': 'success', **result}
+
+
+@shared_task
+def rollup_post_analytics():
+    """
+    Celery task recomputing the daily engagement rollups touched by analytics syncs
+    Runs every hour via Celery Beat
+    """
+    result = EngagementRollupBuilder().run()
+    logger.info(f"Engagement rolled up: {result['rows']} rows over {result['days']} days")
+    return {'status': 'success', **result}
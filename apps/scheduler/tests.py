@@ -1,3 +1,1089 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import time as datetime_time, timedelta
+from unittest import mock
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
+from django.forms.models import model_to_dict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from apps.authentication.models import UserStats
+from apps.core.resilience import LocalSlidingWindowBackend, SlidingWindowLimiter
+from apps.core.rollups import bucket_start
+from apps.core.stub_server import StubHTTPServer, json_handler
+from apps.images.models import GeneratedImage, ImageRendition, ImageTag, ImageTagRelation
+from .models import (
+    AnalyticsSnapshot, EngagementRollup, PostAnalytics, PostAnalyticsPayload, PostingSchedule, ScheduledPost
+)
+from .services import (
+    AnalyticsSyncer, BatchPublisher, MediaStager, PlatformPublisherFactory, PublishDispatcher, PublishScheduler,
+    PublishTimer, SnapshotCompactor
+)
+from .services.timer import LocalScheduleChanges
+from .tasks import (
+    compact_analytics_snapshots, publish_claimed_posts, process_scheduled_posts, publish_scheduled_post, rollup_post_analytics, stage_upcoming_posts,
+    sync_all_analytics, sync_due_analytics
+)
 
-# Create your tests here.
+
+class RateBudgetTestMixin:
+    """
+    Publishers built from the test settings, with empty in-process budgets
+    """
+    
+    def setUp(self):
+        super().setUp()
+        LocalSlidingWindowBackend.reset()
+        publishers = mock.patch.dict(PlatformPublisherFactory._instances, clear=True)
+        publishers.start()
+        self.addCleanup(publishers.stop)
+
+
+class ListQueryCountTests(TestCase):
+    """
+    List endpoints cost a fixed number of queries, whatever the page size
+    """
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='scheduler', password='secret')
+        tags = [ImageTag.objects.create(name=f'tag{i}') for i in range(3)]
+        images = GeneratedImage.objects.bulk_create([
+            GeneratedImage(user=cls.user, prompt=f'prompt {i}', status='validated', metadata={'seed': i})
+            for i in range(60)
+        ])
+        ImageTagRelation.objects.bulk_create([
+            ImageTagRelation(image=image, tag=tag) for image in images for tag in tags
+        ])
+        ImageRendition.objects.bulk_create([
+            ImageRendition(image=image, name='instagram_square', file=f'renditions/{image.id}.jpg',
+                           width=1080, height=1080, format='JPEG', file_size=1024)
+            for image in images
+        ])
+        start = timezone.now() + timedelta(days=1)
+        ScheduledPost.objects.bulk_create([
+            ScheduledPost(user=cls.user, image=image, platform='instagram', caption=f'caption {i}',
+                          scheduled_time=start + timedelta(hours=i), metadata={'draft': i})
+            for i, image in enumerate(images)
+        ])
+        PostingSchedule.objects.bulk_create([
+            PostingSchedule(user=cls.user, name=f'schedule {i}', frequency='daily',
+                            time_of_day=datetime_time(9), platforms=['instagram'])
+            for i in range(60)
+        ])
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def assertPageQueries(self, url, expected, **params):
+        for page_size in (1, 10, 50):
+            with self.subTest(page_size=page_size), self.assertNumQueries(expected):
+                response = self.client.get(url, {'page_size': page_size, **params})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), page_size)
+    
+    def test_scheduled_post_list(self):
+        # count, page (with user, image and image owner), image tags, image renditions
+        self.assertPageQueries(reverse('scheduler:posts_list'), 4)
+    
+    def test_scheduled_post_list_filtered(self):
+        self.assertPageQueries(reverse('scheduler:posts_list'), 4, status='scheduled', platform='instagram')
+    
+    def test_scheduled_post_list_skips_metadata(self):
+        response = self.client.get(reverse('scheduler:posts_list'), {'page_size': 1})
+        result = response.data['results'][0]
+        
+        self.assertNotIn('metadata', result)
+        self.assertNotIn('metadata', result['image_details'])
+        self.assertEqual(sorted(result['image_details']['tags']), ['tag0', 'tag1', 'tag2'])
+        self.assertEqual(len(result['image_details']['renditions']), 1)
+    
+    def test_posting_schedule_list(self):
+        # count, page (with user)
+        self.assertPageQueries(reverse('scheduler:schedules_list'), 2)
+
+    def test_scheduled_post_cursor_walk(self):
+        url = reverse('scheduler:posts_list')
+        response = self.client.get(url, {'pagination': 'cursor', 'page_size': 25})
+        ids = []
+        while True:
+            ids.extend(row['id'] for row in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        
+        expected = list(
+            ScheduledPost.objects.filter(user=self.user).order_by('scheduled_time', 'id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+
+
+class CaptionSearchTests(TestCase):
+    
+    def test_fulltext_search_on_caption_and_hashtags(self):
+        user = User.objects.create_user(username='captions', password='secret')
+        image = GeneratedImage.objects.create(user=user, prompt='plage', status='validated')
+        scheduled_time = timezone.now() + timedelta(days=1)
+        summer = ScheduledPost.objects.create(
+            user=user, image=image, platform='instagram', scheduled_time=scheduled_time,
+            caption="Les vacances d'été commencent", hashtags='#plage #soleil'
+        )
+        ScheduledPost.objects.create(
+            user=user, image=image, platform='instagram', scheduled_time=scheduled_time,
+            caption='Joyeux Noël', hashtags='#hiver'
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        
+        response = client.get(reverse('scheduler:posts_list'), {'search': 'ete sol', 'search_mode': 'fulltext'})
+        
+        self.assertEqual([row['id'] for row in response.data['results']], [summer.id])
+
+
+@override_settings(PUBLISH_RATE_BUDGET_BACKEND='local')
+class SchedulerStatisticsTests(RateBudgetTestMixin, TestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='poster', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.image = GeneratedImage.objects.create(user=self.user, prompt='plage', status='validated')
+        now = timezone.now()
+        self.due = ScheduledPost.objects.create(
+            user=self.user, image=self.image, platform='instagram', caption='due',
+            scheduled_time=now - timedelta(minutes=1)
+        )
+        self.upcoming = ScheduledPost.objects.create(
+            user=self.user, image=self.image, platform='twitter', caption='upcoming',
+            scheduled_time=now + timedelta(days=1)
+        )
+        posted = ScheduledPost.objects.create(
+            user=self.user, image=self.image, platform='instagram', caption='posted',
+            scheduled_time=now - timedelta(days=1), status='posted'
+        )
+        PostAnalytics.objects.create(scheduled_post=posted, engagement_rate=4.0)
+    
+    def _statistics(self, queries):
+        with self.assertNumQueries(queries):
+            return self.client.get(reverse('scheduler:statistics')).data
+    
+    def test_single_aggregate_query(self):
+        self.assertEqual(self._statistics(1), {
+            'total_scheduled': 2, 'total_posted': 1, 'total_failed': 0, 'total_cancelled': 0,
+            'upcoming_posts': 1, 'posts_by_platform': {'instagram': 2, 'twitter': 1},
+            'average_engagement_rate': 4.0,
+        })
+    
+    @override_settings(USER_STATS_ENABLED=True)
+    def test_counters_follow_publishing(self):
+        UserStats.rebuild(self.user.id)
+        publisher = mock.Mock()
+        publisher.publish.return_value = {'success': True, 'platform_post_id': '42'}
+        publisher.rate_budget.take.return_value = (1, 0.0)
+        with mock.patch('apps.scheduler.tasks.PlatformPublisherFactory.get_publisher', return_value=publisher):
+            publish_scheduled_post.apply(args=(self.due.id,))
+        self.upcoming.cancel()
+        
+        # The counters row plus the time-dependent upcoming count
+        self.assertEqual(self._statistics(2), {
+            'total_scheduled': 0, 'total_posted': 2, 'total_failed': 0, 'total_cancelled': 1,
+            'upcoming_posts': 0, 'posts_by_platform': {'instagram': 2, 'twitter': 1},
+            'average_engagement_rate': 2.0,
+        })
+        
+        # Deleting the image cascades to its posts and their analytics
+        self.image.delete()
+        self.assertEqual(
+            model_to_dict(UserStats.objects.get(user=self.user)),
+            model_to_dict(UserStats.rebuild(self.user.id))
+        )
+        self.assertEqual(UserStats.objects.get(user=self.user).analytics_count, 0)
+
+
+class EngagementRollupTests(TestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='engaged', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        image = GeneratedImage.objects.create(user=self.user, prompt='plage', status='validated')
+        self.day = bucket_start(timezone.now() - timedelta(days=2), 'day')
+        self.analytics = []
+        for hours, platform, likes, rate in ((9, 'instagram', 10, 2.0), (15, 'instagram', 30, 4.0),
+                                             (12, 'twitter', 5, 1.0), (36, 'instagram', 7, 3.0)):
+            post = ScheduledPost.objects.create(
+                user=self.user, image=image, platform=platform, caption='caption', status='posted',
+                scheduled_time=self.day, posted_at=self.day + timedelta(hours=hours)
+            )
+            self.analytics.append(PostAnalytics.objects.create(
+                scheduled_post=post, likes=likes, engagement_rate=rate
+            ))
+    
+    def _rollups(self, **params):
+        response = self.client.get(reverse('scheduler:engagement_rollups'), dict(
+            start=self.day.isoformat(), **params
+        ))
+        self.assertEqual(response.status_code, 200)
+        return [
+            (row['bucket'], row['platform'], row['posts'], row['likes'], row['average_engagement_rate'])
+            for row in response.data['results']
+        ]
+    
+    def test_daily_engagement_per_platform(self):
+        self.assertEqual(rollup_post_analytics()['days'], 2)
+        
+        next_day = self.day + timedelta(days=1)
+        self.assertEqual(self._rollups(), [
+            (self.day.isoformat(), 'instagram', 2, 40, 3.0),
+            (self.day.isoformat(), 'twitter', 1, 5, 1.0),
+            (next_day.isoformat(), 'instagram', 1, 7, 3.0),
+        ])
+        self.assertEqual(self._rollups(platform='twitter'), [(self.day.isoformat(), 'twitter', 1, 5, 1.0)])
+    
+    def test_only_synced_days_are_recomputed(self):
+        rollup_post_analytics()
+        # Nothing synced since the last run
+        EngagementRollup.objects.update(updated_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(rollup_post_analytics()['days'], 0)
+        
+        synced_at = timezone.now() + timedelta(hours=2)
+        PostAnalytics.objects.filter(id=self.analytics[0].id).update(likes=50, last_synced_at=synced_at)
+        
+        self.assertEqual(rollup_post_analytics(), {'status': 'success', 'days': 1, 'rows': 2})
+        self.assertEqual(self._rollups(platform='instagram')[0][3], 80)
+
+
+@override_settings(PUBLISH_RATE_BUDGET_BACKEND='local')
+class PublishDispatchTests(RateBudgetTestMixin, TestCase):
+    """
+    Due posts are claimed in batches before being enqueued
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='dispatcher', password='secret')
+        self.image = GeneratedImage.objects.create(user=self.user, prompt='plage', status='validated')
+        now = timezone.now()
+        self.due = [
+            ScheduledPost.objects.create(
+                user=self.user, image=self.image, platform='instagram', caption=f'due {i}',
+                scheduled_time=now - timedelta(minutes=i)
+            )
+            for i in range(5)
+        ]
+        self.upcoming = ScheduledPost.objects.create(
+            user=self.user, image=self.image, platform='twitter', caption='upcoming',
+            scheduled_time=now + timedelta(hours=1)
+        )
+    
+    @override_settings(USER_STATS_ENABLED=True, PUBLISH_BATCH_SIZE=2)
+    def test_due_posts_are_claimed_once_in_batches(self):
+        UserStats.rebuild(self.user.id)
+        with mock.patch.object(publish_claimed_posts, 'delay') as delay:
+            result = process_scheduled_posts()
+            again = process_scheduled_posts()
+        
+        self.assertEqual(result['processed'], 5)
+        self.assertEqual([len(call.args[0]) for call in delay.call_args_list], [2, 2, 1])
+        # One claim token per batch
+        self.assertEqual(len({call.args[1] for call in delay.call_args_list}), 3)
+        # Earliest first
+        self.assertEqual(delay.call_args_list[0].args[0], [self.due[4].id, self.due[3].id])
+        self.assertEqual(again['processed'], 0)
+        self.assertEqual(ScheduledPost.objects.filter(status='processing', claim_count=1).count(), 5)
+        self.assertEqual(ScheduledPost.objects.get(id=self.upcoming.id).status, 'scheduled')
+        self.assertEqual(
+            model_to_dict(UserStats.objects.get(user=self.user)),
+            model_to_dict(UserStats.rebuild(self.user.id))
+        )
+    
+    def test_claimed_batch_is_published(self):
+        claim_token, post_ids = PublishDispatcher(batch_size=10).claim(PublishDispatcher().due())
+        publisher = mock.Mock(max_concurrency=1)
+        publisher.publish.side_effect = [
+            {'success': True, 'platform_post_id': '1'}, {'success': False, 'error': 'refusé'}, RuntimeError('boom'),
+            {'success': True}, {'success': True},
+        ]
+        with mock.patch('apps.scheduler.tasks.PlatformPublisherFactory.get_publisher', return_value=publisher):
+            result = publish_claimed_posts(post_ids, claim_token)
+        
+        self.assertEqual((result['published'], result['failed']), (3, 2))
+        self.assertEqual(ScheduledPost.objects.filter(status='posted').count(), 3)
+        self.assertEqual(PostAnalytics.objects.count(), 3)
+        # A direct publish of an already claimed post does nothing
+        self.assertEqual(publish_scheduled_post.apply(args=(self.due[0].id,)).result['status'], 'not_due')
+    
+    @override_settings(USER_STATS_ENABLED=True)
+    def test_direct_publish_retries_with_the_post_claimable(self):
+        UserStats.rebuild(self.user.id)
+        publisher = mock.Mock()
+        publisher.publish.side_effect = [RuntimeError('boom'), {'success': True, 'platform_post_id': '42'}]
+        publisher.rate_budget.take.return_value = (1, 0.0)
+        with mock.patch('apps.scheduler.tasks.PlatformPublisherFactory.get_publisher', return_value=publisher), \
+                mock.patch('apps.scheduler.services.dispatch.PlatformPublisherFactory.get_publisher',
+                           return_value=publisher):
+            publish_scheduled_post.apply(args=(self.due[0].id,))
+        
+        self.assertEqual(publisher.publish.call_count, 2)
+        post = ScheduledPost.objects.get(id=self.due[0].id)
+        self.assertEqual((post.status, post.platform_post_id, post.claim_count), ('posted', '42', 2))
+        self.assertEqual(
+            model_to_dict(UserStats.objects.get(user=self.user)),
+            model_to_dict(UserStats.rebuild(self.user.id))
+        )
+    
+    def test_direct_publish_fails_the_post_after_the_last_retry(self):
+        publisher = mock.Mock()
+        publisher.publish.side_effect = RuntimeError('boom')
+        publisher.rate_budget.take.return_value = (1, 0.0)
+        with mock.patch('apps.scheduler.tasks.PlatformPublisherFactory.get_publisher', return_value=publisher), \
+                mock.patch('apps.scheduler.services.dispatch.PlatformPublisherFactory.get_publisher',
+                           return_value=publisher):
+            publish_scheduled_post.apply(args=(self.due[0].id,))
+        
+        self.assertEqual(publisher.publish.call_count, 4)
+        post = ScheduledPost.objects.get(id=self.due[0].id)
+        self.assertEqual((post.status, post.error_message), ('failed', 'boom'))
+    
+    @override_settings(USER_STATS_ENABLED=True)
+    def test_expired_leases_are_recovered(self):
+        UserStats.rebuild(self.user.id)
+        dispatcher = PublishDispatcher(lease_timeout=600, max_claims=2)
+        now = timezone.now()
+        dispatcher.claim(dispatcher.due(now), now=now - timedelta(minutes=20))
+        ScheduledPost.objects.filter(id=self.due[0].id).update(claim_count=2)
+        ScheduledPost.objects.filter(id=self.due[1].id).update(claimed_at=now - timedelta(minutes=5))
+        
+        self.assertEqual(dispatcher.recover_expired(now), {'rescheduled': 3, 'failed': 1})
+        statuses = dict(ScheduledPost.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[self.due[0].id], 'failed')
+        self.assertEqual(statuses[self.due[1].id], 'processing')
+        self.assertEqual(dispatcher.claim(dispatcher.due(now), now=now)[1], [self.due[4].id, self.due[3].id, self.due[2].id])
+        self.assertEqual(
+            model_to_dict(UserStats.objects.get(user=self.user)),
+            model_to_dict(UserStats.rebuild(self.user.id))
+        )
+
+
+@override_settings(PUBLISH_RATE_BUDGET_BACKEND='local', PUBLISH_RATE_LIMIT_INSTAGRAM=0)
+class ConcurrentDispatchTests(RateBudgetTestMixin, TransactionTestCase):
+    """
+    Dispatchers running at the same time never claim the same post
+    """
+    
+    def test_concurrent_dispatchers_share_the_due_posts(self):
+        user = User.objects.create_user(username='racer', password='secret')
+        image = GeneratedImage.objects.create(user=user, prompt='plage', status='validated')
+        now = timezone.now()
+        ScheduledPost.objects.bulk_create([
+            ScheduledPost(user=user, image=image, platform='instagram', caption=str(i),
+                          scheduled_time=now - timedelta(seconds=i))
+            for i in range(200)
+        ])
+        
+        claims = []
+        errors = []
+        start = threading.Barrier(4)
+        
+        def claim(dispatcher):
+            # The shared-cache in-memory test database reports a busy table at
+            # once instead of waiting for the lock like a file database
+            while True:
+                try:
+                    return dispatcher.claim(dispatcher.due())[1]
+                except OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    time.sleep(0.001)
+        
+        def dispatch():
+            dispatcher = PublishDispatcher(batch_size=7)
+            try:
+                start.wait()
+                while True:
+                    post_ids = claim(dispatcher)
+                    if not post_ids:
+                        break
+                    claims.append(post_ids)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=dispatch) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(errors, [])
+        claimed = [post_id for batch in claims for post_id in batch]
+        self.assertEqual(len(claimed), 200)
+        self.assertEqual(len(set(claimed)), 200)
+        self.assertEqual(ScheduledPost.objects.filter(status='processing', claim_count=1).count(), 200)
+
+
+@override_settings(PUBLISH_RATE_BUDGET_BACKEND='local')
+class PublishSchedulerTests(RateBudgetTestMixin, TestCase):
+    """
+    The publish scheduler enqueues each post at its scheduled time
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='timer', password='secret')
+        self.image = GeneratedImage.objects.create(user=self.user, prompt='montagne', status='validated')
+        self.now = timezone.now()
+        self.late, self.soon, self.later, self.far = [
+            ScheduledPost.objects.create(
+                user=self.user, image=self.image, platform='instagram', caption=f'post {i}',
+                scheduled_time=self.now + timedelta(seconds=offset)
+            )
+            for i, offset in enumerate((-60, 10, 20, 3600))
+        ]
+        self.changes = LocalScheduleChanges()
+        self.changes.wait(0)
+        self.enqueued = []
+        self.scheduler = PublishScheduler(
+            lookahead=300, refresh=60, changes=self.changes,
+            enqueue=lambda post_ids, claim_token: self.enqueued.append(post_ids)
+        )
+    
+    def test_timer_pops_moved_posts_in_order(self):
+        timer = PublishTimer()
+        timer.schedule(1, self.now + timedelta(seconds=5))
+        timer.schedule(2, self.now + timedelta(seconds=1))
+        timer.schedule(3, self.now + timedelta(seconds=3))
+        timer.schedule(1, self.now + timedelta(seconds=2))
+        timer.remove(3)
+        
+        self.assertEqual(len(timer), 2)
+        self.assertEqual(timer.next_deadline(), self.now + timedelta(seconds=1))
+        self.assertEqual(timer.pop_due(self.now), [])
+        self.assertEqual(
+            timer.pop_due(self.now + timedelta(seconds=10)),
+            [(2, self.now + timedelta(seconds=1)), (1, self.now + timedelta(seconds=2))]
+        )
+        self.assertIsNone(timer.next_deadline())
+    
+    def test_posts_are_enqueued_once_due(self):
+        self.assertEqual(self.scheduler.refresh(self.now), 3)
+        self.assertNotIn(self.far.id, self.scheduler.timer)
+        
+        self.assertEqual(self.scheduler.fire_due(self.now), [self.late.id])
+        self.assertEqual(self.scheduler.fire_due(self.now + timedelta(seconds=5)), [])
+        # Published in the meantime by "publish now": skipped
+        PublishDispatcher().claim(ScheduledPost.objects.filter(id=self.later.id))
+        self.assertEqual(self.scheduler.fire_due(self.now + timedelta(seconds=30)), [self.soon.id])
+        
+        self.assertEqual(self.enqueued, [[self.late.id], [self.soon.id]])
+        self.assertEqual(self.scheduler._timeout(self.now), 1.0)
+        self.assertEqual(len(self.scheduler.timer), 0)
+    
+    def test_stale_entries_are_not_fired_early(self):
+        self.scheduler.refresh(self.now)
+        # Moved and deferred without the scheduler hearing of it
+        ScheduledPost.objects.filter(id=self.soon.id).update(scheduled_time=self.now + timedelta(seconds=120))
+        ScheduledPost.objects.filter(id=self.later.id).update(deferred_until=self.now + timedelta(seconds=90))
+        
+        self.assertEqual(self.scheduler.fire_due(self.now + timedelta(seconds=30)), [self.late.id])
+        self.assertEqual(ScheduledPost.objects.filter(status='scheduled').count(), 3)
+        # Put back at their current deadlines
+        self.assertEqual(
+            self.scheduler.timer.pop_due(self.now + timedelta(minutes=5)),
+            [(self.later.id, self.now + timedelta(seconds=90)), (self.soon.id, self.now + timedelta(seconds=120))]
+        )
+    
+    @override_settings(PUBLISH_TIMER_BACKEND='local')
+    def test_api_changes_update_the_timer(self):
+        self.scheduler.refresh(self.now)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(reverse('scheduler:schedule'), {
+                'image': self.image.id, 'platform': 'twitter', 'caption': 'nouveau',
+                'scheduled_time': (self.now + timedelta(seconds=30)).isoformat()
+            })
+            client.patch(reverse('scheduler:post_detail', args=[self.far.id]), {
+                'scheduled_time': (self.now + timedelta(seconds=40)).isoformat()
+            })
+            client.patch(reverse('scheduler:post_detail', args=[self.soon.id]), {'caption': 'légende'})
+            client.post(reverse('scheduler:cancel_post', args=[self.later.id]))
+        created_id = response.data['post']['id']
+        
+        post_ids = self.changes.wait(0)
+        self.assertEqual(sorted(post_ids), sorted([created_id, self.far.id, self.later.id]))
+        self.scheduler.apply_changes(post_ids)
+        self.assertEqual(
+            [post_id for post_id, _ in self.scheduler.timer.pop_due(self.now + timedelta(minutes=1))],
+            [self.late.id, self.soon.id, created_id, self.far.id]
+        )
+
+
+class CountingPublisher:
+    """
+    Publisher recording how many posts it publishes at the same time
+    """
+    
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+    
+    def publish(self, post):
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        time.sleep(0.05)
+        with self.lock:
+            self.in_flight -= 1
+        # Loaded with the batch: no query from the publishing threads
+        if post.user.profile and post.image and 'refus' in post.caption:
+            return {'success': False, 'error': 'refusé'}
+        return {'success': True, 'platform_post_id': str(post.id)}
+
+
+@override_settings(PUBLISH_RATE_BUDGET_BACKEND='local')
+class BatchPublishingTests(RateBudgetTestMixin, TestCase):
+    """
+    Claimed batches are published concurrently and written in bulk
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='batch', password='secret')
+        self.image = GeneratedImage.objects.create(user=self.user, prompt='forêt', status='validated')
+        self.publishers = {'instagram': CountingPublisher(3), 'twitter': CountingPublisher(1)}
+    
+    def claim(self, platforms, caption='post'):
+        for platform in platforms:
+            ScheduledPost.objects.create(
+                user=self.user, image=self.image, platform=platform, caption=caption,
+                scheduled_time=timezone.now() - timedelta(minutes=1)
+            )
+        return PublishDispatcher(batch_size=len(platforms)).claim(PublishDispatcher().due())
+    
+    def publish(self, claimed):
+        claim_token, post_ids = claimed
+        with mock.patch.dict(PlatformPublisherFactory._instances, self.publishers):
+            return publish_claimed_posts(post_ids, claim_token)
+    
+    @override_settings(USER_STATS_ENABLED=True)
+    def test_platforms_publish_concurrently_within_their_cap(self):
+        UserStats.rebuild(self.user.id)
+        batch = self.claim(['instagram'] * 6 + ['twitter'] * 2 + ['linkedin'])
+        refused = self.claim(['instagram'], caption='refusé')
+        
+        results = [self.publish(batch), self.publish(refused)]
+        
+        self.assertEqual([(result['published'], result['failed']) for result in results], [(8, 1), (0, 1)])
+        self.assertEqual(self.publishers['instagram'].peak, 3)
+        self.assertEqual(self.publishers['twitter'].peak, 1)
+        self.assertEqual(
+            dict(ScheduledPost.objects.filter(status='failed').values_list('platform', 'error_message')),
+            {'linkedin': 'Unsupported platform: linkedin', 'instagram': 'refusé'}
+        )
+        posted = ScheduledPost.objects.filter(status='posted')
+        self.assertEqual(posted.exclude(posted_at=None).count(), 8)
+        self.assertEqual(PostAnalytics.objects.filter(scheduled_post__in=posted).count(), 8)
+        self.assertEqual(
+            model_to_dict(UserStats.objects.get(user=self.user)),
+            model_to_dict(UserStats.rebuild(self.user.id))
+        )
+    
+    def test_queries_do_not_grow_with_the_batch(self):
+        counts = []
+        for size in (2, 20):
+            claimed = self.claim(['instagram', 'twitter'] * (size // 2))
+            with CaptureQueriesContext(connection) as queries:
+                self.publish(claimed)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+    
+    def test_only_the_claim_holder_publishes(self):
+        claim_token, post_ids = self.claim(['instagram'] * 2)
+        # The lease expired and the posts were claimed again
+        PublishDispatcher().release(ScheduledPost.objects.filter(id__in=post_ids))
+        again = PublishDispatcher().claim(PublishDispatcher().due())
+        
+        self.assertEqual(self.publish((claim_token, post_ids))['published'], 0)
+        self.assertEqual(self.publishers['instagram'].peak, 0)
+        self.assertEqual(self.publish(again)['published'], 2)
+    
+    @override_settings(USER_STATS_ENABLED=True)
+    def test_outcomes_of_lost_claims_are_not_written(self):
+        UserStats.rebuild(self.user.id)
+        claimed = self.claim(['instagram'] * 2)
+        lost = claimed[1][0]
+        save = BatchPublisher._save
+        
+        def recovered_meanwhile(publisher, outcomes, claim_token):
+            # The lease expired while the platform calls were running
+            PublishDispatcher().release(ScheduledPost.objects.filter(id=lost))
+            return save(publisher, outcomes, claim_token)
+        
+        with mock.patch.object(BatchPublisher, '_save', recovered_meanwhile):
+            result = self.publish(claimed)
+        
+        self.assertEqual(result['published'], 1)
+        self.assertEqual(ScheduledPost.objects.get(id=lost).status, 'scheduled')
+        self.assertFalse(PostAnalytics.objects.filter(scheduled_post_id=lost).exists())
+        self.assertEqual(
+            model_to_dict(UserStats.objects.get(user=self.user)),
+            model_to_dict(UserStats.rebuild(self.user.id))
+        )
+
+
+class QuotaHandler:
+    """
+    Stub platform API publishing ``limit`` posts, then answering with its quota headers and 429
+    """
+    
+    def __init__(self, limit, headers, payload):
+        self.limit = limit
+        self.headers = headers
+        self.body = json.dumps(payload).encode()
+        self.calls = 0
+    
+    def __call__(self, method, path, body):
+        self.calls += 1
+        if self.calls > self.limit:
+            return 429, self.headers, b'{}'
+        return 200, {'Content-Type': 'application/json'}, self.body
+
+
+@override_settings(
+    PUBLISH_RATE_BUDGET_BACKEND='local', PUBLISH_RATE_LIMIT_INSTAGRAM=2, PUBLISH_RATE_WINDOW_INSTAGRAM=3600,
+    PUBLISH_CONCURRENCY_TWITTER=1, INSTAGRAM_ACCESS_TOKEN='token', FACEBOOK_ACCESS_TOKEN='token',
+    TWITTER_API_KEY='key', TWITTER_API_SECRET='secret'
+)
+class RateBudgetTests(RateBudgetTestMixin, TestCase):
+    """
+    Posts over the quota of their platform account are deferred, not failed
+    """
+    
+    def setUp(self):
+        super().setUp()
+        self.users = []
+        for name in ('alice', 'bob'):
+            user = User.objects.create_user(username=name, password='secret')
+            user.profile.instagram_username = f'{name}_insta'
+            user.profile.save()
+            self.users.append(user)
+        self.image = GeneratedImage.objects.create(
+            user=self.users[0], prompt='lac', status='validated', image_url='https://example.com/lac.png'
+        )
+    
+    def schedule(self, user, count, platform='instagram'):
+        return [
+            ScheduledPost.objects.create(
+                user=user, image=self.image, platform=platform, caption=f'post {i}',
+                scheduled_time=timezone.now() - timedelta(minutes=count - i)
+            )
+            for i in range(count)
+        ]
+    
+    def test_window_slides(self):
+        budget = SlidingWindowLimiter('test', limit=3, window=60, backend='local')
+        with mock.patch('apps.core.resilience.time.time', return_value=1000.0):
+            self.assertEqual(budget.take('account', 2), (2, 0.0))
+        with mock.patch('apps.core.resilience.time.time', return_value=1030.0):
+            self.assertEqual(budget.take('account', 2), (1, 30.0))
+            self.assertEqual(budget.take('other', 1), (1, 0.0))
+        with mock.patch('apps.core.resilience.time.time', return_value=1060.0):
+            # The two calls made at 1000 left the window
+            self.assertEqual(budget.take('account', 3), (2, 30.0))
+        
+        budget.block('other', time.time() + 120)
+        granted, wait = budget.take('other', 1)
+        self.assertEqual(granted, 0)
+        self.assertAlmostEqual(wait, 120, delta=1)
+    
+    @override_settings(USER_STATS_ENABLED=True)
+    def test_posts_over_budget_are_deferred_per_account(self):
+        for user in self.users:
+            UserStats.rebuild(user.id)
+        alice_posts = self.schedule(self.users[0], 3)
+        bob_posts = self.schedule(self.users[1], 2)
+        dispatcher = PublishDispatcher(batch_size=10)
+        
+        now = timezone.now()
+        _, claimed = dispatcher.claim(dispatcher.due(now), now=now)
+        
+        self.assertEqual(sorted(claimed), sorted(post.id for post in alice_posts[:2] + bob_posts))
+        deferred = ScheduledPost.objects.get(id=alice_posts[2].id)
+        self.assertEqual((deferred.status, deferred.claim_count, deferred.claim_token), ('scheduled', 0, None))
+        self.assertAlmostEqual((deferred.deferred_until - now).total_seconds(), 3600, delta=5)
+        # Not due again before the budget frees a slot
+        self.assertEqual(dispatcher.claim(dispatcher.due(now), now=now)[1], [])
+        self.assertTrue(dispatcher.due(deferred.deferred_until).filter(id=deferred.id).exists())
+        for user in self.users:
+            self.assertEqual(
+                model_to_dict(UserStats.objects.get(user=user)),
+                model_to_dict(UserStats.rebuild(user.id))
+            )
+    
+    def test_publishers_keep_their_budget(self):
+        publisher = PlatformPublisherFactory.get_publisher('instagram')
+        self.assertIs(publisher.rate_budget, publisher.rate_budget)
+        self.assertEqual((publisher.rate_budget.limit, publisher.rate_budget.window), (2, 3600))
+
+    def test_quota_refusal_defers_the_batch_post(self):
+        reset = time.time() + 900
+        handler = QuotaHandler(
+            limit=1, headers={'x-rate-limit-remaining': '0', 'x-rate-limit-reset': str(reset)},
+            payload={'data': {'id': '1789'}}
+        )
+        first, second = self.schedule(self.users[0], 2, platform='twitter')
+        publisher = PlatformPublisherFactory.get_publisher('twitter')
+        claim_token, post_ids = PublishDispatcher().claim(PublishDispatcher().due())
+        
+        with StubHTTPServer(handler) as server:
+            publisher.api_url = server.url
+            result = publish_claimed_posts(post_ids, claim_token)
+        
+        self.assertEqual((result['published'], result['failed'], result['deferred']), (1, 0, 1))
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.platform_post_id), ('posted', '1789'))
+        second.refresh_from_db()
+        self.assertEqual((second.status, second.claim_count), ('scheduled', 0))
+        self.assertAlmostEqual(second.deferred_until.timestamp(), reset, delta=5)
+        # The account stays blocked until the announced reset
+        granted, wait = publisher.rate_budget.take(publisher.account_key(second))
+        self.assertEqual(granted, 0)
+        self.assertAlmostEqual(wait, 900, delta=5)
+    
+    def test_spent_quota_defers_the_next_posts(self):
+        usage = {'123': [{'call_count': 100, 'total_time': 20, 'estimated_time_to_regain_access': 15}]}
+        handler = json_handler({'id': '1789'})
+        
+        def spent(method, path, body):
+            status, headers, payload = handler(method, path, body)
+            return status, {**headers, 'X-Business-Use-Case-Usage': json.dumps(usage)}, payload
+        
+        [first] = self.schedule(self.users[0], 1)
+        publisher = PlatformPublisherFactory.get_publisher('instagram')
+        claim_token, post_ids = PublishDispatcher().claim(PublishDispatcher().due())
+        with StubHTTPServer(spent) as server:
+            publisher.api_url = server.url
+            result = publish_claimed_posts(post_ids, claim_token)
+        
+        self.assertEqual(result['published'], 1)
+        self.assertEqual(ScheduledPost.objects.get(id=first.id).status, 'posted')
+        # The budget of the account has one slot left, but Meta said the quota is spent
+        [second] = self.schedule(self.users[0], 1)
+        now = timezone.now()
+        self.assertEqual(PublishDispatcher().claim(PublishDispatcher().due(now), now=now)[1], [])
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'scheduled')
+        self.assertAlmostEqual((second.deferred_until - now).total_seconds(), 900, delta=5)
+    
+    def test_rate_limited_post_task_is_deferred(self):
+        self.users[0].profile.facebook_page_id = '42'
+        self.users[0].profile.save()
+        [post] = self.schedule(self.users[0], 1, platform='facebook')
+        publisher = PlatformPublisherFactory.get_publisher('facebook')
+        handler = QuotaHandler(limit=0, headers={'Retry-After': '120'}, payload={})
+        
+        with StubHTTPServer(handler) as server:
+            publisher.api_url = server.url
+            result = publish_scheduled_post.apply(args=(post.id,)).result
+        
+        self.assertEqual(result['status'], 'deferred')
+        post.refresh_from_db()
+        self.assertEqual((post.status, post.claim_count), ('scheduled', 0))
+        self.assertAlmostEqual((post.deferred_until - timezone.now()).total_seconds(), 120, delta=5)
+        self.assertEqual(publisher.rate_budget.take(publisher.account_key(post))[0], 0)
+
+
+@override_settings(
+    PUBLISH_RATE_BUDGET_BACKEND='local', PUBLISH_STAGING_LEAD=900,
+    INSTAGRAM_ACCESS_TOKEN='token', FACEBOOK_ACCESS_TOKEN='token'
+)
+class MediaStagingTests(RateBudgetTestMixin, TestCase):
+    """
+    Containers are created before the scheduled time and reused when publishing
+    """
+    
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='staging', password='secret')
+        self.user.profile.instagram_username = 'staging_insta'
+        self.user.profile.facebook_page_id = '42'
+        self.user.profile.save()
+        self.image = GeneratedImage.objects.create(
+            user=self.user, prompt='montagne', status='validated', image_url='https://example.com/montagne.png'
+        )
+    
+    def schedule(self, minutes, platform='instagram'):
+        return ScheduledPost.objects.create(
+            user=self.user, image=self.image, platform=platform, caption='sommet',
+            scheduled_time=timezone.now() + timedelta(minutes=minutes)
+        )
+    
+    def test_upcoming_posts_are_staged_once(self):
+        soon = self.schedule(5)
+        later = self.schedule(60)
+        stager = MediaStager()
+        
+        self.assertEqual(stager.stage(), {'staged': 1, 'failed': 0})
+        soon.refresh_from_db()
+        self.assertEqual(soon.metadata['staging']['container_id'], 'instagram_container_mock_id')
+        self.assertNotIn('staging', ScheduledPost.objects.get(id=later.id).metadata)
+        self.assertEqual(stager.stage(), {'staged': 0, 'failed': 0})
+        
+        # An edited caption needs a new container
+        soon.caption = 'au sommet'
+        soon.save()
+        self.assertEqual(stager.stage(), {'staged': 1, 'failed': 0})
+    
+    @override_settings(INSTAGRAM_ACCESS_TOKEN='')
+    def test_staging_failure_leaves_the_post_to_publishing(self):
+        post = self.schedule(5)
+        self.assertEqual(MediaStager().stage(), {'staged': 0, 'failed': 1})
+        post.refresh_from_db()
+        self.assertEqual(post.metadata, {})
+    
+    def test_publishing_reuses_the_staged_container(self):
+        staged = self.schedule(5)
+        expired = self.schedule(5)
+        MediaStager().stage()
+        publisher = PlatformPublisherFactory.get_publisher('instagram')
+        expired.refresh_from_db()
+        staging = {**expired.metadata['staging'], 'expires_at': timezone.now().isoformat()}
+        ScheduledPost.objects.filter(id=expired.id).update(metadata={'staging': staging})
+        ScheduledPost.objects.update(scheduled_time=timezone.now() - timedelta(minutes=1))
+        
+        claim_token, post_ids = PublishDispatcher().claim(PublishDispatcher().due())
+        with StubHTTPServer(json_handler({'id': '1789'})) as server, \
+                mock.patch.object(publisher, 'create_container', wraps=publisher.create_container) as create:
+            publisher.api_url = server.url
+            result = publish_claimed_posts(post_ids, claim_token)
+        
+        self.assertEqual(result['published'], 2)
+        # Only the post whose container expired uploads at publish time
+        self.assertEqual([call.args[0].id for call in create.call_args_list], [expired.id])
+        self.assertEqual(ScheduledPost.objects.get(id=staged.id).status, 'posted')
+    
+    def test_cancelled_posts_release_their_container(self):
+        post = self.schedule(5, platform='facebook')
+        MediaStager().stage()
+        post.refresh_from_db()
+        staging = post.metadata['staging']
+        post.cancel()
+        
+        publisher = PlatformPublisherFactory.get_publisher('facebook')
+        with mock.patch.object(publisher, 'discard') as discard:
+            self.assertEqual(stage_upcoming_posts()['released'], 1)
+        
+        discard.assert_called_once_with(staging)
+        post.refresh_from_db()
+        self.assertNotIn('staging', post.metadata)
+
+
+@override_settings(
+    ANALYTICS_SYNC_HOT_INTERVAL=900, ANALYTICS_SYNC_WARM_INTERVAL=6 * 3600,
+    ANALYTICS_SYNC_COLD_INTERVAL=86400, ANALYTICS_SYNC_BATCH_SIZE=200
+)
+class AnalyticsSyncTests(TestCase):
+    """
+    Analytics are synced in batches, the recent posts more often
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='analytics', password='secret')
+        self.image = GeneratedImage.objects.create(user=self.user, prompt='rivière', status='validated')
+        self.publisher = mock.Mock(analytics_batch_size=2)
+        self.publisher.get_analytics_batch.side_effect = lambda post_ids: [
+            {'success': post_id != 'broken', 'likes': 8, 'comments': 1, 'shares': 1, 'impressions': 200}
+            for post_id in post_ids
+        ]
+        publishers = mock.patch.dict(PlatformPublisherFactory._instances, {'instagram': self.publisher})
+        publishers.start()
+        self.addCleanup(publishers.stop)
+    
+    def publish(self, age, synced_ago, platform_post_id='ok'):
+        now = timezone.now()
+        post = ScheduledPost.objects.create(
+            user=self.user, image=self.image, platform='instagram', caption='publié', status='posted',
+            scheduled_time=now - age, posted_at=now - age, platform_post_id=platform_post_id
+        )
+        analytics = PostAnalytics.objects.create(scheduled_post=post)
+        PostAnalytics.objects.filter(id=analytics.id).update(last_synced_at=now - synced_ago)
+        return analytics
+    
+    @override_settings(USER_STATS_ENABLED=True)
+    def test_each_tier_is_synced_at_its_interval(self):
+        UserStats.rebuild(self.user.id)
+        hot = self.publish(timedelta(hours=2), timedelta(minutes=20))
+        fresh = self.publish(timedelta(hours=3), timedelta(minutes=5))
+        warm = self.publish(timedelta(days=3), timedelta(hours=1))
+        cold = self.publish(timedelta(days=10), timedelta(days=2))
+        expired = self.publish(timedelta(days=40), timedelta(days=5))
+        
+        result = sync_due_analytics()
+        
+        self.assertEqual(result, {'status': 'success', 'hot': 1, 'warm': 0, 'cold': 1, 'failed': 0})
+        synced = PostAnalytics.objects.get(id=hot.id)
+        self.assertEqual((synced.likes, synced.impressions, synced.engagement_rate), (8, 200, 5.0))
+        self.assertGreater(synced.last_synced_at, timezone.now() - timedelta(minutes=1))
+        for analytics in (fresh, warm, expired):
+            self.assertEqual(PostAnalytics.objects.get(id=analytics.id).likes, 0)
+        self.assertEqual(PostAnalytics.objects.get(id=cold.id).likes, 8)
+        self.assertEqual(sync_due_analytics()['hot'], 0)
+        self.assertEqual(
+            model_to_dict(UserStats.objects.get(user=self.user)),
+            model_to_dict(UserStats.rebuild(self.user.id))
+        )
+    
+    def test_batches_are_fetched_and_written_in_bulk(self):
+        counts = []
+        for size in (2, 12):
+            for _ in range(size):
+                self.publish(timedelta(hours=2), timedelta(hours=1))
+            self.publisher.get_analytics_batch.reset_mock()
+            with CaptureQueriesContext(connection) as queries:
+                result = AnalyticsSyncer().run()
+            self.assertEqual(result['hot'], size)
+            # analytics_batch_size posts per API call
+            self.assertEqual(self.publisher.get_analytics_batch.call_count, size // 2)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+    
+    def test_failed_syncs_are_retried_next_run(self):
+        broken = self.publish(timedelta(hours=2), timedelta(hours=1), platform_post_id='broken')
+        self.publish(timedelta(hours=2), timedelta(hours=1))
+        
+        self.assertEqual(AnalyticsSyncer(batch_size=1).run(), {'hot': 1, 'warm': 0, 'cold': 0, 'failed': 1})
+        self.assertEqual(AnalyticsSyncer().run()['failed'], 1)
+        self.assertEqual(PostAnalytics.objects.get(id=broken.id).likes, 0)
+    
+    def test_full_sync_covers_every_recent_post(self):
+        self.publish(timedelta(days=3), timedelta(minutes=5))
+        post = ScheduledPost.objects.create(
+            user=self.user, image=self.image, platform='instagram', caption='sans analytics', status='posted',
+            scheduled_time=timezone.now(), posted_at=timezone.now(), platform_post_id='ok'
+        )
+        
+        result = sync_all_analytics()
+        
+        self.assertEqual((result['synced'], result['hot'], result['warm']), (2, 1, 1))
+        self.assertEqual(post.analytics.likes, 8)
+
+    def test_syncs_append_snapshots(self):
+        analytics = self.publish(timedelta(hours=2), timedelta(hours=1))
+        
+        AnalyticsSyncer().run()
+        self.publisher.get_analytics_batch.side_effect = lambda post_ids: [
+            {'success': True, 'likes': 20, 'impressions': 400} for _ in post_ids
+        ]
+        AnalyticsSyncer().run(full=True)
+        
+        snapshots = AnalyticsSnapshot.objects.filter(scheduled_post_id=analytics.scheduled_post_id).order_by('taken_at')
+        self.assertEqual([(snapshot.likes, snapshot.impressions) for snapshot in snapshots], [(8, 200), (20, 400)])
+        analytics.refresh_from_db()
+        self.assertEqual(snapshots.last().taken_at, analytics.last_synced_at)
+        self.assertEqual(snapshots.last().day, timezone.localdate(analytics.last_synced_at))
+        self.assertFalse(PostAnalyticsPayload.objects.exists())
+    
+    @override_settings(ANALYTICS_KEEP_RAW_DATA=True)
+    def test_raw_results_are_kept_on_demand(self):
+        analytics = self.publish(timedelta(hours=2), timedelta(hours=1))
+        
+        AnalyticsSyncer().run()
+        self.publisher.get_analytics_batch.side_effect = lambda post_ids: [
+            {'success': True, 'likes': 20, 'cursor': 'next'} for _ in post_ids
+        ]
+        AnalyticsSyncer().run(full=True)
+        
+        # One payload per post, the latest result
+        self.assertEqual(PostAnalyticsPayload.objects.get().analytics_id, analytics.id)
+        self.assertEqual(analytics.payload.data, {'success': True, 'likes': 20, 'cursor': 'next'})
+
+
+class AnalyticsSnapshotTests(TestCase):
+    """
+    Snapshots are downsampled as they age and served as engagement curves
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='curves', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        image = GeneratedImage.objects.create(user=self.user, prompt='montagne', status='validated')
+        self.post = ScheduledPost.objects.create(
+            user=self.user, image=image, platform='instagram', caption='courbe', status='posted',
+            scheduled_time=timezone.now() - timedelta(days=60), posted_at=timezone.now() - timedelta(days=60)
+        )
+    
+    def snapshot(self, taken_at, likes, impressions=100):
+        return AnalyticsSnapshot.objects.create(
+            scheduled_post=self.post, day=timezone.localdate(taken_at), taken_at=taken_at,
+            likes=likes, impressions=impressions
+        )
+    
+    def day_at(self, days_ago, hour, minute):
+        day = bucket_start(timezone.now() - timedelta(days=days_ago), 'day')
+        return day.replace(hour=hour, minute=minute)
+    
+    def test_old_days_are_downsampled(self):
+        for days_ago in (1, 10, 35):
+            for hour, minute in ((9, 0), (9, 15), (9, 45), (14, 30)):
+                self.snapshot(self.day_at(days_ago, hour, minute), likes=hour * 100 + minute)
+        
+        result = compact_analytics_snapshots()
+        
+        self.assertEqual(result, {'status': 'success', 'hour': 2, 'day': 3})
+        remaining = AnalyticsSnapshot.objects.order_by('taken_at')
+        self.assertEqual(
+            [(snapshot.day, snapshot.likes) for snapshot in remaining],
+            [(timezone.localdate(self.day_at(35, 0, 0)), 1430)]
+            + [(timezone.localdate(self.day_at(10, 0, 0)), likes) for likes in (945, 1430)]
+            + [(timezone.localdate(self.day_at(1, 0, 0)), likes) for likes in (900, 915, 945, 1430)]
+        )
+        self.assertEqual(SnapshotCompactor().run(), {'hour': 0, 'day': 0})
+    
+    def test_curve_of_a_post(self):
+        for hour, minute, likes in ((9, 0, 2), (9, 30, 4), (10, 15, 9)):
+            self.snapshot(self.day_at(2, hour, minute), likes)
+        self.snapshot(self.day_at(1, 8, 0), likes=12, impressions=0)
+        url = reverse('scheduler:post_analytics_curve', args=[self.post.id])
+        
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([point['likes'] for point in response.data['results']], [2, 4, 9, 12])
+        self.assertEqual(
+            [point['engagement_rate'] for point in response.data['results']], [2.0, 4.0, 9.0, 0]
+        )
+        self.assertEqual(response.data['results'][0]['taken_at'], self.day_at(2, 9, 0))
+        
+        hourly = self.client.get(url, {'granularity': 'hour'}).data['results']
+        self.assertEqual([point['likes'] for point in hourly], [4, 9, 12])
+        daily = self.client.get(url, {'granularity': 'day'}).data['results']
+        self.assertEqual([point['likes'] for point in daily], [9, 12])
+        window = self.client.get(url, {'start': self.day_at(2, 9, 30).isoformat(), 'end': self.day_at(1, 0, 0).isoformat()})
+        self.assertEqual([point['likes'] for point in window.data['results']], [4, 9])
+    
+    def test_curve_queries_do_not_grow_with_snapshots(self):
+        url = reverse('scheduler:post_analytics_curve', args=[self.post.id])
+        counts = []
+        for count in (2, 50):
+            for minute in range(count):
+                self.snapshot(self.day_at(3, 12, 0) + timedelta(minutes=minute), likes=minute)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+    
+    def test_curve_of_another_users_post(self):
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='curieux', password='secret'))
+        url = reverse('scheduler:post_analytics_curve', args=[self.post.id])
+        
+        self.assertEqual(other.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url, {'granularity': 'week'}).status_code, 400)
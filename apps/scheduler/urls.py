@@ -8,7 +8,9 @@ from .views import (
     PostingScheduleListView,
     PostingScheduleDetailView,
     PostAnalyticsView,
+    PostAnalyticsCurveView,
     SyncAnalyticsView,
+    EngagementRollupView,
     SchedulerStatisticsView
 )
 
@@ -28,7 +30,9 @@ urlpatterns = [
     
     # Analytics
     path('posts/<int:pk>/analytics/', PostAnalyticsView.as_view(), name='post_analytics'),
+    path('posts/<int:pk>/analytics/curve/', PostAnalyticsCurveView.as_view(), name='post_analytics_curve'),
     path('posts/<int:pk>/sync-analytics/', SyncAnalyticsView.as_view(), name='sync_analytics'),
+    path('analytics/rollups/', EngagementRollupView.as_view(), name='engagement_rollups'),
     
     # Statistics
     path('statistics/', SchedulerStatisticsView.as_view(), name='statistics'),
@@ -2,17 +2,31 @@ from rest_framework import status, generics, permissions, filters
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
+from django.forms.models import model_to_dict
 from django.utils import timezone
-from django.db.models import Count, Avg, Q
-from .models import ScheduledPost, PostingSchedule, PostAnalytics
+from django.db.models import Prefetch
+from apps.authentication.models import UserStats
+from apps.core.pagination import KeysetPagination, OptionalCursorPaginationMixin
+from apps.core.rollups import bucket_start
+from apps.core.search import FullTextSearchFilter
+from apps.images.models import ImageTagRelation
+from .models import (
+    AnalyticsSnapshot, EngagementRollup, ScheduledPost, PostingSchedule, PostAnalytics, CAPTION_SEARCH_INDEX
+)
 from .serializers import (
     ScheduledPostSerializer,
+    ScheduledPostListSerializer,
     CreateScheduledPostSerializer,
     UpdateScheduledPostSerializer,
     PostingScheduleSerializer,
     PostAnalyticsSerializer,
-    SchedulerStatisticsSerializer
+    SchedulerStatisticsSerializer,
+    EngagementRollupSerializer,
+    EngagementRollupQuerySerializer,
+    AnalyticsCurveQuerySerializer
 )
+from .services import notify_schedule_change
 from .tasks import publish_scheduled_post, sync_post_analytics
 
 
@@ -22,6 +36,10 @@ class SchedulerPagination(PageNumberPagination):
     max_page_size = 100
 
 
+class ScheduledPostCursorPagination(KeysetPagination):
+    ordering = ('scheduled_time', 'id')
+
+
 class SchedulePostView(APIView):
     """
     API endpoint to schedule a new post
@@ -36,6 +54,7 @@ class SchedulePostView(APIView):
         
         if serializer.is_valid():
             scheduled_post = serializer.save(user=request.user)
+            notify_schedule_change([scheduled_post.id])
             
             return Response({
                 'message': 'Post planifié avec succès.',
@@ -48,15 +67,17 @@ class SchedulePostView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ScheduledPostListView(generics.ListAPIView):
+class ScheduledPostListView(OptionalCursorPaginationMixin, generics.ListAPIView):
     """
     API endpoint to list user's scheduled posts
     """
     permission_classes = [permissions.IsAuthenticated]
-    serializer_class = ScheduledPostSerializer
+    serializer_class = ScheduledPostListSerializer
     pagination_class = SchedulerPagination
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    cursor_pagination_class = ScheduledPostCursorPagination
+    filter_backends = [filters.OrderingFilter, FullTextSearchFilter]
     search_fields = ['caption', 'hashtags']
+    search_index = CAPTION_SEARCH_INDEX
     ordering_fields = ['scheduled_time', 'created_at', 'status']
     ordering = ['scheduled_time']
 
@@ -82,7 +103,10 @@ class ScheduledPostListView(generics.ListAPIView):
         if end_date:
             queryset = queryset.filter(scheduled_time__lte=end_date)
         
-        return queryset.select_related('user', 'image')
+        return queryset.select_related('user', 'image', 'image__user').prefetch_related(
+            Prefetch('image__tag_relations', queryset=ImageTagRelation.objects.select_related('tag')),
+            'image__renditions'
+        )
 
 
 class ScheduledPostDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -106,7 +130,8 @@ class ScheduledPostDetailView(generics.RetrieveUpdateDestroyAPIView):
                 {'error': 'Ce post ne peut pas être annulé.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        instance.cancel()
+        if instance.cancel():
+            notify_schedule_change([instance.id])
 
 
 class CancelScheduledPostView(APIView):
@@ -125,6 +150,7 @@ class CancelScheduledPostView(APIView):
             )
         
         if post.cancel():
+            notify_schedule_change([post.id])
             return Response({
                 'message': 'Post annulé avec succès.',
                 'post': ScheduledPostSerializer(post, context={'request': request}).data
@@ -176,7 +202,7 @@ class PostingScheduleListView(generics.ListCreateAPIView):
     pagination_class = SchedulerPagination
 
     def get_queryset(self):
-        return PostingSchedule.objects.filter(user=self.request.user)
+        return PostingSchedule.objects.filter(user=self.request.user).select_related('user')
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -225,6 +251,79 @@ class PostAnalyticsView(APIView):
             )
 
 
+class PostAnalyticsCurveView(APIView):
+    """
+    API endpoint serving the engagement curve of a published post
+
+    Read from the analytics snapshots through their (post, time) index,
+    counters only; ``hour`` and ``day`` keep the last snapshot of each bucket.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        query = AnalyticsCurveQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        
+        if not ScheduledPost.objects.filter(pk=pk, user=request.user).exists():
+            return Response(
+                {'error': 'Post non trouvé.'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        snapshots = AnalyticsSnapshot.objects.filter(scheduled_post_id=pk).order_by('taken_at')
+        if params.get('start'):
+            snapshots = snapshots.filter(taken_at__gte=params['start'])
+        if params.get('end'):
+            snapshots = snapshots.filter(taken_at__lt=params['end'])
+        
+        points = {}
+        for point in snapshots.values('taken_at', *AnalyticsSnapshot.counters).iterator(chunk_size=2000):
+            key = point['taken_at'] if params['granularity'] == 'sync' else bucket_start(
+                point['taken_at'], params['granularity']
+            )
+            # Ordered by time, the last snapshot of a bucket wins
+            points[key] = point
+        
+        results = list(points.values())
+        for point in results:
+            engagement = point['likes'] + point['comments'] + point['shares']
+            point['engagement_rate'] = round(engagement / point['impressions'] * 100, 2) if point['impressions'] else 0
+        
+        return Response({
+            'post_id': pk,
+            'granularity': params['granularity'],
+            'results': results
+        })
+
+
+class EngagementRollupView(APIView):
+    """
+    API endpoint serving the daily engagement per platform as a time series
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        query = EngagementRollupQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        
+        rollups = EngagementRollup.objects.filter(
+            user=request.user,
+            bucket__gte=params['start'],
+            bucket__lt=params['end']
+        ).order_by('bucket', 'platform')
+        if params.get('platform'):
+            rollups = rollups.filter(platform=params['platform'])
+        
+        return Response({
+            'granularity': params['granularity'],
+            'start': params['start'],
+            'end': params['end'],
+            'results': EngagementRollupSerializer(rollups, many=True).data
+        })
+
+
 class SyncAnalyticsView(APIView):
     """
     API endpoint to sync analytics for a post
@@ -262,32 +361,37 @@ class SchedulerStatisticsView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        user_posts = ScheduledPost.objects.filter(user=request.user)
+        now = timezone.now()
+        if settings.USER_STATS_ENABLED:
+            counters = model_to_dict(UserStats.for_user(request.user.id))
+            # Time-dependent, counted on the (status, scheduled_time) index
+            counters['upcoming_posts'] = ScheduledPost.objects.filter(
+                user=request.user,
+                status='scheduled',
+                scheduled_time__gte=now
+            ).count()
+        else:
+            # Every counter in one aggregate query
+            counters = UserStats.count_posts(request.user.id, now=now)
         
         stats = {
-            'total_scheduled': user_posts.filter(status='scheduled').count(),
-            'total_posted': user_posts.filter(status='posted').count(),
-            'total_failed': user_posts.filter(status='failed').count(),
-            'total_cancelled': user_posts.filter(status='cancelled').count(),
-            'upcoming_posts': user_posts.filter(
-                status='scheduled',
-                scheduled_time__gte=timezone.now()
-            ).count(),
+            'total_scheduled': counters['scheduled_posts'],
+            'total_posted': counters['posted_posts'],
+            'total_failed': counters['failed_posts'],
+            'total_cancelled': counters['cancelled_posts'],
+            'upcoming_posts': counters['upcoming_posts'],
         }
         
         # Posts by platform
-        posts_by_platform = user_posts.values('platform').annotate(
-            count=Count('id')
-        )
         stats['posts_by_platform'] = {
-            item['platform']: item['count']
-            for item in posts_by_platform
+            platform: counters[f'{platform}_posts']
+            for platform, _ in ScheduledPost.PLATFORM_CHOICES
+            if counters[f'{platform}_posts']
         }
         
         # Average engagement rate
-        avg_engagement = PostAnalytics.objects.filter(
-            scheduled_post__user=request.user
-        ).aggregate(Avg('engagement_rate'))['engagement_rate__avg']
+        analytics_count = counters['analytics_count']
+        avg_engagement = counters['engagement_rate_sum'] / analytics_count if analytics_count else 0
         
         stats['average_engagement_rate'] = round(avg_engagement, 2) if avg_engagement else 0
         
@@ -2,8 +2,14 @@
 Celery configuration for the project.
 """
 import os
+import time
+from datetime import datetime
 from celery import Celery
+from kombu import Queue
 from celery.schedules import crontab
+from celery.signals import (
+    before_task_publish, task_prerun, worker_process_init, worker_process_shutdown
+)
 
 # Set the default Django settings module
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
@@ -16,18 +22,104 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Auto-discover tasks in all installed apps
 app.autodiscover_tasks()
 
+# Queues:
+# - 'interactive': single generations a user is waiting for, on dedicated workers
+# - 'bulk': batch generations, fed in fair-share batches by dispatch_bulk_generation
+# - 'default': other network-bound tasks (run with high concurrency)
+# - 'cpu': Pillow post-processing (run with one process per core)
+app.conf.task_queues = (
+    Queue('default'),
+    Queue('interactive'),
+    Queue('bulk'),
+    Queue('cpu'),
+)
+
+app.conf.task_routes = {
+    'apps.images.tasks.generate_image_task': {'queue': 'interactive'},
+    'apps.images.tasks.generate_image_batch': {'queue': 'bulk'},
+    'apps.images.tasks.generate_pending_images': {'queue': 'bulk'},
+    'apps.images.tasks.process_image_renditions': {'queue': 'cpu'},
+}
+
 # Celery Beat Schedule for periodic tasks
 app.conf.beat_schedule = {
     'process-scheduled-posts': {
         'task': 'apps.scheduler.tasks.process_scheduled_posts',
         'schedule': crontab(minute='*/5'),  # Every 5 minutes
     },
+    'stage-upcoming-posts': {
+        'task': 'apps.scheduler.tasks.stage_upcoming_posts',
+        'schedule': crontab(minute='*'),  # Every minute, within PUBLISH_STAGING_LEAD of the posts
+    },
     'cleanup-old-images': {
         'task': 'apps.images.tasks.cleanup_old_images',
         'schedule': crontab(hour=2, minute=0),  # Daily at 2 AM
     },
+    'rollup-generation-history': {
+        'task': 'apps.images.tasks.rollup_generation_history',
+        'schedule': crontab(minute=5),  # Hourly, once the previous hour is complete
+    },
+    'sync-due-analytics': {
+        'task': 'apps.scheduler.tasks.sync_due_analytics',
+        'schedule': crontab(minute='*/5'),  # Every 5 minutes, each post at the interval of its age tier
+    },
+    'rollup-post-analytics': {
+        'task': 'apps.scheduler.tasks.rollup_post_analytics',
+        'schedule': crontab(minute=10),  # Hourly
+    },
+    'compact-analytics-snapshots': {
+        'task': 'apps.scheduler.tasks.compact_analytics_snapshots',
+        'schedule': crontab(hour=3, minute=30),  # Daily at 3:30 AM
+    },
+    'prune-generation-history': {
+        'task': 'apps.images.tasks.prune_generation_history',
+        'schedule': crontab(hour=3, minute=0),  # Daily at 3 AM
+    },
+    'dispatch-bulk-generation': {
+        'task': 'apps.images.tasks.dispatch_bulk_generation',
+        'schedule': crontab(minute='*'),  # Every minute, batches also trigger it when they finish
+    },
 }
 
+
+@before_task_publish.connect
+def stamp_enqueue_time(headers=None, **kwargs):
+    """Timestamp every message so workers can measure how long it queued"""
+    if headers is not None:
+        headers['enqueued_at'] = time.time()
+
+
+@task_prerun.connect
+def record_queue_wait(task=None, **kwargs):
+    """Record the queue wait of each task as the 'queue_wait.<queue>' metric"""
+    request = task.request
+    enqueued_at = getattr(request, 'enqueued_at', None)
+    queue = (request.delivery_info or {}).get('routing_key')
+    if not enqueued_at or not queue:
+        return
+    
+    # Countdown/ETA delays are scheduled, not queued
+    if request.eta:
+        eta = request.eta if isinstance(request.eta, datetime) else datetime.fromisoformat(request.eta)
+        enqueued_at = max(enqueued_at, eta.timestamp())
+    
+    from apps.core import metrics
+    metrics.record_duration(f"queue_wait.{queue}", time.time() - enqueued_at)
+
+
+@worker_process_init.connect
+def reset_http_sessions_on_fork(**kwargs):
+    """Give each prefork child its own pooled HTTP connections"""
+    from apps.core.http import reset_sessions
+    reset_sessions()
+
+
+@worker_process_shutdown.connect
+def close_http_sessions(**kwargs):
+    from apps.core.http import reset_sessions
+    reset_sessions()
+
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
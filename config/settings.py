@@ -3,6 +3,7 @@ Django settings for config project.
 """
 
 from pathlib import Path
+import sys
 from datetime import timedelta
 import os
 from decouple import config
@@ -154,17 +155,149 @@ CORS_ALLOWED_ORIGINS = config(
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Redis
+REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
+
+# Running the test suite, which needs no Redis server
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
+# Cache shared by every worker (metrics, circuit breakers); an in-process
+# cache such as LocMemCache only suits single-process runs and the tests
+CACHES = {
+    'default': {
+        'BACKEND': config(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache' if TESTING
+            else 'django.core.cache.backends.redis.RedisCache'
+        ),
+        'LOCATION': config('CACHE_LOCATION', default='redis://localhost:6379/1'),
+    }
+}
+
 # Celery Configuration
-CELERY_BROKER_URL = config('REDIS_URL', default='redis://localhost:6379/0')
-CELERY_RESULT_BACKEND = config('REDIS_URL', default='redis://localhost:6379/0')
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+# Queues and routes are declared in config/celery.py
+CELERY_TASK_DEFAULT_QUEUE = 'default'
 
 # Blackbox AI Configuration
 BLACKBOX_API_KEY = config('BLACKBOX_API_KEY', default='')
+BLACKBOX_API_URL = config('BLACKBOX_API_URL', default='https://api.blackbox.ai/v1/image')
+# Token bucket shared by every worker ('redis' or 'local'), rate in requests/second, 0 = unlimited
+BLACKBOX_RATE_LIMIT = config('BLACKBOX_RATE_LIMIT', default=5, cast=float)
+BLACKBOX_RATE_BURST = config('BLACKBOX_RATE_BURST', default=10, cast=int)
+BLACKBOX_RATE_LIMIT_BACKEND = config('BLACKBOX_RATE_LIMIT_BACKEND', default='redis')
+BLACKBOX_RATE_LIMIT_WAIT = config('BLACKBOX_RATE_LIMIT_WAIT', default=5, cast=float)
+# Circuit breaker: consecutive failures before failing fast, seconds before a probe
+BLACKBOX_BREAKER_THRESHOLD = config('BLACKBOX_BREAKER_THRESHOLD', default=5, cast=int)
+BLACKBOX_BREAKER_RESET_TIMEOUT = config('BLACKBOX_BREAKER_RESET_TIMEOUT', default=30, cast=int)
+
+# Image generation
+GENERATION_REQUEST_TIMEOUT = config('GENERATION_REQUEST_TIMEOUT', default=120, cast=int)
+GENERATION_CONCURRENCY = config('GENERATION_CONCURRENCY', default=16, cast=int)
+GENERATION_BATCH_SIZE = config('GENERATION_BATCH_SIZE', default=50, cast=int)
+# Bulk images generating at once, shared fairly between users (see dispatch_bulk_generation)
+BULK_GENERATION_MAX_IN_FLIGHT = config('BULK_GENERATION_MAX_IN_FLIGHT', default=200, cast=int)
+# Bulk images still generating this long after their batch started are dispatched again
+BULK_GENERATION_LEASE_TIMEOUT = config('BULK_GENERATION_LEASE_TIMEOUT', default=1800, cast=int)
+# Lock serializing dispatch_bulk_generation: redis, or local for tests
+BULK_DISPATCH_LOCK_BACKEND = config('BULK_DISPATCH_LOCK_BACKEND', default='redis')
+# Adaptive concurrency backs off above this latency (seconds) and on 429/5xx
+GENERATION_MIN_CONCURRENCY = config('GENERATION_MIN_CONCURRENCY', default=1, cast=int)
+GENERATION_LATENCY_TARGET = config('GENERATION_LATENCY_TARGET', default=60, cast=float)
+GENERATION_MAX_RETRIES = config('GENERATION_MAX_RETRIES', default=3, cast=int)
+DOWNLOAD_TIMEOUT = config('DOWNLOAD_TIMEOUT', default=30, cast=int)
+DOWNLOAD_MAX_BYTES = config('DOWNLOAD_MAX_BYTES', default=50 * 1024 * 1024, cast=int)
+DOWNLOAD_CHUNK_SIZE = config('DOWNLOAD_CHUNK_SIZE', default=64 * 1024, cast=int)
+DOWNLOAD_SPOOL_MAX_MEMORY = config('DOWNLOAD_SPOOL_MAX_MEMORY', default=1024 * 1024, cast=int)
+
+# Renditions produced for every generated image, from a single decode
+IMAGE_RENDITIONS = [
+    {'name': 'thumbnail', 'size': (300, 300), 'mode': 'fit', 'format': 'JPEG', 'quality': 85},
+    {'name': 'web', 'size': (1080, 1080), 'mode': 'fit', 'format': 'WEBP', 'quality': 80},
+    {'name': 'instagram_portrait', 'size': (1080, 1350), 'mode': 'crop', 'format': 'JPEG', 'quality': 90},
+    {'name': 'twitter', 'size': (1600, 900), 'mode': 'crop', 'format': 'JPEG', 'quality': 85},
+]
+
+# Generation result cache: 'filesystem', 'redis' or '' to disable
+GENERATION_CACHE_BACKEND = config('GENERATION_CACHE_BACKEND', default='filesystem')
+GENERATION_CACHE_DIR = BASE_DIR / config('GENERATION_CACHE_DIR', default='cache/generation')
+GENERATION_CACHE_TTL = config('GENERATION_CACHE_TTL', default=30 * 24 * 3600, cast=int)
+GENERATION_CACHE_MAX_ENTRIES = config('GENERATION_CACHE_MAX_ENTRIES', default=10000, cast=int)
+
+# Per-user counters maintained on every write, read by the statistics endpoints
+# (manage.py rebuild_user_stats after enabling it on an existing database)
+USER_STATS_ENABLED = config('USER_STATS_ENABLED', default=False, cast=bool)
+
+# Tag usage counters maintained by the tag writes, counted from the relations when off
+# (manage.py rebuild_tag_usage after turning them back on)
+TAG_USAGE_COUNTS_ENABLED = config('TAG_USAGE_COUNTS_ENABLED', default=True, cast=bool)
+
+# Purge of old rejected/failed images: age (days), images per chunk, pause between
+# chunks (seconds) and threads deleting the files
+CLEANUP_RETENTION_DAYS = config('CLEANUP_RETENTION_DAYS', default=30, cast=int)
+CLEANUP_CHUNK_SIZE = config('CLEANUP_CHUNK_SIZE', default=500, cast=int)
+CLEANUP_CHUNK_PAUSE = config('CLEANUP_CHUNK_PAUSE', default=0.5, cast=float)
+CLEANUP_FILE_WORKERS = config('CLEANUP_FILE_WORKERS', default=8, cast=int)
+
+# Claim-based publishing dispatch: posts per claimed batch (one Celery message each),
+# seconds before a post stuck in processing is released, claims before it is failed
+PUBLISH_BATCH_SIZE = config('PUBLISH_BATCH_SIZE', default=50, cast=int)
+PUBLISH_LEASE_TIMEOUT = config('PUBLISH_LEASE_TIMEOUT', default=900, cast=int)
+PUBLISH_MAX_CLAIMS = config('PUBLISH_MAX_CLAIMS', default=3, cast=int)
+
+# Posts of a batch published at the same time on each platform
+PUBLISH_CONCURRENCY_INSTAGRAM = config('PUBLISH_CONCURRENCY_INSTAGRAM', default=8, cast=int)
+PUBLISH_CONCURRENCY_FACEBOOK = config('PUBLISH_CONCURRENCY_FACEBOOK', default=8, cast=int)
+PUBLISH_CONCURRENCY_TWITTER = config('PUBLISH_CONCURRENCY_TWITTER', default=4, cast=int)
+
+# Posts each platform account may publish per sliding window (seconds), 0 = no budget;
+# posts over budget are deferred by the dispatcher. Backend: 'redis' or 'local'
+PUBLISH_RATE_BUDGET_BACKEND = config('PUBLISH_RATE_BUDGET_BACKEND', default='redis')
+PUBLISH_RATE_LIMIT_INSTAGRAM = config('PUBLISH_RATE_LIMIT_INSTAGRAM', default=50, cast=int)
+PUBLISH_RATE_WINDOW_INSTAGRAM = config('PUBLISH_RATE_WINDOW_INSTAGRAM', default=86400, cast=int)
+PUBLISH_RATE_LIMIT_FACEBOOK = config('PUBLISH_RATE_LIMIT_FACEBOOK', default=50, cast=int)
+PUBLISH_RATE_WINDOW_FACEBOOK = config('PUBLISH_RATE_WINDOW_FACEBOOK', default=3600, cast=int)
+PUBLISH_RATE_LIMIT_TWITTER = config('PUBLISH_RATE_LIMIT_TWITTER', default=100, cast=int)
+PUBLISH_RATE_WINDOW_TWITTER = config('PUBLISH_RATE_WINDOW_TWITTER', default=86400, cast=int)
+
+# Publish scheduler process (manage.py run_publish_scheduler): seconds of upcoming posts
+# kept in its timer, seconds between two reloads, feed of the post changes ('redis'/'local')
+PUBLISH_TIMER_LOOKAHEAD = config('PUBLISH_TIMER_LOOKAHEAD', default=300, cast=int)
+PUBLISH_TIMER_REFRESH = config('PUBLISH_TIMER_REFRESH', default=60, cast=int)
+PUBLISH_TIMER_BACKEND = config('PUBLISH_TIMER_BACKEND', default='redis')
+
+# Media pre-staging: platform containers created this many seconds before the scheduled
+# time (stage_upcoming_posts runs every minute), posts staged per run
+PUBLISH_STAGING_LEAD = config('PUBLISH_STAGING_LEAD', default=900, cast=int)
+PUBLISH_STAGING_BATCH_SIZE = config('PUBLISH_STAGING_BATCH_SIZE', default=200, cast=int)
+
+# Analytics sync (sync_due_analytics every 5 minutes): seconds between two syncs of the
+# posts published within a day (hot), a week (warm) and 30 days (cold); analytics
+# written per batch, analytics synced per run
+ANALYTICS_SYNC_HOT_INTERVAL = config('ANALYTICS_SYNC_HOT_INTERVAL', default=900, cast=int)
+ANALYTICS_SYNC_WARM_INTERVAL = config('ANALYTICS_SYNC_WARM_INTERVAL', default=6 * 3600, cast=int)
+ANALYTICS_SYNC_COLD_INTERVAL = config('ANALYTICS_SYNC_COLD_INTERVAL', default=86400, cast=int)
+ANALYTICS_SYNC_BATCH_SIZE = config('ANALYTICS_SYNC_BATCH_SIZE', default=200, cast=int)
+ANALYTICS_SYNC_MAX_PER_RUN = config('ANALYTICS_SYNC_MAX_PER_RUN', default=5000, cast=int)
+# Analytics snapshots: days kept at every sync, then at one per hour (one per day after);
+# raw platform results kept apart from the counters (PostAnalyticsPayload) or dropped
+ANALYTICS_SNAPSHOT_FULL_DAYS = config('ANALYTICS_SNAPSHOT_FULL_DAYS', default=7, cast=int)
+ANALYTICS_SNAPSHOT_HOURLY_DAYS = config('ANALYTICS_SNAPSHOT_HOURLY_DAYS', default=30, cast=int)
+ANALYTICS_KEEP_RAW_DATA = config('ANALYTICS_KEEP_RAW_DATA', default=False, cast=bool)
+
+# History rollups: hours of history read per run, raw history kept (days, 0 = forever)
+ROLLUP_MAX_HOURS_PER_RUN = config('ROLLUP_MAX_HOURS_PER_RUN', default=168, cast=int)
+HISTORY_RETENTION_DAYS = config('HISTORY_RETENTION_DAYS', default=0, cast=int)
+
+# Outgoing HTTP connection pooling (per worker process)
+HTTP_POOL_CONNECTIONS = config('HTTP_POOL_CONNECTIONS', default=10, cast=int)
+HTTP_POOL_MAXSIZE = config('HTTP_POOL_MAXSIZE', default=10, cast=int)
 
 # Social Media API Keys
 INSTAGRAM_ACCESS_TOKEN = config('INSTAGRAM_ACCESS_TOKEN', default='')